@@ -1,7 +1,71 @@
 """ This module is used to define constants"""
+import datetime
+
 # https://core.telegram.org/bots/api#markdownv2-style
 
 
+# * Telegram does not accept messages longer than 4096 characters, counted in UTF-16 code units
+MAX_MESSAGE_LENGTH = 4096
+
+# * Telegram keeps the updates which were not delivered for at most 24 hours
+UPDATE_IDS_TTL = 24 * 60 * 60
+
+# * the errors with the same fingerprint are sent in full to the developers once,
+#   then summarized once every this many seconds
+ERROR_REPORTS_WINDOW = 5 * 60
+
+# * Telegram allows about 30 messages per second to different chats,
+#   a margin is left for the replies to the users' updates
+MAX_MESSAGES_PER_SECOND = 25
+SENDER_WORKERS = 8
+MAX_SEND_ATTEMPTS = 3
+# * the progress of the broadcasts is reported to the admin once every this many seconds
+SEND_PROGRESS_INTERVAL = 10
+# * the messages waiting for the rate limiter gain one priority class every this many seconds,
+#   so that a giocata fan-out is not delayed by a broadcast, but the broadcast is not stopped for its whole duration
+PRIORITY_AGING_INTERVAL = 60
+BROADCAST_PROGRESS_MESSAGE = "{}\n\nInviati {} su {}"
+BROADCAST_COMPLETED_MESSAGE = "Broadcast completato: {} messaggi inviati, {} utenti hanno bloccato il bot, {} errori"
+
+# * sharded sender: the send jobs are processed in chunks of user IDs, after each of which
+#   the progress is recorded and the job's lease is extended
+SEND_JOB_CHUNK_SIZE = 200
+SEND_JOB_LEASE_DURATION = 2 * 60
+SEND_JOBS_POLL_INTERVAL = 2
+# * the sender workers split the global rate budget among the ones holding a live lease on it
+RATE_BUDGET_LEASE_DURATION = 30
+RATE_BUDGET_REFRESH_INTERVAL = 5
+# * the sender workers stop sending for this many seconds after the last giocata or outcome sent by the bot
+RATE_BUDGET_PRIORITY_DURATION = 10
+
+# * the users are reminded of the expiration of their LoT subscription this many days before it
+EXPIRY_REMINDER_DAYS = 3
+# * UTC
+EXPIRY_REMINDER_TIME = datetime.time(hour=8)
+EXPIRY_REMINDER_BATCH_SIZE = 500
+
+# * the cached trends and resoconti are invalidated locally when an outcome arrives or when a user accepts
+#   a giocata, and in any case they are computed again after this many seconds, since the other
+#   instances of the bot cannot invalidate them
+RESULTS_CACHE_TTL = 60
+
+# * the broadcasts segments are materialized again once every this many seconds
+SEGMENTS_REFRESH_INTERVAL = 15 * 60
+
+# * the engagement rankings of the fan-outs are computed from the giocate accepted in the last days,
+#   once every this many seconds
+ENGAGEMENT_WINDOW_DAYS = 30
+ENGAGEMENT_RANKINGS_REFRESH_INTERVAL = 60 * 60
+
+# * the conversation states and the user_data read from the db are used for this many seconds,
+#   after which they are read again, since another instance of the bot may have changed them
+PERSISTENCE_CACHE_TTL = 2
+# * the changed conversation states and user_data are written to the db once every this many seconds
+#   (and at the end of each request on the cloud function), or as soon as this many users have changes
+PERSISTENCE_FLUSH_INTERVAL = 1
+PERSISTENCE_MAX_PENDING_USERS = 100
+
+
 # ================================== PAYMENTS =========================================
 
 REFERRAL_CODE_LEN = 8
@@ -31,6 +95,12 @@ Accedi premendo <a href="https://t.me/+jW-C8fxuYXU5ZDJk">qui al gruppo LoT Meist
 <b>PS: Condividi questo screenshot taggandoci su Instagram per ricevere un omaggio!</b>"""
 
 
+# {0}: the subscription's display name, {1}: the expiration date
+EXPIRY_REMINDER_MESSAGE = """⏰ Il tuo abbonamento <b>{0}</b> scade il <b>{1}</b>!
+
+Ricaricalo dal menu <i>Energia</i> per continuare a ricevere tutte le analisi LoT senza interruzioni 🚀"""
+
+
 # ================================== MAIN MENU =========================================
 
 BENTORNATO_MESSAGE = "Bentornato, puoi continuare ad utilizzare il bot"
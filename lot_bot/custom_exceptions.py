@@ -109,3 +109,12 @@ class CommandArgumentsError(Exception):
     # ! this will be sent as an answer to the analisti and needs to be completed
     def __str__(self) -> str:
         return self.message
+
+
+class SegmentDefinitionError(Exception):
+    def __init__(self, message: str):
+        self.message = message
+
+    # ! this will be sent as an answer to the admins
+    def __str__(self) -> str:
+        return self.message
@@ -144,6 +144,25 @@ def update_analytics(user_id: int, analytics_data: Dict) -> bool:
         raise e
 
 
+def retrieve_analytics_with_accepted_giocate(giocate_ids: List) -> List[Dict]:
+    """Retrieves the accepted giocate of the users who accepted at least one of the specified giocate.
+
+    Args:
+        giocate_ids (List)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        List[Dict]: the users' analytics _id and accepted_giocate
+    """
+    try:
+        return list(db.mongo.analytics.find({"accepted_giocate": {"$in": giocate_ids}}, {"_id": 1, "accepted_giocate": 1}))
+    except Exception as e:
+        lgr.logger.error(f"Error during analytics with accepted giocate retrieval - {len(giocate_ids)=}")
+        raise e
+
+
 def update_accepted_giocate(user_id: int, giocata_id: int) -> bool:
     try:
         update_result: UpdateResult = db.mongo.analytics.update_one(
@@ -0,0 +1,69 @@
+from typing import Dict, List, Optional
+
+from lot_bot import database as db
+from lot_bot import logger as lgr
+from pymongo import ReplaceOne
+from pymongo.results import BulkWriteResult
+
+
+def save_engagement_rankings(rankings_data: List[Dict]) -> int:
+    """Creates or replaces the engagement rankings specified by their _id.
+
+    Args:
+        rankings_data (List[Dict])
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        int: the number of saved rankings
+    """
+    if not rankings_data:
+        return 0
+    try:
+        bulk_result: BulkWriteResult = db.mongo.engagement_rankings.bulk_write(
+            [ReplaceOne({"_id": ranking_data["_id"]}, ranking_data, upsert=True) for ranking_data in rankings_data],
+            ordered=False,
+        )
+        return bulk_result.matched_count + bulk_result.upserted_count
+    except Exception as e:
+        lgr.logger.error(f"Error during engagement rankings saving - {len(rankings_data)=}")
+        raise e
+
+
+def retrieve_engagement_ranking(ranking_id: str) -> Optional[Dict]:
+    """Retrieves the engagement ranking.
+
+    Args:
+        ranking_id (str)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        Optional[Dict]: the ranking data, None if it was not found
+    """
+    try:
+        return db.mongo.engagement_rankings.find_one({"_id": ranking_id})
+    except Exception as e:
+        lgr.logger.error(f"Error during engagement ranking retrieval - {ranking_id=}")
+        raise e
+
+
+def delete_engagement_rankings_refreshed_before(timestamp: float) -> int:
+    """Deletes the engagement rankings which were not refreshed since the timestamp.
+
+    Args:
+        timestamp (float)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        int: the number of deleted rankings
+    """
+    try:
+        return db.mongo.engagement_rankings.delete_many({"refreshed_at": {"$lt": timestamp}}).deleted_count
+    except Exception as e:
+        lgr.logger.error(f"Error during old engagement rankings deletion - {timestamp=}")
+        raise e
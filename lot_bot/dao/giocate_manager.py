@@ -5,6 +5,8 @@ from lot_bot import custom_exceptions
 from lot_bot import database as db
 from lot_bot import logger as lgr
 from lot_bot.models import sports as spr
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
 from pymongo.collection import ReturnDocument
 from pymongo.errors import DuplicateKeyError
 from pymongo.results import InsertOneResult
@@ -62,6 +64,33 @@ def retrieve_giocata_by_num_and_sport(giocata_num: str, sport: str) -> Optional[
         raise e
 
 
+def retrieve_giocata_by_id(giocata_id: str) -> Optional[Dict]:
+    """Retrieves the giocata by its _id, which can be specified
+    either as an ObjectId or as its hex string (as found in the
+    callback data of the register giocata keyboard).
+
+    Args:
+        giocata_id (str)
+
+    Returns:
+        Dict: giocata
+        None: in case of giocata not found or invalid id
+
+    Raises:
+        e (Exception): in case of db errors
+    """
+    try:
+        giocata_object_id = ObjectId(giocata_id)
+    except (InvalidId, TypeError):
+        lgr.logger.warning(f"Invalid giocata id - {giocata_id=}")
+        return None
+    try:
+        return db.mongo.giocate.find_one({ "_id": giocata_object_id })
+    except Exception as e:
+        lgr.logger.error(f"Error during giocata retrieval by id - {giocata_id=}")
+        raise e
+
+
 def retrieve_giocate_from_ids(ids_list: List[int]) -> List[Dict]:
     """Retrieves all the giocate specified by the ids in the list.
 
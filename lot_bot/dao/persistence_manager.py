@@ -0,0 +1,58 @@
+from typing import Dict, Optional
+
+from lot_bot import database as db
+from lot_bot import logger as lgr
+from pymongo import UpdateOne
+from pymongo.results import BulkWriteResult
+
+
+def retrieve_persistence_data(persistence_id: int) -> Optional[Dict]:
+    """Retrieves the conversation states and the user_data stored for the user.
+
+    Args:
+        persistence_id (int): the user's ID
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        Optional[Dict]: the persistence data, None if it was not found
+    """
+    try:
+        return db.mongo.persistence.find_one({"_id": persistence_id})
+    except Exception as e:
+        lgr.logger.error(f"Error during persistence data retrieval - {persistence_id=}")
+        raise e
+
+
+def update_persistence_data(fields_by_persistence_id: Dict[int, Dict]) -> int:
+    """Sets the fields of the persistence data of each user, creating it if needed.
+    The fields whose value is None are removed.
+
+    Args:
+        fields_by_persistence_id (Dict[int, Dict]): {user_id: {field path: value}}
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        int: the number of updated persistence data
+    """
+    if not fields_by_persistence_id:
+        return 0
+    update_requests = []
+    for persistence_id, fields in fields_by_persistence_id.items():
+        update = {}
+        fields_to_set = {field: value for field, value in fields.items() if value is not None}
+        if fields_to_set:
+            update["$set"] = fields_to_set
+        fields_to_unset = {field: "" for field, value in fields.items() if value is None}
+        if fields_to_unset:
+            update["$unset"] = fields_to_unset
+        update_requests.append(UpdateOne({"_id": persistence_id}, update, upsert=True))
+    try:
+        bulk_result: BulkWriteResult = db.mongo.persistence.bulk_write(update_requests, ordered=False)
+        return bulk_result.matched_count + bulk_result.upserted_count
+    except Exception as e:
+        lgr.logger.error(f"Error during persistence data update - {len(fields_by_persistence_id)=}")
+        raise e
@@ -0,0 +1,80 @@
+from typing import Dict, List, Optional
+
+from lot_bot import database as db
+from lot_bot import logger as lgr
+from pymongo.results import DeleteResult, UpdateResult
+
+
+def save_segment(segment_data: Dict) -> bool:
+    """Creates or replaces the segment specified by segment_data["_id"].
+
+    Args:
+        segment_data (Dict)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        bool: True if the segment was saved, False otherwise
+    """
+    try:
+        update_result: UpdateResult = db.mongo.segments.replace_one({"_id": segment_data["_id"]}, segment_data, upsert=True)
+        return bool(update_result.matched_count or update_result.upserted_id is not None)
+    except Exception as e:
+        lgr.logger.error(f"Error during segment saving - {segment_data['_id']=}")
+        raise e
+
+
+def retrieve_segment(segment_name: str) -> Optional[Dict]:
+    """Retrieves the segment, including its user IDs.
+
+    Args:
+        segment_name (str)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        Optional[Dict]: the segment data, None if it was not found
+    """
+    try:
+        return db.mongo.segments.find_one({"_id": segment_name})
+    except Exception as e:
+        lgr.logger.error(f"Error during segment retrieval - {segment_name=}")
+        raise e
+
+
+def retrieve_segments_summaries() -> List[Dict]:
+    """Retrieves all the segments, without their user IDs.
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        List[Dict]: the segments' _id, size, refreshed_at and query
+    """
+    try:
+        return list(db.mongo.segments.find({}, {"_id": 1, "size": 1, "refreshed_at": 1, "query": 1}).sort("_id", 1))
+    except Exception as e:
+        lgr.logger.error("Error during segments summaries retrieval")
+        raise e
+
+
+def delete_segment(segment_name: str) -> bool:
+    """Deletes the segment.
+
+    Args:
+        segment_name (str)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        bool: True if the segment was deleted, False otherwise
+    """
+    try:
+        delete_result: DeleteResult = db.mongo.segments.delete_one({"_id": segment_name})
+        return bool(delete_result.deleted_count)
+    except Exception as e:
+        lgr.logger.error(f"Error during segment deletion - {segment_name=}")
+        raise e
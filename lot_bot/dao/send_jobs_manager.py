@@ -0,0 +1,251 @@
+from typing import Dict, List, Optional
+
+from lot_bot import database as db
+from lot_bot import logger as lgr
+from pymongo.collection import ReturnDocument
+from pymongo.results import InsertManyResult, UpdateResult
+
+PENDING_STATUS = "pending"
+CLAIMED_STATUS = "claimed"
+DONE_STATUS = "done"
+# * the _id of the document holding the senders' leases on the global rate budget
+RATE_BUDGET_ID = "rate_budget"
+
+
+def create_send_jobs(send_jobs_data: List[Dict]) -> List:
+    """Creates the send jobs, which are pending until a sender worker claims them.
+
+    Args:
+        send_jobs_data (List[Dict])
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        List: the IDs of the created jobs
+    """
+    try:
+        insert_result: InsertManyResult = db.mongo.send_jobs.insert_many(send_jobs_data)
+        return insert_result.inserted_ids
+    except Exception as e:
+        lgr.logger.error(f"Error during send jobs creation - {len(send_jobs_data)=}")
+        raise e
+
+
+def claim_send_job(shard: int, worker_id: str, now_timestamp: float, lease_expires_at: float) -> Optional[Dict]:
+    """Claims the oldest send job of the shard which is pending
+    or whose lease has expired, i.e. whose worker stopped.
+
+    Args:
+        shard (int)
+        worker_id (str)
+        now_timestamp (float)
+        lease_expires_at (float)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        Optional[Dict]: the claimed job, None if there is no job to claim
+    """
+    try:
+        return db.mongo.send_jobs.find_one_and_update(
+            {
+                "shard": shard,
+                "$or": [
+                    {"status": PENDING_STATUS},
+                    {"status": CLAIMED_STATUS, "lease_expires_at": {"$lt": now_timestamp}},
+                ],
+            },
+            {"$set": {"status": CLAIMED_STATUS, "claimed_by": worker_id, "lease_expires_at": lease_expires_at}},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+    except Exception as e:
+        lgr.logger.error(f"Error during send job claim - {shard=} - {worker_id=}")
+        raise e
+
+
+def update_send_job_progress(job_id, worker_id: str, next_index: int, counts_increments: Dict[str, int], lease_expires_at: float) -> bool:
+    """Records the progress of the send job and extends its lease,
+    as long as the job is still claimed by the worker.
+
+    Args:
+        job_id
+        worker_id (str)
+        next_index (int): the index of the first user ID which was not sent to yet
+        counts_increments (Dict[str, int]): the increments of sent_count, blocked_count and failed_count
+        lease_expires_at (float)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        bool: True if the job was updated, False if the worker lost its claim
+    """
+    try:
+        update_result: UpdateResult = db.mongo.send_jobs.update_one(
+            {"_id": job_id, "status": CLAIMED_STATUS, "claimed_by": worker_id},
+            {"$set": {"next_index": next_index, "lease_expires_at": lease_expires_at}, "$inc": counts_increments},
+        )
+        return bool(update_result.matched_count)
+    except Exception as e:
+        lgr.logger.error(f"Error during send job progress update - {job_id=} - {worker_id=}")
+        raise e
+
+
+def extend_send_job_lease(job_id, worker_id: str, lease_expires_at: float) -> bool:
+    """Extends the lease of the send job, as long as it is still claimed by the worker.
+
+    Args:
+        job_id
+        worker_id (str)
+        lease_expires_at (float)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        bool: True if the lease was extended, False if the worker lost its claim
+    """
+    try:
+        update_result: UpdateResult = db.mongo.send_jobs.update_one(
+            {"_id": job_id, "status": CLAIMED_STATUS, "claimed_by": worker_id},
+            {"$set": {"lease_expires_at": lease_expires_at}},
+        )
+        return bool(update_result.matched_count)
+    except Exception as e:
+        lgr.logger.error(f"Error during send job lease extension - {job_id=} - {worker_id=}")
+        raise e
+
+
+def complete_send_job(job_id, worker_id: str) -> bool:
+    """Marks the send job as done, as long as it is still claimed by the worker.
+
+    Args:
+        job_id
+        worker_id (str)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        bool: True if the job was completed, False if the worker lost its claim
+    """
+    try:
+        update_result: UpdateResult = db.mongo.send_jobs.update_one(
+            {"_id": job_id, "status": CLAIMED_STATUS, "claimed_by": worker_id},
+            {"$set": {"status": DONE_STATUS}},
+        )
+        return bool(update_result.matched_count)
+    except Exception as e:
+        lgr.logger.error(f"Error during send job completion - {job_id=} - {worker_id=}")
+        raise e
+
+
+def retrieve_broadcast_send_jobs(broadcast_id: str) -> List[Dict]:
+    """Retrieves the send jobs of the broadcast, without their user IDs.
+
+    Args:
+        broadcast_id (str)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        List[Dict]
+    """
+    try:
+        return list(db.mongo.send_jobs.find({"broadcast_id": broadcast_id}, {"user_ids": 0}))
+    except Exception as e:
+        lgr.logger.error(f"Error during broadcast send jobs retrieval - {broadcast_id=}")
+        raise e
+
+
+def register_broadcast_completion_report(broadcast_id: str) -> bool:
+    """Records that the completion of the broadcast was reported to the admin,
+    so that only one of the workers reports it.
+
+    Args:
+        broadcast_id (str)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        bool: True if the completion was registered now, False if it had already been
+    """
+    try:
+        update_result: UpdateResult = db.mongo.send_jobs.update_one(
+            {"broadcast_id": broadcast_id, "reports_completion": True, "completion_reported": {"$ne": True}},
+            {"$set": {"completion_reported": True}},
+        )
+        return bool(update_result.modified_count)
+    except Exception as e:
+        lgr.logger.error(f"Error during broadcast completion registration - {broadcast_id=}")
+        raise e
+
+
+def refresh_rate_budget_lease(worker_id: str, lease_expires_at: float, expired_worker_ids: List[str] = None,
+        paused_until: float = 0, yields_to_priority: bool = False, priority_until: float = 0) -> Dict:
+    """Extends the worker's lease on the global rate budget, removing the expired leases of the other workers.
+    The global pause and the priority period (during which the workers which yield to priority do not send)
+    are extended to paused_until and priority_until, if they are later.
+
+    Args:
+        worker_id (str)
+        lease_expires_at (float)
+        expired_worker_ids (List[str], optional): Defaults to None.
+        paused_until (float, optional): Defaults to 0.
+        yields_to_priority (bool, optional): whether the worker stops sending during the priority periods. Defaults to False.
+        priority_until (float, optional): Defaults to 0.
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        Dict: the rate budget document, with the leases in the form of {worker_id: lease_expires_at}
+            and the workers which yield to priority in the form of {worker_id: True}
+    """
+    update = {
+        "$set": {f"leases.{worker_id}": lease_expires_at},
+        "$max": {"paused_until": paused_until, "priority_until": priority_until},
+    }
+    if yields_to_priority:
+        update["$set"][f"yielding_workers.{worker_id}"] = True
+    expired_worker_ids = [expired_worker_id for expired_worker_id in expired_worker_ids or [] if expired_worker_id != worker_id]
+    if expired_worker_ids:
+        update["$unset"] = {f"{field}.{expired_worker_id}": "" for expired_worker_id in expired_worker_ids for field in ("leases", "yielding_workers")}
+    try:
+        return db.mongo.rate_budget.find_one_and_update(
+            {"_id": RATE_BUDGET_ID},
+            update,
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except Exception as e:
+        lgr.logger.error(f"Error during rate budget lease refresh - {worker_id=}")
+        raise e
+
+
+def delete_rate_budget_lease(worker_id: str) -> bool:
+    """Releases the worker's lease on the global rate budget.
+
+    Args:
+        worker_id (str)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        bool: True if the lease was released, False otherwise
+    """
+    try:
+        update_result: UpdateResult = db.mongo.rate_budget.update_one(
+            {"_id": RATE_BUDGET_ID},
+            {"$unset": {f"leases.{worker_id}": "", f"yielding_workers.{worker_id}": ""}},
+        )
+        return bool(update_result.modified_count)
+    except Exception as e:
+        lgr.logger.error(f"Error during rate budget lease deletion - {worker_id=}")
+        raise e
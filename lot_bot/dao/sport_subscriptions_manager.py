@@ -1,6 +1,7 @@
 from typing import List, Dict
 from lot_bot import database as db
 from lot_bot import logger as lgr
+from lot_bot.models import subscriptions as subs
 from pymongo.results import UpdateResult
 
 
@@ -48,10 +49,46 @@ def create_sport_subscription(sport_sub_data : Dict) -> bool:
         raise e
 
 
-def retrieve_all_user_ids_sub_to_sport_and_strategy(sport: str, strategy: str) -> List:
+def _create_sport_access_query(sport: str, active_timestamp: float) -> Dict:
+    """Creates the query filtering out the users who do not have access to the sport at active_timestamp.
+    The users who do not have the sport access map yet are kept, so that they can be checked
+    against their subscriptions.
+
+    Args:
+        sport (str)
+        active_timestamp (float)
+
+    Returns:
+        Dict: the query
+    """
+    return { "$or": [
+        { f"sport_access.{sport}": { "$gt": active_timestamp } },
+        { f"sport_access.{subs.ALL_SPORTS_ACCESS_KEY}": { "$gt": active_timestamp } },
+        { "sport_access": { "$exists": False } },
+    ] }
+
+
+def retrieve_all_user_ids_sub_to_sport_and_strategy(sport: str, strategy: str, active_timestamp: float = None) -> List:
+    """Retrieves the ids of the users subscribed to the sport and strategy.
+
+    Args:
+        sport (str)
+        strategy (str)
+        active_timestamp (float, optional): if specified, only the users with access to the sport
+            at this timestamp are retrieved. Defaults to None.
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        List: the users' ids
+    """
+    query = { "sport_subscriptions" : { "$elemMatch": { "sport": sport, "strategies": strategy } } }
+    if active_timestamp is not None:
+        query.update(_create_sport_access_query(sport, active_timestamp))
     try:
         raw_user_ids = list(db.mongo.utenti.find(
-            { "sport_subscriptions" : { "$elemMatch": { "sport": sport, "strategies": strategy } } },
+            query,
             # { "sport_subscriptions.sport" : sport, "sport_subscriptions": { "$elemMatch": { "strategies": strategy } } },
             { "_id": 1 }
         ))
@@ -61,10 +98,26 @@ def retrieve_all_user_ids_sub_to_sport_and_strategy(sport: str, strategy: str) -
         raise e 
 
 
-def retrieve_all_user_ids_sub_to_sport(sport: str) -> List:
+def retrieve_all_user_ids_sub_to_sport(sport: str, active_timestamp: float = None) -> List:
+    """Retrieves the ids of the users subscribed to any strategy of the sport.
+
+    Args:
+        sport (str)
+        active_timestamp (float, optional): if specified, only the users with access to the sport
+            at this timestamp are retrieved. Defaults to None.
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        List: the users' ids
+    """
+    query = { "sport_subscriptions.sport" : sport }
+    if active_timestamp is not None:
+        query.update(_create_sport_access_query(sport, active_timestamp))
     try:
         raw_user_ids = list(db.mongo.utenti.find(
-            { "sport_subscriptions.sport" : sport },
+            query,
             { "_id": 1 }
         ))
         return [raw_user_id["_id"] for raw_user_id in raw_user_ids]
@@ -91,7 +144,7 @@ def retrieve_subs_from_user_id(user_id: int) -> Dict:
     try:
         sub_result = db.mongo.utenti.find_one(
             { "_id": user_id },
-            { "sport_subscriptions": 1,  "subscriptions": 1}
+            { "sport_subscriptions": 1,  "subscriptions": 1, "sport_access": 1}
         )
         if not sub_result:
             return {}
@@ -114,14 +167,14 @@ def retrieve_subscribed_strats_from_user_id_and_sport(user_id: int, sport: str)
     Raises:
         e (Exception): in case of db errors
     """
-    lgr.logger.debug(f"Retrieving sub strats for {user_id} and sport {sport}")
+    lgr.logger.debug("Retrieving sub strats for %s and sport %s", user_id, sport)
     try:
         sub_result = db.mongo.utenti.find_one(
             { "_id": user_id, "sport_subscriptions.sport": sport },
             { "sport_subscriptions": { "$elemMatch": { "sport": sport } } }
         )
         if sub_result and len(sub_result["sport_subscriptions"]) > 0:
-            lgr.logger.debug(f"{sub_result=}")
+            lgr.logger.debug("sub_result=%r", sub_result)
             return sub_result["sport_subscriptions"][0]["strategies"]
         return []
     except Exception as e:
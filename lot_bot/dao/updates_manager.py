@@ -0,0 +1,49 @@
+import datetime
+
+from lot_bot import database as db
+from lot_bot import logger as lgr
+from pymongo.errors import DuplicateKeyError
+
+
+def register_update_id(update_id: int) -> bool:
+    """Records the update_id as received.
+    The records are removed by the TTL index on received_at.
+
+    Args:
+        update_id (int)
+
+    Raises:
+        e (Exception): in case there is a db error
+
+    Returns:
+        bool: True if the update_id was registered,
+            False if it had already been received
+    """
+    try:
+        db.mongo.updates.insert_one({"_id": update_id, "received_at": datetime.datetime.utcnow()})
+        return True
+    except DuplicateKeyError:
+        return False
+    except Exception as e:
+        lgr.logger.error(f"Error during update_id registration - {update_id=}")
+        raise e
+
+
+def delete_update_id(update_id: int) -> bool:
+    """Deletes the update_id record, so that the update can be received again.
+
+    Args:
+        update_id (int)
+
+    Raises:
+        e (Exception): in case there is a db error
+
+    Returns:
+        bool: True if the record was deleted,
+            False otherwise
+    """
+    try:
+        return bool(db.mongo.updates.delete_one({"_id": update_id}).deleted_count)
+    except Exception as e:
+        lgr.logger.error(f"Error during update_id deletion - {update_id=}")
+        raise e
@@ -1,15 +1,16 @@
 import datetime
 from json import dumps
 from typing import Dict, Optional, List, Union
-from dateutil.relativedelta import relativedelta
 
 from lot_bot import database as db
 from lot_bot import logger as lgr
+from pymongo import UpdateOne
 from pymongo.collection import ReturnDocument
 from pymongo.results import DeleteResult, InsertOneResult, UpdateResult
 
 from lot_bot.models import subscriptions as subs
 from lot_bot.models import sports as sprt
+from lot_bot.models import personal_stakes as personal_stakes_model
 
 
 
@@ -55,36 +56,6 @@ def retrieve_user(user_id: int) -> Optional[Dict]:
         lgr.logger.error(f"User id: {user_id}")
         return None
 
-def retrieve_user_ids(_type: str, days: int = None ) -> List[int]:
-    """Retrieves users' IDs.
-
-    Args:
-        _type: can be "not_blocked","expired","active",activated_from","expires_in"
-
-    Raises:
-        e: in case of db errors
-
-    Returns:
-        List[int]: the list of the users' IDs
-    """
-    now_timestamp = datetime.datetime.utcnow().timestamp()
-
-    try:
-        if _type == "not_blocked":
-            results = db.mongo.utenti.find({"blocked": False}, {"_id": 1})
-        if _type == "active":
-            results = db.mongo.utenti.find({"blocked": False, "subscriptions" : { "$elemMatch": { "expiration_date": {"$gt": now_timestamp}, "name":subs.sub_container.LOTCOMPLETE.name} }}, {"_id": 1})
-        if _type == "expired":
-            results = db.mongo.utenti.find({"blocked": False, "subscriptions" : { "$elemMatch": { "expiration_date": {"$lt": now_timestamp}, "name":subs.sub_container.LOTCOMPLETE.name} }}, {"_id": 1})
-        if _type == "activated_from":
-            date = (datetime.datetime.utcnow() - relativedelta(days=days)).timestamp()
-            results = db.mongo.utenti.find({"blocked": False, "first_access_timestamp" : {"$gt": date}}, {"_id": 1})
-        if not results:
-            return []
-        return [entry["_id"] for entry in results]
-    except Exception as e:
-        raise e
-
 def retrieve_user_id_by_referral(referral_code: str) -> Optional[Dict]:
     """Retrives the id of the user specified by referral_code.
 
@@ -159,6 +130,26 @@ def retrieve_user_fields_by_user_id(user_id: int, user_fields: List[str]) -> Opt
         raise e
 
 
+def retrieve_users_fields_by_query(query: Dict, user_fields: List[str]) -> List[Dict]:
+    """Retrieves the fields of all the users matching the query.
+
+    Args:
+        query (Dict)
+        user_fields (List[str]): the list of the fields that will be retrieved, along with _id
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        List[Dict]: the users data
+    """
+    try:
+        return list(db.mongo.utenti.find(query, {field: 1 for field in user_fields}))
+    except Exception as e:
+        lgr.logger.error(f"Error during users fields retrieval by query - {query=} - {user_fields=}")
+        raise e
+
+
 def retrieve_user_giocate_since_timestamp(user_id: int, timestamp: float) -> Optional[List]:
     """Retrieves all the giocate for user user_id since the time
     indicated by the timestamp.
@@ -214,7 +205,9 @@ def retrieve_users_who_played_giocata(giocata_id: str) -> List:
 
 def update_user(user_id: int, user_data: Dict) -> bool:
     """Updates the user specified by the user_id,
-        using the data found in user_data
+        using the data found in user_data.
+    In case the subscriptions are updated, the denormalized sport access map
+        and LoT expiration date are updated along with them.
 
     Args:
         user_id (int)
@@ -228,6 +221,10 @@ def update_user(user_id: int, user_data: Dict) -> bool:
             False otherwise
     """
     try:
+        if "subscriptions" in user_data and "sport_access" not in user_data:
+            user_data = {**user_data, "sport_access": subs.create_sport_access_from_subscriptions(user_data["subscriptions"])}
+        if "subscriptions" in user_data and "lot_expiration_date" not in user_data:
+            user_data = {**user_data, "lot_expiration_date": subs.get_subscription_expiration_date(user_data["subscriptions"], subs.sub_container.LOTCOMPLETE.name)}
         update_result: UpdateResult = db.mongo.utenti.update_one(
             {"_id": user_id},
             {"$set": user_data}
@@ -241,6 +238,35 @@ def update_user(user_id: int, user_data: Dict) -> bool:
         raise e
 
 
+def store_subscriptions_derived_fields(user_id: int, user_subscriptions: List[Dict]) -> bool:
+    """Stores the sport access map and the LoT expiration date derived from the user's subscriptions,
+    without touching the subscriptions themselves.
+    Each derived date is only raised, so that a more recent one (e.g. set by a payment
+    registered in the meantime) is never reverted.
+
+    Args:
+        user_id (int)
+        user_subscriptions (List[Dict])
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        bool: True if the user was found
+    """
+    derived_fields = {
+        f"sport_access.{sport_name}": expiration_date
+        for sport_name, expiration_date in subs.create_sport_access_from_subscriptions(user_subscriptions).items()
+    }
+    derived_fields["lot_expiration_date"] = subs.get_subscription_expiration_date(user_subscriptions, subs.sub_container.LOTCOMPLETE.name)
+    try:
+        update_result: UpdateResult = db.mongo.utenti.update_one({"_id": user_id}, {"$max": derived_fields})
+        return bool(update_result.matched_count)
+    except Exception as e:
+        lgr.logger.error(f"Error during subscriptions derived fields storing - {user_id=}")
+        raise e
+
+
 def update_user_by_username_and_retrieve_fields(username: str, user_data: Dict, user_fields: List = ["_id"]) -> Optional[Dict]:
     """Updates the user specified by the username, returning the user's ID.
 
@@ -281,7 +307,7 @@ def register_giocata_for_user_id(giocata: Dict, user_id: int) -> bool:
         bool: True in case the giocata was added, False otherwise
     """
     try:
-        lgr.logger.debug(f"Registering {giocata=} for {user_id=}")
+        lgr.logger.debug("Registering giocata=%r for user_id=%r", giocata, user_id)
         update_result: UpdateResult = db.mongo.utenti.update_one(
             { "_id": user_id, },
             { "$addToSet": { "giocate": giocata } }
@@ -294,12 +320,14 @@ def register_giocata_for_user_id(giocata: Dict, user_id: int) -> bool:
         raise e
 
 
-def update_user_personal_stakes(user_id: int, personal_stake: Dict) -> bool:
-    """Adds a personalized stake to the ones of the specified user.
+def update_user_personal_stakes(user_id: int, personal_stake: Dict, compiled_personal_stakes: Dict = None) -> bool:
+    """Adds a personalized stake to the ones of the specified user,
+    eventually replacing the compiled personal stakes too.
 
     Args:
         user_id (int)
         personal_stake (Dict)
+        compiled_personal_stakes (Dict, optional): the compiled personal stakes, including the new one. Defaults to None.
 
     Raises:
         e: in case of db errors
@@ -309,9 +337,12 @@ def update_user_personal_stakes(user_id: int, personal_stake: Dict) -> bool:
     """
     try:
         lgr.logger.debug(f"Registering {personal_stake=} for {user_id=}")
+        update_query = { "$addToSet": { "personal_stakes": personal_stake } }
+        if compiled_personal_stakes is not None:
+            update_query["$set"] = { "compiled_personal_stakes": compiled_personal_stakes }
         update_result: UpdateResult = db.mongo.utenti.update_one(
             { "_id": user_id, },
-            { "$addToSet": { "personal_stakes": personal_stake } }
+            update_query
         )
         # this will be true if there was at least a match
         return bool(update_result.matched_count)
@@ -461,6 +492,80 @@ def update_user_succ_referrals(user_id: int, referred_user_id: str) -> bool:
         raise e
 
 
+def register_successful_payment(user_id: int, payment: Dict, subscription_entry: Dict, previous_expiration_date: Optional[float], user_data: Dict) -> bool:
+    """Registers the payment and extends the user's subscription with a single atomic update,
+    which also sets user_data and raises the sport access granted by the subscription.
+    The update is applied only if the payment (by telegram_payment_charge_id) was not
+    registered yet and if the subscription's expiration date is still previous_expiration_date,
+    so that neither a duplicate payment nor a concurrent update can extend it twice.
+
+    Args:
+        user_id (int)
+        payment (Dict): the payment data, containing telegram_payment_charge_id
+        subscription_entry (Dict): the subscription's name and its new expiration_date
+        previous_expiration_date (Optional[float]): the expiration date the new one was calculated from,
+            None if the user does not have the subscription yet
+        user_data (Dict): the other fields to set
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        bool: True if the payment was registered, False if it was already registered,
+            the subscription was changed in the meantime or the user was not found
+    """
+    query = {
+        "_id": user_id,
+        "payments.telegram_payment_charge_id": { "$ne": payment["telegram_payment_charge_id"] },
+    }
+    update = {
+        "$set": dict(user_data),
+        "$push": { "payments": payment },
+        "$max": {
+            f"sport_access.{sport_name}": expiration_date
+            for sport_name, expiration_date in subs.create_sport_access_from_subscriptions([subscription_entry]).items()
+        },
+    }
+    update_options = {}
+    if previous_expiration_date is None:
+        query["subscriptions.name"] = { "$ne": subscription_entry["name"] }
+        update["$push"]["subscriptions"] = subscription_entry
+    else:
+        subscription_filter = { "name": subscription_entry["name"], "expiration_date": previous_expiration_date }
+        query["subscriptions"] = { "$elemMatch": subscription_filter }
+        # * the query matches the payments array too, hence the positional operator $ cannot be used
+        update["$set"]["subscriptions.$[subscription].expiration_date"] = subscription_entry["expiration_date"]
+        update_options["array_filters"] = [{ f"subscription.{field}": value for field, value in subscription_filter.items() }]
+    if subscription_entry["name"] == subs.sub_container.LOTCOMPLETE.name:
+        update["$set"]["lot_expiration_date"] = subscription_entry["expiration_date"]
+    try:
+        update_result: UpdateResult = db.mongo.utenti.update_one(query, update, **update_options)
+        return bool(update_result.matched_count)
+    except Exception as e:
+        lgr.logger.error(f"Error during successful payment registration - {user_id=} - {str(payment)=} - {subscription_entry=}")
+        raise e
+
+
+def check_payment_registered(user_id: int, telegram_payment_charge_id: str) -> bool:
+    """Checks if the payment was already registered for the user.
+
+    Args:
+        user_id (int)
+        telegram_payment_charge_id (str)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        bool
+    """
+    try:
+        return db.mongo.utenti.count_documents({ "_id": user_id, "payments.telegram_payment_charge_id": telegram_payment_charge_id }, limit=1) > 0
+    except Exception as e:
+        lgr.logger.error(f"Error during payment registration check - {user_id=} - {telegram_payment_charge_id=}")
+        raise e
+
+
 def update_user_referred_payments(user_id: int, referred_user_id: str) -> bool:
     """Add the referred user to the successful referred payments
         for the user specified by user_id.
@@ -491,6 +596,119 @@ def update_user_referred_payments(user_id: int, referred_user_id: str) -> bool:
         raise e
 
 
+def backfill_lot_expiration_dates() -> int:
+    """Sets the denormalized lot_expiration_date of the users created before it was introduced.
+    Since the missing values are indexed as null, the users to update are found through the index.
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        int: the number of updated users
+    """
+    try:
+        users_without_expiration = db.mongo.utenti.find({ "lot_expiration_date": None }, { "subscriptions": 1 })
+        updates = [
+            UpdateOne(
+                { "_id": user_data["_id"] },
+                { "$set": { "lot_expiration_date": subs.get_subscription_expiration_date(user_data.get("subscriptions", []), subs.sub_container.LOTCOMPLETE.name) } }
+            )
+            for user_data in users_without_expiration
+        ]
+        if not updates:
+            return 0
+        return db.mongo.utenti.bulk_write(updates, ordered=False).modified_count
+    except Exception as e:
+        lgr.logger.error("Error during LoT expiration dates backfill")
+        raise e
+
+
+def retrieve_users_to_remind_of_expiration(now_timestamp: float, limit_timestamp: float) -> List[Dict]:
+    """Retrieves the users whose LoT subscription expires between now_timestamp and limit_timestamp,
+    who are not blocked and were not reminded of this expiration yet.
+    A user was already reminded if the reminded expiration date is still in the future,
+    since after a renewal the previous expiration date is in the past.
+
+    Args:
+        now_timestamp (float)
+        limit_timestamp (float)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        List[Dict]: the users' _id and lot_expiration_date
+    """
+    try:
+        return list(db.mongo.utenti.find(
+            {
+                "lot_expiration_date": { "$gt": now_timestamp, "$lte": limit_timestamp },
+                "reminded_expiration_date": { "$not": { "$gte": now_timestamp } },
+                "blocked": False,
+            },
+            { "_id": 1, "lot_expiration_date": 1 }
+        ))
+    except Exception as e:
+        lgr.logger.error(f"Error during retrieval of users to remind of expiration - {now_timestamp=} - {limit_timestamp=}")
+        raise e
+
+
+def claim_expiry_reminder(user_id: int, expiration_date: float, now_timestamp: float) -> bool:
+    """Records the expiration date the user is about to be reminded of, only if
+    the user was not reminded of it yet, so that a single instance of the bot sends the reminder.
+
+    Args:
+        user_id (int)
+        expiration_date (float)
+        now_timestamp (float)
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        bool: True if the reminder was claimed, False if the user was already reminded or the expiration date changed
+    """
+    try:
+        update_result = db.mongo.utenti.update_one(
+            {
+                "_id": user_id,
+                "lot_expiration_date": expiration_date,
+                "reminded_expiration_date": { "$not": { "$gte": now_timestamp } },
+            },
+            { "$set": { "reminded_expiration_date": expiration_date } }
+        )
+        return update_result.modified_count == 1
+    except Exception as e:
+        lgr.logger.error(f"Error during expiry reminder claim - {user_id=} - {expiration_date=}")
+        raise e
+
+
+def release_expiry_reminders(reminded_expiration_dates: Dict[int, float]) -> int:
+    """Removes the claims of the reminders which could not be sent, with a single bulk write,
+    so that the users are reminded on the next run.
+
+    Args:
+        reminded_expiration_dates (Dict[int, float]): the claimed expiration date, by user ID
+
+    Raises:
+        e (Exception): in case of db errors
+
+    Returns:
+        int: the number of updated users
+    """
+    if not reminded_expiration_dates:
+        return 0
+    try:
+        updates = [
+            UpdateOne({ "_id": user_id, "reminded_expiration_date": expiration_date }, { "$unset": { "reminded_expiration_date": "" } })
+            for user_id, expiration_date in reminded_expiration_dates.items()
+        ]
+        return db.mongo.utenti.bulk_write(updates, ordered=False).modified_count
+    except Exception as e:
+        lgr.logger.error(f"Error during expiry reminders release - {len(reminded_expiration_dates)=}")
+        raise e
+
+
 
 def delete_user_by_id(user_id: int) -> bool:
     """Deletes the user specified by user_id
@@ -511,7 +729,8 @@ def delete_user_by_id(user_id: int) -> bool:
 
 
 def delete_personal_stake_by_user_id_or_username(user_identification_data: Union[int, str], personal_stake_id: str) -> bool:
-    """Deletes a user's personal stake, indicated by its position on the personal stake's list.
+    """Deletes a user's personal stake, indicated by its position on the personal stake's list,
+    and rebuilds the compiled personal stakes.
 
     Args:
         user_identification_data (Union[int, str]): either the user's ID or username
@@ -535,7 +754,11 @@ def delete_personal_stake_by_user_id_or_username(user_identification_data: Union
             return False
         personal_stakes = user_data["personal_stakes"]
         del personal_stakes[personal_stake_id]
-        result: UpdateResult = db.mongo.utenti.update_one(user_query, {"$set": { "personal_stakes": personal_stakes } })
+        compiled_personal_stakes = personal_stakes_model.compile_personal_stakes(personal_stakes)
+        result: UpdateResult = db.mongo.utenti.update_one(user_query, {"$set": { 
+            "personal_stakes": personal_stakes, 
+            "compiled_personal_stakes": compiled_personal_stakes 
+        } })
         return bool(result.modified_count)
     except Exception as e:
         lgr.logger.error(f"Error deletion of user stake - {user_identification_data} - {personal_stake_id}")
@@ -592,7 +815,7 @@ def check_user_sport_subscription(message_date: datetime.datetime, user_subscrip
         sport = sprt.sports_container.get_sport(sport_name)
         if sub is None or sport is None:
             raise Exception
-        if sub.available_sports == [] or sport in sub.available_sports:
+        if not sub.available_sports or sport in sub.available_sports:
             if check_user_subscription_validity(message_date, user_subscriptions, sub_name=sub.name):
                 return True
     return False
@@ -1,7 +1,9 @@
 from pymongo import MongoClient
 
 from lot_bot import config as cfg
+from lot_bot import constants as cst
 from lot_bot import logger as lgr
+from lot_bot import metrics
 
 import certifi
 
@@ -17,6 +19,8 @@ class MongoDatabase:
         try:
             self.client = MongoClient(
                 cfg.config.MONGO_DB_URL,
+                # measures the latency of each db command
+                event_listeners=[metrics.DbCommandsListener()],
                 #tlsCAFile=certifi.where()
             )
             # The ping command is cheap and does not require auth, 
@@ -30,10 +34,29 @@ class MongoDatabase:
         self.utenti = db["utenti"]
         # ensures the uniqueness of the users' referral codes
         self.utenti.create_index([("referral_code", 1)], unique=True)
+        # finds the users whose LoT subscription is expiring with a range query
+        self.utenti.create_index([("lot_expiration_date", 1), ("reminded_expiration_date", 1)])
         self.giocate = db["giocate"]
         # ensures the uniqueness of the giocata_num together with sport
         self.giocate.create_index([("giocata_num", 1), ("sport", 1)], unique=True)
         self.analytics = db["analytics"]
+        # finds the users who accepted the recent giocate, to rank them by engagement
+        self.analytics.create_index([("accepted_giocate", 1)])
+        # the broadcasts audiences, materialized as lists of user IDs
+        self.segments = db["segments"]
+        # the users ranked by engagement, used to order the fan-outs
+        self.engagement_rankings = db["engagement_rankings"]
+        # the broadcasts' shards, claimed by the sharded sender workers
+        self.send_jobs = db["send_jobs"]
+        self.send_jobs.create_index([("shard", 1), ("status", 1), ("created_at", 1)])
+        self.send_jobs.create_index([("broadcast_id", 1)])
+        # the sender workers' leases on the global rate budget
+        self.rate_budget = db["rate_budget"]
+        # the users' conversation states and user_data, shared by all the bot's instances
+        self.persistence = db["persistence"]
+        # recently received update_ids, used to drop the updates sent more than once
+        self.updates = db["updates"]
+        self.updates.create_index([("received_at", 1)], expireAfterSeconds=cst.UPDATE_IDS_TTL)
 
 
 def create_db():
@@ -0,0 +1,208 @@
+""" This module is used to avoid flooding the developers with error messages
+when the same error is raised many times in a short while (e.g. when the db
+is unreachable during a fan-out).
+Each error is identified by its fingerprint: the first occurrence is reported
+in full, the following ones are only counted and summarized once per window.
+The reports are sent by a separate thread, so that the failing handler is never blocked.
+"""
+import os
+import queue
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Optional
+
+from lot_bot import constants as cst
+from lot_bot import logger as lgr
+
+# * the number of innermost frames of the traceback used in the fingerprint
+FINGERPRINT_FRAMES = 3
+# * max number of reports waiting to be sent, the following ones are dropped
+MAX_PENDING_REPORTS = 100
+# * how often the sender thread checks for the summaries to send, in seconds
+SUMMARIES_CHECK_INTERVAL = 5
+
+# the aggregator used by the error handler, created together with the bot
+error_aggregator = None
+
+
+def get_error_fingerprint(error: BaseException, num_of_frames: int = FINGERPRINT_FRAMES) -> str:
+    """Identifies the error by its type and the innermost frames of its traceback,
+    without the message, which can contain the data of the single occurrence.
+
+    Args:
+        error (BaseException)
+        num_of_frames (int, optional): Defaults to FINGERPRINT_FRAMES.
+
+    Returns:
+        str: e.g. "pymongo.errors.AutoReconnect @ pool.py:connect:1203 < ..."
+    """
+    error_type = type(error)
+    error_type_name = error_type.__qualname__
+    if error_type.__module__ not in ("builtins", "__main__"):
+        error_type_name = f"{error_type.__module__}.{error_type_name}"
+    frames = traceback.extract_tb(error.__traceback__)[-num_of_frames:]
+    frames_description = " < ".join(
+        f"{os.path.basename(frame.filename)}:{frame.name}:{frame.lineno}"
+        for frame in reversed(frames)
+    )
+    if not frames_description:
+        return error_type_name
+    return f"{error_type_name} @ {frames_description}"
+
+
+class _ErrorWindow:
+    __slots__ = ("start_time", "suppressed_count")
+
+    def __init__(self, start_time: float):
+        self.start_time = start_time
+        self.suppressed_count = 0
+
+
+class ErrorAggregator:
+    """Reports the first occurrence of each error in full and then, once per window,
+    how many more errors with the same fingerprint were raised.
+    A fingerprint with no occurrences for a whole window is forgotten, so that
+    its next occurrence is reported in full again.
+    """
+
+    def __init__(self, send_messages: Callable[[List[str]], None], window: float = cst.ERROR_REPORTS_WINDOW,
+            max_pending_reports: int = MAX_PENDING_REPORTS):
+        """
+        Args:
+            send_messages (Callable[[List[str]], None]): the function sending the messages to the developers
+            window (float, optional): in seconds. Defaults to cst.ERROR_REPORTS_WINDOW.
+            max_pending_reports (int, optional): Defaults to MAX_PENDING_REPORTS.
+        """
+        self.send_messages = send_messages
+        self.window = window
+        self._windows : Dict[str, _ErrorWindow] = {}
+        self._lock = threading.Lock()
+        self._pending_reports : queue.Queue = queue.Queue(maxsize=max_pending_reports)
+        self._sender : Optional[threading.Thread] = None
+
+    def start(self):
+        self._sender = threading.Thread(target=self._send_reports, name="error_reporter", daemon=True)
+        self._sender.start()
+
+    def stop(self, timeout: float = None):
+        """Sends the pending reports, then stops the sender thread.
+
+        Args:
+            timeout (float, optional): max seconds to wait for the sender thread. Defaults to None.
+        """
+        if self._sender is None:
+            return
+        self._pending_reports.put(None)
+        self._sender.join(timeout)
+        self._sender = None
+
+    def report(self, fingerprint: str, create_messages: Callable[[], List[str]], now: float = None) -> bool:
+        """Enqueues the full report of the error if it is the first occurrence
+        of its fingerprint in the current window, otherwise it only counts it.
+        It never blocks: if there are too many pending reports, the report is dropped.
+
+        Args:
+            fingerprint (str)
+            create_messages (Callable[[], List[str]]): creates the messages of the full report,
+                called only if the report has to be sent
+            now (float, optional): the current monotonic time. Defaults to None.
+
+        Returns:
+            bool: True if the full report was enqueued
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            error_window = self._windows.get(fingerprint)
+            if error_window is not None:
+                error_window.suppressed_count += 1
+                return False
+            self._windows[fingerprint] = _ErrorWindow(now)
+        return self._enqueue(create_messages())
+
+    def enqueue_messages(self, messages: List[str]) -> bool:
+        """Enqueues messages which are not errors (e.g. alerts), to be sent by the sender thread as they are.
+        It never blocks: if there are too many pending reports, the messages are dropped.
+
+        Args:
+            messages (List[str])
+
+        Returns:
+            bool: True if the messages were enqueued
+        """
+        return self._enqueue(messages)
+
+    def _enqueue(self, messages: List[str]) -> bool:
+        try:
+            self._pending_reports.put_nowait(messages)
+        except queue.Full:
+            lgr.logger.warning("Too many pending error reports, report dropped")
+            return False
+        return True
+
+    def get_due_summaries(self, now: float = None) -> List[str]:
+        """Closes the expired windows, returning the summaries of the ones with suppressed errors,
+        which start a new window.
+
+        Args:
+            now (float, optional): the current monotonic time. Defaults to None.
+
+        Returns:
+            List[str]
+        """
+        if now is None:
+            now = time.monotonic()
+        summaries = []
+        with self._lock:
+            for fingerprint, error_window in list(self._windows.items()):
+                if now - error_window.start_time < self.window:
+                    continue
+                if error_window.suppressed_count == 0:
+                    del self._windows[fingerprint]
+                    continue
+                window_minutes = max(round((now - error_window.start_time) / 60), 1)
+                summaries.append(
+                    f"{error_window.suppressed_count} more like this in the last {window_minutes} minutes:\n{fingerprint}"
+                )
+                self._windows[fingerprint] = _ErrorWindow(now)
+        return summaries
+
+    def _send(self, messages: List[str]):
+        try:
+            self.send_messages(messages)
+        except Exception as e:
+            lgr.logger.error("Could not send the error report - %s", e)
+
+    def _send_reports(self):
+        while True:
+            try:
+                messages = self._pending_reports.get(timeout=min(SUMMARIES_CHECK_INTERVAL, self.window))
+            except queue.Empty:
+                messages = []
+            stopping = messages is None
+            if messages:
+                self._send(messages)
+            summaries = self.get_due_summaries()
+            if summaries:
+                self._send(summaries)
+            if stopping:
+                break
+
+
+def create_error_aggregator(send_messages: Callable[[List[str]], None]) -> ErrorAggregator:
+    """Creates and starts the aggregator used by the error handler,
+    stopping the previous one, if any.
+
+    Args:
+        send_messages (Callable[[List[str]], None]): the function sending the messages to the developers
+
+    Returns:
+        ErrorAggregator
+    """
+    global error_aggregator
+    if error_aggregator is not None:
+        error_aggregator.stop(timeout=1)
+    error_aggregator = ErrorAggregator(send_messages)
+    error_aggregator.start()
+    return error_aggregator
@@ -131,7 +131,7 @@ def get_command_messages_filter() -> Filters:
     return Filters.command
 
 def get_broadcast_media_filter() -> Filters:
-    return Filters.caption(["/broadcast"])
+    return Filters.caption_regex(r"^/broadcast(_attivi|_scaduti|_nuovi|_segmento)?(\s|$)")
 
 
 # ================================================ PATTERNS ================================================
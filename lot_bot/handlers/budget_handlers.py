@@ -7,15 +7,16 @@ from lot_bot import config as cfg
 from lot_bot import utils
 from lot_bot.dao import user_manager, budget_manager, analytics_manager
 from lot_bot.handlers import message_handlers
+from lot_bot.handlers.conversation_states import (
+    CREATE_BUDGET_NAME, SET_BUDGET_INTEREST, SET_BUDGET_BALANCE,
+    EDIT_BUDGET_NAME, EDIT_BUDGET_BALANCE, EDIT_BASE_SIMPLY_INTEREST, DELETE_BUDGET, CONFIRM_DELETE_BUDGET,
+    SET_FIRST_BUDGET_BALANCE)
 from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ConversationHandler
 from telegram.ext.dispatcher import CallbackContext
 from lot_bot import database as db #TODO creare file tipo budget_manager.py in stile user_manager.py
 from typing import Dict
 
-CREATE_BUDGET_NAME, SET_BUDGET_INTEREST, SET_BUDGET_BALANCE = range(3)
-EDIT_BUDGET_NAME, EDIT_BUDGET_BALANCE,EDIT_BASE_SIMPLY_INTEREST, DELETE_BUDGET, CONFIRM_DELETE_BUDGET = range(5)
-SET_FIRST_BUDGET_BALANCE = 0
 
 def to_budgets_menu(update: Update, context: CallbackContext, send_new: bool = False):
     chat_id = update.effective_user.id
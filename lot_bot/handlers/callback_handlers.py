@@ -1,6 +1,7 @@
 """Module for the Callback Query Handlers"""
 import datetime
 import random
+from typing import Dict, Optional, Tuple
 
 from lot_bot import config as cfg
 from lot_bot import constants as cst
@@ -8,6 +9,7 @@ from lot_bot import custom_exceptions
 from lot_bot import keyboards as kyb
 from lot_bot import logger as lgr
 from lot_bot import database as db
+from lot_bot import results_cache
 from lot_bot import utils
 from lot_bot.dao import (giocate_manager, sport_subscriptions_manager,
                          user_manager, budget_manager, analytics_manager)
@@ -81,14 +83,14 @@ def set_sport_strategy_state(update: Update, context: CallbackContext):
     Raises:
         Exception: in case any among sport, strategy and state are invalid. 
     """
-    lgr.logger.debug(f"Received callback {update.callback_query.data}")
+    lgr.logger.debug("Received callback %s", update.callback_query.data)
     sport_token, strategy_token, state = update.callback_query.data.split("_")
     sport = spr.sports_container.get_sport(sport_token)
     if not sport:
         lgr.logger.error(f"Could not set strategies for sport {sport_token}")
         raise custom_exceptions.SportNotFoundError(sport_token)
     strategy = strat.strategies_container.get_strategy(strategy_token)
-    if not strategy or not strategy in sport.strategies:
+    if not sport.has_strategy(strategy):
         lgr.logger.error(f"Could not find {strategy} taken from {strategy_token} in sport {sport.name}")
         raise custom_exceptions.StrategyNotFoundError(sport_token, strategy_token)
     if state != "activate" and state != "disable":
@@ -448,9 +450,54 @@ def strategy_explanation(update: Update, context: CallbackContext):
         )
 
 
+def _retrieve_giocata_from_register_callback(update: Update) -> Tuple[Dict, Optional[int]]:
+    """Retrieves the giocata referred by a register giocata callback, along
+    with the stake which was shown to the user.
+    The giocata _id and the stake are read from the callback data 
+    (register_giocata_<yes|no>_<giocata _id>[_<personal stake>]); 
+    the giocata text is parsed only for the messages sent with the old keyboard,
+    which carried no data.
+
+    Args:
+        update (Update)
+
+    Raises:
+        Exception: in case the giocata cannot be retrieved
+
+    Returns:
+        Tuple[Dict, Optional[int]]: the retrieved giocata and the stake of the message, 
+            which is None in case it is not known
+    """
+    callback_data_tokens = update.callback_query.data.split("_")
+    if len(callback_data_tokens) > 3:
+        giocata_id = callback_data_tokens[3]
+        message_stake = None
+        if len(callback_data_tokens) > 4 and callback_data_tokens[4] != "":
+            message_stake = int(callback_data_tokens[4])
+        retrieved_giocata = giocate_manager.retrieve_giocata_by_id(giocata_id)
+        if not retrieved_giocata:
+            lgr.logger.error(f"Cannot retrieve giocata from register callback - {giocata_id=}")
+            raise Exception("Cannot retrieve giocata from register callback")
+        return retrieved_giocata, message_stake
+    # * old keyboard without data, identify the giocata type and parse it accordingly
+    giocata_text = update.callback_query.message.text
+    if "status:" not in giocata_text.split("\n")[0].lower():
+        lgr.logger.debug("Parsing LoT giocata")
+        parsed_giocata = giocata_model.parse_giocata(giocata_text, message_sent_timestamp=update.callback_query.message.date)
+    else:
+        lgr.logger.debug("Parsing TB giocata")
+        parsed_giocata = giocata_model.parse_teacherbet_giocata(giocata_text, message_sent_timestamp=update.callback_query.message.date)[0]
+    retrieved_giocata = giocate_manager.retrieve_giocata_by_num_and_sport(parsed_giocata["giocata_num"], parsed_giocata["sport"])
+    if not retrieved_giocata:
+        lgr.logger.error(f"Cannot retrieve giocata from register callback - {parsed_giocata['giocata_num']=} {parsed_giocata['sport']=}")
+        raise Exception("Cannot retrieve giocata from register callback")
+    return retrieved_giocata, parsed_giocata.get("base_stake")
+
+
 def accept_register_giocata(update: Update, context: CallbackContext):
     """
-    The callback for this is register_giocata_yes
+    The callback for this is register_giocata_yes_<giocata _id>_<personal stake>
+    (or register_giocata_yes for the messages sent with the old keyboard)
 
     Args:
         update (Update): [description]
@@ -465,24 +512,14 @@ def accept_register_giocata(update: Update, context: CallbackContext):
     giocata_text_rows = giocata_text.split("\n")
     giocata_text_without_answer_row = "\n".join(giocata_text_rows[:-1])
     updated_giocata_text = giocata_text_without_answer_row + "\n🟩 Operazione effettuata 🟩"
-    # * identify the giocata type and parse it accordingly
-    if "status:" not in giocata_text_rows[0].lower():
-        lgr.logger.debug("Parsing LoT giocata")
-        parsed_giocata = giocata_model.parse_giocata(giocata_text, message_sent_timestamp=update.callback_query.message.date)
-    else:
-        lgr.logger.debug("Parsing TB giocata")
-        parsed_giocata = giocata_model.parse_teacherbet_giocata(giocata_text, message_sent_timestamp=update.callback_query.message.date)[0]
     # * retrieve and save the giocata for the user
-    retrieved_giocata = giocate_manager.retrieve_giocata_by_num_and_sport(parsed_giocata["giocata_num"], parsed_giocata["sport"])
-    if not retrieved_giocata:
-        lgr.logger.error(f"Cannot retrieve giocata upon giocata acceptation - {parsed_giocata['giocata_num']=} {parsed_giocata['sport']=}")
-        raise Exception("Cannot retrieve giocata upon giocata acceptation")
+    retrieved_giocata, message_stake = _retrieve_giocata_from_register_callback(update)
     personal_user_giocata = giocata_model.create_user_giocata()
     personal_user_giocata["original_id"] = retrieved_giocata["_id"]
     personal_user_giocata["acceptance_timestamp"] = datetime.datetime.utcnow().timestamp()
     # * check for differences in the saved stake and the current one (personalized stake)
-    if "base_stake" in parsed_giocata and parsed_giocata["base_stake"] != retrieved_giocata["base_stake"]:
-        personal_user_giocata["personal_stake"] = parsed_giocata["base_stake"]
+    if message_stake is not None and message_stake != retrieved_giocata.get("base_stake"):
+        personal_user_giocata["personal_stake"] = message_stake
     user_manager.register_giocata_for_user_id(personal_user_giocata, user_chat_id)
     # * update user budget if giocata has an outcome
     giocata_outcome = retrieved_giocata["outcome"]
@@ -501,6 +538,8 @@ def accept_register_giocata(update: Update, context: CallbackContext):
             update_result = users.update_single_user_budget_with_giocata2(user_chat_id, default_budget_balance, personal_user_giocata["original_id"], retrieved_giocata)
             if not update_result:
                 context.bot.send_message(user_chat_id, "ERRORE: impossibile aggiornare il budget, la giocata non è stata trovata")
+    # * the new giocata is part of the user's resoconti
+    results_cache.invalidate_user_results(user_chat_id)
     #* update analtics and check checklist completion
     analytics_update = analytics_manager.update_accepted_giocate(user_chat_id, retrieved_giocata["_id"])
     if not analytics_update:
@@ -522,7 +561,8 @@ def accept_register_giocata(update: Update, context: CallbackContext):
 
 def refuse_register_giocata(update: Update, context: CallbackContext):
     """
-    The callback for this is register_giocata_no
+    The callback for this is register_giocata_no_<giocata _id>
+    (or register_giocata_no for the messages sent with the old keyboard)
 
     Args:
         update (Update): [description]
@@ -533,11 +573,7 @@ def refuse_register_giocata(update: Update, context: CallbackContext):
     giocata_text_without_answer_row = "\n".join(giocata_text.split("\n")[:-1])
     updated_giocata_text = giocata_text_without_answer_row + "\n🟥 Operazione non effettuata 🟥"
     #* retrieve giocata id
-    parsed_giocata = giocata_model.parse_giocata(giocata_text, message_sent_timestamp=update.callback_query.message.date)
-    retrieved_giocata = giocate_manager.retrieve_giocata_by_num_and_sport(parsed_giocata["giocata_num"], parsed_giocata["sport"])
-    if not retrieved_giocata:
-        lgr.logger.error(f"Cannot retrieve giocata upon giocata acceptation - {parsed_giocata['giocata_num']=} {parsed_giocata['sport']=}")
-        raise Exception("Cannot retrieve giocata upon giocata acceptation")
+    retrieved_giocata, _ = _retrieve_giocata_from_register_callback(update)
     #* update analtics and check checklist completion
     analytics_manager.update_refused_giocate(user_chat_id, retrieved_giocata["_id"])
     if analytics_manager.check_checklist_completion(user_chat_id):
@@ -579,9 +615,10 @@ def last_24_hours_resoconto(update: Update, context: CallbackContext):
         update (Update)
         context (CallbackContext)
     """
-    giocate_since_timestamp = (datetime.datetime.utcnow() - datetime.timedelta(hours=24)).timestamp()
+    resoconto_window = datetime.timedelta(hours=24)
+    giocate_since_timestamp = (datetime.datetime.utcnow() - resoconto_window).timestamp()
     resoconto_message_header = "RESOCONTO - ULTIME 24 ORE"
-    send_resoconto_since_timestamp(update, context, giocate_since_timestamp, resoconto_message_header)
+    send_resoconto_since_timestamp(update, context, giocate_since_timestamp, resoconto_message_header, resoconto_window=resoconto_window)
 
 
 def last_7_days_resoconto(update: Update, context: CallbackContext):
@@ -591,9 +628,10 @@ def last_7_days_resoconto(update: Update, context: CallbackContext):
         update (Update)
         context (CallbackContext)
     """
-    giocate_since_timestamp = (datetime.datetime.utcnow() - datetime.timedelta(days=7)).timestamp()
+    resoconto_window = datetime.timedelta(days=7)
+    giocate_since_timestamp = (datetime.datetime.utcnow() - resoconto_window).timestamp()
     resoconto_message_header = "RESOCONTO - ULTIMI 7 GIORNI"
-    send_resoconto_since_timestamp(update, context, giocate_since_timestamp, resoconto_message_header)
+    send_resoconto_since_timestamp(update, context, giocate_since_timestamp, resoconto_message_header, resoconto_window=resoconto_window)
 
 
 def last_30_days_resoconto(update: Update, context: CallbackContext):
@@ -603,16 +641,55 @@ def last_30_days_resoconto(update: Update, context: CallbackContext):
         update (Update)
         context (CallbackContext)
     """
-    giocate_since_timestamp = (datetime.datetime.utcnow() - datetime.timedelta(days=30)).timestamp()
+    resoconto_window = datetime.timedelta(days=30)
+    giocate_since_timestamp = (datetime.datetime.utcnow() - resoconto_window).timestamp()
     resoconto_message_header = "RESOCONTO - ULTIMI 30 GIORNI"
-    send_resoconto_since_timestamp(update, context, giocate_since_timestamp, resoconto_message_header)
+    send_resoconto_since_timestamp(update, context, giocate_since_timestamp, resoconto_message_header, resoconto_window=resoconto_window)
+
 
+def _retrieve_resoconto_lines(chat_id: int, giocate_since_timestamp: float, resoconto_window: datetime.timedelta = None) -> Tuple[str, ...]:
+    """Retrieves the lines of the resoconto of the user's giocate since the timestamp.
+    In case the window is specified, the lines are cached until an outcome for one of the
+    included giocate arrives, the user accepts a new giocata or the oldest giocata exits the window.
+
+    Args:
+        chat_id (int)
+        giocate_since_timestamp (float)
+        resoconto_window (datetime.timedelta, optional): the window of the resoconto. Defaults to None.
 
-def _create_and_send_resoconto(context: CallbackContext, chat_id: int, giocate_since_timestamp: float, resoconto_message_header: str, edit_messages: bool = True, message_id: int = None, receiver_user_id: int = None):
+    Returns:
+        Tuple[str, ...]: the lines of the resoconto, empty if no giocata was found
+    """
+    window_seconds = int(resoconto_window.total_seconds()) if resoconto_window is not None else None
+    if window_seconds is not None:
+        cached_resoconto_lines = results_cache.get_cached_result(results_cache.RESOCONTO, window_seconds, user_id=chat_id)
+        if cached_resoconto_lines is not None:
+            return cached_resoconto_lines
     user_giocate_data = user_manager.retrieve_user_giocate_since_timestamp(chat_id, giocate_since_timestamp)
+    resoconto_lines = ()
+    if user_giocate_data != []:
+        user_giocate_data_dict = {giocata["original_id"]: giocata for giocata in user_giocate_data}
+        user_giocate_ids = list(user_giocate_data_dict.keys())
+        giocate_full_data = giocate_manager.retrieve_giocate_from_ids(user_giocate_ids)
+        resoconto_lines = tuple(utils.create_resoconto_lines(giocate_full_data, user_giocate_data_dict))
+    if window_seconds is not None:
+        # * the resoconto changes when the oldest giocata exits the window
+        acceptance_timestamps = [giocata["acceptance_timestamp"] for giocata in user_giocate_data if "acceptance_timestamp" in giocata]
+        expiration_timestamp = None
+        if acceptance_timestamps:
+            # * acceptance timestamps come from utcnow, while the cache expirations use the actual current timestamp
+            seconds_to_expiration = min(acceptance_timestamps) + window_seconds - datetime.datetime.utcnow().timestamp()
+            expiration_timestamp = datetime.datetime.now().timestamp() + seconds_to_expiration
+        results_cache.cache_result(results_cache.RESOCONTO, window_seconds, resoconto_lines, user_id=chat_id, 
+            expiration_timestamp=expiration_timestamp, giocata_ids=[giocata["original_id"] for giocata in user_giocate_data])
+    return resoconto_lines
+
+
+def _create_and_send_resoconto(context: CallbackContext, chat_id: int, giocate_since_timestamp: float, resoconto_message_header: str, edit_messages: bool = True, message_id: int = None, receiver_user_id: int = None, resoconto_window: datetime.timedelta = None):
+    resoconto_lines = _retrieve_resoconto_lines(chat_id, giocate_since_timestamp, resoconto_window=resoconto_window)
     if receiver_user_id is None:
         receiver_user_id = chat_id
-    if user_giocate_data == []:
+    if not resoconto_lines:
         no_giocata_found_text = resoconto_message_header + "\nNessuna giocata trovata."
         if edit_messages:
             context.bot.edit_message_text(
@@ -627,18 +704,17 @@ def _create_and_send_resoconto(context: CallbackContext, chat_id: int, giocate_s
                 no_giocata_found_text,
             )
         return
-    user_giocate_data_dict = {giocata["original_id"]: giocata for giocata in user_giocate_data}
-    user_giocate_ids = list(user_giocate_data_dict.keys())
-    giocate_full_data = giocate_manager.retrieve_giocate_from_ids(user_giocate_ids)
-    resoconto_message = resoconto_message_header + "\n" + utils.create_resoconto_message(giocate_full_data, user_giocate_data_dict)
+    # * the resoconto is split in more messages to stay within Telegram's max message length
+    resoconto_messages = utils.split_lines_in_messages(resoconto_lines, header=resoconto_message_header)
     # * edit last message/send message with resoconto
     if edit_messages:
         context.bot.edit_message_text(
-            resoconto_message,
+            next(resoconto_messages, resoconto_message_header),
             chat_id=receiver_user_id,
             message_id=message_id,
             reply_markup=None,
         )
+        message_handlers.send_messages_to_chat(context, receiver_user_id, resoconto_messages)
         # * send new message with menu
         context.bot.send_message(
             receiver_user_id,
@@ -646,10 +722,7 @@ def _create_and_send_resoconto(context: CallbackContext, chat_id: int, giocate_s
             reply_markup=kyb.RESOCONTI_KEYBOARD,
         )
     else:
-        context.bot.send_message(
-            receiver_user_id,
-            resoconto_message,
-        )
+        message_handlers.send_messages_to_chat(context, receiver_user_id, resoconto_messages)
 
 def send_latest_giocate_to_new_user(update: Update, context: CallbackContext):
     lgr.logger.debug("Sending last 5 giocate in last 10h")
@@ -657,7 +730,7 @@ def send_latest_giocate_to_new_user(update: Update, context: CallbackContext):
     latest_giocate = giocate_manager.retrieve_giocate_between_timestamps(
         datetime.datetime.now().timestamp(), (datetime.datetime.now()+datetime.timedelta(hours=-6)).timestamp()
     )
-    lgr.logger.debug(f"{latest_giocate=}")
+    lgr.logger.debug("latest_giocate=%r", latest_giocate)
 
     if not latest_giocate:
         context.bot.send_message(
@@ -687,7 +760,7 @@ def send_latest_giocate_to_new_user(update: Update, context: CallbackContext):
         if giocata["sport"] in sport_validi:
             text = giocata["raw_text"]
  
-            custom_reply_markup = kyb.REGISTER_GIOCATA_KEYBOARD
+            custom_reply_markup = kyb.create_register_giocata_keyboard(giocata["_id"])
             user_budget = budget_manager.retrieve_default_budget_from_user_id(chat_id)
             if user_budget:
                 #user_budget_balance = int(user_budget["simply_interest_base"]) temporary
@@ -730,13 +803,14 @@ def send_socials_list(update: Update, context: CallbackContext):
     #user_data["subscriptions"].append(free_sub)
     to_homepage(update, context, send_new_message=True, delete_last_message=False)
 
-def send_resoconto_since_timestamp(update: Update, context: CallbackContext, giocate_since_timestamp: float, resoconto_message_header: str):
+def send_resoconto_since_timestamp(update: Update, context: CallbackContext, giocate_since_timestamp: float, resoconto_message_header: str, resoconto_window: datetime.timedelta = None):
     """[summary]
 
     Args:
         update (Update)
         context (CallbackContext)
         giocate_since_timestamp (float): timestamp indicating from when to start retrieveing giocate
+        resoconto_window (datetime.timedelta, optional): the window of the resoconto, used to cache it. Defaults to None.
     """
     chat_id = update.callback_query.from_user.id
     message_id = update.callback_query.message.message_id
@@ -746,7 +820,7 @@ def send_resoconto_since_timestamp(update: Update, context: CallbackContext, gio
         return
     # TODO add analyitics with type and timestamp
     # context.dispatcher.run_async(_create_and_send_resoconto, context, chat_id, giocate_since_timestamp, resoconto_message_header, message_id=message_id)
-    _create_and_send_resoconto(context, chat_id, giocate_since_timestamp, resoconto_message_header, message_id=message_id)
+    _create_and_send_resoconto(context, chat_id, giocate_since_timestamp, resoconto_message_header, message_id=message_id, resoconto_window=resoconto_window)
 
 
 def get_free_month_subscription(update: Update, context: CallbackContext):
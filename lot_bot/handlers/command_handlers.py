@@ -1,19 +1,22 @@
 """Module containing all the message handlers"""
 import datetime
-from typing import List, Optional, Union, Callable, Tuple
+import html
+import io
+from typing import Dict, List, Optional, Union, Tuple
 
 from lot_bot import config as cfg
 from lot_bot import constants as cst
-from lot_bot import database as db
 from lot_bot import custom_exceptions
 from lot_bot import keyboards as kyb
 from lot_bot import logger as lgr
+from lot_bot import metrics
+from lot_bot import sender
+from lot_bot import sharded_sender
 from lot_bot import utils
-from lot_bot.dao import user_manager, analytics_manager
+from lot_bot.dao import user_manager, analytics_manager, segments_manager
 from lot_bot.handlers import message_handlers, callback_handlers
-from lot_bot.models import personal_stakes, users, giocate, subscriptions, strategies, sports, analytics
+from lot_bot.models import personal_stakes, users, giocate, subscriptions, strategies, sports, analytics, segments
 from telegram import ParseMode, Update
-from telegram.error import Unauthorized
 from telegram.ext.dispatcher import CallbackContext
 
 
@@ -219,7 +222,7 @@ def start_command(update: Update, context: CallbackContext):
         #else:
         #    sub = subs_model.create_teacherbet_base_sub()
         subscriptions_list = [sub,free_sub]
-        db.mongo.utenti.update_one({ "_id": user_id }, { "$set": { "subscriptions": subscriptions_list } } )
+        user_manager.update_user(user_id, {"subscriptions": subscriptions_list})
 
 
         return
@@ -359,32 +362,81 @@ def aggiungi_giorni(update: Update, context: CallbackContext):
     update.effective_message.reply_text(reply_message)
 
 
-def _send_broadcast_messages(context: CallbackContext, parsed_text: str, _type: str, days: int = None ):
-    """Function to be called in async in order to send a broadcast message.
+# * the broadcast commands which can be used in the caption of a broadcast media, with the segments they target
+BROADCAST_MEDIA_COMMANDS_SEGMENTS = {
+    "/broadcast": segments.NOT_BLOCKED_SEGMENT_NAME,
+    "/broadcast_attivi": segments.ACTIVE_SEGMENT_NAME,
+    "/broadcast_scaduti": segments.EXPIRED_SEGMENT_NAME,
+}
+
+
+def _send_broadcast(update: Update, context: CallbackContext, segment_name: str, method: str, method_kwargs: Dict, days: int = None):
+    """Sends a broadcast to the users of the segment, through the rate-limited sender and without
+    blocking the dispatcher if it is running, or enqueues it for the sharded sender workers
+    if they are enabled in the config.
+    The admin is told the number of users and the estimated send time before the sending starts,
+    then the same message is updated with the progress, and the outcome is sent once it is completed.
 
     Args:
+        update (Update)
+        context (CallbackContext)
+        segment_name (str): the name of a builtin segment ("not_blocked", "active", "expired") or of a custom one
+        method (str): the Bot method sending the broadcast, one of sharded_sender.SEND_METHODS
+        method_kwargs (Dict): the arguments of the method, besides the user ID
+        days (int, optional): if specified, only the users who started the bot in the last days
+            are included; only the not_blocked segment supports it. Defaults to None.
+    """
+    segment_data = segments.get_segment(segment_name)
+    if segment_data is None:
+        update.effective_message.reply_text(f"ERRORE: il segmento {segment_name} non esiste")
+        return
+    activated_since_timestamp = None
+    if days is not None:
+        activated_since_timestamp = (datetime.datetime.utcnow() - datetime.timedelta(days=days)).timestamp()
+    user_ids = segments.get_segment_user_ids(segment_data, activated_since_timestamp)
+    refreshed_minutes_ago = int((datetime.datetime.utcnow().timestamp() - segment_data["refreshed_at"]) // 60)
+    estimated_send_time = utils.create_duration_text(segments.estimate_send_time(len(user_ids)))
+    status_text = f"Invio a {len(user_ids)} utenti del segmento {segment_name} (aggiornato {refreshed_minutes_ago} minuti fa), tempo stimato: {estimated_send_time}"
+    status_message = update.effective_message.reply_text(status_text)
+    if cfg.config.SENDER_SHARDS and user_ids:
+        broadcast_id = sharded_sender.enqueue_broadcast(
+            user_ids, method, method_kwargs, cfg.config.SENDER_SHARDS,
+            status_chat_id=status_message.chat_id, status_message_id=status_message.message_id, status_text=status_text,
+        )
+        lgr.logger.info(f"Enqueued -{segment_name}- broadcast {broadcast_id} to {len(user_ids)} users")
+        return
+
+    def report_progress(partial_result: sender.SendResult):
+        status_message.edit_text(cst.BROADCAST_PROGRESS_MESSAGE.format(status_text, partial_result.get_completed_count(), len(user_ids)))
+
+    def send_to_segment_users():
+        send_method = getattr(context.bot, method)
+        lgr.logger.info(f"Starting to send -{segment_name}- broadcast to {len(user_ids)} users")
+        send_result = sender.send_to_users(user_ids, lambda target_user_id: send_method(target_user_id, **method_kwargs), report_progress=report_progress)
+        update.effective_message.reply_text(
+            cst.BROADCAST_COMPLETED_MESSAGE.format(len(send_result.sent_ids), len(send_result.blocked_ids), len(send_result.failed_ids))
+        )
+
+    # * in the long-lived modes, the broadcast is sent by the dispatcher's async workers, so that the
+    #   following updates (e.g. the giocate) are handled meanwhile; on the cloud function, where the
+    #   dispatcher is not running, the request must not end before the broadcast is sent
+    if context.dispatcher.running:
+        context.dispatcher.run_async(send_to_segment_users)
+    else:
+        send_to_segment_users()
+
+
+def _send_broadcast_messages(update: Update, context: CallbackContext, parsed_text: str, segment_name: str, days: int = None):
+    """Sends a broadcast text message to the users of the segment.
+
+    Args:
+        update (Update)
         context (CallbackContext)
         parsed_text (str)
-        _type (str) - broadcast type. can be "not_blocked","expired","active",activated_from","expires_in"
-        days (int) - optional, should be present only for activated_from and expires_in type
+        segment_name (str)
+        days (int, optional): see _send_broadcast. Defaults to None.
     """
-    user_ids = user_manager.retrieve_user_ids(_type, days)
-    lgr.logger.info(f"Starting to send -{_type}- broadcast message in async to approx. {len(user_ids)} users")
-    for user_id in user_ids:
-        try:
-            context.bot.send_message(                
-                user_id,
-                parsed_text,
-                parse_mode="HTML"
-            )
-        except Unauthorized:
-            lgr.logger.debug(f"""Unathorized user {user_id}""")
-            # lgr.logger.info(f"User {user_id} blocked the bot")
-            pass
-        except Exception as e:
-            lgr.logger.debug(f"""Generic exception for user {user_id} {e}""")
-            #lgr.logger.warning(f"Error in sending message: {str(e)}")
-            pass
+    _send_broadcast(update, context, segment_name, "send_message", {"text": parsed_text, "parse_mode": "HTML"}, days)
 
 def send_message_handler(update: Update, context: CallbackContext):
     """ Sends a message to the user specified by ID or username.
@@ -441,8 +493,7 @@ def broadcast_handler(update: Update, context: CallbackContext):
         update.effective_message.reply_text("ERRORE: non disponi dei permessi necessari ad utilizzare questo comando")
         return
     parsed_text = "\n".join(update.effective_message.text.split("\n")[1:]).strip()
-    # context.dispatcher.run_async(_send_broadcast_messages, context, parsed_text) # TODO find out why it doesn't work
-    _send_broadcast_messages(context, parsed_text, "not_blocked")
+    _send_broadcast_messages(update, context, parsed_text, segments.NOT_BLOCKED_SEGMENT_NAME)
 
 def broadcast_scaduti_handler(update: Update, context: CallbackContext):
     """ Sends a message to all the users with expired subscription in the db.
@@ -459,8 +510,7 @@ def broadcast_scaduti_handler(update: Update, context: CallbackContext):
         update.effective_message.reply_text("ERRORE: non disponi dei permessi necessari ad utilizzare questo comando")
         return
     parsed_text = "\n".join(update.effective_message.text.split("\n")[1:]).strip()
-    # context.dispatcher.run_async(_send_broadcast_messages, context, parsed_text) # TODO find out why it doesn't work
-    _send_broadcast_messages(context, parsed_text, "expired")
+    _send_broadcast_messages(update, context, parsed_text, segments.EXPIRED_SEGMENT_NAME)
 
 def broadcast_attivi_handler(update: Update, context: CallbackContext):
     """ Sends a message to all the users with active subscription in the db.
@@ -477,8 +527,7 @@ def broadcast_attivi_handler(update: Update, context: CallbackContext):
         update.effective_message.reply_text("ERRORE: non disponi dei permessi necessari ad utilizzare questo comando")
         return
     parsed_text = "\n".join(update.effective_message.text.split("\n")[1:]).strip()
-    # context.dispatcher.run_async(_send_broadcast_messages, context, parsed_text) # TODO find out why it doesn't work
-    _send_broadcast_messages(context, parsed_text, "active")
+    _send_broadcast_messages(update, context, parsed_text, segments.ACTIVE_SEGMENT_NAME)
 
 def broadcast_nuovi_handler(update: Update, context: CallbackContext):
     """ Sends a message to all the users with active subscription in the db.
@@ -498,13 +547,135 @@ def broadcast_nuovi_handler(update: Update, context: CallbackContext):
     try:
         days = int(str_days)
         parsed_text = "\n".join(update.effective_message.text.split("\n")[1:]).strip()
-        _send_broadcast_messages(context, parsed_text, "activated_from", days)
+        _send_broadcast_messages(update, context, parsed_text, segments.NOT_BLOCKED_SEGMENT_NAME, days)
     except ValueError:
         update.effective_message.reply_text(f"ERRORE: '{str_days}' non è un numero di giorni valido. Controlla che il messaggio sia tipo:\n\n/broadcast_nuovi 3\nMessaggio da inviare")
     except Exception as e:
         lgr.logger.warning(f"Error in sending broadcast_nuovi message: {str(e)}")
         update.effective_message.reply_text("ERRORE: Controlla che il messaggio sia tipo:\n\n/broadcast_nuovi 3\nMessaggio da inviare")
 
+def broadcast_segment_handler(update: Update, context: CallbackContext):
+    """ Sends a message to all the users of a segment.
+    /broadcast_segmento <segment name> LINE BREAK <message>
+
+    Args:
+        update (Update)
+        context (CallbackContext)
+    """
+    lgr.logger.info("Received /broadcast_segmento")
+    user_id = update.effective_user.id
+    try:
+        segment_name = initial_command_parsing(user_id, context.args, 1, permitted_roles=["admin"])
+    except custom_exceptions.UserPermissionError as e:
+        update.effective_message.reply_text(str(e))
+        return
+    except custom_exceptions.CommandArgumentsError as e:
+        update.effective_message.reply_text(str(e) + "il nome del segmento e, andando a capo, il messaggio")
+        return
+    parsed_text = "\n".join(update.effective_message.text.split("\n")[1:]).strip()
+    _send_broadcast_messages(update, context, parsed_text, str(segment_name))
+
+
+def create_segment_handler(update: Update, context: CallbackContext):
+    """ Creates (or replaces) a custom segment, defined by a query on the users.
+    /crea_segmento <segment name> LINE BREAK <query JSON>
+
+    Args:
+        update (Update)
+        context (CallbackContext)
+    """
+    lgr.logger.info("Received /crea_segmento")
+    user_id = update.effective_user.id
+    try:
+        segment_name = initial_command_parsing(user_id, context.args, 1, permitted_roles=["admin"])
+    except custom_exceptions.UserPermissionError as e:
+        update.effective_message.reply_text(str(e))
+        return
+    except custom_exceptions.CommandArgumentsError as e:
+        update.effective_message.reply_text(str(e) + "il nome del segmento e, andando a capo, la query in JSON")
+        return
+    query_text = "\n".join(update.effective_message.text.split("\n")[1:]).strip()
+    try:
+        query = segments.parse_custom_segment_definition(str(segment_name), query_text)
+        segment_data = segments.refresh_segment(str(segment_name), query)
+    except custom_exceptions.SegmentDefinitionError as e:
+        update.effective_message.reply_text(str(e))
+        return
+    except Exception as e:
+        lgr.logger.warning(f"Error creating segment {segment_name} - {str(e)}")
+        update.effective_message.reply_text(f"ERRORE: impossibile creare il segmento - {str(e)}")
+        return
+    update.effective_message.reply_text(f"Segmento {segment_name} creato: {segment_data['size']} utenti")
+
+
+def delete_segment_handler(update: Update, context: CallbackContext):
+    """ Deletes a custom segment.
+    /elimina_segmento <segment name>
+
+    Args:
+        update (Update)
+        context (CallbackContext)
+    """
+    user_id = update.effective_user.id
+    try:
+        segment_name = initial_command_parsing(user_id, context.args, 1, permitted_roles=["admin"])
+    except custom_exceptions.UserPermissionError as e:
+        update.effective_message.reply_text(str(e))
+        return
+    except custom_exceptions.CommandArgumentsError as e:
+        update.effective_message.reply_text(str(e) + "il nome del segmento")
+        return
+    if segment_name in segments.BUILTIN_SEGMENTS_QUERIES:
+        update.effective_message.reply_text(f"ERRORE: il segmento {segment_name} è predefinito e non può essere eliminato")
+        return
+    if not segments_manager.delete_segment(str(segment_name)):
+        update.effective_message.reply_text(f"ERRORE: il segmento {segment_name} non esiste")
+        return
+    update.effective_message.reply_text(f"Segmento {segment_name} eliminato")
+
+
+def visualize_segments(update: Update, context: CallbackContext):
+    """ Shows the segments, with their size and the time of their last refresh.
+    /segmenti
+
+    Args:
+        update (Update)
+        context (CallbackContext)
+    """
+    user_id = update.effective_user.id
+    if not users.check_user_permission(user_id, permitted_roles=["admin"]):
+        update.effective_message.reply_text("ERRORE: non disponi dei permessi necessari ad utilizzare questo comando")
+        return
+    segments_summaries = segments_manager.retrieve_segments_summaries()
+    if not segments_summaries:
+        update.effective_message.reply_text("Nessun segmento disponibile, usa /aggiorna_segmenti per crearli")
+        return
+    now_timestamp = datetime.datetime.utcnow().timestamp()
+    segments_lines = [
+        f"<b>{segment_summary['_id']}</b>: {segment_summary['size']} utenti, aggiornato {int((now_timestamp - segment_summary['refreshed_at']) // 60)} minuti fa"
+        + (f"\n<code>{html.escape(segment_summary['query'], quote=False)}</code>" if segment_summary.get("query") else "") + "\n"
+        for segment_summary in segments_summaries
+    ]
+    for message in utils.split_lines_in_messages(segments_lines, header="Segmenti:"):
+        update.effective_message.reply_text(message, parse_mode=ParseMode.HTML)
+
+
+def refresh_segments_handler(update: Update, context: CallbackContext):
+    """ Refreshes all the segments.
+    /aggiorna_segmenti
+
+    Args:
+        update (Update)
+        context (CallbackContext)
+    """
+    user_id = update.effective_user.id
+    if not users.check_user_permission(user_id, permitted_roles=["admin"]):
+        update.effective_message.reply_text("ERRORE: non disponi dei permessi necessari ad utilizzare questo comando")
+        return
+    refreshed_segments = segments.refresh_all_segments()
+    update.effective_message.reply_text(f"Aggiornati {len(refreshed_segments)} segmenti")
+
+
 def unlock_messages_to_user(update: Update, context: CallbackContext):
     """/sblocca_utente <username or ID>
 
@@ -742,10 +913,11 @@ def get_user_resoconto(update: Update, context: CallbackContext):
         target_user_id = update_result["_id"]
     # * create resoconto
     lgr.logger.debug(f"Creating resoconto of user with user_id {target_user_id}")
-    giocate_since_timestamp = (datetime.datetime.utcnow() - datetime.timedelta(days=days_for_resoconto)).timestamp()
+    resoconto_window = datetime.timedelta(days=days_for_resoconto)
+    giocate_since_timestamp = (datetime.datetime.utcnow() - resoconto_window).timestamp()
     resoconto_message_header = f"Resoconto utente {target_user_identification_data} -  Ultimi {days_for_resoconto} giorni" # TODO add dates
     # context.dispatcher.run_async(callback_handlers._create_and_send_resoconto, context, target_user_id, giocate_since_timestamp, resoconto_message_header, edit_messages=False)
-    callback_handlers._create_and_send_resoconto(context, target_user_id, giocate_since_timestamp, resoconto_message_header, edit_messages=False, receiver_user_id=user_id)
+    callback_handlers._create_and_send_resoconto(context, target_user_id, giocate_since_timestamp, resoconto_message_header, edit_messages=False, receiver_user_id=user_id, resoconto_window=resoconto_window)
         
     
 ############################################ STAKE COMMANDS ############################################
@@ -796,9 +968,10 @@ def create_personal_stake(update: Update, context: CallbackContext):
         update.effective_message.reply_text("ERRORE: lo stake personalizzato inserito si sovrappone ad un altro già presente. Controlla gli stake dell'utente con il comando /visualizza_stake <username o ID>.")
         return
 
-    # * add the personal stake
+    # * add the personal stake, rebuilding the compiled ones
     target_user_id = target_user_data["_id"]
-    update_result = user_manager.update_user_personal_stakes(target_user_id, parsed_stake)
+    compiled_personal_stakes = personal_stakes.compile_personal_stakes(target_user_data["personal_stakes"] + [parsed_stake])
+    update_result = user_manager.update_user_personal_stakes(target_user_id, parsed_stake, compiled_personal_stakes=compiled_personal_stakes)
     if not update_result:
         update.effective_message.reply_text("ERRORE: database non raggiungibile")
 
@@ -1088,51 +1261,90 @@ def send_file_id(update: Update, _):
     update.effective_message.reply_text(reply_message)  
 
 
-def _send_broadcast_media(send_media_function: Callable, file_id: str, caption: str):
-    """Function to be called in async in order to send a broadcast media.
+def send_metrics(update: Update, context: CallbackContext):
+    """/metriche
+    Sends the current metrics of the bot (handlers, db commands and Telegram requests latency),
+    in the Prometheus text format, as a file.
+
+    Args:
+        update (Update)
+        context (CallbackContext)
+    """
+    user_id = update.effective_user.id
+    # * check if the user has the permission to use this command
+    if not users.check_user_permission(user_id, permitted_roles=["admin"]):
+        update.effective_message.reply_text("ERRORE: non disponi dei permessi necessari ad utilizzare questo comando")
+        return
+    metrics_file = io.BytesIO(metrics.render_metrics().encode("utf-8"))
+    update.effective_message.reply_document(metrics_file, filename="metrics.txt")
+
+
+def _parse_broadcast_media_caption(caption: str) -> Tuple[str, Optional[int], str]:
+    """Parses the caption of a broadcast media, whose first line is one of the broadcast
+    commands (with its arguments) and the rest is the caption to send.
 
     Args:
-        send_media_function (Callable)
-        file_id (str)
         caption (str)
+
+    Raises:
+        custom_exceptions.CommandArgumentsError: if the command arguments are missing or not valid
+
+    Returns:
+        Tuple[str, Optional[int], str]: the segment name, the days (for /broadcast_nuovi) and the caption to send
     """
-    all_user_ids = user_manager.retrieve_user_ids("not_blocked")
-    lgr.logger.info(f"Starting to send broadcast media in async to approx. {len(all_user_ids)} users")
-    for user_id in all_user_ids:
-        try:
-            send_media_function(                
-                user_id,
-                file_id,
-                caption=caption
-            )
-        except Unauthorized:
-            lgr.logger.info(f"User {user_id} blocked the bot")
-        except Exception as e:
-            lgr.logger.info(f"Error in sending message: {str(e)}")
+    first_line, _, caption_to_send = caption.partition("\n")
+    command, *command_args = first_line.split()
+    days = None
+    if command in ("/broadcast_nuovi", "/broadcast_segmento"):
+        if not command_args:
+            raise custom_exceptions.CommandArgumentsError()
+        command_argument = command_args.pop(0)
+        if command == "/broadcast_segmento":
+            segment_name = command_argument
+        else:
+            segment_name = segments.NOT_BLOCKED_SEGMENT_NAME
+            try:
+                days = int(command_argument)
+            except ValueError:
+                raise custom_exceptions.CommandArgumentsError()
+    else:
+        segment_name = BROADCAST_MEDIA_COMMANDS_SEGMENTS[command]
+    # * the words following the command arguments on the first line are part of the caption
+    caption_to_send = "\n".join(line for line in (" ".join(command_args), caption_to_send.strip()) if line)
+    return segment_name, days, caption_to_send
 
 
 def broadcast_media(update: Update, context: CallbackContext):
+    """Sends the media (photo, video or document) to the users of a segment,
+    copying the admin's message, so that the media is not uploaded again.
+    <media> with caption: /broadcast[_attivi|_scaduti|_nuovi <days>|_segmento <segment name>] LINE BREAK <caption>
+
+    Args:
+        update (Update)
+        context (CallbackContext)
+    """
     user_id = update.effective_user.id
     # * check if the user has the permission to use this command
     if not users.check_user_permission(user_id, permitted_roles=["admin"]):
         update.effective_message.reply_text("ERRORE: non disponi dei permessi necessari ad utilizzare questo comando")
         return
-    file_id = None
-    if not update.effective_message.document is None:
-        file_id = update.effective_message.document.file_id
-        send_media_function = context.bot.send_document
-    elif not update.effective_message.photo is None and update.effective_message.photo != []:
-        file_id = update.effective_message.photo[-1].file_id
-        send_media_function = context.bot.send_photo
-    elif not update.effective_message.video is None:
-        file_id = update.effective_message.video.file_id
-        send_media_function = context.bot.send_video
-    if file_id is None:
-        reply_message = "Impossibile ottenere il file_id dal media inviato"
-        update.effective_message.reply_text(reply_message)
+    message = update.effective_message
+    if message.document is None and not message.photo and message.video is None:
+        message.reply_text("ERRORE: il media inviato non è supportato, invia una foto, un video o un documento")
         return
-    caption = " ".join(update.effective_message.caption.split()[1:]).strip()
-    _send_broadcast_media(send_media_function, file_id, caption)
+    try:
+        segment_name, days, caption = _parse_broadcast_media_caption(message.caption)
+    except custom_exceptions.CommandArgumentsError as e:
+        message.reply_text(str(e) + "il segmento (o i giorni) e, andando a capo, la didascalia")
+        return
+    _send_broadcast(
+        update,
+        context,
+        segment_name,
+        "copy_message",
+        {"from_chat_id": message.chat_id, "message_id": message.message_id, "caption": caption},
+        days,
+    )
 
 #TODO modify to handle multiple budgets
 def get_user_budget(update: Update, context: CallbackContext):
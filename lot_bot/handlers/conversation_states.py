@@ -0,0 +1,11 @@
+"""Module containing the states of the budget and payment conversations,
+kept apart from their handlers so that the conversations can be registered
+without importing the handler modules"""
+
+# ================================== BUDGET =========================================
+CREATE_BUDGET_NAME, SET_BUDGET_INTEREST, SET_BUDGET_BALANCE = range(3)
+EDIT_BUDGET_NAME, EDIT_BUDGET_BALANCE,EDIT_BASE_SIMPLY_INTEREST, DELETE_BUDGET, CONFIRM_DELETE_BUDGET = range(5)
+SET_FIRST_BUDGET_BALANCE = 0
+
+# ================================== PAYMENTS =========================================
+REFERRAL = 0
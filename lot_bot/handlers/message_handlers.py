@@ -4,22 +4,26 @@ import html
 import json
 import traceback
 import datetime
-from typing import List
+from typing import Iterable, List
 
 from lot_bot import config as cfg
 from lot_bot import constants as cst
 from lot_bot import custom_exceptions
+from lot_bot import error_reporter
 from lot_bot import keyboards as kyb
 from lot_bot import logger as lgr
+from lot_bot import results_cache
+from lot_bot import sender
 from lot_bot import utils
 from lot_bot.dao import (giocate_manager, sport_subscriptions_manager,
                          user_manager, budget_manager)
+from lot_bot.models import engagement
 from lot_bot.models import giocate as giocata_model
 from lot_bot.models import sports as spr
 from lot_bot.models import strategies as strat
 from lot_bot.models import users
 from lot_bot.models import subscriptions as subs_model
-from telegram import ParseMode, Update
+from telegram import Bot, ParseMode, Update
 from telegram.error import Unauthorized
 from telegram.ext.dispatcher import CallbackContext
 
@@ -27,19 +31,84 @@ from telegram.ext.dispatcher import CallbackContext
 
 
 def send_messages_to_developers(context: CallbackContext, messages_to_send: List[str], parse_mode=None):
+    """Sends the messages to the developers through the error reporter's thread, so that the handler
+    does not wait for the rate limiter (the developer alerts have the lowest priority).
+    Without the error reporter, the messages are sent directly.
+
+    Args:
+        context (CallbackContext)
+        messages_to_send (List[str])
+        parse_mode (optional): None or ParseMode.HTML. Defaults to None.
+    """
+    if error_reporter.error_aggregator is None:
+        send_messages_to_developers_with_bot(context.bot, messages_to_send, parse_mode=parse_mode)
+        return
+    # * the error reporter sends the messages as HTML
+    if parse_mode != ParseMode.HTML:
+        messages_to_send = [html.escape(msg) for msg in messages_to_send]
+    error_reporter.error_aggregator.enqueue_messages(messages_to_send)
+
+
+def send_messages_to_developers_with_bot(bot: Bot, messages_to_send: List[str], parse_mode=None):
     for dev_chat_id in cfg.config.DEVELOPER_CHAT_IDS:
         for msg in messages_to_send:
             try:
-                context.bot.send_message(chat_id=dev_chat_id, text=msg, parse_mode=parse_mode)
+                sender.rate_limiter.acquire(sender.MessagePriority.DEV_ALERT)
+                bot.send_message(chat_id=dev_chat_id, text=msg, parse_mode=parse_mode)
             except Exception as e:
                 lgr.logger.error(f"Could not send message {msg} to developer {dev_chat_id}")
                 lgr.logger.error(f"{str(e)}") # cannot raise e since it would loop with the error handler
 
 
+def send_messages_to_chat(context: CallbackContext, chat_id: int, messages_to_send: Iterable[str], parse_mode=None) -> int:
+    """Sends the messages to the chat, in order.
+
+    Args:
+        context (CallbackContext)
+        chat_id (int)
+        messages_to_send (Iterable[str]): the messages, each one within Telegram's max message length
+        parse_mode (optional): Defaults to None.
+
+    Returns:
+        int: the number of messages sent
+    """
+    messages_sent = 0
+    for msg in messages_to_send:
+        context.bot.send_message(chat_id=chat_id, text=msg, parse_mode=parse_mode)
+        messages_sent += 1
+    return messages_sent
+
+
+def _check_and_update_user_sport_access(user_id: int, message_date: datetime.datetime, sport: str) -> bool:
+    """Checks if the user has an active subscription for the given sport,
+    storing the sport access map created from the user's subscriptions.
+
+    Args:
+        user_id (int)
+        message_date (datetime.datetime): the date of the message being sent
+        sport (str)
+
+    Returns:
+        bool: True if the user has access to the sport, False otherwise
+    """
+    user_data = user_manager.retrieve_user_fields_by_user_id(user_id, ["subscriptions"])
+    if not user_data or "subscriptions" not in user_data:
+        return False
+    try:
+        user_manager.store_subscriptions_derived_fields(user_id, user_data["subscriptions"])
+    except Exception as e:
+        lgr.logger.warning(f"Could not store the sport access map for user {user_id} - {str(e)}")
+    return user_manager.check_user_sport_subscription(message_date, user_data["subscriptions"], sport)
+
+
 def send_message_to_all_subscribers(update: Update, context: CallbackContext, original_text: str, sport: str, strategy: str, 
-                                        is_giocata: bool = False):
+                                        is_giocata: bool = False, giocata_id: str = None, order_by_engagement: bool = None):
     """Sends a message to all the user subscribed to a certain sport's strategy.
-    If the message is a giocata, the reply_keyboard is the one used for the giocata registration.
+    If the message is a giocata, the reply_keyboard is the one used for the giocata registration,
+    which carries the giocata _id and the eventual personal stake of the user.
+    The giocate are sent with the highest priority, the other messages (e.g. outcomes and cashouts)
+    right after them, so that they are not delayed by the broadcasts.
+    If order_by_engagement is True, the users who engaged the most with the strategy receive the message first.
 
     In case the number of messages sent is less than the number of abbonati, 
     a message is sent to the developers. 
@@ -51,49 +120,70 @@ def send_message_to_all_subscribers(update: Update, context: CallbackContext, or
         sport (str)
         strategy (str)
         is_giocata (bool, default = False): False if it is not a giocata, True otherwise.
+        giocata_id (str, default = None): the _id of the giocata, used in the register giocata keyboard.
+        order_by_engagement (bool, default = None): defaults to cfg.config.ENGAGEMENT_ORDERED_FAN_OUT.
 
     """
     text = original_text
+    # * the users without access to the sport are filtered out directly by the query
+    message_timestamp = update.effective_message.date.timestamp()
     # * check if the strategy is all, hence the message has to be sent to all sub to the specified sport
     if strategy != "all":
         lgr.logger.info(f"Sending message to all users subscribed to {sport} - {strategy}")
-        sub_user_ids = sport_subscriptions_manager.retrieve_all_user_ids_sub_to_sport_and_strategy(sport, strategy)
+        sub_user_ids = sport_subscriptions_manager.retrieve_all_user_ids_sub_to_sport_and_strategy(sport, strategy, active_timestamp=message_timestamp)
     else:
         lgr.logger.info(f"Sending message to all users subscribed to any strategy of {sport}")
-        sub_user_ids = sport_subscriptions_manager.retrieve_all_user_ids_sub_to_sport(sport)
+        sub_user_ids = sport_subscriptions_manager.retrieve_all_user_ids_sub_to_sport(sport, active_timestamp=message_timestamp)
     # * check if there are any subscribers to the specified strategy
     if sub_user_ids == []:
         lgr.logger.warning(f"There are no sport_subscriptions for {sport=} {strategy=}")
         return
+    if order_by_engagement is None:
+        order_by_engagement = cfg.config.ENGAGEMENT_ORDERED_FAN_OUT
+    if order_by_engagement:
+        try:
+            sub_user_ids = engagement.order_user_ids_by_engagement(sub_user_ids, sport, strategy)
+        except Exception as e:
+            # * the message is sent anyway, in the default order
+            lgr.logger.warning(f"Could not order the subscribers of {sport} - {strategy} by engagement - {str(e)}")
     messages_sent = 0
     messages_to_be_sent = len(sub_user_ids)
+    priority = sender.MessagePriority.GIOCATA if is_giocata else sender.MessagePriority.OUTCOME
     lgr.logger.info(f"Found {messages_to_be_sent} sport_subscriptions for {sport} - {strategy}")
     # * eventually add giocata text at the end of the message
     if is_giocata:
         original_text += "\n\nSeguirai questo evento?"
+        if giocata_id:
+            base_register_giocata_keyboard = kyb.create_register_giocata_keyboard(giocata_id)
+        else:
+            base_register_giocata_keyboard = kyb.REGISTER_GIOCATA_KEYBOARD
     for user_id in sub_user_ids:
-        user_data = user_manager.retrieve_user_fields_by_user_id(user_id, ["subscriptions", "personal_stakes", "blocked"])
+        user_data = user_manager.retrieve_user_fields_by_user_id(user_id, ["sport_access", "personal_stakes", "compiled_personal_stakes", "blocked"])
         # * check if the user actually exists
         if not user_data:
-            lgr.logger.warning(f"No user found with id {user_id} while handling giocata")
+            lgr.fan_out_logger.warning("No user found with id %s while handling giocata", user_id)
             messages_to_be_sent -= 1
             continue
         # * check if the user is blocked
         if user_data["blocked"]:
-            #lgr.logger.warning(f"User {user_id} is blocked") TODO fix with a more efficient way to print this
+            lgr.fan_out_logger.debug("User %s is blocked", user_id)
             messages_to_be_sent -= 1
             continue
-        # * check if the user has an active subscription for the given sport
-        if not user_manager.check_user_sport_subscription(update.effective_message.date, user_data["subscriptions"], sport):
-            #lgr.logger.warning(f"User {user_id} is not active or does not have access to said sport") TODO fix with a more efficient way to print this
+        # * users without the sport access map are checked against their subscriptions, which are then denormalized
+        if "sport_access" not in user_data and not _check_and_update_user_sport_access(user_id, update.effective_message.date, sport):
+            lgr.fan_out_logger.debug("User %s is not active or does not have access to %s", user_id, sport)
             messages_to_be_sent -= 1
             continue
-        #lgr.logger.debug(f"Sending message to {user_id}") TODO fix with a more efficient way to print this
+        lgr.fan_out_logger.debug("Sending message to %s", user_id)
         # * in case of giocata message, add the register giocata keyboard and personalize the stake
         if is_giocata:
-            custom_reply_markup = kyb.REGISTER_GIOCATA_KEYBOARD
+            custom_reply_markup = base_register_giocata_keyboard
             if "personal_stakes" in user_data:
-                text = giocata_model.personalize_giocata_text(original_text, user_data["personal_stakes"], sport, strategy)
+                text, personal_stake = giocata_model.personalize_giocata_text_and_get_stake(original_text, user_data["personal_stakes"], sport, strategy, 
+                    compiled_personal_stakes=user_data.get("compiled_personal_stakes"))
+                # * the stake is sent along the callback data, so that it does not need to be parsed upon registration
+                if giocata_id and personal_stake is not None:
+                    custom_reply_markup = kyb.create_register_giocata_keyboard(giocata_id, personal_stake)
             user_budget = budget_manager.retrieve_default_budget_from_user_id(user_id)
             if user_budget:
                 if user_budget["interest_type"] == "semplice":
@@ -109,6 +199,7 @@ def send_message_to_all_subscribers(update: Update, context: CallbackContext, or
             custom_reply_markup = kyb.STARTUP_REPLY_KEYBOARD
             text = original_text
         try:
+            sender.rate_limiter.acquire(priority)
             context.bot.send_message(
                 user_id, 
                 text, 
@@ -116,10 +207,10 @@ def send_message_to_all_subscribers(update: Update, context: CallbackContext, or
             messages_sent += 1
         # * check if the user has blocked the bot
         except Unauthorized:
-            #lgr.logger.warning(f"Could not send message: user {user_id} blocked the bot") TODO fix with a more efficient way to print this
+            lgr.fan_out_logger.debug("Could not send message: user %s blocked the bot", user_id)
             messages_to_be_sent -= 1
         except Exception as e:
-            lgr.logger.error(f"Could not send message {text} to user {user_id} - {str(e)}")
+            lgr.fan_out_logger.error("Could not send message %s to user %s - %s", text, user_id, e)
     if messages_sent < messages_to_be_sent:
         error_text = f"{messages_sent} messages have been sent out of {messages_to_be_sent} for {sport} - {strategy}"
         lgr.logger.warning(error_text)
@@ -209,14 +300,14 @@ def giocata_handler(update: Update, context: CallbackContext):
         return
     # * save giocata in db
     try:
-        giocate_manager.create_giocata(parsed_giocata)
+        giocata_id = giocate_manager.create_giocata(parsed_giocata)
     except custom_exceptions.GiocataCreationError:
         update.effective_message.reply_text(f"ATTENZIONE: la giocata non è stata inviata perchè la combinazione '#{parsed_giocata['giocata_num']}' - '{parsed_giocata['sport']}' è già stata utilizzata.")
         return
     sport = parsed_giocata["sport"]
     strategy = parsed_giocata["strategy"]
     lgr.logger.info(f"Received giocata {sport} - {strategy}")
-    send_message_to_all_subscribers(update, context, text, sport, strategy, is_giocata=True)
+    send_message_to_all_subscribers(update, context, text, sport, strategy, is_giocata=True, giocata_id=giocata_id)
 
 
 def teacherbet_giocata_handler(update: Update, context: CallbackContext):
@@ -225,11 +316,11 @@ def teacherbet_giocata_handler(update: Update, context: CallbackContext):
     for parsed_giocata in parsed_giocate:
         # TODO OPTIMIZATION: only one access to the db to store them
         try:
-            giocate_manager.create_giocata(parsed_giocata)
+            giocata_id = giocate_manager.create_giocata(parsed_giocata)
         except custom_exceptions.GiocataCreationError:
             update.effective_message.reply_text(f"ATTENZIONE: la giocata non è stata inviata perchè la combinazione '#{parsed_giocata['giocata_num']}' - '{parsed_giocata['sport']}' è già stata utilizzata.")
             return
-        send_message_to_all_subscribers(update, context, parsed_giocata["raw_text"], spr.sports_container.TEACHERBET.name, strat.strategies_container.TEACHERBETLUXURY.name, is_giocata=True)
+        send_message_to_all_subscribers(update, context, parsed_giocata["raw_text"], spr.sports_container.TEACHERBET.name, strat.strategies_container.TEACHERBETLUXURY.name, is_giocata=True, giocata_id=giocata_id)
 
 
 def outcome_giocata_handler(update: Update, context: CallbackContext):
@@ -257,6 +348,7 @@ def outcome_giocata_handler(update: Update, context: CallbackContext):
     # send_message_to_all_subscribers(update, context, text, giocata_num, sport, strategy.name)#, is_outcome=True, outcome_data={"giocata_num": giocata_num, "outcome": outcome})
     # * update the budget of all the user's who accepted the giocata
     users.update_users_budget_with_giocata(updated_giocata)
+    results_cache.invalidate_giocata_results(updated_giocata["_id"])
 
 
 def send_giocata_outcome(context: CallbackContext, giocata_id: str, outcome_text: str):
@@ -275,14 +367,15 @@ def send_giocata_outcome(context: CallbackContext, giocata_id: str, outcome_text
                 stake = giocata["base_stake"]
             outcome_text_to_send = giocata_model.update_outcome_text_with_money_value(outcome_text_to_send, user_budget['balance'], stake, giocata["base_quota"], giocata["outcome"])
         try:
+            sender.rate_limiter.acquire(sender.MessagePriority.OUTCOME)
             context.bot.send_message(
                 user_id, 
                 outcome_text_to_send)
         # * check if the user has blocked the bot
         except Unauthorized:
-            lgr.logger.warning(f"Could not send message: user {user_id} blocked the bot")
+            lgr.fan_out_logger.warning("Could not send message: user %s blocked the bot", user_id)
         except Exception as e:
-            lgr.logger.error(f"Could not send message {outcome_text} to user {user_id} - {str(e)}")
+            lgr.fan_out_logger.error("Could not send message %s to user %s - %s", outcome_text, user_id, e)
 
 
 def teacherbet_giocata_outcome_handler(update: Update, context: CallbackContext):
@@ -303,6 +396,7 @@ def teacherbet_giocata_outcome_handler(update: Update, context: CallbackContext)
             update.effective_message.reply_text(f"ATTENZIONE: il risultato non è stata inviato perchè la giocata non è stata trovata nel database. Si prega di ricontrollare e rimandare l'esito.")
             return
     updated_giocata = giocate_manager.retrieve_giocata_by_num_and_sport(giocata_num, sport)
+    results_cache.invalidate_giocata_results(updated_giocata["_id"])
     strategy = strat.strategies_container.get_strategy(updated_giocata["strategy"])
     send_message_to_all_subscribers(update, context, text, sport, strategy.name)
 
@@ -327,6 +421,7 @@ def exchange_cashout_handler(update: Update, context: CallbackContext):
     if not updated_giocata:
         update.effective_message.reply_text(f"ATTENZIONE: il cashout non è stato inviato. La giocata {giocata_num} non è stata trovata")
         return
+    results_cache.invalidate_giocata_results(updated_giocata["_id"])
     # * create parsed cashout message
     cashout_text = utils.create_cashout_message(cashout_text_raw)
     lgr.logger.info(f"Received cashout message {cashout_text}")
@@ -357,24 +452,28 @@ def checklist_completed_handler(update: Update, context: CallbackContext):
 
 
 def unrecognized_message(update: Update, _):
-    lgr.logger.info(f"Unrecognized message: {update.effective_message}")
+    if not update.effective_message:
+        lgr.logger.info("Unrecognized update %s", update.update_id)
+        return
+    # * the whole message is only written when debugging
+    lgr.logger.info("Unrecognized message %s from chat %s", update.effective_message.message_id, update.effective_chat.id)
+    lgr.logger.debug("Unrecognized message: %s", update.effective_message)
 
 
 ############################################ ERROR HANDLER ############################################
 
 
-def error_handler(update: Update, context: CallbackContext):
-    """Handles all the errors coming from any other handler.
-         The error is written in the logs and a message is sent
-         to all the developers to notify them about it.
-         (taken from: 
-         https://github.com/python-telegram-bot/python-telegram-bot/blob/master/examples/errorhandlerbot.py)
+def create_error_report(update: Update, context: CallbackContext) -> List[str]:
+    """Creates the messages describing the error to the developers:
+    the update, the chat and user data and the traceback, split in chunks.
 
     Args:
         update (Update)
         context (CallbackContext)
+
+    Returns:
+        List[str]
     """
-    lgr.logger.error(msg="Exception while handling an update:", exc_info=context.error)
     # traceback.format_exception returns the usual python message about an exception, but as a
     #   list of strings rather than a single string, so we have to join them together.
     tb_list = traceback.format_exception(None, context.error, context.error.__traceback__)
@@ -394,9 +493,31 @@ def error_handler(update: Update, context: CallbackContext):
     for i in range(splits):
         start_index = i * MAX_MESSAGE_LENGTH
         end_index = int(min((i+1) * MAX_MESSAGE_LENGTH, len(escaped_tb_string)))
-        lgr.logger.error(html.escape(tb_string[start_index:end_index]))
         to_send.append(f"<pre>{html.escape(tb_string[start_index:end_index])}</pre>")
-    send_messages_to_developers(context, to_send, parse_mode=ParseMode.HTML)
+    return to_send
+
+
+def error_handler(update: Update, context: CallbackContext):
+    """Handles all the errors coming from any other handler.
+         The error is written in the logs and a message is sent
+         to all the developers to notify them about it.
+         The errors with the same fingerprint are sent in full only once,
+         then they are summarized periodically (see error_reporter).
+         (taken from: 
+         https://github.com/python-telegram-bot/python-telegram-bot/blob/master/examples/errorhandlerbot.py)
+
+    Args:
+        update (Update)
+        context (CallbackContext)
+    """
+    fingerprint = error_reporter.get_error_fingerprint(context.error)
+    if error_reporter.error_aggregator is None:
+        lgr.logger.error(msg="Exception while handling an update:", exc_info=context.error)
+        send_messages_to_developers(context, create_error_report(update, context), parse_mode=ParseMode.HTML)
+    elif error_reporter.error_aggregator.report(fingerprint, lambda: create_error_report(update, context)):
+        lgr.logger.error(msg="Exception while handling an update:", exc_info=context.error)
+    else:
+        lgr.logger.error("Exception while handling an update (summarized): %s - %s", fingerprint, context.error)
     # ! send a message to the user
     try:
         user_chat_id = None
@@ -13,10 +13,9 @@ from lot_bot.handlers import callback_handlers, message_handlers, ref_code_handl
 from lot_bot.models import users, subscriptions as subs
 from telegram import LabeledPrice, Update
 from telegram.ext.conversationhandler import ConversationHandler
+from lot_bot.handlers.conversation_states import REFERRAL
 from telegram.ext.dispatcher import CallbackContext
 
-REFERRAL = 0
-
 
 def to_add_linked_referral_before_payment(update: Update, context: CallbackContext) -> Optional[int]:
     """Asks the user to add a new referral/affiliation code, possibily showing the one that he/she
@@ -230,6 +229,27 @@ def pre_checkout_handler(update: Update, context: CallbackContext):
         del context.user_data["payment_limit_timestamp"]
 
 
+def _register_referred_payment(context: CallbackContext, linked_referral_id: int, payment_id: str, user_id: int):
+    """Adds the payment to the referred payments of the referral user,
+    notifying the developers in case of errors.
+    It is run asynchronously, outside of the payment's update.
+
+    Args:
+        context (CallbackContext)
+        linked_referral_id (int)
+        payment_id (str)
+        user_id (int): the user who paid
+    """
+    try:
+        refs_update_result = user_manager.update_user_referred_payments(linked_referral_id, payment_id)
+    except Exception as e:
+        lgr.logger.error(f"Could not update referred payments of user {linked_referral_id} - {str(e)}")
+        refs_update_result = False
+    if not refs_update_result:
+        refs_error_message = f"ERRORE PAGAMENTO: non è stato possibile aggiungere il pagamento {payment_id} dell'utente {user_id} all'utente referral {linked_referral_id}"
+        message_handlers.send_messages_to_developers(context, [refs_error_message])
+
+
 def successful_payment_callback(update: Update, context: CallbackContext):
     """Sends a final "thank you" message to the user to complete the transaction,
     then saves the user's payment and update the referred user referral count, if there
@@ -245,71 +265,49 @@ def successful_payment_callback(update: Update, context: CallbackContext):
     payment_final_message = cst.SUCCESSFUL_PAYMENT_TEXT
     payment_outcome_text = "Pagamento effettuato con successo" # This string is part of the text that will be sent to new payments channel
     user_id = update.effective_user.id
-    retrieved_user = user_manager.retrieve_user_fields_by_user_id(user_id, ["subscriptions", "linked_referral_user"])
-    retrieved_user_subs = retrieved_user["subscriptions"]
-    user_subs_name = [entry["name"] for entry in retrieved_user_subs]
+    successful_payment = update.message.successful_payment
     # new_expiration_date =  datetime.datetime(2021, 12, 2, hour=23, minute=59).timestamp() # TODO REVERT
     sub_name = "lotcomplete" #"_".join(context.user_data["payment_payload"].split("_")[1:])
     # * extend the user's subscription up to the same day of the next month
     days = 30
-    pack_type = "_".join(context.user_data["payment_payload"].split("_")[1:])
+    # * the payload is the same one of the pre checkout query
+    pack_type = "_".join(successful_payment.invoice_payload.split("_")[1:])
     if pack_type == "1m":
         days = 30
     elif pack_type == "4m":
         days = 120
     elif pack_type == "1a":
         days = 365
-    if sub_name not in user_subs_name:
-        new_expiration_date = (datetime.datetime.utcnow() + datetime.timedelta(days=days)).timestamp()
-        retrieved_user_subs.append({"name": sub_name, "expiration_date": new_expiration_date})
-    else:
-        base_exp_date = [entry["expiration_date"] for entry in retrieved_user_subs if entry["name"] == sub_name][0]
-        # base_exp_date = retrieved_user_subs[sub_name]["expiration_date"]
-
-        new_expiration_date: float = users.extend_expiration_date(base_exp_date, days)
-        for sub_entry in retrieved_user_subs:
-            if sub_entry["name"] == sub_name:
-                sub_entry["expiration_date"] = new_expiration_date
-                break
-    # * add email to user data
-    user_email = update.message.successful_payment.order_info.email
-    user_data = {
-        "subscriptions": retrieved_user_subs,
-        "successful_referrals_since_last_payment": [],
-        "email": user_email,
-    }
-    try:
-        user_update_result = user_manager.update_user(user_id, user_data)
-    except:
-        user_update_result = False
-    if not user_update_result:
-        lgr.logger.error(f"Could not update data after payment for user {user_id} - {user_data=}")
-    payment_data = update.message.successful_payment.to_dict()
+    payment_data = successful_payment.to_dict()
     payment_data["datetime_timestamp"] = datetime.datetime.utcnow().timestamp()
     payment_data["payment_id"] = str(user_id) + "-" + str(payment_data["datetime_timestamp"])
-    # * get linked referral user
-    linked_referral_id = retrieved_user["linked_referral_user"]["linked_user_id"]
-    if not linked_referral_id is None:
-        lgr.logger.debug(f"Updating referred user {linked_referral_id} after successful payment by {user_id}")
-        payment_data["referred_by"] = linked_referral_id
-        refs_update_result = user_manager.update_user_referred_payments(linked_referral_id, payment_data["payment_id"])
-        if not refs_update_result:
-            refs_error_message = f"ERRORE PAGAMENTO: non è stato possibile aggiungere il pagamento {payment_data['payment_id']} dell'utente {user_id} all'utente referral {linked_referral_id}"
-            message_handlers.send_messages_to_developers(context, [refs_error_message])
-    # * registering payment
-    lgr.logger.debug(f"Registering payment {str(payment_data)} for {user_id}")
+    # * the subscription, the email, the referrals reset and the payment are written with a single update
+    user_email = successful_payment.order_info.email if successful_payment.order_info else None
+    linked_referral_id = None
     try:
-        register_result = user_manager.register_payment_for_user_id(payment_data, user_id)
-    except:
+        registration_result = users.register_payment_and_extend_subscription(user_id, payment_data, sub_name, days, user_email)
+    except Exception as e:
         # this gets both db errors and other issues related to missing users
-        register_result = False
+        lgr.logger.error(f"Could not register payment for user {user_id} - {str(e)}")
+        registration_result = False
+    if registration_result is None:
+        # * duplicate delivery of a payment already registered and notified
+        lgr.logger.warning(f"Payment {successful_payment.telegram_payment_charge_id} of user {user_id} already registered")
+        return
+    if registration_result:
+        new_expiration_date, linked_referral_id = registration_result
+    else:
+        new_expiration_date = None
+    # * the referral user is updated in the background, since the payer does not need to wait for it
+    if not linked_referral_id is None:
+        lgr.logger.debug(f"Updating referred user {linked_referral_id} after successful payment by {user_id}")
+        context.dispatcher.run_async(_register_referred_payment, context, linked_referral_id, payment_data["payment_id"], user_id)
     # * handle data registration errors
-    if not register_result or not user_update_result:
+    if not registration_result:
         lgr.logger.error(f"Could not register payment {str(payment_data)} for user {user_id}")
         payment_final_message = f"ERRORE: il pagamento è stato effettuato con successo, ma non siamo riusciti a registrarlo correttamente.\n"
         payment_final_message += f"Si prega di contattarci su @teamlot e di riportare il seguente codice: {payment_data['payment_id']}"
-        dev_message = "ERRORE: pagamento non registrato per l'utente {user_id}.\n"
-        dev_message += f"Update dati utente: {user_update_result=} - registrazione pagamento: {register_result=}\n"
+        dev_message = f"ERRORE: pagamento non registrato per l'utente {user_id}.\n"
         dev_message += f"Dati pagamento:\n {str(payment_data)}"
         message_handlers.send_messages_to_developers(context, [dev_message])
         payment_outcome_text = "Pagamento effettuato con successo, ma non è stato possibile registrarlo correttamente."
@@ -330,14 +328,17 @@ def successful_payment_callback(update: Update, context: CallbackContext):
     #         message_handlers.send_messages_to_developers(context, [dev_message])
     #         payment_outcome_text = "Pagamento effettuato con successo, ma non è stato possibile registrarlo correttamente per l'affiliazione."
     # * send final payment message and homepage
-    del context.user_data["payment_payload"]
+    context.user_data.pop("payment_payload", None)
     update.message.reply_text(payment_final_message, parse_mode="HTML")
     message_handlers.homepage_handler(update, context)
 
     price = str(payment_data["total_amount"])
     price = price[:-2]+","+price[-2:] + " " + payment_data["currency"]
 
-    new_expiration_date_text = datetime.datetime.strftime( datetime.datetime.utcfromtimestamp(new_expiration_date) + datetime.timedelta(hours=1), "%d/%m/%Y alle %H:%M")
+    if new_expiration_date is None:
+        new_expiration_date_text = "non registrata"
+    else:
+        new_expiration_date_text = datetime.datetime.strftime( datetime.datetime.utcfromtimestamp(new_expiration_date) + datetime.timedelta(hours=1), "%d/%m/%Y alle %H:%M")
     new_payment_channel_message = cst.NEW_PAYMENT_CHANNEL_MESSAGE.format(
         update.effective_user.id, 
         update.effective_user.first_name, 
@@ -0,0 +1,97 @@
+""" This module contains the jobs which are run periodically by the JobQueue,
+which is started only when the bot runs as a long-lived process
+(i.e. polling or the webhook server).
+"""
+import datetime
+
+from telegram import Bot, ParseMode
+from telegram.ext import CallbackContext, JobQueue
+
+from lot_bot import constants as cst
+from lot_bot import logger as lgr
+from lot_bot import sender
+from lot_bot.dao import user_manager
+from lot_bot.models import engagement, segments
+from lot_bot.models import subscriptions as subs
+
+
+def create_expiry_reminder_message(expiration_date: float) -> str:
+    # * the expiration dates are shown in the Italian time zone, as in the rest of the bot
+    expiration_date_string = datetime.datetime.strftime(datetime.datetime.utcfromtimestamp(expiration_date) + datetime.timedelta(hours=1), "%d/%m/%Y alle %H:%M")
+    return cst.EXPIRY_REMINDER_MESSAGE.format(subs.sub_container.LOTCOMPLETE.display_name, expiration_date_string)
+
+
+def remind_expiring_subscriptions(bot: Bot, days: int = cst.EXPIRY_REMINDER_DAYS, batch_size: int = cst.EXPIRY_REMINDER_BATCH_SIZE,
+        now_timestamp: float = None) -> int:
+    """Reminds the users whose LoT subscription expires in the next days of its expiration.
+    The reminders are sent in batches through the rate-limited sender. Before each batch,
+    each user is claimed by recording the reminded expiration date, so that the users are
+    not reminded twice of the same expiration, even if the job is run again or by more
+    instances of the bot at the same time (if the job is stopped halfway, the claimed users
+    of the current batch are not reminded).
+    The claims of the failed users are removed after the batch, so that they are tried again on the next run.
+
+    Args:
+        bot (Bot)
+        days (int, optional): Defaults to cst.EXPIRY_REMINDER_DAYS.
+        batch_size (int, optional): Defaults to cst.EXPIRY_REMINDER_BATCH_SIZE.
+        now_timestamp (float, optional): Defaults to the current UTC timestamp.
+
+    Returns:
+        int: the number of reminded users
+    """
+    if now_timestamp is None:
+        now_timestamp = datetime.datetime.utcnow().timestamp()
+    backfilled_users = user_manager.backfill_lot_expiration_dates()
+    if backfilled_users:
+        lgr.logger.info(f"Backfilled the LoT expiration date of {backfilled_users} users")
+    users_to_remind = user_manager.retrieve_users_to_remind_of_expiration(now_timestamp, now_timestamp + days * 24 * 60 * 60)
+    lgr.logger.info(f"Sending expiry reminders to {len(users_to_remind)} users")
+    reminded_users = 0
+    for batch_start in range(0, len(users_to_remind), batch_size):
+        expiration_dates = {
+            user_data["_id"]: user_data["lot_expiration_date"]
+            for user_data in users_to_remind[batch_start:batch_start + batch_size]
+            if user_manager.claim_expiry_reminder(user_data["_id"], user_data["lot_expiration_date"], now_timestamp)
+        }
+        send_result = sender.send_to_users(
+            expiration_dates.keys(),
+            lambda user_id: bot.send_message(user_id, create_expiry_reminder_message(expiration_dates[user_id]), parse_mode=ParseMode.HTML),
+        )
+        user_manager.release_expiry_reminders({user_id: expiration_dates[user_id] for user_id in send_result.failed_ids})
+        reminded_users += len(send_result.sent_ids)
+    lgr.logger.info(f"Sent expiry reminders to {reminded_users} users")
+    return reminded_users
+
+
+def expiry_reminders_job(context: CallbackContext):
+    remind_expiring_subscriptions(context.bot)
+
+
+def refresh_segments_job(context: CallbackContext):
+    refreshed_segments = segments.refresh_all_segments()
+    lgr.logger.info(f"Refreshed {len(refreshed_segments)} segments")
+
+
+def refresh_engagement_rankings_job(context: CallbackContext):
+    num_of_rankings = engagement.refresh_engagement_rankings()
+    lgr.logger.info(f"Refreshed {num_of_rankings} engagement rankings")
+
+
+def flush_persistence_job(context: CallbackContext):
+    if context.dispatcher.persistence:
+        context.dispatcher.persistence.flush()
+
+
+def schedule_jobs(job_queue: JobQueue):
+    """Schedules the periodic jobs, which start running once the job queue is started.
+
+    Args:
+        job_queue (JobQueue)
+    """
+    job_queue.run_daily(expiry_reminders_job, cst.EXPIRY_REMINDER_TIME, name="expiry_reminders")
+    # * the segments are refreshed on start as well, so that they are ready for the broadcasts
+    job_queue.run_repeating(refresh_segments_job, cst.SEGMENTS_REFRESH_INTERVAL, first=0, name="refresh_segments")
+    job_queue.run_repeating(refresh_engagement_rankings_job, cst.ENGAGEMENT_RANKINGS_REFRESH_INTERVAL, first=0, name="refresh_engagement_rankings")
+    # * the changed conversation states and user_data are written in batches
+    job_queue.run_repeating(flush_persistence_job, cst.PERSISTENCE_FLUSH_INTERVAL, name="flush_persistence")
@@ -1,13 +1,21 @@
+import datetime
+import functools
+from typing import Dict, FrozenSet, Tuple
+
 from telegram import (InlineKeyboardButton, InlineKeyboardMarkup,
                       KeyboardButton, ReplyKeyboardMarkup, Update)
 
 from lot_bot import constants as cst
 from lot_bot.models import sports as spr
 from lot_bot.models import strategies as strat
+from lot_bot.models import subscriptions as subs
 from lot_bot.models import users
 from lot_bot.dao import sport_subscriptions_manager, user_manager, budget_manager
 from lot_bot import logger as lgr
 
+# * max number of signatures cached for each of the user dependent keyboards
+KEYBOARDS_CACHE_SIZE = 256
+
 
 _startup_buttons = [
     [KeyboardButton(text=cst.ENERGY_BUTTON_TEXT)],
@@ -90,6 +98,31 @@ _register_giocata_buttons = [
 REGISTER_GIOCATA_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=_register_giocata_buttons)
 
 
+def create_register_giocata_keyboard(giocata_id: str, personal_stake: int = None) -> InlineKeyboardMarkup:
+    """Creates the register giocata keyboard carrying the giocata _id
+    and the stake shown to the user, so that the callbacks do not need to 
+    parse the giocata text again.
+
+    The callbacks of this keyboard are in the form of:
+        register_giocata_yes_<giocata _id>_<personal stake>
+        register_giocata_no_<giocata _id>
+    where the personal stake is empty in case it was not personalized.
+
+    Args:
+        giocata_id (str): the _id of the giocata (ObjectId or its hex string)
+        personal_stake (int, optional): the stake rendered in the message. Defaults to None.
+
+    Returns:
+        InlineKeyboardMarkup: the aformentioned keyboard
+    """
+    personal_stake_data = "" if personal_stake is None else str(personal_stake)
+    register_giocata_buttons = [
+        [InlineKeyboardButton(text="SI ✅", callback_data=f"register_giocata_yes_{giocata_id}_{personal_stake_data}"),
+        InlineKeyboardButton(text="NO ❌", callback_data=f"register_giocata_no_{giocata_id}")],
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=register_giocata_buttons)
+
+
 # ===================================== PAGAMENTO E REFERRAL MENU =====================================
 
 _payment_and_referral_buttons = [
@@ -182,10 +215,27 @@ def create_sports_inline_keyboard(update: Update) -> InlineKeyboardMarkup:
     # sport_subscriptions = sport_subscriptions_manager.retrieve_sport_subscriptions_from_user_id(chat_id)
     user_data = sport_subscriptions_manager.retrieve_subs_from_user_id(chat_id)
     sport_subscriptions = user_data["sport_subscriptions"]
-    available_sports = users.get_user_available_sports_names_from_subscriptions(user_data["subscriptions"])
+    if "sport_access" in user_data:
+        available_sports = subs.get_available_sports_names_from_sport_access(user_data["sport_access"], datetime.datetime.utcnow().timestamp())
+    else:
+        available_sports = users.get_user_available_sports_names_from_subscriptions(user_data["subscriptions"])
     subscribed_sports = [entry["sport"].lower() for entry in sport_subscriptions]
-    sports_in_menu = [sport for sport in spr.sports_container if sport.show_in_menu]
-    if available_sports == []:
+    return build_sports_inline_keyboard(frozenset(available_sports), frozenset(subscribed_sports))
+
+
+@functools.lru_cache(maxsize=KEYBOARDS_CACHE_SIZE)
+def build_sports_inline_keyboard(available_sports: FrozenSet[str], subscribed_sports: FrozenSet[str]) -> InlineKeyboardMarkup:
+    """Builds the sports inline keyboard, caching it by its signature.
+
+    Args:
+        available_sports (FrozenSet[str]): the names of the sports accessible by the user, empty if every sport is
+        subscribed_sports (FrozenSet[str]): the names of the sports the user is subscribed to
+
+    Returns:
+        InlineKeyboardMarkup
+    """
+    sports_in_menu = spr.sports_container.get_sports_in_menu()
+    if not available_sports:
         emoji_sport = {sport.name: "🔴" for sport in sports_in_menu}
     else:
         emoji_sport = {sport.name: "🔴" if sport.name in available_sports else "🔒" for sport in sports_in_menu}
@@ -229,6 +279,20 @@ def create_strategies_inline_keyboard(update: Update, sport: spr.Sport) -> Inlin
     chat_id = update.effective_chat.id
     active_strategies = sport_subscriptions_manager.retrieve_subscribed_strats_from_user_id_and_sport(chat_id, sport.name)
     lgr.logger.debug(f"User active strategies: {active_strategies=}")
+    return build_strategies_inline_keyboard(sport, frozenset(active_strategies))
+
+
+@functools.lru_cache(maxsize=KEYBOARDS_CACHE_SIZE)
+def build_strategies_inline_keyboard(sport: spr.Sport, active_strategies: FrozenSet[str]) -> InlineKeyboardMarkup:
+    """Builds the strategies inline keyboard of the sport, caching it by its signature.
+
+    Args:
+        sport (spr.Sport)
+        active_strategies (FrozenSet[str]): the names of the strategies the user is subscribed to
+
+    Returns:
+        InlineKeyboardMarkup
+    """
     emoji_strategies = {strategy.name: "🔴" for strategy in sport.strategies}
     for strategy in active_strategies:
         emoji_strategies[strategy] = "🟢"
@@ -306,8 +370,20 @@ def create_budgets_inline_keyboard(update: Update) -> InlineKeyboardMarkup:
     # sport_subscriptions = sport_subscriptions_manager.retrieve_sport_subscriptions_from_user_id(chat_id)
     user_data = user_manager.retrieve_user_fields_by_user_id(chat_id,["budgets"])
     budgets = user_data["budgets"]
-    budget_names = [entry["budget_name"] for entry in budgets]
+    budget_names = tuple(entry["budget_name"] for entry in budgets)
+    return build_budgets_inline_keyboard(budget_names)
+
+
+@functools.lru_cache(maxsize=KEYBOARDS_CACHE_SIZE)
+def build_budgets_inline_keyboard(budget_names: Tuple[str, ...]) -> InlineKeyboardMarkup:
+    """Builds the budgets inline keyboard, caching it by its signature.
 
+    Args:
+        budget_names (Tuple[str, ...]): the names of the user's budgets, in order
+
+    Returns:
+        InlineKeyboardMarkup
+    """
     keyboard_budget = []
     for name in budget_names:
         budget_callback_data = f"edit_budget_{name}"
@@ -318,6 +394,34 @@ def create_budgets_inline_keyboard(update: Update) -> InlineKeyboardMarkup:
     keyboard_budget.append([InlineKeyboardButton(text=f"Indietro ↩️", callback_data= "to_bot_config_menu")])
     return InlineKeyboardMarkup(inline_keyboard=keyboard_budget)
 
+
+def get_keyboards_cache_stats() -> Dict[str, Dict[str, float]]:
+    """Returns the usage statistics of the cached keyboards builders.
+
+    Returns:
+        Dict[str, Dict[str, float]]: for each builder, its hits, misses, hit rate, current size and max size
+    """
+    cached_builders = (build_sports_inline_keyboard, build_strategies_inline_keyboard, build_budgets_inline_keyboard)
+    cache_stats = {}
+    for builder in cached_builders:
+        cache_info = builder.cache_info()
+        lookups = cache_info.hits + cache_info.misses
+        cache_stats[builder.__name__] = {
+            "hits": cache_info.hits,
+            "misses": cache_info.misses,
+            "hit_rate": cache_info.hits / lookups if lookups else 0.0,
+            "size": cache_info.currsize,
+            "max_size": cache_info.maxsize,
+        }
+    return cache_stats
+
+
+def clear_keyboards_cache():
+    """Empties the caches of the keyboards builders, resetting their statistics."""
+    build_sports_inline_keyboard.cache_clear()
+    build_strategies_inline_keyboard.cache_clear()
+    build_budgets_inline_keyboard.cache_clear()
+
 def create_edit_budget_inline_keyboard(update: Update) -> InlineKeyboardMarkup:
     """Creates the inline keyboard to edit the selected budget
     
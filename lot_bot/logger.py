@@ -1,11 +1,86 @@
+import atexit
+import itertools
 import logging
+import logging.handlers
+import queue
+import threading
+from typing import Dict, Iterator
 
 from lot_bot import config as cfg
 
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# * for each sampled logger, 1 record out of this many is written, for each message template
+SAMPLED_LOGGERS_RATES = {
+    "fan_out": 100,
+    "parsing": 100,
+}
+
 # this is the variable that will be used to write on logs
 # just import this variable in any of the other file which
 #   needs it
 logger = None
+# loggers for the per-user messages of the fan-out loops and for the giocate
+#   parsing (which is repeated for each user), which are sampled
+fan_out_logger = None
+parsing_logger = None
+# the listener which writes the enqueued log records
+log_listener = None
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through only 1 record out of every sample_rate records with the same message template.
+    The warnings and the errors are never sampled.
+    Since the template is used, the call sites must use the lazy %-style arguments.
+    """
+
+    def __init__(self, sample_rate: int):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self._counters : Dict[str, Iterator[int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        template = str(record.msg)
+        counter = self._counters.get(template)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(template, itertools.count())
+        record_number = next(counter)
+        if record_number % self.sample_rate:
+            return False
+        if record_number:
+            record.msg = f"{template} [1 out of {self.sample_rate}, {record_number + 1} so far]"
+        return True
+
+
+def create_sampled_logger(name: str, sample_rate: int) -> logging.Logger:
+    """Creates a child of the main logger which only writes 1 record
+    out of every sample_rate with the same message template (except for warnings and errors).
+
+    Args:
+        name (str)
+        sample_rate (int)
+
+    Returns:
+        logging.Logger
+    """
+    sampled_logger = logging.getLogger(f"{__name__}.{name}")
+    for log_filter in list(sampled_logger.filters):
+        if isinstance(log_filter, SamplingFilter):
+            sampled_logger.removeFilter(log_filter)
+    sampled_logger.addFilter(SamplingFilter(sample_rate))
+    return sampled_logger
+
+
+def stop_logger():
+    """Writes the records still in the queue and stops the listener."""
+    global log_listener
+    if log_listener:
+        log_listener.stop()
+        log_listener = None
+
 
 def create_logger():
     """Creates the logger object that is used on the whole app.
@@ -14,6 +89,9 @@ def create_logger():
     point of the application, only AFTER the config object
     has been created.
     Logging setup:
+     - the handlers only enqueue the log records, which are written
+        on a separate thread by the listener, so that the I/O does not
+        slow down the update handlers
      - filename: the path on which the logs are saved
      - encoding: the encoding of the logs
      - format:   the structure of the log messages
@@ -23,15 +101,29 @@ def create_logger():
         logging.Logger
     """
     global logger
+    global fan_out_logger
+    global parsing_logger
+    global log_listener
     logger_level = logging.INFO if cfg.config.ENV != "development" and cfg.config.ENV != "testing" else logging.DEBUG
-    if cfg.config.LOG_ON_FILE:
-        logging.basicConfig(
-            filename=cfg.config.LOG_PATH,
-            encoding="utf-8", 
-            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-            level=logger_level)
+    # * as in logging.basicConfig, the logs are written on the console if there is no path
+    if cfg.config.LOG_ON_FILE and cfg.config.LOG_PATH:
+        output_handler = logging.FileHandler(cfg.config.LOG_PATH, encoding="utf-8")
     else:
-        logging.basicConfig(
-            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-            level=logger_level)
+        output_handler = logging.StreamHandler()
+    output_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    stop_logger()
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(log_queue, output_handler, respect_handler_level=True)
+    log_listener.start()
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root_logger.removeHandler(handler)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(logger_level)
     logger = logging.getLogger(__name__)
+    fan_out_logger = create_sampled_logger("fan_out", SAMPLED_LOGGERS_RATES["fan_out"])
+    parsing_logger = create_sampled_logger("parsing", SAMPLED_LOGGERS_RATES["parsing"])
+
+
+atexit.register(stop_logger)
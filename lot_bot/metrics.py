@@ -0,0 +1,213 @@
+""" This module contains the metrics of the bot (handlers latency, db commands
+latency and Telegram API calls), which can be exported in the Prometheus text format.
+The metrics are kept in memory and are reset when the process restarts.
+"""
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from pymongo import monitoring
+from telegram import Bot
+from telegram.error import TelegramError
+from telegram.ext import DispatcherHandlerStop
+
+# * upper bounds of the latency histograms buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence[str]) -> str:
+    if not label_names:
+        return ""
+    escaped_values = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in label_values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(label_names, escaped_values)) + "}"
+
+
+class Counter:
+    """Counter with labels, which can only be incremented."""
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values : Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """Gauge with labels, which can be set to any value."""
+
+    def set(self, *label_values: str, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    """Histogram with labels, with cumulative buckets as in Prometheus."""
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # * for each label values: the count of each bucket (the last one is +Inf), the sum and the count
+        self._values : Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *label_values: str, value: float):
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if label_values not in self._values:
+                self._values[label_values] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            bucket_counts, sum_and_count = self._values[label_values]
+            bucket_counts[bucket_index] += 1
+            sum_and_count[0] += value
+            sum_and_count[1] += 1
+
+    def get_count(self, *label_values: str) -> int:
+        return self._values[label_values][1][1] if label_values in self._values else 0
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        bucket_label_names = self.label_names + ("le",)
+        with self._lock:
+            for label_values, (bucket_counts, (values_sum, values_count)) in sorted(self._values.items()):
+                cumulative_count = 0
+                for upper_bound, bucket_count in zip(self.buckets + ("+Inf",), bucket_counts):
+                    cumulative_count += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(bucket_label_names, label_values + (str(upper_bound),))} {cumulative_count}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {values_sum}")
+                lines.append(f"{self.name}_count{labels} {values_count}")
+        return lines
+
+
+HANDLER_LATENCY = Histogram("lot_handler_latency_seconds", "Latency of the update handlers", ["handler"])
+HANDLER_ERRORS = Counter("lot_handler_errors_total", "Exceptions raised by the update handlers", ["handler"])
+DB_COMMAND_LATENCY = Histogram("lot_db_command_latency_seconds", "Latency of the db commands", ["command", "collection"])
+DB_COMMAND_ERRORS = Counter("lot_db_command_errors_total", "Failed db commands", ["command", "collection"])
+TELEGRAM_REQUEST_LATENCY = Histogram("lot_telegram_request_latency_seconds", "Latency of the Telegram API requests", ["method"])
+TELEGRAM_REQUEST_ERRORS = Counter("lot_telegram_request_errors_total", "Failed Telegram API requests", ["method", "error"])
+UPDATE_QUEUE_DEPTH = Gauge("lot_update_queue_depth", "Updates waiting to be processed by the webhook server")
+
+ALL_METRICS = (
+    HANDLER_LATENCY,
+    HANDLER_ERRORS,
+    DB_COMMAND_LATENCY,
+    DB_COMMAND_ERRORS,
+    TELEGRAM_REQUEST_LATENCY,
+    TELEGRAM_REQUEST_ERRORS,
+    UPDATE_QUEUE_DEPTH,
+)
+
+
+def render_metrics() -> str:
+    """Renders all the metrics in the Prometheus text format.
+
+    Returns:
+        str
+    """
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    for metric in ALL_METRICS:
+        metric.reset()
+
+
+def measure_handler(handler_name: str, handler_function: Callable[[], object]) -> object:
+    """Runs the handler function, measuring its latency and counting its exceptions.
+
+    Args:
+        handler_name (str)
+        handler_function (Callable[[], object])
+
+    Returns:
+        object: the result of the handler function
+    """
+    start_time = time.perf_counter()
+    try:
+        return handler_function()
+    except DispatcherHandlerStop:
+        raise
+    except Exception:
+        HANDLER_ERRORS.inc(handler_name)
+        raise
+    finally:
+        HANDLER_LATENCY.observe(handler_name, value=time.perf_counter() - start_time)
+
+
+class DbCommandsListener(monitoring.CommandListener):
+    """Measures the latency of each db command, by command name and collection."""
+
+    def __init__(self):
+        # * the command name and the collection of the started commands, by request ID
+        self._started_commands : Dict[Tuple[int, int], Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        with self._lock:
+            self._started_commands[(event.request_id, event.operation_id)] = (event.command_name, collection)
+
+    def _pop_started_command(self, event) -> Tuple[str, str]:
+        with self._lock:
+            return self._started_commands.pop((event.request_id, event.operation_id), (event.command_name, ""))
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        command_name, collection = self._pop_started_command(event)
+        DB_COMMAND_LATENCY.observe(command_name, collection, value=event.duration_micros / 10**6)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        command_name, collection = self._pop_started_command(event)
+        DB_COMMAND_LATENCY.observe(command_name, collection, value=event.duration_micros / 10**6)
+        DB_COMMAND_ERRORS.inc(command_name, collection)
+
+
+class InstrumentedBot(Bot):
+    """Bot which measures the latency of each Telegram API request and counts its errors, by method."""
+
+    def _post(self, endpoint: str, data: dict = None, timeout: float = None, api_kwargs: dict = None) -> object:
+        start_time = time.perf_counter()
+        try:
+            return super()._post(endpoint, data=data, timeout=timeout, api_kwargs=api_kwargs)
+        except TelegramError as e:
+            # * e.g. RetryAfter (429), Unauthorized (403), BadRequest (400)
+            TELEGRAM_REQUEST_ERRORS.inc(endpoint, type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_REQUEST_LATENCY.observe(endpoint, value=time.perf_counter() - start_time)
@@ -0,0 +1,213 @@
+import dataclasses
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from lot_bot import logger as lgr
+from lot_bot.dao import giocate_manager
+from lot_bot.models import giocate as giocata_model
+from lot_bot.models import users
+
+INTEREST_TYPES = ("semplice", "composto")
+
+
+@dataclasses.dataclass(frozen=True)
+class BacktestConfiguration:
+    """A stake configuration to replay the giocate with.
+    The personal stakes have the same structure and semantics of the users' ones:
+    the first stake matching the giocata is used, otherwise the base stake is.
+    """
+    name : str
+    personal_stakes : Tuple[Dict, ...] = ()
+    interest_type : str = "composto"
+    # * budget * 100, as the users' budgets
+    initial_budget : int = 10000
+
+    def __post_init__(self):
+        if self.interest_type not in INTEREST_TYPES:
+            raise ValueError(f"Interest type {self.interest_type} is not one of {INTEREST_TYPES}")
+        object.__setattr__(self, "personal_stakes", tuple(self.personal_stakes))
+
+
+@dataclasses.dataclass(frozen=True)
+class GiocateColumns:
+    """The giocate with an outcome, in columnar form and sorted by sent timestamp.
+    Sports and strategies are encoded as indexes of sports_names and strategies_names.
+    """
+    sent_timestamps : np.ndarray
+    sport_codes : np.ndarray
+    strategy_codes : np.ndarray
+    sports_names : Tuple[str, ...]
+    strategies_names : Tuple[str, ...]
+    quotas : np.ndarray
+    base_stakes : np.ndarray
+    outcomes : np.ndarray
+    # * cashout percentages * 100, nan for the giocate without a cashout
+    cashouts : np.ndarray
+
+    def __len__(self):
+        return len(self.sent_timestamps)
+
+
+@dataclasses.dataclass(frozen=True)
+class BacktestResult:
+    """The equity curves and the drawdowns of each configuration.
+    Each row refers to a configuration, each column to the budget after a giocata,
+    the first column being the initial budget.
+    """
+    configurations : Tuple[BacktestConfiguration, ...]
+    sent_timestamps : np.ndarray
+    equity_curves : np.ndarray
+    drawdowns : np.ndarray
+
+    @property
+    def final_budgets(self) -> np.ndarray:
+        return self.equity_curves[:, -1]
+
+    @property
+    def max_drawdowns(self) -> np.ndarray:
+        return self.drawdowns.max(axis=1)
+
+
+def create_giocate_columns(giocate: List[Dict]) -> GiocateColumns:
+    """Creates the columnar form of the giocate, skipping the ones without an outcome
+    and the ones which cannot be evaluated (no cashout and no stake or quota).
+
+    Args:
+        giocate (List[Dict])
+
+    Returns:
+        GiocateColumns
+    """
+    valid_giocate = [
+        giocata for giocata in giocate
+        if giocata.get("outcome", "?") != "?" and ("cashout" in giocata or ("base_stake" in giocata and "base_quota" in giocata))
+    ]
+    valid_giocate.sort(key=lambda giocata: giocata.get("sent_timestamp", 0))
+    sports_names, sport_codes = np.unique([giocata["sport"] for giocata in valid_giocate], return_inverse=True)
+    strategies_names, strategy_codes = np.unique([giocata.get("strategy", "") for giocata in valid_giocate], return_inverse=True)
+    return GiocateColumns(
+        sent_timestamps=np.array([giocata.get("sent_timestamp", 0) for giocata in valid_giocate], dtype=np.float64),
+        sport_codes=sport_codes.astype(np.int32),
+        strategy_codes=strategy_codes.astype(np.int32),
+        sports_names=tuple(str(name) for name in sports_names),
+        strategies_names=tuple(str(name) for name in strategies_names),
+        quotas=np.array([giocata.get("base_quota", 0) for giocata in valid_giocate], dtype=np.int64),
+        base_stakes=np.array([giocata.get("base_stake", 0) for giocata in valid_giocate], dtype=np.int64),
+        outcomes=np.array([giocata["outcome"] for giocata in valid_giocate], dtype=object),
+        cashouts=np.array([giocata.get("cashout", np.nan) for giocata in valid_giocate], dtype=np.float64),
+    )
+
+
+def load_giocate_columns(min_timestamp: float, max_timestamp: float) -> GiocateColumns:
+    """Retrieves the giocate sent between the timestamps and creates their columnar form.
+
+    Args:
+        min_timestamp (float)
+        max_timestamp (float)
+
+    Returns:
+        GiocateColumns
+    """
+    giocate = giocate_manager.retrieve_giocate_between_timestamps(max_timestamp, min_timestamp, include_only_giocate_with_outcome=True)
+    lgr.logger.info(f"Loaded {len(giocate)} giocate for backtesting")
+    return create_giocate_columns(giocate)
+
+
+def _create_personal_stake_mask(columns: GiocateColumns, personal_stake: Dict) -> np.ndarray:
+    mask = (columns.quotas >= int(personal_stake["min_quota"])) & (columns.quotas <= int(personal_stake["max_quota"]))
+    if personal_stake["sport"] != "all":
+        if personal_stake["sport"] not in columns.sports_names:
+            return np.zeros(len(columns), dtype=bool)
+        mask &= columns.sport_codes == columns.sports_names.index(personal_stake["sport"])
+    if "all" not in personal_stake["strategies"]:
+        strategy_codes = [columns.strategies_names.index(name) for name in personal_stake["strategies"] if name in columns.strategies_names]
+        mask &= np.isin(columns.strategy_codes, strategy_codes)
+    return mask
+
+
+def create_stakes_matrix(columns: GiocateColumns, configurations: Sequence[BacktestConfiguration]) -> np.ndarray:
+    """Creates the stakes used for each giocata by each configuration.
+
+    Args:
+        columns (GiocateColumns)
+        configurations (Sequence[BacktestConfiguration])
+
+    Returns:
+        np.ndarray: the stakes (* 100), with shape (configurations, giocate)
+    """
+    stakes = np.empty((len(configurations), len(columns)), dtype=np.int64)
+    for row, configuration in enumerate(configurations):
+        configuration_stakes = columns.base_stakes.copy()
+        # * reversed, so that the first matching personal stake wins
+        for personal_stake in reversed(configuration.personal_stakes):
+            mask = _create_personal_stake_mask(columns, personal_stake)
+            configuration_stakes[mask] = int(personal_stake["stake"])
+        stakes[row] = configuration_stakes
+    return stakes
+
+
+def calculate_outcome_percentages(columns: GiocateColumns, stakes: np.ndarray) -> np.ndarray:
+    """Vectorized version of the outcome percentage rules used for budgets and trends:
+    get_outcome_percentage for most giocate, the cashout for the exchange ones
+    and the fixed percentages for the MB ones.
+
+    Args:
+        columns (GiocateColumns)
+        stakes (np.ndarray): as created by create_stakes_matrix
+
+    Returns:
+        np.ndarray: the outcome percentages (as in x.y%), with the same shape of stakes
+    """
+    outcome_percentages = giocata_model.get_outcome_percentages(columns.outcomes, stakes, columns.quotas)
+    # * MB giocate do not depend on the stake
+    if giocata_model.MB_STRATEGY_NAME in columns.strategies_names:
+        is_mb = columns.strategy_codes == columns.strategies_names.index(giocata_model.MB_STRATEGY_NAME)
+        for outcome, mb_outcome_percentage in giocata_model.MB_OUTCOME_PERCENTAGES.items():
+            outcome_percentages = np.where(is_mb & (columns.outcomes == outcome), mb_outcome_percentage, outcome_percentages)
+    # * neither do the cashouts, which are ignored for void giocate
+    has_cashout = ~np.isnan(columns.cashouts)
+    cashout_percentages = np.where(columns.outcomes != "void", np.nan_to_num(columns.cashouts) / 100, 0.0)
+    return np.where(has_cashout, cashout_percentages, outcome_percentages)
+
+
+def calculate_drawdowns(equity_curves: np.ndarray) -> np.ndarray:
+    """Calculates the drawdown from the previous peak at each point of the equity curves.
+
+    Args:
+        equity_curves (np.ndarray)
+
+    Returns:
+        np.ndarray: the drawdowns, as fractions of the previous peak
+    """
+    peaks = np.maximum.accumulate(equity_curves, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drawdowns = np.where(peaks > 0, (peaks - equity_curves) / peaks, 0.0)
+    return drawdowns
+
+
+def run_backtest(columns: GiocateColumns, configurations: Sequence[BacktestConfiguration]) -> BacktestResult:
+    """Replays the giocate under each configuration, updating the budgets as the users' ones are:
+    the composto interest applies the rounded outcome percentage to the current budget,
+    the semplice one to the initial budget.
+
+    Args:
+        columns (GiocateColumns)
+        configurations (Sequence[BacktestConfiguration])
+
+    Returns:
+        BacktestResult
+    """
+    configurations = tuple(configurations)
+    stakes = create_stakes_matrix(columns, configurations)
+    budget_percentages = users.round_budget_percentages(calculate_outcome_percentages(columns, stakes) / 100)
+    initial_budgets = np.array([configuration.initial_budget for configuration in configurations], dtype=np.float64)[:, np.newaxis]
+    is_composto = np.array([configuration.interest_type == "composto" for configuration in configurations])[:, np.newaxis]
+    composto_curves = initial_budgets * np.cumprod(1 + budget_percentages, axis=1)
+    semplice_curves = initial_budgets * (1 + np.cumsum(budget_percentages, axis=1))
+    equity_curves = np.hstack((initial_budgets, np.where(is_composto, composto_curves, semplice_curves)))
+    return BacktestResult(
+        configurations=configurations,
+        sent_timestamps=columns.sent_timestamps,
+        equity_curves=equity_curves,
+        drawdowns=calculate_drawdowns(equity_curves),
+    )
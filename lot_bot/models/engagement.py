@@ -0,0 +1,93 @@
+""" This module contains the engagement rankings, which order the users subscribed
+to a strategy by how much they recently engaged with its giocate, so that the most
+engaged users receive a giocata first during a fan-out.
+The rankings are precomputed periodically from the analytics by a job.
+"""
+import datetime
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from lot_bot import constants as cst
+from lot_bot.dao import analytics_manager, engagement_rankings_manager, giocate_manager
+from lot_bot.models import segments
+
+# * the strategy of the rankings of all the users who engaged with a sport
+ALL_STRATEGIES_RANKING_NAME = "all"
+
+
+def get_ranking_id(sport: str, strategy: str) -> str:
+    return f"{sport}/{strategy}"
+
+
+def compute_engagement_rankings(giocate: Iterable[Dict], users_accepted_giocate: Iterable[Dict]) -> Dict[str, List[int]]:
+    """Ranks, for each strategy and for each sport, the users who accepted at least one of the giocate,
+    by number of accepted giocate and then by the sent timestamp of the last one they accepted.
+
+    Args:
+        giocate (Iterable[Dict]): the recent giocate, with _id, sport, strategy and sent_timestamp
+        users_accepted_giocate (Iterable[Dict]): the users' analytics, with _id and accepted_giocate
+
+    Returns:
+        Dict[str, List[int]]: the user IDs ranked from the most engaged one, by ranking ID
+    """
+    giocate_by_id = {giocata["_id"]: giocata for giocata in giocate}
+    # * {ranking_id: {user_id: (accepted giocate, last accepted giocata timestamp)}}
+    scores : Dict[str, Dict[int, Tuple[int, float]]] = {}
+    for user_analytics in users_accepted_giocate:
+        for giocata_id in user_analytics.get("accepted_giocate", []):
+            giocata = giocate_by_id.get(giocata_id)
+            if giocata is None:
+                continue
+            for strategy in (giocata["strategy"], ALL_STRATEGIES_RANKING_NAME):
+                ranking_scores = scores.setdefault(get_ranking_id(giocata["sport"], strategy), {})
+                accepted_giocate, last_accepted_timestamp = ranking_scores.get(user_analytics["_id"], (0, 0.0))
+                ranking_scores[user_analytics["_id"]] = (accepted_giocate + 1, max(last_accepted_timestamp, giocata.get("sent_timestamp", 0.0)))
+    return {
+        ranking_id: sorted(ranking_scores, key=ranking_scores.get, reverse=True)
+        for ranking_id, ranking_scores in scores.items()
+    }
+
+
+def refresh_engagement_rankings(now_timestamp: float = None, window_days: int = cst.ENGAGEMENT_WINDOW_DAYS) -> int:
+    """Computes the engagement rankings from the giocate accepted in the last days, and saves them.
+    The rankings of the strategies without recently accepted giocate are deleted.
+
+    Args:
+        now_timestamp (float, optional): Defaults to the current UTC timestamp.
+        window_days (int, optional): Defaults to cst.ENGAGEMENT_WINDOW_DAYS.
+
+    Returns:
+        int: the number of rankings
+    """
+    if now_timestamp is None:
+        now_timestamp = datetime.datetime.utcnow().timestamp()
+    recent_giocate = giocate_manager.retrieve_giocate_between_timestamps(now_timestamp, now_timestamp - window_days * 24 * 60 * 60)
+    users_accepted_giocate = []
+    if recent_giocate:
+        users_accepted_giocate = analytics_manager.retrieve_analytics_with_accepted_giocate([giocata["_id"] for giocata in recent_giocate])
+    rankings = compute_engagement_rankings(recent_giocate, users_accepted_giocate)
+    engagement_rankings_manager.save_engagement_rankings([
+        {"_id": ranking_id, "user_ids": segments.pack_ids(user_ids), "size": len(user_ids), "refreshed_at": now_timestamp}
+        for ranking_id, user_ids in rankings.items()
+    ])
+    engagement_rankings_manager.delete_engagement_rankings_refreshed_before(now_timestamp)
+    return len(rankings)
+
+
+def order_user_ids_by_engagement(user_ids: Sequence[int], sport: str, strategy: str) -> List[int]:
+    """Orders the user IDs by the engagement ranking of the sport's strategy.
+    The users who are not in the ranking follow, in their original order.
+
+    Args:
+        user_ids (Sequence[int])
+        sport (str)
+        strategy (str): the strategy's name, or "all" for the whole sport
+
+    Returns:
+        List[int]
+    """
+    ranking_data = engagement_rankings_manager.retrieve_engagement_ranking(get_ranking_id(sport, strategy))
+    if ranking_data is None:
+        return list(user_ids)
+    ranks = {user_id: rank for rank, user_id in enumerate(segments.unpack_ids(ranking_data["user_ids"]))}
+    # * sorted is stable, so the users without a rank keep their order
+    return sorted(user_ids, key=lambda user_id: ranks.get(user_id, len(ranks)))
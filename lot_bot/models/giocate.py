@@ -1,17 +1,28 @@
 import datetime
 import random
 import re
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
 
 from lot_bot import custom_exceptions, filters
 from lot_bot import logger as lgr
+from lot_bot import results_cache
 from lot_bot import utils
 from lot_bot.models import sports as spr
 from lot_bot.models import strategies as strat
+from lot_bot.models import personal_stakes as personal_stakes_model
 from lot_bot.dao import giocate_manager
 
 STAKE_PATTERN = r"\s*Stake\s*(\d+[.,]?\d*)\s*"
 
+# * MB giocate have fixed outcome percentages
+MB_STRATEGY_NAME = "mb"
+MB_OUTCOME_PERCENTAGES = {
+    "win": 0.7,
+    "loss": -500,
+}
+
 OUTCOME_EMOJIS = {
     "win": "🟢",
     "loss": "🔴",
@@ -134,7 +145,7 @@ def get_outcome_percentage(outcome: str, stake: int, quota: int) -> float:
     Returns:
         float: the outcome percentage (as in x.y%)
     """
-    lgr.logger.debug(f"Calculating outcome percentage on {outcome} - {stake} - {quota}")
+    lgr.logger.debug("Calculating outcome percentage on %s - %s - %s", outcome, stake, quota)
     if outcome == "win":
         outcome_percentage = (stake * (quota - 100)) / 10000
     elif outcome == "loss":
@@ -144,6 +155,24 @@ def get_outcome_percentage(outcome: str, stake: int, quota: int) -> float:
     return outcome_percentage
 
 
+def get_outcome_percentages(outcomes: Union[str, np.ndarray], stakes: np.ndarray, quotas: Union[int, np.ndarray]) -> np.ndarray:
+    """Vectorized version of get_outcome_percentage, whose arguments
+    (arrays or scalars) are broadcast together.
+
+    Args:
+        outcomes (Union[str, np.ndarray])
+        stakes (np.ndarray)
+        quotas (Union[int, np.ndarray])
+
+    Returns:
+        np.ndarray: the outcome percentages (as in x.y%)
+    """
+    outcomes = np.asarray(outcomes)
+    stakes = np.asarray(stakes, dtype=np.float64)
+    outcome_percentages = np.where(outcomes == "win", (stakes * (np.asarray(quotas) - 100)) / 10000, 0.0)
+    return np.where(outcomes == "loss", -stakes / 100, outcome_percentages)
+
+
 def get_sport_name_from_giocata(text: str) -> str:
     """Extracts the sport name from a giocata message.
     It checks if the sports exists.
@@ -158,7 +187,10 @@ def get_sport_name_from_giocata(text: str) -> str:
         GiocataParsingError: if the sport was not found
     """
     sport_row = text.split("\n")[0].lower()
-    # ? could be faster if we would just get the second token
+    # * the row is usually <emoji> <display name> <emoji>, hence try the direct lookup first
+    sport = spr.sports_container.get_sport_by_display_name(" ".join(sport_row.split()[1:-1]))
+    if sport:
+        return sport.name
     for sport in spr.sports_container:
         if sport.display_name.lower() in sport_row:
             return sport.name
@@ -189,8 +221,8 @@ def get_strategy_name_from_giocata(text: str, sport: spr.Sport) -> str:
         played_strategy = " ".join(played_strategy.split()[:-1])
     strategy = strat.strategies_container.get_strategy(played_strategy)
     sport = spr.sports_container.get_sport(sport)
-    if strategy and strategy in sport.strategies:
-        lgr.logger.debug(f"Parsed strategy {strategy.display_name}")
+    if sport.has_strategy(strategy):
+        lgr.parsing_logger.debug("Parsed strategy %s", strategy.display_name)
         return strategy.name
     else:
         error_message = f"giocata_model.get_strategy_name_from_giocata: Strategy {played_strategy} not found from {text} for sport {sport.name}"
@@ -326,38 +358,52 @@ def parse_giocata(giocata_text: str, message_sent_timestamp: float=None) -> Opti
     return parsed_giocata
 
 
-def personalize_giocata_text(giocata_text: str, personal_stakes: List, sport_name: str, strategy_name: str) -> str:
-    """TODO tests
+def personalize_giocata_text_and_get_stake(giocata_text: str, personal_stakes: List, sport_name: str, strategy_name: str, 
+        compiled_personal_stakes: Dict = None) -> Tuple[str, Optional[int]]:
+    """Personalizes the stake of the giocata text with the first of the user's personal stakes 
+    matching the giocata sport, strategy and quota.
 
     Args:
-        giocata_text (str): [description]
-        personal_stakes (List): [description]
-        sport_name (str): [description]
-        strategy_name (str): [description]
+        giocata_text (str)
+        personal_stakes (List): the user's personal stakes
+        sport_name (str)
+        strategy_name (str)
+        compiled_personal_stakes (Dict, optional): the compiled personal stakes, stored along the user's data. 
+            They are compiled from personal_stakes if not specified. Defaults to None.
 
     Returns:
-        str: [description]
+        Tuple[str, Optional[int]]: the personalized text and the personal stake applied, if any
     """
     if personal_stakes == []:
-        return giocata_text
+        return giocata_text, None
+    if compiled_personal_stakes is None:
+        compiled_personal_stakes = personal_stakes_model.compile_personal_stakes(personal_stakes)
     giocata_quota = get_quota_from_giocata(giocata_text)
-    for personal_stake in personal_stakes:
-        # * check sport and strategy
-        personal_stake_sport = personal_stake["sport"] 
-        personal_stake_strategies = personal_stake["strategies"]
-        if ((personal_stake_sport != "all" and personal_stake_sport != sport_name) or 
-            (not "all" in personal_stake_strategies and not strategy_name in personal_stake_strategies)):
-            continue
-        # * check quota in range
-        if personal_stake["min_quota"] > giocata_quota or personal_stake["max_quota"] < giocata_quota:
-            continue
-        # * modify stake
-        giocata_text = re.sub(STAKE_PATTERN, f"Stake {personal_stake['stake'] / 100:.2f}", giocata_text)
-        break
+    personal_stake = personal_stakes_model.find_personal_stake(compiled_personal_stakes, sport_name, strategy_name, giocata_quota)
+    # * modify stake
+    if personal_stake is not None:
+        giocata_text = re.sub(STAKE_PATTERN, f"Stake {personal_stake / 100:.2f}", giocata_text)
     giocata_text_rows = giocata_text.split("\n")
     giocata_text_rows = giocata_text_rows[:-1] + ["(stake personalizzato)", "", giocata_text_rows[-1]]
     giocata_text = "\n".join(giocata_text_rows)
-    return giocata_text
+    return giocata_text, personal_stake
+
+
+def personalize_giocata_text(giocata_text: str, personal_stakes: List, sport_name: str, strategy_name: str, 
+        compiled_personal_stakes: Dict = None) -> str:
+    """Personalizes the stake of the giocata text, see personalize_giocata_text_and_get_stake.
+
+    Args:
+        giocata_text (str)
+        personal_stakes (List): the user's personal stakes
+        sport_name (str)
+        strategy_name (str)
+        compiled_personal_stakes (Dict, optional): the compiled personal stakes. Defaults to None.
+
+    Returns:
+        str: the personalized text
+    """
+    return personalize_giocata_text_and_get_stake(giocata_text, personal_stakes, sport_name, strategy_name, compiled_personal_stakes)[0]
 
 
 def create_personal_giocata_from_new_giocata(retrieved_giocata: Dict, stake_from_giocata_message: str) -> Tuple[Dict, str]:
@@ -471,7 +517,7 @@ def create_trend_counts_and_totals_for_giocate(latest_giocate: List) -> Dict[str
     """
     trend_counts_and_totals = {}
     for giocata in latest_giocate:
-        lgr.logger.debug(f"{giocata['sport']=} - {giocata['outcome']=}")
+        lgr.logger.debug("giocata['sport']=%r - giocata['outcome']=%r", giocata["sport"], giocata["outcome"])
         # * skip void and unfinished giocate
         if giocata["outcome"] == "void" or giocata["outcome"] == "?":
             continue
@@ -486,10 +532,8 @@ def create_trend_counts_and_totals_for_giocate(latest_giocate: List) -> Dict[str
             outcome_percentage = giocata["cashout"] / 100
         # * (use fixed values for MB giocate)
         elif giocata_strategy == strat.strategies_container.MB: # mb
-            if giocata["outcome"] == "win":
-                outcome_percentage = 0.7
-            elif giocata["outcome"] == "loss":
-                outcome_percentage = -500
+            if giocata["outcome"] in MB_OUTCOME_PERCENTAGES:
+                outcome_percentage = MB_OUTCOME_PERCENTAGES[giocata["outcome"]]
         elif "base_stake" in giocata and "base_quota" in giocata: # * (most of the others)
             outcome_percentage = get_outcome_percentage(giocata["outcome"], giocata["base_stake"], giocata["base_quota"])
         else:
@@ -531,10 +575,10 @@ def create_trend_message(trend_counts_and_totals: Dict[str, Tuple[int, float]],
         # * calculate sport trend
         if days_for_trend:
             sport_trend = round(total_percentage / days_for_trend, 2)
-            lgr.logger.debug(f"{giocata_sport.display_name}: {total_percentage}% in {days_for_trend} giorni [{giocate_count} giocate] = {sport_trend}%")
+            lgr.logger.debug("%s: %s%% in %s giorni [%s giocate] = %s%%", giocata_sport.display_name, total_percentage, days_for_trend, giocate_count, sport_trend)
         else:
             sport_trend = round(total_percentage / giocate_count, 2)
-            lgr.logger.debug(f"{giocata_sport.display_name}: {total_percentage}% in {giocate_count} giocate = {sport_trend}%")
+            lgr.logger.debug("%s: %s%% in %s giocate = %s%%", giocata_sport.display_name, total_percentage, giocate_count, sport_trend)
         # * create trend entry for sport
         trend_emoji = get_trend_emoji(giocata_sport.name, sport_trend)
         percentage_string = ""
@@ -545,6 +589,10 @@ def create_trend_message(trend_counts_and_totals: Dict[str, Tuple[int, float]],
 
 
 def get_giocate_trend_message_since_days(days_for_trend: int) -> str:
+    # * the window is aligned to midnight, hence the trend changes at the next one (or when an outcome arrives)
+    cached_trend_message = results_cache.get_cached_result(results_cache.TREND_DAYS, days_for_trend)
+    if cached_trend_message is not None:
+        return cached_trend_message
     last_midnight = datetime.datetime.combine(datetime.datetime.today(), datetime.time.min)
     days_for_trend_midnight = last_midnight - datetime.timedelta(days=days_for_trend) 
     latest_giocate = giocate_manager.retrieve_giocate_between_timestamps(last_midnight.timestamp(), 
@@ -557,10 +605,14 @@ def get_giocate_trend_message_since_days(days_for_trend: int) -> str:
     start_date = days_for_trend_midnight.strftime("%d/%m/%Y")
     end_date = last_midnight.strftime("%d/%m/%Y")
     trend_message = f"✍️ LoT TREND ({start_date} - {end_date})\n\n" + trend_message
+    results_cache.cache_result(results_cache.TREND_DAYS, days_for_trend, trend_message, expiration_timestamp=results_cache.get_next_midnight_timestamp())
     return trend_message
 
 
 def get_giocate_trend_for_lastest_n_giocate(num_of_giocate_for_trend: int):
+    cached_trend_message = results_cache.get_cached_result(results_cache.TREND_EVENTS, num_of_giocate_for_trend)
+    if cached_trend_message is not None:
+        return cached_trend_message
     lgr.logger.info(f"Retrieving last {num_of_giocate_for_trend} giocate to create trend")
     latest_giocate = giocate_manager.retrieve_last_n_giocate(num_of_giocate_for_trend, 
         include_only_giocate_with_outcome=True, 
@@ -568,6 +620,7 @@ def get_giocate_trend_for_lastest_n_giocate(num_of_giocate_for_trend: int):
     trend_counts_and_totals = create_trend_counts_and_totals_for_giocate(latest_giocate)
     trend_message = create_trend_message(trend_counts_and_totals)
     trend_message = f"✍️ LoT TREND (ultime {num_of_giocate_for_trend} giocate)\n\n" + trend_message
+    results_cache.cache_result(results_cache.TREND_EVENTS, num_of_giocate_for_trend, trend_message)
     return trend_message
 
 
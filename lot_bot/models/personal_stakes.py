@@ -1,4 +1,5 @@
-from typing import Dict, List
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from lot_bot import logger as lgr
 from lot_bot.models import sports as spr
@@ -72,7 +73,7 @@ def parse_personal_stake(personal_stake_data: List) -> Dict:
             found_strat = strat.strategies_container.get_strategy(strategy)
             if not found_strat:
                 raise custom_exceptions.PersonalStakeParsingError(f"ERRORE: la strategia {strategy} non esiste")
-            if not found_strat in found_sport.strategies:
+            if not found_sport.has_strategy(found_strat):
                 raise custom_exceptions.PersonalStakeParsingError(f"ERRORE: la strategia {strategy} non è disponibile per lo sport {sport}")
             strategies.append(found_strat.name)
     # * create the new personal stake
@@ -85,28 +86,128 @@ def parse_personal_stake(personal_stake_data: List) -> Dict:
     return personal_stake_data
 
 
-def check_stakes_overlapping(new_stake: Dict, user_stakes: List) -> bool:
+COMPILED_KEY_SEPARATOR = "|"
+
+
+def _get_compiled_key(sport_name: str, strategy_name: str) -> str:
+    return f"{sport_name}{COMPILED_KEY_SEPARATOR}{strategy_name}"
+
+
+def _compile_intervals(intervals: List[Tuple[int, int, int, int]]) -> Dict[str, List[int]]:
+    """Compiles the quota intervals of a single (sport, strategy) key into sorted 
+    non-overlapping segments. Where more intervals cover the same quotas, the
+    segment is assigned to the one which comes first in the user's stakes list.
+
+    Args:
+        intervals (List[Tuple[int, int, int, int]]): (min quota, max quota + 1, position in the list, stake)
+
+    Returns:
+        Dict[str, List[int]]: the parallel lists "starts", "ends" (excluded), "stakes" and "positions"
+    """
+    boundaries = sorted({boundary for start, end, _, _ in intervals for boundary in (start, end)})
+    compiled_intervals = {"starts": [], "ends": [], "stakes": [], "positions": []}
+    for segment_start, segment_end in zip(boundaries, boundaries[1:]):
+        covering_stakes = [(position, stake) for start, end, position, stake in intervals if start <= segment_start and segment_end <= end]
+        if not covering_stakes:
+            continue
+        position, stake = min(covering_stakes)
+        # * merge contiguous segments belonging to the same stake
+        if compiled_intervals["ends"] and compiled_intervals["ends"][-1] == segment_start and compiled_intervals["positions"][-1] == position:
+            compiled_intervals["ends"][-1] = segment_end
+            continue
+        compiled_intervals["starts"].append(segment_start)
+        compiled_intervals["ends"].append(segment_end)
+        compiled_intervals["stakes"].append(stake)
+        compiled_intervals["positions"].append(position)
+    return compiled_intervals
+
+
+def compile_personal_stakes(user_stakes: List[Dict]) -> Dict[str, Dict[str, List[int]]]:
+    """Compiles the user's personal stakes in a lookup structure keyed by
+    "<sport>|<strategy>" (where both can be "all"), each containing sorted 
+    non-overlapping quota intervals, which are searched by bisection.
+    The structure only contains strings, ints and lists, so that it can 
+    be stored along the user's data.
+
+    Args:
+        user_stakes (List[Dict]): list of the user personalized stakes
+
+    Returns:
+        Dict[str, Dict[str, List[int]]]: the compiled personal stakes
+    """
+    intervals_by_key = {}
+    for position, user_stake in enumerate(user_stakes or []):
+        # * quotas are ints (x100) and the range is inclusive, hence the end is max quota + 1
+        interval = (int(user_stake["min_quota"]), int(user_stake["max_quota"]) + 1, position, int(user_stake["stake"]))
+        for strategy_name in set(user_stake["strategies"]):
+            compiled_key = _get_compiled_key(user_stake["sport"], strategy_name)
+            intervals_by_key.setdefault(compiled_key, []).append(interval)
+    return {compiled_key: _compile_intervals(intervals) for compiled_key, intervals in intervals_by_key.items()}
+
+
+def find_personal_stake(compiled_personal_stakes: Dict[str, Dict[str, List[int]]], sport_name: str, strategy_name: str, quota: int) -> Optional[int]:
+    """Finds the personal stake to apply to a giocata, keeping the semantics of a
+    linear scan of the stakes list: the first stake matching sport (or "all"),
+    strategy (or "all") and having the quota in its range is used.
+
+    Args:
+        compiled_personal_stakes (Dict[str, Dict[str, List[int]]]): as created by compile_personal_stakes
+        sport_name (str)
+        strategy_name (str)
+        quota (int)
+
+    Returns:
+        Optional[int]: the personal stake, or None if no stake matches
+    """
+    found_position, found_stake = None, None
+    for sport_key in (sport_name, "all"):
+        for strategy_key in (strategy_name, "all"):
+            compiled_intervals = compiled_personal_stakes.get(_get_compiled_key(sport_key, strategy_key))
+            if not compiled_intervals:
+                continue
+            index = bisect_right(compiled_intervals["starts"], quota) - 1
+            if index < 0 or quota >= compiled_intervals["ends"][index]:
+                continue
+            position = compiled_intervals["positions"][index]
+            if found_position is None or position < found_position:
+                found_position, found_stake = position, compiled_intervals["stakes"][index]
+    return found_stake
+
+
+def _get_overlapping_candidate_keys(compiled_personal_stakes: Dict, sport_name: str, strategies_names: List[str]) -> Iterator[str]:
+    for compiled_key in compiled_personal_stakes:
+        key_sport, key_strategy = compiled_key.split(COMPILED_KEY_SEPARATOR)
+        # * sports are different and neither of them are "all"
+        if key_sport != "all" and sport_name != "all" and key_sport != sport_name:
+            continue
+        # * if sports overlap, no common strategies and none or them are "all"
+        if key_strategy != "all" and "all" not in strategies_names and key_strategy not in strategies_names:
+            continue
+        yield compiled_key
+
+
+def check_stakes_overlapping(new_stake: Dict, user_stakes: List, compiled_personal_stakes: Dict = None) -> bool:
     """Checks if the new stake overlaps with any of the user's stakes.
 
     Args:
         new_stake (Dict)
         user_stakes (List)
+        compiled_personal_stakes (Dict, optional): the compiled user_stakes, created if not specified. Defaults to None.
 
     Returns:
         bool: True if the stakes are overlapping, False otherwise
     """
     if not user_stakes:
         return False
-    for stake in user_stakes:
-        stake_sport = stake["sport"] 
-        # * sports are different and neither of them are "all"
-        # * if sports overlap, no common strategies and none or them are "all"
-        if ((stake_sport != "all" and new_stake["sport"] != "all" and stake_sport != new_stake["sport"]) or 
-            (len(set(stake["strategies"]) & set(new_stake["strategies"])) == 0 and "all" not in stake["strategies"] and "all" not in new_stake["strategies"])):
-            continue
-        retrieved_min_quota = stake["min_quota"]
-        retrieved_max_quota = stake["max_quota"]
-        if retrieved_min_quota <= new_stake["min_quota"] <= retrieved_max_quota or retrieved_min_quota <= new_stake["max_quota"] <= retrieved_max_quota:
+    if compiled_personal_stakes is None:
+        compiled_personal_stakes = compile_personal_stakes(user_stakes)
+    new_min_quota = int(new_stake["min_quota"])
+    new_max_quota = int(new_stake["max_quota"])
+    for compiled_key in _get_overlapping_candidate_keys(compiled_personal_stakes, new_stake["sport"], new_stake["strategies"]):
+        compiled_intervals = compiled_personal_stakes[compiled_key]
+        # * the last segment starting before the end of the new stake is the only one which can overlap it
+        index = bisect_left(compiled_intervals["starts"], new_max_quota + 1) - 1
+        if index >= 0 and compiled_intervals["ends"][index] > new_min_quota:
             return True
     return False
 
@@ -0,0 +1,237 @@
+""" This module contains the segments, which are the audiences of the broadcasts
+materialized as compact lists of user IDs, so that a broadcast can start sending
+without querying the users.
+The segments are refreshed periodically by a job and, if their last refresh is too old,
+when they are used; the custom ones, defined by the admins with a query on the users,
+are also refreshed when they are created.
+"""
+import array
+import bisect
+import datetime
+import json
+import re
+from typing import Callable, Dict, List, Optional, Sequence
+
+from lot_bot import constants as cst
+from lot_bot import custom_exceptions
+from lot_bot.dao import segments_manager, user_manager
+
+NOT_BLOCKED_SEGMENT_NAME = "not_blocked"
+ACTIVE_SEGMENT_NAME = "active"
+EXPIRED_SEGMENT_NAME = "expired"
+# * the builtin segments' queries, which depend on the refresh timestamp
+BUILTIN_SEGMENTS_QUERIES : Dict[str, Callable[[float], Dict]] = {
+    NOT_BLOCKED_SEGMENT_NAME: lambda now_timestamp: {"blocked": False},
+    ACTIVE_SEGMENT_NAME: lambda now_timestamp: {"blocked": False, "lot_expiration_date": {"$gt": now_timestamp}},
+    EXPIRED_SEGMENT_NAME: lambda now_timestamp: {"blocked": False, "lot_expiration_date": {"$gt": 0, "$lt": now_timestamp}},
+}
+SEGMENT_NAME_PATTERN = re.compile(r"^[a-z0-9_]{1,32}$")
+# * the operators which would run JavaScript on the db
+FORBIDDEN_QUERY_OPERATORS = {"$where", "$function", "$accumulator"}
+
+
+def pack_ids(ids: Sequence[int]) -> bytes:
+    return array.array("q", ids).tobytes()
+
+
+def unpack_ids(packed_ids: bytes) -> array.array:
+    ids = array.array("q")
+    ids.frombytes(packed_ids)
+    return ids
+
+
+def create_segment_data(name: str, user_ids: Sequence[int], refreshed_at: float, query: Optional[Dict] = None,
+        first_access_timestamps: Optional[Sequence[float]] = None) -> Dict:
+    """Creates the segment document, where the user IDs (and their first access
+    timestamps, if any) are packed as 64 bit arrays.
+
+    Args:
+        name (str)
+        user_ids (Sequence[int])
+        refreshed_at (float)
+        query (Optional[Dict], optional): the query of the custom segments. Defaults to None.
+        first_access_timestamps (Optional[Sequence[float]], optional): the users' first access timestamps,
+            in the same (ascending) order of user_ids. Defaults to None.
+
+    Returns:
+        Dict
+    """
+    segment_data = {
+        "_id": name,
+        "user_ids": pack_ids(user_ids),
+        "size": len(user_ids),
+        "refreshed_at": refreshed_at,
+        # * stored as JSON, since its keys can start with $
+        "query": json.dumps(query) if query is not None else None,
+    }
+    if first_access_timestamps is not None:
+        segment_data["first_access_timestamps"] = array.array("d", first_access_timestamps).tobytes()
+    return segment_data
+
+
+def check_custom_segment_query(query: object):
+    """Checks that the query can be used for a custom segment.
+
+    Args:
+        query (object)
+
+    Raises:
+        custom_exceptions.SegmentDefinitionError: if the query is not a dict or contains an operator running JavaScript
+    """
+    if not isinstance(query, dict):
+        raise custom_exceptions.SegmentDefinitionError("ERRORE: la query del segmento deve essere un oggetto JSON")
+    values_to_check = [query]
+    while values_to_check:
+        value = values_to_check.pop()
+        if isinstance(value, dict):
+            forbidden_operators = FORBIDDEN_QUERY_OPERATORS.intersection(value.keys())
+            if forbidden_operators:
+                raise custom_exceptions.SegmentDefinitionError(f"ERRORE: l'operatore {forbidden_operators.pop()} non può essere usato nei segmenti")
+            values_to_check.extend(value.values())
+        elif isinstance(value, list):
+            values_to_check.extend(value)
+
+
+def parse_custom_segment_definition(name: str, query_text: str) -> Dict:
+    """Parses the name and the JSON query of a custom segment.
+
+    Args:
+        name (str)
+        query_text (str)
+
+    Raises:
+        custom_exceptions.SegmentDefinitionError: if the name or the query are not valid
+
+    Returns:
+        Dict: the query
+    """
+    if not SEGMENT_NAME_PATTERN.match(name):
+        raise custom_exceptions.SegmentDefinitionError("ERRORE: il nome del segmento può contenere solo lettere minuscole, numeri e _ (max 32 caratteri)")
+    if name in BUILTIN_SEGMENTS_QUERIES:
+        raise custom_exceptions.SegmentDefinitionError(f"ERRORE: il segmento {name} è predefinito e non può essere modificato")
+    try:
+        query = json.loads(query_text)
+    except ValueError as e:
+        raise custom_exceptions.SegmentDefinitionError(f"ERRORE: la query del segmento non è un JSON valido - {str(e)}")
+    check_custom_segment_query(query)
+    return query
+
+
+def refresh_segment(name: str, query: Optional[Dict] = None, now_timestamp: float = None) -> Dict:
+    """Materializes the segment, running its query on the users, and saves it.
+    The blocked users are never part of a segment.
+    The not_blocked segment is sorted by first access, so that the users
+    activated in the last days can be found in it too.
+
+    Args:
+        name (str)
+        query (Optional[Dict], optional): the query of the custom segment, None for the builtin ones. Defaults to None.
+        now_timestamp (float, optional): Defaults to the current UTC timestamp.
+
+    Returns:
+        Dict: the segment data
+    """
+    if now_timestamp is None:
+        now_timestamp = datetime.datetime.utcnow().timestamp()
+    if query is None:
+        users_query = BUILTIN_SEGMENTS_QUERIES[name](now_timestamp)
+    else:
+        users_query = {"$and": [query, {"blocked": False}]}
+    if name == NOT_BLOCKED_SEGMENT_NAME:
+        users_data = user_manager.retrieve_users_fields_by_query(users_query, ["_id", "first_access_timestamp"])
+        users_data.sort(key=lambda user_data: user_data.get("first_access_timestamp", 0))
+        segment_data = create_segment_data(
+            name,
+            [user_data["_id"] for user_data in users_data],
+            now_timestamp,
+            first_access_timestamps=[user_data.get("first_access_timestamp", 0) for user_data in users_data],
+        )
+    else:
+        users_data = user_manager.retrieve_users_fields_by_query(users_query, ["_id"])
+        segment_data = create_segment_data(name, [user_data["_id"] for user_data in users_data], now_timestamp, query=query)
+    segments_manager.save_segment(segment_data)
+    return segment_data
+
+
+def refresh_all_segments(now_timestamp: float = None) -> List[Dict]:
+    """Refreshes the builtin segments and the custom ones.
+
+    Args:
+        now_timestamp (float, optional): Defaults to the current UTC timestamp.
+
+    Returns:
+        List[Dict]: the segments data
+    """
+    # * the expiration dates of the users created before they were denormalized are needed by active and expired
+    user_manager.backfill_lot_expiration_dates()
+    refreshed_segments = [refresh_segment(name, now_timestamp=now_timestamp) for name in BUILTIN_SEGMENTS_QUERIES]
+    for segment_summary in segments_manager.retrieve_segments_summaries():
+        if segment_summary["_id"] not in BUILTIN_SEGMENTS_QUERIES and segment_summary.get("query"):
+            refreshed_segments.append(refresh_segment(segment_summary["_id"], json.loads(segment_summary["query"]), now_timestamp=now_timestamp))
+    return refreshed_segments
+
+
+def get_segment(name: str, now_timestamp: float = None) -> Optional[Dict]:
+    """Returns the materialized segment.
+    The segments refreshed more than SEGMENTS_REFRESH_INTERVAL seconds ago
+    (e.g. on the cloud function, where the refresh job is not run) and the builtin
+    segments which were never refreshed are refreshed now.
+
+    Args:
+        name (str)
+        now_timestamp (float, optional): Defaults to the current UTC timestamp.
+
+    Returns:
+        Optional[Dict]: the segment data, None if there is no segment with that name
+    """
+    if now_timestamp is None:
+        now_timestamp = datetime.datetime.utcnow().timestamp()
+    segment_data = segments_manager.retrieve_segment(name)
+    if segment_data is None and name not in BUILTIN_SEGMENTS_QUERIES:
+        return None
+    if segment_data is not None and now_timestamp - segment_data["refreshed_at"] < cst.SEGMENTS_REFRESH_INTERVAL:
+        return segment_data
+    query = None
+    if name not in BUILTIN_SEGMENTS_QUERIES:
+        if not segment_data.get("query"):
+            return segment_data
+        query = json.loads(segment_data["query"])
+    elif name != NOT_BLOCKED_SEGMENT_NAME:
+        user_manager.backfill_lot_expiration_dates()
+    return refresh_segment(name, query, now_timestamp=now_timestamp)
+
+
+def get_segment_user_ids(segment_data: Dict, activated_since_timestamp: float = None) -> Sequence[int]:
+    """Returns the user IDs of the segment.
+
+    Args:
+        segment_data (Dict)
+        activated_since_timestamp (float, optional): if specified, only the users whose first access
+            is after it are returned; only the not_blocked segment supports it. Defaults to None.
+
+    Raises:
+        ValueError: if activated_since_timestamp is specified for a segment not sorted by first access
+
+    Returns:
+        Sequence[int]
+    """
+    user_ids = unpack_ids(segment_data["user_ids"])
+    if activated_since_timestamp is None:
+        return user_ids
+    if "first_access_timestamps" not in segment_data:
+        raise ValueError(f"Segment {segment_data['_id']} is not sorted by first access")
+    first_access_timestamps = array.array("d")
+    first_access_timestamps.frombytes(segment_data["first_access_timestamps"])
+    return user_ids[bisect.bisect_right(first_access_timestamps, activated_since_timestamp):]
+
+
+def estimate_send_time(num_of_users: int) -> float:
+    """Estimates the seconds needed to send a message to the users, at the sender's rate.
+
+    Args:
+        num_of_users (int)
+
+    Returns:
+        float
+    """
+    return num_of_users / cst.MAX_MESSAGES_PER_SECOND
@@ -1,20 +1,28 @@
 import dataclasses
-from typing import Optional, List
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Optional, Tuple
 
 from lot_bot.models import strategies
 
-@dataclasses.dataclass
+# * eq=False: sports are singletons, hence they are compared (and hashed) by identity
+@dataclasses.dataclass(frozen=True, eq=False)
 class Sport:
     name : str
-    strategies : List[strategies.Strategy] # ! should not partecipate in eq
+    strategies : Tuple[strategies.Strategy, ...]
     show_in_menu : bool = True
     display_name : str = ""
     emoji : str = "📑"
     outcome_percentage_in_resoconto : bool = True
+    strategy_names : FrozenSet[str] = dataclasses.field(init=False, repr=False)
 
     def __post_init__(self):
         if self.display_name == "":
-            self.display_name = self.name.capitalize()
+            object.__setattr__(self, "display_name", self.name.capitalize())
+        object.__setattr__(self, "strategies", tuple(self.strategies))
+        object.__setattr__(self, "strategy_names", frozenset(strategy.name for strategy in self.strategies))
+
+    def has_strategy(self, strategy: Optional[strategies.Strategy]) -> bool:
+        return strategy is not None and strategy.name in self.strategy_names
 
 
 strats = strategies.StrategyContainer()
@@ -61,15 +69,21 @@ class SportsContainer:
     #MMA : Sport = Sport("mma", _base_strategies, emoji="🥋", display_name="MMA")
     #NEWS : Sport = Sport("news", _news_strategies, display_name="News") 
 
+    def __post_init__(self):
+        # * registries are computed once, so that lookups and iterations do not copy the dataclass
+        self._sports : Tuple[Sport, ...] = tuple(getattr(self, field.name) for field in dataclasses.fields(self))
+        self._sports_by_token : Dict[str, Sport] = MappingProxyType({field.name: getattr(self, field.name) for field in dataclasses.fields(self)})
+        self._sports_by_display_name : Dict[str, Sport] = MappingProxyType({sport.display_name.lower(): sport for sport in self._sports})
+        self._sports_in_menu : Tuple[Sport, ...] = tuple(sport for sport in self._sports if sport.show_in_menu)
+
     def __iter__(self):
-        attributes = dataclasses.asdict(self).keys()
-        yield from (getattr(self, attribute) for attribute in attributes)
+        yield from self._sports
 
     def __next__(self):
         yield
 
     def __contains__(self, item: Sport):
-        return dataclasses.astuple(item) in dataclasses.astuple(self) # wat
+        return any(item is sport for sport in self._sports)
 
     def __eq__(self, __o: object) -> bool:
         if hasattr(__o, "name"):
@@ -80,13 +94,18 @@ class SportsContainer:
         if not sport_string:
             return None
         parsed_sport_string = sport_string.upper().strip().replace(" ", "").replace("_", "")
-        if hasattr(self, parsed_sport_string):
-            return getattr(self, parsed_sport_string)
-        else:
+        return self._sports_by_token.get(parsed_sport_string)
+
+    def get_sport_by_display_name(self, display_name: str) -> Optional[Sport]:
+        if not display_name:
             return None
+        return self._sports_by_display_name.get(display_name.lower().strip())
     
+    def get_sports_in_menu(self) -> Tuple[Sport, ...]:
+        return self._sports_in_menu
+
     def astuple(self):
-        return tuple([self.__dict__[field.name] for field in dataclasses.fields(self)])
+        return self._sports
 
 
 sports_container = SportsContainer()
@@ -1,8 +1,10 @@
-from typing import Optional
+from types import MappingProxyType
+from typing import Dict, Optional, Tuple
 from lot_bot import constants as cst
 import dataclasses
 
-@dataclasses.dataclass
+# * eq=False: strategies are singletons, hence they are compared (and hashed) by identity
+@dataclasses.dataclass(frozen=True, eq=False)
 class Strategy:
     name : str
     display_name : str = ""
@@ -11,7 +13,7 @@ class Strategy:
 
     def __post_init__(self):
         if self.display_name == "":
-            self.display_name = self.name.capitalize()
+            object.__setattr__(self, "display_name", self.name.capitalize())
 
 
 
@@ -65,28 +67,34 @@ class StrategyContainer:
     # SHOWTELEVISIVI : Strategy = Strategy("showtelevisivi", display_name="Show Televisivi")
 
 
+    def __post_init__(self):
+        # * registries are computed once, so that lookups and iterations do not copy the dataclass
+        self._strategies : Tuple[Strategy, ...] = tuple(getattr(self, field.name) for field in dataclasses.fields(self))
+        self._strategies_by_token : Dict[str, Strategy] = MappingProxyType({field.name: getattr(self, field.name) for field in dataclasses.fields(self)})
+        self._strategies_by_display_name : Dict[str, Strategy] = MappingProxyType({strategy.display_name.lower(): strategy for strategy in self._strategies})
+
     def astuple(self):
-        return tuple([self.__dict__[field.name] for field in dataclasses.fields(self)])
+        return self._strategies
 
     def __iter__(self):
-        # attributes = dataclasses.asdict(self).keys()
-        # yield from (getattr(self, attribute) for attribute in attributes)
-        yield from self.astuple()
+        yield from self._strategies
     
     def __next__(self):
         yield
 
     def __contains__(self, item: Strategy):
-        pass
+        return any(item is strategy for strategy in self._strategies)
 
     def get_strategy(self, strategy_token: str) -> Optional[Strategy]:
         if not strategy_token:
             return None
         strategy_token = strategy_token.upper().strip().replace(" ", "").replace("_", "")
-        if hasattr(self, strategy_token):
-            return getattr(self, strategy_token)
-        else:
+        return self._strategies_by_token.get(strategy_token)
+
+    def get_strategy_by_display_name(self, display_name: str) -> Optional[Strategy]:
+        if not display_name:
             return None
+        return self._strategies_by_display_name.get(display_name.lower().strip())
     
 
 
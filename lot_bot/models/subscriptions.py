@@ -1,22 +1,26 @@
 import dataclasses
 import datetime
-from typing import Optional, List
+from types import MappingProxyType
+from typing import Dict, List, Optional, Tuple
 
 from lot_bot.models import sports
 
 
-@dataclasses.dataclass
+# * eq=False: subscriptions are singletons, hence they are compared (and hashed) by identity
+@dataclasses.dataclass(frozen=True, eq=False)
 class Subscription:
     name : str
     display_name : str = ""
-    available_sports : List[sports.Sport] = dataclasses.field(default_factory=list)
+    available_sports : Tuple[sports.Sport, ...] = ()
     description : str = ""
     price : int = 0
-    aliases : List[str] = dataclasses.field(default_factory=list)
+    aliases : Tuple[str, ...] = ()
 
     def __post_init__(self):
         if self.display_name == "":
-            self.display_name = self.name.capitalize()
+            object.__setattr__(self, "display_name", self.name.capitalize())
+        object.__setattr__(self, "available_sports", tuple(self.available_sports))
+        object.__setattr__(self, "aliases", tuple(self.aliases))
 
 
 @dataclasses.dataclass
@@ -63,32 +67,112 @@ class SubContainer:
         aliases=["lot pro", "pro", "pro lot"]
     )
 
+    def __post_init__(self):
+        # * registries are computed once, so that lookups and iterations do not copy the dataclass
+        self._subs : Tuple[Subscription, ...] = tuple(getattr(self, field.name) for field in dataclasses.fields(self))
+        self._subs_by_token : Dict[str, Subscription] = MappingProxyType({field.name: getattr(self, field.name) for field in dataclasses.fields(self)})
+        subs_by_alias = {}
+        # * reversed, so that the first subscription wins in case of duplicated aliases
+        for sub in reversed(self._subs):
+            subs_by_alias.update({alias: sub for alias in sub.aliases})
+        self._subs_by_alias : Dict[str, Subscription] = MappingProxyType(subs_by_alias)
+
     def __iter__(self):
-        attributes = dataclasses.asdict(self).keys()
-        yield from (getattr(self, attribute) for attribute in attributes)
+        yield from self._subs
 
     def __next__(self):
         yield
 
     def astuple(self):
-        return tuple([self.__dict__[field.name] for field in dataclasses.fields(self)])
+        return self._subs
 
     def get_subscription(self, sub_string: str) -> Optional[Subscription]:
         if not sub_string:
             return None
         parsed_sub_string = sub_string.upper().strip().replace(" ", "").replace("_", "")
-        if hasattr(self, parsed_sub_string):
-            return getattr(self, parsed_sub_string)
-        else:
-            for sub in self.astuple():
-                if sub_string in sub.aliases:
-                    return sub
-        return None
+        if parsed_sub_string in self._subs_by_token:
+            return self._subs_by_token[parsed_sub_string]
+        return self._subs_by_alias.get(sub_string)
 
 sub_container = SubContainer()
 
+# * key of the sport access map used by the subscriptions which include every sport
+ALL_SPORTS_ACCESS_KEY = "all"
+
 
 
 def create_teacherbet_base_sub():
     trial_expiration_timestamp = (datetime.datetime.now() + datetime.timedelta(days=3)).timestamp()
     return {"name": sub_container.TEACHERBET.name, "expiration_date": trial_expiration_timestamp}
+
+
+def create_sport_access_from_subscriptions(user_subscriptions: List[Dict]) -> Dict[str, float]:
+    """Creates the denormalized sport access map of a user, which maps each sport name
+    to the latest expiration date among the user's subscriptions granting access to it.
+    The subscriptions including every sport are mapped to ALL_SPORTS_ACCESS_KEY,
+    so that sports added later on are covered too.
+    Unknown subscriptions are ignored.
+
+    Args:
+        user_subscriptions (List[Dict]): the user's subscriptions entries, with name and expiration_date
+
+    Returns:
+        Dict[str, float]: the sport access map, in the form of {sport_name: expiration_timestamp}
+    """
+    sport_access = {}
+    for sub_entry in user_subscriptions:
+        sub = sub_container.get_subscription(sub_entry["name"])
+        if sub is None:
+            continue
+        expiration_date = float(sub_entry["expiration_date"])
+        if not sub.available_sports:
+            sports_names = (ALL_SPORTS_ACCESS_KEY,)
+        else:
+            sports_names = (sport.name for sport in sub.available_sports)
+        for sport_name in sports_names:
+            if expiration_date > sport_access.get(sport_name, 0):
+                sport_access[sport_name] = expiration_date
+    return sport_access
+
+
+def get_subscription_expiration_date(user_subscriptions: List[Dict], sub_name: str) -> float:
+    """Returns the expiration date of the user's subscription specified by sub_name,
+    which is denormalized for LOTCOMPLETE in the user's lot_expiration_date.
+
+    Args:
+        user_subscriptions (List[Dict]): the user's subscriptions entries, with name and expiration_date
+        sub_name (str)
+
+    Returns:
+        float: the expiration timestamp, 0 if the user does not have the subscription
+    """
+    expiration_dates = [float(sub_entry["expiration_date"]) for sub_entry in user_subscriptions if sub_entry["name"] == sub_name]
+    return max(expiration_dates, default=0)
+
+
+def get_sport_access_expiration(sport_access: Dict[str, float], sport_name: str) -> float:
+    """Returns the expiration date of the access to the specified sport.
+
+    Args:
+        sport_access (Dict[str, float]): the user's sport access map
+        sport_name (str)
+
+    Returns:
+        float: the expiration timestamp, 0 if the user never had access to the sport
+    """
+    return max(sport_access.get(sport_name, 0), sport_access.get(ALL_SPORTS_ACCESS_KEY, 0))
+
+
+def get_available_sports_names_from_sport_access(sport_access: Dict[str, float], timestamp: float) -> List[str]:
+    """Returns the names of the sports which are accessible at the given timestamp.
+
+    Args:
+        sport_access (Dict[str, float]): the user's sport access map
+        timestamp (float)
+
+    Returns:
+        List[str]: the names of the accessible sports, or an empty list if every sport is accessible
+    """
+    if sport_access.get(ALL_SPORTS_ACCESS_KEY, 0) > timestamp:
+        return []
+    return [sport_name for sport_name, expiration_date in sport_access.items() if expiration_date > timestamp]
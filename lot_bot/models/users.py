@@ -1,10 +1,12 @@
 import datetime
 import random
 import string
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Tuple, Union
 
+import numpy as np
 from dateutil.relativedelta import relativedelta
 from lot_bot import constants as cst
+from lot_bot import custom_exceptions
 from lot_bot import logger as lgr
 from lot_bot.dao import user_manager, budget_manager
 from lot_bot.models import giocate as giocata_model
@@ -13,6 +15,8 @@ from telegram import User
 
 # role: user, analyst, admin
 ROLES = ["user", "analyst", "admin", "teacherbet"]
+# * attempts to register a payment while the user's subscriptions are being changed by other updates
+MAX_PAYMENT_REGISTRATION_ATTEMPTS = 3
 
 def create_base_user_data():
     return {
@@ -36,6 +40,9 @@ def create_base_user_data():
         "sport_subscriptions": [],
         "budgets": [],
         "personal_stakes": [],
+        "compiled_personal_stakes": {},
+        "sport_access": {},
+        "lot_expiration_date": 0,
         "messages_received": [],
         "used_codes": [],
         "active_codes": []
@@ -126,6 +133,53 @@ def add_days_to_user_subscription(user_id: int, days: int) -> bool:
     return user_update_result
 
 
+def register_payment_and_extend_subscription(user_id: int, payment: Dict, sub_name: str, days: int, user_email: str) -> Optional[Tuple[float, Optional[int]]]:
+    """Registers the payment (along with the user's linked referral user, if any), extending the user's
+    subscription by the specified days, setting the user's email and resetting the successful referrals,
+    all with a single atomic update.
+    The payment is registered only once for each telegram_payment_charge_id, so that
+    a duplicate delivery of the same payment does not extend the subscription twice.
+
+    Args:
+        user_id (int)
+        payment (Dict): the payment data, containing telegram_payment_charge_id
+        sub_name (str)
+        days (int)
+        user_email (str)
+
+    Raises:
+        custom_exceptions.UserNotFound: in case the user is not found
+        Exception: in case the subscription keeps being changed by other updates, or of db errors
+
+    Returns:
+        Optional[Tuple[float, Optional[int]]]: the new expiration date and the ID of the user's linked referral user,
+            None if the payment was already registered
+    """
+    for _ in range(MAX_PAYMENT_REGISTRATION_ATTEMPTS):
+        retrieved_user = user_manager.retrieve_user_fields_by_user_id(user_id, ["subscriptions", "linked_referral_user"])
+        if not retrieved_user:
+            raise custom_exceptions.UserNotFound(user_id)
+        previous_expiration_date = next((entry["expiration_date"] for entry in retrieved_user["subscriptions"] if entry["name"] == sub_name), None)
+        if previous_expiration_date is None:
+            new_expiration_date = (datetime.datetime.utcnow() + datetime.timedelta(days=days)).timestamp()
+        else:
+            new_expiration_date = extend_expiration_date(previous_expiration_date, days)
+        user_data = {
+            "successful_referrals_since_last_payment": [],
+            "email": user_email,
+        }
+        subscription_entry = {"name": sub_name, "expiration_date": new_expiration_date}
+        linked_referral_id = retrieved_user["linked_referral_user"]["linked_user_id"]
+        if linked_referral_id is not None:
+            payment = {**payment, "referred_by": linked_referral_id}
+        if user_manager.register_successful_payment(user_id, payment, subscription_entry, previous_expiration_date, user_data):
+            return new_expiration_date, linked_referral_id
+        # * the update was not applied: either the payment is a duplicate or the subscription was just changed
+        if user_manager.check_payment_registered(user_id, payment["telegram_payment_charge_id"]):
+            return None
+    raise Exception(f"Could not register payment {payment['telegram_payment_charge_id']} for user {user_id}: its subscriptions keep changing")
+
+
 def calculate_new_budget_after_giocata(user_budget: int, giocata: Dict, personalized_stake: int = None) -> int:
     """[summary]
 
@@ -143,14 +197,14 @@ def calculate_new_budget_after_giocata(user_budget: int, giocata: Dict, personal
         stake = personalized_stake
     # * get outcome percentage
     if "cashout" in giocata:
-        lgr.logger.debug(f"{giocata['cashout']=}")
+        lgr.logger.debug("giocata['cashout']=%r", giocata["cashout"])
         outcome_percentage = (giocata["cashout"] / 100) * int(giocata["outcome"] != "void") # just to be sure to avoid abbinate
     else:
         outcome_percentage = giocata_model.get_outcome_percentage(giocata["outcome"], stake, giocata["base_quota"])
     # * update budget with outcome percentange
     budget_difference = (user_budget * round(outcome_percentage / 100, 2))
     new_budget = user_budget + budget_difference
-    lgr.logger.debug(f"New budget calculated: {user_budget=}  - {outcome_percentage=} - {budget_difference=}")
+    lgr.logger.debug("New budget calculated: user_budget=%r - outcome_percentage=%r - budget_difference=%r", user_budget, outcome_percentage, budget_difference)
     return new_budget
 
 def calculate_new_budget_after_giocata2(user_budget_balance: int, giocata: Dict, personalized_stake: int = None) -> int:
@@ -170,17 +224,68 @@ def calculate_new_budget_after_giocata2(user_budget_balance: int, giocata: Dict,
         stake = personalized_stake
     # * get outcome percentage
     if "cashout" in giocata:
-        lgr.logger.debug(f"{giocata['cashout']=}")
+        lgr.logger.debug("giocata['cashout']=%r", giocata["cashout"])
         outcome_percentage = (giocata["cashout"] / 100) * int(giocata["outcome"] != "void") # just to be sure to avoid abbinate
     else:
         outcome_percentage = giocata_model.get_outcome_percentage(giocata["outcome"], stake, giocata["base_quota"])
     # * update budget with outcome percentange
     budget_difference = (user_budget_balance * round(outcome_percentage / 100, 2))
     new_budget = user_budget_balance + budget_difference
-    lgr.logger.debug(f"New budget calculated: {user_budget_balance=}  - {outcome_percentage=} - {budget_difference=}")
+    lgr.logger.debug("New budget calculated: user_budget_balance=%r - outcome_percentage=%r - budget_difference=%r", user_budget_balance, outcome_percentage, budget_difference)
     return new_budget
 
 
+def calculate_new_budgets_after_giocata(user_budget_balances: np.ndarray, giocata: Dict, personalized_stakes: np.ndarray = None) -> np.ndarray:
+    """Vectorized version of calculate_new_budget_after_giocata2, calculating the new
+    budget balances of all the users who played the giocata at once.
+    The results are the same of the scalar version, rounding included: 
+    the outcome percentages close to a rounding tie are rounded with the 
+    builtin round, exactly as the scalar version does.
+
+    Args:
+        user_budget_balances (np.ndarray): actual budgets * 100
+        giocata (Dict)
+        personalized_stakes (np.ndarray, optional): the users' personalized stakes, 0 meaning the base stake is used. Defaults to None.
+
+    Returns:
+        np.ndarray: the new budgets after the giocata
+    """
+    user_budget_balances = np.asarray(user_budget_balances, dtype=np.float64)
+    # * get outcome percentages (the cashout does not depend on the stake)
+    if "cashout" in giocata:
+        outcome_percentages = np.full(user_budget_balances.shape, (giocata["cashout"] / 100) * int(giocata["outcome"] != "void"))
+    else:
+        stakes = np.full(user_budget_balances.shape, giocata["base_stake"], dtype=np.float64)
+        # * check if there are personalized stakes
+        if personalized_stakes is not None:
+            personalized_stakes = np.asarray(personalized_stakes, dtype=np.float64)
+            stakes = np.where(personalized_stakes != 0, personalized_stakes, stakes)
+        outcome_percentages = giocata_model.get_outcome_percentages(giocata["outcome"], stakes, giocata["base_quota"])
+    # * update budgets with outcome percentanges
+    return user_budget_balances + user_budget_balances * round_budget_percentages(outcome_percentages / 100)
+
+
+def round_budget_percentages(budget_percentages: np.ndarray) -> np.ndarray:
+    """Rounds the budget percentages (outcome percentages / 100) to 2 decimals, 
+    with the same results of the builtin round: np.round scales by 100 before rounding,
+    which can move values close to a .5 tie on the other side of it, hence those
+    values are rounded with the builtin round.
+
+    Args:
+        budget_percentages (np.ndarray): array of any shape
+
+    Returns:
+        np.ndarray: the rounded budget percentages
+    """
+    budget_percentages = np.asarray(budget_percentages, dtype=np.float64)
+    rounded_budget_percentages = np.round(budget_percentages, 2)
+    scaled_budget_percentages = budget_percentages * 100
+    close_to_tie = np.abs(np.abs(scaled_budget_percentages - np.floor(scaled_budget_percentages)) - 0.5) < 1e-6
+    for index in zip(*np.nonzero(close_to_tie)):
+        rounded_budget_percentages[index] = round(float(budget_percentages[index]), 2)
+    return rounded_budget_percentages
+
+
 
 def update_single_user_budget_with_giocata(target_user_id: int, target_user_budget: int, giocata_id, 
                                             giocata_data: Dict, user_personal_stake: int = None) -> bool:
@@ -239,7 +344,8 @@ def update_single_user_budget_with_giocata2(target_user_id: int, target_user_bud
     return update_result
 
 def update_users_budget_with_giocata(updated_giocata: Dict):
-    """Updates the budgets of the users who played the new giocata.
+    """Updates the default budgets of the users who played the new giocata,
+    calculating all the new budgets at once.
 
     Args:
         updated_giocata (Dict)
@@ -247,24 +353,27 @@ def update_users_budget_with_giocata(updated_giocata: Dict):
     users_who_played_giocata = user_manager.retrieve_users_who_played_giocata(updated_giocata["_id"])
     if not users_who_played_giocata:
         return
+    # * the budgets are already included in the retrieved users
+    target_users_ids, target_users_budgets, target_users_personal_stakes = [], [], []
     for target_user in users_who_played_giocata:
-        #if target_user["budget"] is None: #temporary
-        default_budget = budget_manager.retrieve_default_budget_from_user_id(target_user["_id"]) 
+        default_budget = next((budget for budget in target_user.get("budgets") or [] if budget["default"]), None)
         if not default_budget:
-            print("LALALALALALA NOT DEFAULT BUDGET")
             continue
-        else:
-            print("LALALALALALA DEFAULT BUDGET")
-        #target_user_budget = int(target_user["budget"]) temporary
-        target_user_budget = int(default_budget["balance"]) 
-        target_user_personal_stake = int(target_user["giocate"]["personal_stake"])
-        update_single_user_budget_with_giocata2(
-            target_user["_id"], 
-            target_user_budget, 
+        target_users_ids.append(target_user["_id"])
+        target_users_budgets.append(default_budget)
+        target_users_personal_stakes.append(int(target_user["giocate"]["personal_stake"]))
+    if not target_users_ids:
+        return
+    target_users_balances = np.array([int(budget["balance"]) for budget in target_users_budgets], dtype=np.int64)
+    new_budget_balances = calculate_new_budgets_after_giocata(target_users_balances, updated_giocata, np.array(target_users_personal_stakes))
+    for target_user_id, target_user_budget, target_user_balance, new_budget_balance in zip(
+            target_users_ids, target_users_budgets, target_users_balances.tolist(), new_budget_balances.tolist()):
+        budget_manager.update_budget_balance(target_user_id, target_user_budget["budget_name"], new_budget_balance)
+        # * update personal giocata with pre-giocata budget info
+        user_manager.update_user_giocata_with_previous_budget(
+            target_user_id, 
             updated_giocata["_id"],
-            updated_giocata, 
-            user_personal_stake=target_user_personal_stake
-        )
+            target_user_balance)
 
 #TODO2 change blabla
 def update_users_budget_with_giocata2(updated_giocata: Dict):
@@ -368,7 +477,7 @@ def get_user_available_sports_names_from_subscriptions(user_subscriptions: List[
             raise Exception
         if float(sub_entry["expiration_date"]) < now_timestamp:
             continue
-        if sub.available_sports == []:
+        if not sub.available_sports:
             return []
         sports_names = [sub_sport.name for sub_sport in sub.available_sports]
         user_available_sports.extend(sports_names)
@@ -0,0 +1,267 @@
+""" This module contains the persistence of the conversation states and of the user_data,
+which are stored on the db so that a conversation can go on even if the next update
+of the user is handled by another (or a new) instance of the bot.
+The data of each user is cached in process for a few seconds, so that the many reads
+made while handling an update (each ConversationHandler is checked for each update)
+cost at most one db read, and the changes are written to the db in batches.
+"""
+import collections
+import collections.abc
+import copy
+import threading
+import time
+from typing import Any, DefaultDict, Dict, Iterator, List, Optional, Tuple
+
+from telegram.ext import BasePersistence
+
+from lot_bot import constants as cst
+from lot_bot.dao import persistence_manager
+
+ConversationKey = Tuple[int, ...]
+
+
+def get_persistence_id(key: ConversationKey) -> int:
+    """Returns the ID of the user (or of the chat, for the conversations
+    which are not per user) whose data contains the conversation.
+
+    Args:
+        key (ConversationKey)
+
+    Returns:
+        int
+    """
+    return key[-1]
+
+
+def get_conversation_key_field(key: ConversationKey) -> str:
+    return "_".join(str(key_part) for key_part in key)
+
+
+def get_conversation_key(key_field: str) -> ConversationKey:
+    return tuple(int(key_part) for key_part in key_field.split("_"))
+
+
+class PersistentConversations(collections.abc.MutableMapping):
+    """The conversations of a ConversationHandler, which reads and
+    writes the conversation states through the persistence."""
+
+    def __init__(self, persistence: "MongoPersistence", name: str):
+        self.persistence = persistence
+        self.name = name
+
+    def __getitem__(self, key: ConversationKey) -> object:
+        state = self.persistence.get_conversation_state(self.name, key)
+        if state is None:
+            raise KeyError(key)
+        return state
+
+    def __setitem__(self, key: ConversationKey, state: object):
+        self.persistence.update_conversation(self.name, key, state)
+
+    def __delitem__(self, key: ConversationKey):
+        if key not in self:
+            raise KeyError(key)
+        self.persistence.update_conversation(self.name, key, None)
+
+    def __iter__(self) -> Iterator[ConversationKey]:
+        # * only the conversations in the cache are known without reading the whole collection
+        return iter(self.persistence.get_cached_conversation_keys(self.name))
+
+    def __len__(self) -> int:
+        return len(self.persistence.get_cached_conversation_keys(self.name))
+
+
+class MongoPersistence(BasePersistence):
+    """Persistence of the conversation states and of the user_data on the persistence collection,
+    with a document for each user ({"_id": user_id, "conversations": {name: {key: state}}, "user_data": {...}}).
+    The documents are cached for cache_ttl seconds, or as long as they have changes which
+    were not written yet; the changes are written by flush, which is called periodically
+    and as soon as max_pending_users users have changes.
+    The chat_data and the bot_data are not used by the bot, so they are not stored.
+    """
+
+    def __init__(self, cache_ttl: float = cst.PERSISTENCE_CACHE_TTL, max_pending_users: int = cst.PERSISTENCE_MAX_PENDING_USERS):
+        super().__init__(store_user_data=True, store_chat_data=False, store_bot_data=False)
+        self.cache_ttl = cache_ttl
+        self.max_pending_users = max_pending_users
+        # * {user_id: {"conversations": {name: {key field: state}}, "user_data": {...}}}
+        self._persistence_data : Dict[int, Dict] = {}
+        self._loaded_at : Dict[int, float] = {}
+        # * incremented for each change of the user's data, so that a db read started
+        #   before a change does not overwrite it
+        self._versions : DefaultDict[int, int] = collections.defaultdict(int)
+        # * {user_id: {field path: value}}, None values are removed from the db
+        self._pending_fields : Dict[int, Dict[str, Any]] = {}
+        self._flushing_fields : Dict[int, Dict[str, Any]] = {}
+        # * the number of updates of the user being handled, whose user_data was refreshed
+        #   and will be passed to update_user_data at the end of the handling
+        self._handled_updates : DefaultDict[int, int] = collections.defaultdict(int)
+        # * handlers are run by multiple workers
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+
+    def _has_unwritten_changes(self, persistence_id: int) -> bool:
+        return persistence_id in self._pending_fields or persistence_id in self._flushing_fields
+
+    def _get_persistence_data(self, persistence_id: int) -> Dict:
+        """Returns the cached data of the user, reading it from the db
+        if it was not cached or if it is older than the cache TTL.
+        Must be called without holding the lock.
+
+        Args:
+            persistence_id (int)
+
+        Returns:
+            Dict
+        """
+        with self._lock:
+            loaded_at = self._loaded_at.get(persistence_id)
+            if loaded_at is not None and (self._has_unwritten_changes(persistence_id) or time.monotonic() - loaded_at < self.cache_ttl):
+                return self._persistence_data[persistence_id]
+            version = self._versions[persistence_id]
+        stored_data = persistence_manager.retrieve_persistence_data(persistence_id) or {}
+        with self._lock:
+            # * the data changed while it was being read is more recent than the read one
+            changed = self._versions[persistence_id] != version or self._has_unwritten_changes(persistence_id)
+            if not changed or persistence_id not in self._persistence_data:
+                self._persistence_data[persistence_id] = {
+                    "conversations": stored_data.get("conversations", {}),
+                    "user_data": stored_data.get("user_data", {}),
+                }
+                self._loaded_at[persistence_id] = time.monotonic()
+            return self._persistence_data[persistence_id]
+
+    def _set_field(self, persistence_id: int, field: Optional[str], value: Any):
+        """Records a change of the user's data, which must have been already applied to the cache.
+        Must be called holding the lock.
+
+        Args:
+            persistence_id (int)
+            field (Optional[str]): the changed field path, None if the change must not be written
+            value (Any): None to remove the field
+        """
+        self._versions[persistence_id] += 1
+        self._loaded_at[persistence_id] = time.monotonic()
+        if field is not None:
+            self._pending_fields.setdefault(persistence_id, {})[field] = value
+
+    def _flush_if_needed(self):
+        if len(self._pending_fields) >= self.max_pending_users:
+            self.flush()
+
+    def get_conversation_state(self, name: str, key: ConversationKey) -> Optional[object]:
+        """Returns the state of the conversation.
+
+        Args:
+            name (str): the ConversationHandler's name
+            key (ConversationKey)
+
+        Returns:
+            Optional[object]: the state, None if the conversation is not active
+        """
+        persistence_data = self._get_persistence_data(get_persistence_id(key))
+        with self._lock:
+            return persistence_data["conversations"].get(name, {}).get(get_conversation_key_field(key))
+
+    def get_cached_conversation_keys(self, name: str) -> List[ConversationKey]:
+        with self._lock:
+            return [
+                get_conversation_key(key_field)
+                for persistence_data in self._persistence_data.values()
+                for key_field in persistence_data["conversations"].get(name, {})
+            ]
+
+    def get_conversations(self, name: str) -> PersistentConversations:
+        return PersistentConversations(self, name)
+
+    def update_conversation(self, name: str, key: ConversationKey, new_state: Optional[object]):
+        persistence_id = get_persistence_id(key)
+        persistence_data = self._get_persistence_data(persistence_id)
+        key_field = get_conversation_key_field(key)
+        with self._lock:
+            # * the data may have been read again in the meantime
+            persistence_data = self._persistence_data.setdefault(persistence_id, persistence_data)
+            conversations = persistence_data["conversations"].setdefault(name, {})
+            if conversations.get(key_field) == new_state:
+                return
+            if new_state is None:
+                del conversations[key_field]
+            else:
+                conversations[key_field] = new_state
+            # * the states of the conversations waiting for an asynchronous handler
+            #   contain the handler's promise, so they are only kept in process
+            field = None if isinstance(new_state, tuple) else f"conversations.{name}.{key_field}"
+            self._set_field(persistence_id, field, new_state)
+        self._flush_if_needed()
+
+    def get_user_data(self) -> DefaultDict[int, Dict]:
+        # * the user_data of each user is read when one of its updates is handled (see refresh_user_data)
+        return collections.defaultdict(dict)
+
+    def refresh_user_data(self, user_id: int, user_data: Dict):
+        persistence_data = self._get_persistence_data(user_id)
+        with self._lock:
+            self._handled_updates[user_id] += 1
+            stored_user_data = copy.deepcopy(persistence_data["user_data"])
+        user_data.clear()
+        user_data.update(stored_user_data)
+
+    def update_user_data(self, user_id: int, data: Dict):
+        with self._lock:
+            # * the dispatcher also passes the user_data of all the users it has ever seen
+            #   (e.g. after each job): they were not changed by a handler and may be older
+            #   than the stored ones, hence they are neither read nor written
+            if not self._handled_updates.get(user_id):
+                return
+            self._handled_updates[user_id] -= 1
+            if not self._handled_updates[user_id]:
+                del self._handled_updates[user_id]
+        # * the data is already a copy of the dispatcher's one
+        persistence_data = self._get_persistence_data(user_id)
+        with self._lock:
+            persistence_data = self._persistence_data.setdefault(user_id, persistence_data)
+            if persistence_data["user_data"] == data:
+                return
+            persistence_data["user_data"] = data
+            self._set_field(user_id, "user_data", data or None)
+        self._flush_if_needed()
+
+    def get_chat_data(self) -> DefaultDict[int, Dict]:
+        return collections.defaultdict(dict)
+
+    def update_chat_data(self, chat_id: int, data: Dict):
+        pass
+
+    def get_bot_data(self) -> Dict:
+        return {}
+
+    def update_bot_data(self, data: Dict):
+        pass
+
+    def flush(self):
+        """Writes the pending changes to the db, in a single bulk write.
+        The users whose data is cached since more than the cache TTL are removed from the cache.
+
+        Raises:
+            e (Exception): in case of db errors, after which the changes are kept pending
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._flushing_fields, self._pending_fields = self._pending_fields, {}
+            try:
+                persistence_manager.update_persistence_data(self._flushing_fields)
+            except Exception as e:
+                with self._lock:
+                    # * the changes made in the meantime are more recent
+                    for persistence_id, fields in self._flushing_fields.items():
+                        self._pending_fields[persistence_id] = {**fields, **self._pending_fields.get(persistence_id, {})}
+                    self._flushing_fields = {}
+                raise e
+            with self._lock:
+                self._flushing_fields = {}
+                now = time.monotonic()
+                for persistence_id, loaded_at in list(self._loaded_at.items()):
+                    if now - loaded_at >= self.cache_ttl and not self._has_unwritten_changes(persistence_id):
+                        del self._loaded_at[persistence_id]
+                        del self._persistence_data[persistence_id]
+                        self._versions.pop(persistence_id, None)
@@ -0,0 +1,147 @@
+""" This module is used to cache the results of the trends and of the resoconti,
+which change when a giocata outcome arrives, when a user accepts a giocata
+or when their window moves (e.g. at midnight).
+Each result is identified by its kind, its window and, in case of user dependent
+results, the user's ID.
+The results are invalidated locally as soon as an outcome or an acceptance is handled,
+and each one is kept for at most RESULTS_CACHE_TTL seconds, since the changes handled
+by the other instances of the bot do not invalidate it.
+"""
+import collections
+import dataclasses
+import datetime
+import threading
+from typing import Any, Dict, FrozenSet, Hashable, Iterable, Optional, Set, Tuple
+
+from lot_bot import constants as cst
+
+# * kinds of the cached results
+TREND_DAYS = "trend_days"
+TREND_EVENTS = "trend_events"
+RESOCONTO = "resoconto"
+
+MAX_RESULTS_CACHE_SIZE = 4096
+
+ResultKey = Tuple[str, Hashable, Optional[int]]
+
+
+@dataclasses.dataclass(frozen=True)
+class CachedResult:
+    value : Any
+    expiration_timestamp : float
+    # * the _ids (as strings) of the giocate the result depends on
+    giocata_ids : FrozenSet[str] = frozenset()
+
+
+_results : "collections.OrderedDict[ResultKey, CachedResult]" = collections.OrderedDict()
+_keys_by_giocata_id : Dict[str, Set[ResultKey]] = collections.defaultdict(set)
+# * handlers are run by multiple workers
+_lock = threading.Lock()
+
+
+def get_next_midnight_timestamp() -> float:
+    """Returns the timestamp of the next midnight, used as the expiration date
+    for the results computed over windows aligned to midnight.
+
+    Returns:
+        float
+    """
+    next_day = datetime.date.today() + datetime.timedelta(days=1)
+    return datetime.datetime.combine(next_day, datetime.time.min).timestamp()
+
+
+def _remove_result(key: ResultKey):
+    cached_result = _results.pop(key, None)
+    if cached_result is None:
+        return
+    for giocata_id in cached_result.giocata_ids:
+        giocata_keys = _keys_by_giocata_id.get(giocata_id)
+        if giocata_keys is None:
+            continue
+        giocata_keys.discard(key)
+        if not giocata_keys:
+            del _keys_by_giocata_id[giocata_id]
+
+
+def get_cached_result(kind: str, window: Hashable, user_id: int = None) -> Optional[Any]:
+    """Retrieves the cached result, if it is present and not expired.
+
+    Args:
+        kind (str): one of TREND_DAYS, TREND_EVENTS and RESOCONTO
+        window (Hashable): the window of the result (days, number of giocate, seconds...)
+        user_id (int, optional): the user the result refers to. Defaults to None.
+
+    Returns:
+        Optional[Any]: the cached result, None if there was none
+    """
+    key = (kind, window, user_id)
+    with _lock:
+        cached_result = _results.get(key)
+        if cached_result is None:
+            return None
+        if cached_result.expiration_timestamp <= datetime.datetime.now().timestamp():
+            _remove_result(key)
+            return None
+        _results.move_to_end(key)
+        return cached_result.value
+
+
+def cache_result(kind: str, window: Hashable, value: Any, user_id: int = None, expiration_timestamp: float = None, giocata_ids: Iterable = (),
+        ttl: float = None):
+    """Caches the result, evicting the least recently used one if the cache is full.
+    The result expires at the expiration timestamp or after the TTL, whichever comes first.
+
+    Args:
+        kind (str): one of TREND_DAYS, TREND_EVENTS and RESOCONTO
+        window (Hashable): the window of the result (days, number of giocate, seconds...)
+        value (Any): the result
+        user_id (int, optional): the user the result refers to. Defaults to None.
+        expiration_timestamp (float, optional): when the result stops being valid. Defaults to None.
+        giocata_ids (Iterable, optional): the _ids of the giocate the result depends on. Defaults to ().
+        ttl (float, optional): in seconds. Defaults to cst.RESULTS_CACHE_TTL.
+    """
+    key = (kind, window, user_id)
+    if ttl is None:
+        ttl = cst.RESULTS_CACHE_TTL
+    ttl_expiration_timestamp = datetime.datetime.now().timestamp() + ttl
+    if expiration_timestamp is None or expiration_timestamp > ttl_expiration_timestamp:
+        expiration_timestamp = ttl_expiration_timestamp
+    cached_result = CachedResult(value, expiration_timestamp, frozenset(str(giocata_id) for giocata_id in giocata_ids))
+    with _lock:
+        _remove_result(key)
+        _results[key] = cached_result
+        for giocata_id in cached_result.giocata_ids:
+            _keys_by_giocata_id[giocata_id].add(key)
+        while len(_results) > MAX_RESULTS_CACHE_SIZE:
+            _remove_result(next(iter(_results)))
+
+
+def invalidate_giocata_results(giocata_id: Any):
+    """Invalidates the results depending on the giocata, together with all the trends,
+    since an outcome can add a giocata to them.
+
+    Args:
+        giocata_id (Any): the _id of the giocata
+    """
+    with _lock:
+        for key in list(_keys_by_giocata_id.get(str(giocata_id), ())):
+            _remove_result(key)
+        for key in [key for key in _results if key[0] in (TREND_DAYS, TREND_EVENTS)]:
+            _remove_result(key)
+
+
+def invalidate_user_results(user_id: int):
+    """Invalidates all the results of the user.
+
+    Args:
+        user_id (int)
+    """
+    with _lock:
+        for key in [key for key in _results if key[2] == user_id]:
+            _remove_result(key)
+
+
+def clear_results_cache():
+    with _lock:
+        _results.clear()
+        _keys_by_giocata_id.clear()
@@ -0,0 +1,280 @@
+""" This module contains the router, a single handler which stands in front of all
+the bot's handlers and only checks the ones which can match the update.
+The candidates are selected by update kind, then by source chat for the message
+handlers restricted to some chats (i.e. the sport channels), by command name for
+the command handlers and by callback data prefix for the callback query handlers.
+The candidates are checked in the order in which they were added, so the first
+matching handler is the same one the dispatcher would have found checking them all.
+"""
+import heapq
+import re
+from typing import Any, Dict, FrozenSet, Hashable, List, Optional, Tuple
+
+from telegram import MessageEntity, Update
+from telegram.ext import (BasePersistence, CallbackQueryHandler, CommandHandler,
+                          ConversationHandler, Handler, MessageHandler,
+                          PreCheckoutQueryHandler)
+from telegram.ext.filters import BaseFilter, Filters, MergedFilter
+
+from lot_bot import metrics
+
+# * the characters which end the literal prefix of a regex
+REGEX_SPECIAL_CHARACTERS = set("\\.^$*+?{}[]|()")
+# * the characters which make the previous one optional
+REGEX_QUANTIFIERS = set("*?{")
+
+RoutedHandler = Tuple[int, Handler]
+
+
+def get_filter_chat_ids(message_filter: BaseFilter) -> Optional[FrozenSet[int]]:
+    """Finds the chats the filter is restricted to, looking for the Filters.chat
+    combined with the other filters.
+
+    Args:
+        message_filter (BaseFilter)
+
+    Returns:
+        Optional[FrozenSet[int]]: the IDs of the chats, None if the filter is not restricted to any chat
+    """
+    if isinstance(message_filter, Filters.chat):
+        if message_filter.usernames or message_filter.allow_empty:
+            return None
+        return message_filter.chat_ids
+    if not isinstance(message_filter, MergedFilter):
+        return None
+    base_chat_ids = get_filter_chat_ids(message_filter.base_filter)
+    if isinstance(message_filter.and_filter, BaseFilter):
+        and_chat_ids = get_filter_chat_ids(message_filter.and_filter)
+        if base_chat_ids is None or and_chat_ids is None:
+            return base_chat_ids if and_chat_ids is None else and_chat_ids
+        return base_chat_ids & and_chat_ids
+    if isinstance(message_filter.or_filter, BaseFilter):
+        or_chat_ids = get_filter_chat_ids(message_filter.or_filter)
+        if base_chat_ids is None or or_chat_ids is None:
+            return None
+        return base_chat_ids | or_chat_ids
+    return None
+
+
+def get_pattern_literal_prefix(pattern: Any) -> Optional[str]:
+    """Finds the literal prefix which all the strings matched by the pattern
+    (with re.match, as the CallbackQueryHandler does) start with.
+
+    Args:
+        pattern (Any): the pattern of a CallbackQueryHandler
+
+    Returns:
+        Optional[str]: the literal prefix, None if the pattern is not a regex
+            or it has alternatives at its top level
+    """
+    if isinstance(pattern, re.Pattern):
+        pattern = pattern.pattern
+    if not isinstance(pattern, str):
+        return None
+    # * alternatives at the top level can start with anything
+    depth = 0
+    is_in_character_class = False
+    index = 0
+    while index < len(pattern):
+        character = pattern[index]
+        if character == "\\":
+            index += 1
+        elif is_in_character_class:
+            is_in_character_class = character != "]"
+        elif character == "[":
+            is_in_character_class = True
+        elif character == "(":
+            depth += 1
+        elif character == ")":
+            depth -= 1
+        elif character == "|" and depth == 0:
+            return None
+        index += 1
+    if pattern.startswith("^"):
+        pattern = pattern[1:]
+    literal_prefix = ""
+    for character in pattern:
+        if character in REGEX_SPECIAL_CHARACTERS:
+            if character in REGEX_QUANTIFIERS:
+                literal_prefix = literal_prefix[:-1]
+            break
+        literal_prefix += character
+    return literal_prefix
+
+
+def get_update_command(update: Update) -> Optional[str]:
+    """Finds the command of the update, as the CommandHandler does.
+
+    Args:
+        update (Update)
+
+    Returns:
+        Optional[str]: the lowercase command without the bot username, None if there is none
+    """
+    message = update.effective_message
+    if not message or not message.text or not message.entities:
+        return None
+    command_entity = message.entities[0]
+    if command_entity.type != MessageEntity.BOT_COMMAND or command_entity.offset != 0:
+        return None
+    return message.text[1:command_entity.length].split("@")[0].lower()
+
+
+def get_handler_name(handler: Handler, check_result: object) -> str:
+    """Returns the name of the function handling the update, used in the metrics.
+    For the ConversationHandlers, it is the one of the handler of the current state.
+
+    Args:
+        handler (Handler)
+        check_result (object): the result of the check_update of the handler
+
+    Returns:
+        str
+    """
+    if isinstance(handler, ConversationHandler) and isinstance(check_result, tuple) and len(check_result) == 3:
+        return get_handler_name(check_result[1], check_result[2])
+    callback = getattr(handler, "callback", None)
+    return getattr(callback, "__name__", type(handler).__name__)
+
+
+class _PrefixTrieNode:
+    __slots__ = ("children", "handlers")
+
+    def __init__(self):
+        self.children : Dict[str, "_PrefixTrieNode"] = {}
+        self.handlers : List[RoutedHandler] = []
+
+
+class UpdateRouter(Handler):
+    """Handler which routes each update to the first of its handlers matching it.
+    The handlers which cannot be routed (e.g. the ConversationHandlers) are checked for each update.
+    As the dispatcher does, the persistent ConversationHandlers are given the persistence.
+    """
+
+    __slots__ = (
+        "_handlers_count",
+        "_always_checked_handlers",
+        "_message_handlers",
+        "_message_handlers_by_chat_id",
+        "_command_handlers",
+        "_callback_query_handlers_trie",
+        "_pre_checkout_query_handlers",
+        "_candidates_cache",
+        "_persistence",
+    )
+
+    def __init__(self, persistence: BasePersistence = None):
+        super().__init__(callback=None)
+        self._persistence = persistence
+        self._handlers_count = 0
+        self._always_checked_handlers : List[RoutedHandler] = []
+        self._message_handlers : List[RoutedHandler] = []
+        self._message_handlers_by_chat_id : Dict[int, List[RoutedHandler]] = {}
+        self._command_handlers : Dict[str, List[RoutedHandler]] = {}
+        self._callback_query_handlers_trie = _PrefixTrieNode()
+        self._pre_checkout_query_handlers : List[RoutedHandler] = []
+        # * merged candidates, by route
+        self._candidates_cache : Dict[Hashable, List[Handler]] = {}
+
+    def add_handler(self, handler: Handler):
+        """Adds the handler, which will be checked after the ones already added.
+
+        Args:
+            handler (Handler)
+
+        Raises:
+            ValueError: if the handler is a persistent ConversationHandler and the router has no persistence
+        """
+        if isinstance(handler, ConversationHandler) and handler.persistent and handler.name:
+            if not self._persistence:
+                raise ValueError(f"ConversationHandler {handler.name} can not be persistent if the router has no persistence")
+            handler.persistence = self._persistence
+            handler.conversations = self._persistence.get_conversations(handler.name)
+        routed_handler = (self._handlers_count, handler)
+        self._handlers_count += 1
+        self._candidates_cache.clear()
+        if isinstance(handler, CommandHandler):
+            for command in handler.command:
+                self._command_handlers.setdefault(command, []).append(routed_handler)
+        elif isinstance(handler, MessageHandler):
+            chat_ids = get_filter_chat_ids(handler.filters)
+            if chat_ids is None:
+                self._message_handlers.append(routed_handler)
+            else:
+                for chat_id in chat_ids:
+                    self._message_handlers_by_chat_id.setdefault(chat_id, []).append(routed_handler)
+        elif isinstance(handler, CallbackQueryHandler):
+            trie_node = self._callback_query_handlers_trie
+            for character in get_pattern_literal_prefix(handler.pattern) or "":
+                trie_node = trie_node.children.setdefault(character, _PrefixTrieNode())
+            trie_node.handlers.append(routed_handler)
+        elif isinstance(handler, PreCheckoutQueryHandler):
+            self._pre_checkout_query_handlers.append(routed_handler)
+        else:
+            self._always_checked_handlers.append(routed_handler)
+
+    def _get_callback_query_route(self, callback_data: Optional[str]) -> Tuple[Hashable, List[List[RoutedHandler]]]:
+        trie_node = self._callback_query_handlers_trie
+        matched_nodes = [trie_node]
+        for character in callback_data or "":
+            trie_node = trie_node.children.get(character)
+            if trie_node is None:
+                break
+            if trie_node.handlers:
+                matched_nodes.append(trie_node)
+        # * the deepest matched node determines all the others
+        return ("callback_query", id(matched_nodes[-1])), [node.handlers for node in matched_nodes]
+
+    def _get_route(self, update: Update) -> Tuple[Hashable, List[List[RoutedHandler]]]:
+        if update.callback_query:
+            route_key, handlers_lists = self._get_callback_query_route(update.callback_query.data)
+        elif update.pre_checkout_query:
+            route_key, handlers_lists = "pre_checkout_query", [self._pre_checkout_query_handlers]
+        else:
+            route_key, handlers_lists = "other", []
+        # * CommandHandlers look at the effective message of any update
+        command = get_update_command(update)
+        if command in self._command_handlers:
+            route_key = (route_key, command)
+            handlers_lists.append(self._command_handlers[command])
+        if update.message or update.edited_message or update.channel_post or update.edited_channel_post:
+            chat_id = update.effective_chat.id if update.effective_chat else None
+            chat_handlers = self._message_handlers_by_chat_id.get(chat_id)
+            route_key = (route_key, "message", chat_id if chat_handlers else None)
+            handlers_lists.append(self._message_handlers)
+            if chat_handlers:
+                handlers_lists.append(chat_handlers)
+        handlers_lists.append(self._always_checked_handlers)
+        return route_key, handlers_lists
+
+    def get_candidates(self, update: Update) -> List[Handler]:
+        """Returns the handlers which can match the update, in the order in which they were added.
+
+        Args:
+            update (Update)
+
+        Returns:
+            List[Handler]
+        """
+        route_key, handlers_lists = self._get_route(update)
+        candidates = self._candidates_cache.get(route_key)
+        if candidates is None:
+            candidates = [handler for _, handler in heapq.merge(*handlers_lists, key=lambda routed_handler: routed_handler[0])]
+            self._candidates_cache[route_key] = candidates
+        return candidates
+
+    def check_update(self, update: object) -> Optional[Tuple[Handler, object]]:
+        if not isinstance(update, Update):
+            return None
+        for handler in self.get_candidates(update):
+            check_result = handler.check_update(update)
+            if check_result is not None and check_result is not False:
+                return handler, check_result
+        return None
+
+    def handle_update(self, update: Update, dispatcher, check_result: Tuple[Handler, object], context=None):
+        handler, handler_check_result = check_result
+        return metrics.measure_handler(
+            get_handler_name(handler, handler_check_result),
+            lambda: handler.handle_update(update, dispatcher, handler_check_result, context),
+        )
@@ -38,6 +38,17 @@ class Config(object):
     API_ID = None
     API_HASH = None
     BOT_TEST_USERNAME = None
+    # * webhook server mode
+    WEBHOOK_URL = None
+    WEBHOOK_LISTEN = "0.0.0.0"
+    WEBHOOK_PORT = 8443
+    WEBHOOK_PATH = "/webhook"
+    UPDATE_WORKERS = 4
+    UPDATE_QUEUE_SIZE = 1000
+    # * number of sharded sender worker processes, 0 to send the broadcasts from the bot process
+    SENDER_SHARDS = 0
+    # * if True, the giocate are sent to the users who engaged the most with the strategy first
+    ENGAGEMENT_ORDERED_FAN_OUT = False
 
 
 
@@ -128,6 +139,15 @@ def load_env_variables():
 
     config.WELCOME_DOCUMENT_FILE_ID = os.getenv("WELCOME_DOCUMENT_FILE_ID", "")
 
+    config.WEBHOOK_URL = os.getenv("WEBHOOK_URL", None)
+    config.WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", Config.WEBHOOK_LISTEN)
+    config.WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", Config.WEBHOOK_PORT))
+    config.WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", Config.WEBHOOK_PATH)
+    config.UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", Config.UPDATE_WORKERS))
+    config.UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", Config.UPDATE_QUEUE_SIZE))
+    config.SENDER_SHARDS = int(os.getenv("SENDER_SHARDS", Config.SENDER_SHARDS))
+    config.ENGAGEMENT_ORDERED_FAN_OUT = os.getenv("ENGAGEMENT_ORDERED_FAN_OUT", "false").lower() == "true"
+
 
 def create_config():
     """Creates the config object that will be used by all
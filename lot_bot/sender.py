@@ -0,0 +1,182 @@
+""" This module contains the rate-limited sender, which sends a message to many users
+concurrently, without exceeding the number of messages per second allowed by Telegram.
+All the senders of the process share the same rate limiter, which gives the tokens
+to the waiting messages by priority class.
+"""
+import dataclasses
+import enum
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, Unauthorized
+
+from lot_bot import constants as cst
+from lot_bot import logger as lgr
+
+
+class MessagePriority(enum.IntEnum):
+    """The priority classes of the outgoing messages, from the most urgent one."""
+    GIOCATA = 0
+    # * outcomes, cashouts and the other messages of the analysts
+    OUTCOME = 1
+    INTERACTIVE = 2
+    BROADCAST = 3
+    DEV_ALERT = 4
+
+
+class RateLimiter:
+    """Token bucket, refilled with rate tokens per second.
+    The tokens are given by strict priority, with aging: a waiting message gains
+    one priority class every aging_interval seconds, so that no class starves.
+    When Telegram answers with RetryAfter, no token is given until the requested time has passed.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, aging_interval: float = cst.PRIORITY_AGING_INTERVAL):
+        """
+        Args:
+            rate (float): the max number of tokens per second
+            burst (int, optional): the max number of tokens which can be taken at once. Defaults to 1.
+            aging_interval (float, optional): Defaults to cst.PRIORITY_AGING_INTERVAL.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.aging_interval = aging_interval
+        self._tokens = float(burst)
+        self._last_refill_time = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        # * heap of (deadline, arrival order): since all the waiters age at the same pace,
+        #   the one with the earliest arrival time + priority * aging_interval goes first
+        self._waiters = []
+        self._waiters_counter = itertools.count()
+
+    def acquire(self, priority: MessagePriority = MessagePriority.INTERACTIVE):
+        """Waits until a token is available and no message with a higher (aged) priority is waiting, then takes it.
+
+        Args:
+            priority (MessagePriority, optional): Defaults to MessagePriority.INTERACTIVE.
+        """
+        with self._condition:
+            waiter = (time.monotonic() + priority * self.aging_interval, next(self._waiters_counter))
+            heapq.heappush(self._waiters, waiter)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._tokens = min(self.burst, self._tokens + (now - self._last_refill_time) * self.rate)
+                    self._last_refill_time = now
+                    wait_time = self._paused_until - now
+                    if self._waiters[0] != waiter:
+                        # * the first waiter notifies the others once it takes its token
+                        wait_time = None
+                    elif wait_time <= 0:
+                        if self._tokens >= 1:
+                            self._tokens -= 1
+                            heapq.heappop(self._waiters)
+                            self._condition.notify_all()
+                            return
+                        wait_time = (1 - self._tokens) / self.rate
+                    self._condition.wait(wait_time)
+            except BaseException:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+                raise
+
+    def pause(self, seconds: float):
+        """Stops giving tokens for the specified seconds.
+
+        Args:
+            seconds (float)
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+@dataclasses.dataclass
+class SendResult:
+    sent_ids : List[int] = dataclasses.field(default_factory=list)
+    # * the users who blocked the bot
+    blocked_ids : List[int] = dataclasses.field(default_factory=list)
+    failed_ids : List[int] = dataclasses.field(default_factory=list)
+
+    def get_completed_count(self) -> int:
+        return len(self.sent_ids) + len(self.blocked_ids) + len(self.failed_ids)
+
+
+rate_limiter = RateLimiter(cst.MAX_MESSAGES_PER_SECOND)
+
+
+def _send_with_retries(user_id: int, send_message: Callable[[int], object], limiter: RateLimiter, max_attempts: int,
+        priority: MessagePriority) -> str:
+    for attempt in range(1, max_attempts + 1):
+        limiter.acquire(priority)
+        try:
+            send_message(user_id)
+            return "sent_ids"
+        except RetryAfter as e:
+            lgr.fan_out_logger.warning("Flood limit reached sending to %s, pausing for %s seconds", user_id, e.retry_after)
+            limiter.pause(e.retry_after)
+        except Unauthorized:
+            lgr.fan_out_logger.debug("Could not send message: user %s blocked the bot", user_id)
+            return "blocked_ids"
+        except BadRequest as e:
+            lgr.fan_out_logger.warning("Could not send message to user %s - %s", user_id, e)
+            return "failed_ids"
+        except NetworkError as e:
+            lgr.fan_out_logger.warning("Network error sending to user %s (attempt %s) - %s", user_id, attempt, e)
+        except Exception as e:
+            lgr.fan_out_logger.error("Could not send message to user %s - %s", user_id, e)
+            return "failed_ids"
+    return "failed_ids"
+
+
+def send_to_users(user_ids: Iterable[int], send_message: Callable[[int], object], limiter: RateLimiter = None,
+        num_of_workers: int = cst.SENDER_WORKERS, max_attempts: int = cst.MAX_SEND_ATTEMPTS,
+        report_progress: Callable[[SendResult], None] = None, progress_interval: float = cst.SEND_PROGRESS_INTERVAL,
+        priority: MessagePriority = MessagePriority.BROADCAST) -> SendResult:
+    """Sends a message to each user, using a pool of workers which share the rate limiter.
+    The sends failed because of the flood limit or of network errors are retried.
+
+    Args:
+        user_ids (Iterable[int])
+        send_message (Callable[[int], object]): the function sending the message to the user ID
+        limiter (RateLimiter, optional): Defaults to the rate limiter of the process.
+        num_of_workers (int, optional): Defaults to cst.SENDER_WORKERS.
+        max_attempts (int, optional): Defaults to cst.MAX_SEND_ATTEMPTS.
+        report_progress (Callable[[SendResult], None], optional): called with a copy of the partial result
+            at most once every progress_interval seconds. Defaults to None.
+        progress_interval (float, optional): Defaults to cst.SEND_PROGRESS_INTERVAL.
+        priority (MessagePriority, optional): Defaults to MessagePriority.BROADCAST.
+
+    Returns:
+        SendResult
+    """
+    limiter = limiter or rate_limiter
+    result = SendResult()
+    result_lock = threading.Lock()
+    last_report_time = time.monotonic()
+
+    def send(user_id: int):
+        nonlocal last_report_time
+        outcome = _send_with_retries(user_id, send_message, limiter, max_attempts, priority)
+        partial_result = None
+        with result_lock:
+            getattr(result, outcome).append(user_id)
+            if report_progress and time.monotonic() - last_report_time >= progress_interval:
+                last_report_time = time.monotonic()
+                partial_result = SendResult(list(result.sent_ids), list(result.blocked_ids), list(result.failed_ids))
+        if partial_result:
+            try:
+                report_progress(partial_result)
+            except Exception as e:
+                lgr.logger.warning(f"Could not report the sending progress - {str(e)}")
+
+    with ThreadPoolExecutor(max_workers=num_of_workers, thread_name_prefix="sender") as executor:
+        list(executor.map(send, user_ids))
+    return result
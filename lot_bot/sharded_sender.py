@@ -0,0 +1,404 @@
+""" This module contains the sharded sender, which sends the broadcasts from several worker
+processes, on one or more hosts, so that the sending is not bound to the GIL of the bot process.
+The recipients of a broadcast are partitioned by user ID hash into shards, each of which
+becomes a send job on the db, claimed with a lease by the worker of that shard.
+The workers split the global rate budget among the ones holding a live lease on it.
+"""
+import datetime
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+from telegram import Bot
+from telegram.utils.request import Request
+
+from lot_bot import config as cfg
+from lot_bot import constants as cst
+from lot_bot import database as db
+from lot_bot import logger as lgr
+from lot_bot import metrics
+from lot_bot import sender
+from lot_bot.dao import send_jobs_manager
+from lot_bot.models import segments
+
+# * the Bot methods which can be used by the send jobs, called with the user ID as first argument
+SEND_METHODS = {"send_message", "copy_message"}
+SEND_COUNTS_FIELDS = {"sent_ids": "sent_count", "blocked_ids": "blocked_count", "failed_ids": "failed_count"}
+
+
+def get_user_shard(user_id: int, num_of_shards: int) -> int:
+    return zlib.crc32(str(user_id).encode()) % num_of_shards
+
+
+def create_send_jobs_data(broadcast_id: str, user_ids: Iterable[int], num_of_shards: int, method: str, method_kwargs: Dict,
+        created_at: float, status_chat_id: int = None, status_message_id: int = None, status_text: str = "") -> List[Dict]:
+    """Creates a send job for each shard with at least one of the users.
+    The first job is the one recording that the completion of the broadcast was reported.
+
+    Args:
+        broadcast_id (str)
+        user_ids (Iterable[int])
+        num_of_shards (int)
+        method (str): one of SEND_METHODS
+        method_kwargs (Dict): the arguments of the method, besides the user ID
+        created_at (float)
+        status_chat_id (int, optional): the chat of the message updated with the progress. Defaults to None.
+        status_message_id (int, optional): the message updated with the progress. Defaults to None.
+        status_text (str, optional): the text of the status message. Defaults to "".
+
+    Raises:
+        ValueError: if the method is not one of SEND_METHODS
+
+    Returns:
+        List[Dict]
+    """
+    if method not in SEND_METHODS:
+        raise ValueError(f"{method} cannot be used to send a broadcast")
+    shards_user_ids = [[] for _ in range(num_of_shards)]
+    for user_id in user_ids:
+        shards_user_ids[get_user_shard(user_id, num_of_shards)].append(user_id)
+    send_jobs_data = []
+    for shard, shard_user_ids in enumerate(shards_user_ids):
+        if not shard_user_ids:
+            continue
+        send_jobs_data.append({
+            "broadcast_id": broadcast_id,
+            "shard": shard,
+            "user_ids": segments.pack_ids(shard_user_ids),
+            "size": len(shard_user_ids),
+            "next_index": 0,
+            "method": method,
+            "method_kwargs": method_kwargs,
+            "status": send_jobs_manager.PENDING_STATUS,
+            "claimed_by": None,
+            "lease_expires_at": 0,
+            "created_at": created_at,
+            "sent_count": 0,
+            "blocked_count": 0,
+            "failed_count": 0,
+            "status_chat_id": status_chat_id,
+            "status_message_id": status_message_id,
+            "status_text": status_text,
+            "reports_completion": not send_jobs_data,
+        })
+    return send_jobs_data
+
+
+def enqueue_broadcast(user_ids: Iterable[int], method: str, method_kwargs: Dict, num_of_shards: int,
+        status_chat_id: int = None, status_message_id: int = None, status_text: str = "") -> str:
+    """Enqueues the broadcast as one send job per shard, which the sender workers will claim.
+
+    Args:
+        user_ids (Iterable[int])
+        method (str): one of SEND_METHODS
+        method_kwargs (Dict): the arguments of the method, besides the user ID
+        num_of_shards (int)
+        status_chat_id (int, optional): see create_send_jobs_data. Defaults to None.
+        status_message_id (int, optional): see create_send_jobs_data. Defaults to None.
+        status_text (str, optional): see create_send_jobs_data. Defaults to "".
+
+    Returns:
+        str: the broadcast ID
+    """
+    broadcast_id = uuid.uuid4().hex
+    send_jobs_data = create_send_jobs_data(
+        broadcast_id, user_ids, num_of_shards, method, method_kwargs, datetime.datetime.utcnow().timestamp(),
+        status_chat_id=status_chat_id, status_message_id=status_message_id, status_text=status_text,
+    )
+    if send_jobs_data:
+        send_jobs_manager.create_send_jobs(send_jobs_data)
+    return broadcast_id
+
+
+def report_broadcast_progress(bot: Bot, broadcast_id: str):
+    """Updates the status message of the broadcast with the progress of all its shards,
+    or reports its completion, once, when all the shards are done.
+
+    Args:
+        bot (Bot)
+        broadcast_id (str)
+    """
+    send_jobs = send_jobs_manager.retrieve_broadcast_send_jobs(broadcast_id)
+    if not send_jobs or send_jobs[0]["status_chat_id"] is None:
+        return
+    counts = {count_field: sum(send_job[count_field] for send_job in send_jobs) for count_field in SEND_COUNTS_FIELDS.values()}
+    status_chat_id = send_jobs[0]["status_chat_id"]
+    if all(send_job["status"] == send_jobs_manager.DONE_STATUS for send_job in send_jobs):
+        if send_jobs_manager.register_broadcast_completion_report(broadcast_id):
+            bot.send_message(
+                status_chat_id,
+                cst.BROADCAST_COMPLETED_MESSAGE.format(counts["sent_count"], counts["blocked_count"], counts["failed_count"]),
+            )
+        return
+    bot.edit_message_text(
+        cst.BROADCAST_PROGRESS_MESSAGE.format(send_jobs[0]["status_text"], sum(counts.values()), sum(send_job["size"] for send_job in send_jobs)),
+        chat_id=status_chat_id,
+        message_id=send_jobs[0]["status_message_id"],
+    )
+
+
+class SharedRateLimiter(sender.RateLimiter):
+    """Rate limiter of a sender worker or of an instance of the bot, whose rate is its share
+    of the global rate budget, i.e. the global rate divided by the number of processes
+    holding a live lease on it.
+    The lease is refreshed while tokens are taken, and the flood limit pauses are shared
+    through the rate budget document as well.
+    The priority classes are shared too: while a process sends giocate or outcomes, it extends
+    the priority period of the rate budget, during which the sender workers (which yield to priority)
+    do not send and the other processes split the global rate among themselves.
+    """
+
+    def __init__(self, worker_id: str, global_rate: float = cst.MAX_MESSAGES_PER_SECOND,
+            lease_duration: float = cst.RATE_BUDGET_LEASE_DURATION, refresh_interval: float = cst.RATE_BUDGET_REFRESH_INTERVAL,
+            yields_to_priority: bool = False, priority_duration: float = cst.RATE_BUDGET_PRIORITY_DURATION):
+        """
+        Args:
+            worker_id (str)
+            global_rate (float, optional): the max number of messages per second of all the workers. Defaults to cst.MAX_MESSAGES_PER_SECOND.
+            lease_duration (float, optional): Defaults to cst.RATE_BUDGET_LEASE_DURATION.
+            refresh_interval (float, optional): Defaults to cst.RATE_BUDGET_REFRESH_INTERVAL.
+            yields_to_priority (bool, optional): True for the sender workers, which only send broadcasts. Defaults to False.
+            priority_duration (float, optional): how long the priority period lasts after the last
+                giocata or outcome. Defaults to cst.RATE_BUDGET_PRIORITY_DURATION.
+        """
+        super().__init__(global_rate)
+        self.worker_id = worker_id
+        self.global_rate = global_rate
+        self.lease_duration = lease_duration
+        self.refresh_interval = refresh_interval
+        self.yields_to_priority = yields_to_priority
+        self.priority_duration = priority_duration
+        self._last_lease_refresh_time = float("-inf")
+        self._expired_worker_ids = []
+        self._published_priority_until = 0.0
+        # * the start of the current priority period, as seen by this process
+        self._priority_started_at = None
+        self._refresh_lock = threading.Lock()
+
+    def refresh_lease(self, paused_until: float = 0, priority_until: float = 0) -> float:
+        """Extends the worker's lease on the rate budget and updates the worker's rate.
+
+        Args:
+            paused_until (float, optional): the timestamp until which all the workers have to pause. Defaults to 0.
+            priority_until (float, optional): the timestamp until which the workers which yield to priority
+                must not send. Defaults to 0.
+
+        Returns:
+            float: the worker's rate
+        """
+        now = time.time()
+        rate_budget = send_jobs_manager.refresh_rate_budget_lease(self.worker_id, now + self.lease_duration, self._expired_worker_ids,
+            paused_until, yields_to_priority=self.yields_to_priority, priority_until=priority_until)
+        self._published_priority_until = max(self._published_priority_until, priority_until)
+        leases = rate_budget.get("leases", {})
+        self._expired_worker_ids = [worker_id for worker_id, lease_expires_at in leases.items() if lease_expires_at <= now]
+        live_worker_ids = [worker_id for worker_id in leases if worker_id not in self._expired_worker_ids]
+        priority_until = rate_budget.get("priority_until", 0)
+        if priority_until <= now:
+            self._priority_started_at = None
+        elif self._priority_started_at is None:
+            self._priority_started_at = now
+        # * the yielding workers are known to have stopped only once they all refreshed their lease
+        if self._priority_started_at is not None and now - self._priority_started_at >= self.refresh_interval:
+            yielding_worker_ids = rate_budget.get("yielding_workers", {})
+            live_worker_ids = [worker_id for worker_id in live_worker_ids if worker_id not in yielding_worker_ids]
+        with self._lock:
+            self.rate = self.global_rate / max(len(live_worker_ids), 1)
+        self._last_lease_refresh_time = time.monotonic()
+        pause_time = rate_budget.get("paused_until", 0) - now
+        if self.yields_to_priority:
+            pause_time = max(pause_time, priority_until - now)
+        if pause_time > 0:
+            super().pause(pause_time)
+        return self.rate
+
+    def acquire(self, priority: sender.MessagePriority = sender.MessagePriority.INTERACTIVE):
+        now = time.time()
+        # * the priority period is extended before it is about to end
+        claims_priority = priority <= sender.MessagePriority.OUTCOME and self._published_priority_until - now < self.priority_duration / 2
+        if (claims_priority or time.monotonic() - self._last_lease_refresh_time >= self.refresh_interval) and self._refresh_lock.acquire(blocking=False):
+            try:
+                self.refresh_lease(priority_until=now + self.priority_duration if claims_priority else 0)
+            except Exception as e:
+                # * the last known share is kept
+                lgr.logger.warning(f"Could not refresh the rate budget lease of {self.worker_id} - {str(e)}")
+            finally:
+                self._refresh_lock.release()
+        super().acquire(priority)
+
+    def pause(self, seconds: float):
+        super().pause(seconds)
+        try:
+            self.refresh_lease(time.time() + seconds)
+        except Exception as e:
+            lgr.logger.warning(f"Could not share the pause of {self.worker_id} - {str(e)}")
+
+    def release_lease(self):
+        send_jobs_manager.delete_rate_budget_lease(self.worker_id)
+
+
+def create_worker_id(shard: int) -> str:
+    # * the dots would be interpreted as nested fields by the db
+    return f"{socket.gethostname()}-{os.getpid()}-{shard}".replace(".", "_")
+
+
+def create_bot_process_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-bot".replace(".", "_")
+
+
+def share_rate_budget_with_workers():
+    """Replaces the rate limiter of the bot's process with one taking its share of the global
+    rate budget, so that the giocate, the outcomes and the replies sent by the bot and the
+    broadcasts sent by the sender workers do not exceed the global rate together."""
+    sender.rate_limiter = SharedRateLimiter(create_bot_process_id())
+
+
+class SenderWorker:
+    """Claims the send jobs of its shard and sends them, in chunks, through a pool of threads.
+    After each chunk, the progress is recorded; the lease on the job is extended periodically
+    while the job is sent, since a chunk can take longer than the lease (e.g. with a small
+    share of the rate budget or after a flood limit pause).
+    If the worker stops, another worker of the same shard resumes the job from the last
+    recorded chunk once the lease has expired.
+    """
+
+    def __init__(self, bot: Bot, shard: int, worker_id: str = None, limiter: sender.RateLimiter = None,
+            chunk_size: int = cst.SEND_JOB_CHUNK_SIZE, lease_duration: float = cst.SEND_JOB_LEASE_DURATION,
+            poll_interval: float = cst.SEND_JOBS_POLL_INTERVAL, progress_interval: float = cst.SEND_PROGRESS_INTERVAL):
+        self.bot = bot
+        self.shard = shard
+        self.worker_id = worker_id or create_worker_id(shard)
+        self.limiter = limiter or SharedRateLimiter(self.worker_id, yields_to_priority=True)
+        self.chunk_size = chunk_size
+        self.lease_duration = lease_duration
+        self.poll_interval = poll_interval
+        self.progress_interval = progress_interval
+
+    def _report_progress(self, broadcast_id: str):
+        try:
+            report_broadcast_progress(self.bot, broadcast_id)
+        except Exception as e:
+            lgr.logger.warning(f"Could not report the progress of broadcast {broadcast_id} - {str(e)}")
+
+    def _keep_job_lease(self, job_id, stop_event: threading.Event, claim_lost_event: threading.Event):
+        while not stop_event.wait(self.lease_duration / 3):
+            try:
+                if not send_jobs_manager.extend_send_job_lease(job_id, self.worker_id, time.time() + self.lease_duration):
+                    claim_lost_event.set()
+                    return
+            except Exception as e:
+                lgr.logger.warning(f"Could not extend the lease of send job {job_id} - {str(e)}")
+
+    def process_job(self, send_job: Dict) -> bool:
+        """Sends the job's message to its remaining users.
+
+        Args:
+            send_job (Dict)
+
+        Returns:
+            bool: True if the job was completed, False if the worker lost its claim
+        """
+        send_method = getattr(self.bot, send_job["method"])
+        method_kwargs = send_job["method_kwargs"]
+        user_ids = segments.unpack_ids(send_job["user_ids"])
+        lgr.logger.info(f"Sender worker {self.worker_id} sending broadcast {send_job['broadcast_id']} to {len(user_ids) - send_job['next_index']} users")
+        last_report_time = time.monotonic()
+        stop_lease_event, claim_lost_event = threading.Event(), threading.Event()
+
+        def send_to_user(user_id: int):
+            # * once the claim is lost, the job is resumed by another worker
+            if not claim_lost_event.is_set():
+                send_method(user_id, **method_kwargs)
+
+        lease_thread = threading.Thread(target=self._keep_job_lease, args=(send_job["_id"], stop_lease_event, claim_lost_event), daemon=True)
+        lease_thread.start()
+        try:
+            for chunk_start in range(send_job["next_index"], len(user_ids), self.chunk_size):
+                chunk_end = min(chunk_start + self.chunk_size, len(user_ids))
+                send_result = sender.send_to_users(user_ids[chunk_start:chunk_end], send_to_user, limiter=self.limiter)
+                counts_increments = {count_field: len(getattr(send_result, result_field)) for result_field, count_field in SEND_COUNTS_FIELDS.items()}
+                if claim_lost_event.is_set() or not send_jobs_manager.update_send_job_progress(
+                        send_job["_id"], self.worker_id, chunk_end, counts_increments, time.time() + self.lease_duration):
+                    lgr.logger.warning(f"Sender worker {self.worker_id} lost the claim of send job {send_job['_id']}")
+                    return False
+                if time.monotonic() - last_report_time >= self.progress_interval:
+                    last_report_time = time.monotonic()
+                    self._report_progress(send_job["broadcast_id"])
+        finally:
+            stop_lease_event.set()
+            lease_thread.join()
+        if not send_jobs_manager.complete_send_job(send_job["_id"], self.worker_id):
+            lgr.logger.warning(f"Sender worker {self.worker_id} lost the claim of send job {send_job['_id']}")
+            return False
+        self._report_progress(send_job["broadcast_id"])
+        return True
+
+    def claim_and_process_job(self) -> bool:
+        """Claims a send job of the shard and processes it.
+
+        Returns:
+            bool: True if a job was claimed, False otherwise
+        """
+        now = time.time()
+        send_job = send_jobs_manager.claim_send_job(self.shard, self.worker_id, now, now + self.lease_duration)
+        if send_job is None:
+            return False
+        self.process_job(send_job)
+        return True
+
+    def run(self, stop_event: Optional[threading.Event] = None):
+        """Processes the send jobs of the shard until stop_event is set.
+
+        Args:
+            stop_event (Optional[threading.Event], optional): Defaults to None.
+        """
+        stop_event = stop_event or threading.Event()
+        try:
+            while not stop_event.is_set():
+                try:
+                    if self.claim_and_process_job():
+                        continue
+                except Exception as e:
+                    lgr.logger.error(f"Error in sender worker {self.worker_id} - {str(e)}")
+                stop_event.wait(self.poll_interval)
+        finally:
+            if isinstance(self.limiter, SharedRateLimiter):
+                self.limiter.release_lease()
+
+
+def run_sender_worker(shard: int):
+    """Entry point of the sender worker process of the shard."""
+    cfg.create_config()
+    lgr.create_logger()
+    db.create_db()
+    worker_bot = metrics.InstrumentedBot(token=cfg.config.TOKEN, request=Request(con_pool_size=cst.SENDER_WORKERS + 1))
+    lgr.logger.info(f"Starting sender worker of shard {shard}")
+    try:
+        SenderWorker(worker_bot, shard).run()
+    except KeyboardInterrupt:
+        lgr.logger.info(f"Stopped sender worker of shard {shard}")
+
+
+def run_sender_workers(shards: Iterable[int]):
+    """Runs a sender worker process for each of the shards, until they are interrupted.
+    Each shard must be run by at least one worker, either on this host or on another one.
+
+    Args:
+        shards (Iterable[int])
+    """
+    # * spawn, so that each process opens its own db and Telegram connections
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_sender_worker, args=(shard,), name=f"sender-{shard}") for shard in shards]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
@@ -0,0 +1,127 @@
+""" This module is used to profile the startup of the bot: the import time of
+each module, measured by a fresh interpreter run with -X importtime, and the
+time spent creating the config, the logger, the db and the bot.
+"""
+import dataclasses
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+# * import time:  self [us] | cumulative | imported package
+IMPORT_TIME_LINE_REGEX = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclasses.dataclass(frozen=True)
+class ImportTime:
+    module_name : str
+    # * microseconds
+    self_time : int
+    cumulative_time : int
+    # * 0 for the modules imported directly by the profiled one
+    depth : int
+
+
+@dataclasses.dataclass(frozen=True)
+class StepTime:
+    name : str
+    # * seconds
+    elapsed_time : float
+    error : Optional[str] = None
+
+
+def parse_import_times(importtime_output: str) -> List[ImportTime]:
+    """Parses the output produced by the interpreter when run with -X importtime.
+
+    Args:
+        importtime_output (str)
+
+    Returns:
+        List[ImportTime]: the import times, in the order in which the imports were completed
+    """
+    import_times = []
+    for line in importtime_output.splitlines():
+        match = IMPORT_TIME_LINE_REGEX.match(line)
+        if not match:
+            continue
+        self_time, cumulative_time, indentation, module_name = match.groups()
+        import_times.append(ImportTime(module_name, int(self_time), int(cumulative_time), (len(indentation) - 1) // 2))
+    return import_times
+
+
+def profile_imports(module_name: str = "main") -> List[ImportTime]:
+    """Imports the module in a fresh interpreter, so that no module is already imported,
+    and measures the import time of each module.
+
+    Args:
+        module_name (str, optional): Defaults to "main".
+
+    Raises:
+        Exception: if the import fails
+
+    Returns:
+        List[ImportTime]
+    """
+    completed_process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        cwd=PROJECT_ROOT,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if completed_process.returncode != 0:
+        raise Exception(f"Error importing {module_name}: {completed_process.stderr[-1000:]}")
+    return parse_import_times(completed_process.stderr)
+
+
+def profile_startup_steps(steps: Sequence[Tuple[str, Callable[[], None]]]) -> List[StepTime]:
+    """Runs the startup steps in order, measuring each one of them.
+    The steps following a failed one are not run.
+
+    Args:
+        steps (Sequence[Tuple[str, Callable[[], None]]]): the name and the function of each step
+
+    Returns:
+        List[StepTime]
+    """
+    step_times = []
+    for step_name, step_function in steps:
+        start_time = time.perf_counter()
+        try:
+            step_function()
+        except Exception as e:
+            step_times.append(StepTime(step_name, time.perf_counter() - start_time, str(e)))
+            break
+        step_times.append(StepTime(step_name, time.perf_counter() - start_time))
+    return step_times
+
+
+def create_startup_report(import_times: List[ImportTime], step_times: List[StepTime], max_modules: int = 30) -> str:
+    """Creates the startup report: the total import time, the slowest modules
+    by cumulative and by self import time, and the time of each startup step.
+
+    Args:
+        import_times (List[ImportTime])
+        step_times (List[StepTime])
+        max_modules (int, optional): the number of modules listed for each ranking. Defaults to 30.
+
+    Returns:
+        str
+    """
+    total_import_time = sum(import_time.cumulative_time for import_time in import_times if import_time.depth == 0)
+    report_lines = [f"Total import time: {total_import_time / 1000:.1f} ms ({len(import_times)} modules)", ""]
+    report_lines.append("Slowest modules by cumulative import time (ms):")
+    for import_time in sorted(import_times, key=lambda import_time: import_time.cumulative_time, reverse=True)[:max_modules]:
+        report_lines.append(f"{import_time.cumulative_time / 1000:>10.1f}  {import_time.module_name}")
+    report_lines.extend(["", "Slowest modules by self import time (ms):"])
+    for import_time in sorted(import_times, key=lambda import_time: import_time.self_time, reverse=True)[:max_modules]:
+        report_lines.append(f"{import_time.self_time / 1000:>10.1f}  {import_time.module_name}")
+    report_lines.extend(["", "Startup steps (ms):"])
+    for step_time in step_times:
+        step_line = f"{step_time.elapsed_time * 1000:>10.1f}  {step_time.name}"
+        if step_time.error:
+            step_line += f" - FAILED: {step_time.error}"
+        report_lines.append(step_line)
+    return "\n".join(report_lines)
@@ -0,0 +1,58 @@
+""" This module is used to drop the updates which Telegram sends more than once,
+for instance when a webhook request takes too long to be answered.
+The recently received update_ids are kept in a bounded in-memory set and
+in a TTL collection, shared among the instances of the bot.
+"""
+import collections
+import threading
+
+from lot_bot import logger as lgr
+from lot_bot.dao import updates_manager
+
+MAX_SEEN_UPDATE_IDS = 10000
+
+_seen_update_ids : "collections.OrderedDict[int, None]" = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def is_duplicate_update(update_id: int) -> bool:
+    """Checks if the update was already received, registering it otherwise.
+    In case of db errors, only the in-memory set is used.
+
+    Args:
+        update_id (int)
+
+    Returns:
+        bool: True if the update was already received and has to be dropped
+    """
+    with _lock:
+        if update_id in _seen_update_ids:
+            return True
+        _seen_update_ids[update_id] = None
+        while len(_seen_update_ids) > MAX_SEEN_UPDATE_IDS:
+            _seen_update_ids.popitem(last=False)
+    try:
+        return not updates_manager.register_update_id(update_id)
+    except Exception as e:
+        lgr.logger.warning(f"Cannot check update {update_id} on db, using the local set only - {str(e)}")
+        return False
+
+
+def forget_update(update_id: int):
+    """Forgets the update, so that it is accepted again when Telegram resends it.
+    Used when the processing of the update failed on the cloud function, whose request then fails.
+
+    Args:
+        update_id (int)
+    """
+    with _lock:
+        _seen_update_ids.pop(update_id, None)
+    try:
+        updates_manager.delete_update_id(update_id)
+    except Exception as e:
+        lgr.logger.warning(f"Cannot forget update {update_id} on db - {str(e)}")
+
+
+def clear_seen_updates():
+    with _lock:
+        _seen_update_ids.clear()
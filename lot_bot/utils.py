@@ -1,6 +1,8 @@
 import datetime
+import itertools
+import math
 import re
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from lot_bot import config as cfg
 from lot_bot import custom_exceptions, filters
@@ -94,8 +96,19 @@ def parse_float_string_to_int(float_string: str) -> int:
         raise e
 
 
-def create_resoconto_message(giocate: List[Dict], user_giocate_data_dict: Dict) -> str:
-    """Creates the resoconto message, given the base giocate and adding additional personalized
+# * sport data used in every line of the resoconto, in the form of {sport_name: (display_name, outcome_percentage_in_resoconto)}
+_RESOCONTO_SPORTS_DATA = {sport.name: (sport.display_name, sport.outcome_percentage_in_resoconto) for sport in spr.sports_container}
+
+
+def _get_resoconto_sport_data(sport_name: str) -> Tuple[str, bool]:
+    if sport_name in _RESOCONTO_SPORTS_DATA:
+        return _RESOCONTO_SPORTS_DATA[sport_name]
+    sport = spr.sports_container.get_sport(sport_name)
+    return sport.display_name, sport.outcome_percentage_in_resoconto
+
+
+def create_resoconto_lines(giocate: List[Dict], user_giocate_data_dict: Dict) -> Iterator[str]:
+    """Yields the lines of the resoconto message, given the base giocate and adding additional personalized
     stake data if any.
     Base structure:
         <index>) <Sport>#<giocata_num> @<Quota> Stake <(personalized) stake> = <outcome percentage>% 
@@ -106,15 +119,13 @@ def create_resoconto_message(giocate: List[Dict], user_giocate_data_dict: Dict)
         giocate (List[Dict])
         user_giocate_data_dict (Dict): user giocate for the personalized stakes
 
-    Returns:
-        str: the resoconto message
+    Yields:
+        str: the resoconto line of each giocata, newline included
     """
-    lgr.logger.debug(f"Creating resoconto with giocate {giocate}")
-    resoconto_message = ""
     for index, giocata in enumerate(giocate, 1):
         user_giocata = user_giocate_data_dict[giocata["_id"]]
         stake_section = ""
-        sport = spr.sports_container.get_sport(giocata['sport'])
+        sport_display_name, outcome_percentage_in_resoconto = _get_resoconto_sport_data(giocata["sport"])
         if "base_stake" in giocata:
             stake = giocata["base_stake"]
             # * check for a personalized stake
@@ -124,7 +135,7 @@ def create_resoconto_message(giocate: List[Dict], user_giocate_data_dict: Dict)
             parsed_stake = stake / 100
             stake_section = f"Stake {parsed_stake:.2f}%"
         # * get outcome percentage
-        if sport.outcome_percentage_in_resoconto:
+        if outcome_percentage_in_resoconto:
             outcome_percentage = giocata_model.get_outcome_percentage(giocata["outcome"], stake, giocata["base_quota"])
             outcome_percentage_string = f" = {outcome_percentage:.2f}%"
             if "pre_giocata_budget" in user_giocata:
@@ -143,8 +154,121 @@ def create_resoconto_message(giocate: List[Dict], user_giocate_data_dict: Dict)
         if "base_quota" in giocata:
             parsed_quota = giocata["base_quota"] / 100
             quota_section = f"@{parsed_quota:.2f} "
-        resoconto_message += f"{index}) {sport.display_name} #{giocata['giocata_num']}: {quota_section}{stake_section}{outcome_percentage_string}{outcome_emoji}\n"
-    return resoconto_message
+        yield f"{index}) {sport_display_name} #{giocata['giocata_num']}: {quota_section}{stake_section}{outcome_percentage_string}{outcome_emoji}\n"
+
+
+def create_resoconto_message(giocate: List[Dict], user_giocate_data_dict: Dict) -> str:
+    """Creates the resoconto message, given the base giocate and adding additional personalized
+    stake data if any. See create_resoconto_lines for the structure of each line.
+
+    Args:
+        giocate (List[Dict])
+        user_giocate_data_dict (Dict): user giocate for the personalized stakes
+
+    Returns:
+        str: the resoconto message
+    """
+    return "".join(create_resoconto_lines(giocate, user_giocate_data_dict))
+
+
+def create_duration_text(seconds: float) -> str:
+    """Creates the text of a duration, in seconds if it is shorter than a minute,
+    in minutes (rounded up) otherwise.
+
+    Args:
+        seconds (float)
+
+    Returns:
+        str
+    """
+    if seconds < 60:
+        return f"{math.ceil(seconds)} secondi"
+    return f"{math.ceil(seconds / 60)} minuti"
+
+
+def get_telegram_length(text: str) -> int:
+    """Returns the length of the text as measured by Telegram, in UTF-16 code units,
+    where the characters outside the BMP (e.g. most emojis) count as 2.
+
+    Args:
+        text (str)
+
+    Returns:
+        int
+    """
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _split_long_line(line: str, max_length: int) -> Iterator[str]:
+    """Splits the line in chunks no longer than max_length (in UTF-16 code units),
+    never splitting a character.
+
+    Args:
+        line (str)
+        max_length (int)
+
+    Yields:
+        str: the chunks
+    """
+    chunk_start = 0
+    chunk_length = 0
+    for index, char in enumerate(line):
+        char_length = 2 if ord(char) > 0xFFFF else 1
+        if chunk_length + char_length > max_length:
+            yield line[chunk_start:index]
+            chunk_start = index
+            chunk_length = 0
+        chunk_length += char_length
+    yield line[chunk_start:]
+
+
+def split_lines_in_messages(lines: Iterable[str], header: str = "", max_length: int = cst.MAX_MESSAGE_LENGTH) -> Iterator[str]:
+    """Groups the lines in messages no longer than max_length, splitting them only on line boundaries.
+    The length is measured in UTF-16 code units, as Telegram does.
+    The header is placed at the beginning of the first message.
+    Lines longer than max_length on their own are split in more messages.
+
+    Args:
+        lines (Iterable[str]): the lines of the messages, each one ending with a newline
+        header (str, optional): the first line of the first message. Defaults to "".
+        max_length (int, optional): the max length of each message. Defaults to cst.MAX_MESSAGE_LENGTH.
+
+    Yields:
+        str: the messages
+    """
+    message_lines = []
+    message_length = 0
+    if header:
+        lines = itertools.chain((header + "\n",), lines)
+    for line in lines:
+        line_length = get_telegram_length(line)
+        if message_length + line_length > max_length and message_lines:
+            yield "".join(message_lines)
+            message_lines = []
+            message_length = 0
+        if line_length > max_length:
+            *line_chunks, line = _split_long_line(line, max_length)
+            yield from line_chunks
+            line_length = get_telegram_length(line)
+        message_lines.append(line)
+        message_length += line_length
+    if message_lines:
+        yield "".join(message_lines)
+
+
+def create_resoconto_messages(giocate: List[Dict], user_giocate_data_dict: Dict, header: str = "", max_length: int = cst.MAX_MESSAGE_LENGTH) -> Iterator[str]:
+    """Creates the resoconto message split in chunks which can be sent as single Telegram messages.
+
+    Args:
+        giocate (List[Dict])
+        user_giocate_data_dict (Dict): user giocate for the personalized stakes
+        header (str, optional): the header of the resoconto. Defaults to "".
+        max_length (int, optional): the max length of each message. Defaults to cst.MAX_MESSAGE_LENGTH.
+
+    Yields:
+        str: the resoconto messages
+    """
+    yield from split_lines_in_messages(create_resoconto_lines(giocate, user_giocate_data_dict), header=header, max_length=max_length)
 
 
 def get_sport_and_strategy_from_normal_message(message_first_row: str) -> Tuple[spr.Sport, Optional[strat.Strategy]]:
@@ -173,7 +297,7 @@ def get_sport_and_strategy_from_normal_message(message_first_row: str) -> Tuple[
     strategy_token = matches.group(2)
     strategy = strat.strategies_container.get_strategy(strategy_token)
     # * check that a strategy has been found and if it is valid
-    if strategy and strategy not in sport.strategies:
+    if strategy and not sport.has_strategy(strategy):
         lgr.logger.error(f"Strategy {strategy_token} not valid from {message_first_row=}")
         raise custom_exceptions.NormalMessageParsingError(f"strategia '{strategy_token}' non valida per lo sport '{sport_token}'")
     return sport, strategy
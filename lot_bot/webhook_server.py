@@ -0,0 +1,255 @@
+""" This module contains the long-lived webhook server, which acknowledges each
+Telegram update as soon as it is received and enqueues it, so that it is
+processed by a pool of workers.
+The updates already received are dropped by the workers, so that the db
+check does not block the server's IOLoop.
+Each chat is always assigned to the same worker, hence the updates of a chat
+are processed in the order in which they were received.
+"""
+import collections
+import json
+import queue
+import threading
+import time
+from typing import Callable, Deque, Dict, List, Optional
+
+import tornado.ioloop
+import tornado.web
+from telegram import Bot, Update
+
+from lot_bot import logger as lgr
+from lot_bot import metrics
+from lot_bot import update_deduplicator
+
+# * max number of latencies used to compute the processing latency statistics
+LATENCY_SAMPLES_SIZE = 1000
+
+
+def get_update_chat_id(update: Update) -> int:
+    """Returns the ID used to assign the update to a worker: the chat's one,
+    the user's one if there is no chat, the update's one otherwise.
+
+    Args:
+        update (Update)
+
+    Returns:
+        int
+    """
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return update.update_id
+
+
+class UpdateQueue:
+    """Bounded queue of updates, processed by a pool of workers.
+    Each worker has its own queue and each chat is assigned to a single worker,
+    so that the updates of the same chat are never processed concurrently nor out of order.
+    The updates already received are dropped before being processed.
+    """
+
+    def __init__(self, process_update: Callable[[Update], None], num_of_workers: int = 4, max_size: int = 1000):
+        """
+        Args:
+            process_update (Callable[[Update], None]): the function processing each update
+            num_of_workers (int, optional): Defaults to 4.
+            max_size (int, optional): the max number of updates waiting to be processed. Defaults to 1000.
+        """
+        self.process_update = process_update
+        self.num_of_workers = num_of_workers
+        self.max_size = max_size
+        worker_max_size = max(max_size // num_of_workers, 1)
+        self._worker_queues : List[queue.Queue] = [queue.Queue(maxsize=worker_max_size) for _ in range(num_of_workers)]
+        self._workers : List[threading.Thread] = []
+        self._stats_lock = threading.Lock()
+        self._latencies : Deque[float] = collections.deque(maxlen=LATENCY_SAMPLES_SIZE)
+        self.processed_updates = 0
+        self.failed_updates = 0
+        self.rejected_updates = 0
+        self.duplicate_updates = 0
+
+    def start(self):
+        for index, worker_queue in enumerate(self._worker_queues):
+            worker = threading.Thread(target=self._work, args=(worker_queue,), name=f"update_worker_{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout: float = None):
+        """Stops the workers once they have processed the updates already enqueued.
+
+        Args:
+            timeout (float, optional): max seconds to wait for each worker. Defaults to None.
+        """
+        for worker_queue in self._worker_queues:
+            worker_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def put(self, update: Update) -> bool:
+        """Enqueues the update, without blocking.
+
+        Args:
+            update (Update)
+
+        Returns:
+            bool: True if the update was enqueued, False if the queue is full
+        """
+        worker_queue = self._worker_queues[get_update_chat_id(update) % self.num_of_workers]
+        try:
+            worker_queue.put_nowait((update, time.monotonic()))
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected_updates += 1
+            return False
+        return True
+
+    def _work(self, worker_queue: queue.Queue):
+        while True:
+            queue_entry = worker_queue.get()
+            if queue_entry is None:
+                break
+            update, enqueue_time = queue_entry
+            # * a resent update is handled by the same worker, after the first one
+            if update_deduplicator.is_duplicate_update(update.update_id):
+                lgr.logger.warning(f"Dropped duplicate update {update.update_id}")
+                with self._stats_lock:
+                    self.duplicate_updates += 1
+                continue
+            try:
+                self.process_update(update)
+                failed = False
+            except Exception as e:
+                lgr.logger.error(f"Error processing update {update.update_id} - {str(e)}")
+                failed = True
+            latency = time.monotonic() - enqueue_time
+            with self._stats_lock:
+                self._latencies.append(latency)
+                self.processed_updates += 1
+                self.failed_updates += int(failed)
+
+    def get_depth(self) -> int:
+        return sum(worker_queue.qsize() for worker_queue in self._worker_queues)
+
+    def get_stats(self) -> Dict:
+        """Returns the queue depth and the processing latency (from enqueue to the end of processing)
+        of the latest updates, in seconds.
+
+        Returns:
+            Dict
+        """
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                "queue_depth": self.get_depth(),
+                "queue_max_size": self.max_size,
+                "workers": self.num_of_workers,
+                "processed_updates": self.processed_updates,
+                "failed_updates": self.failed_updates,
+                "rejected_updates": self.rejected_updates,
+                "duplicate_updates": self.duplicate_updates,
+            }
+        if latencies:
+            stats["latency_avg"] = sum(latencies) / len(latencies)
+            stats["latency_p50"] = latencies[len(latencies) // 2]
+            stats["latency_p95"] = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+            stats["latency_max"] = latencies[-1]
+        return stats
+
+
+class WebhookHandler(tornado.web.RequestHandler):
+    """Receives the updates from Telegram, acknowledging them immediately.
+    In case the queue is full, 503 is returned, so that Telegram sends the update again later.
+    """
+
+    def initialize(self, bot: Bot, update_queue: UpdateQueue):
+        self.bot = bot
+        self.update_queue = update_queue
+
+    def post(self):
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot)
+        except Exception as e:
+            lgr.logger.error(f"Received invalid update - {str(e)}")
+            self.set_status(400)
+            return
+        if update is None:
+            self.set_status(400)
+            return
+        if not self.update_queue.put(update):
+            # * Telegram will send it again
+            lgr.logger.warning(f"Update queue is full, update {update.update_id} rejected")
+            self.set_status(503)
+            return
+        self.write("Ok")
+
+
+class StatusHandler(tornado.web.RequestHandler):
+    """Exposes the update queue statistics."""
+
+    def initialize(self, update_queue: UpdateQueue):
+        self.update_queue = update_queue
+
+    def get(self):
+        self.write(self.update_queue.get_stats())
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Exposes the metrics of the bot in the Prometheus text format."""
+
+    def initialize(self, update_queue: UpdateQueue):
+        self.update_queue = update_queue
+
+    def get(self):
+        metrics.UPDATE_QUEUE_DEPTH.set(value=self.update_queue.get_depth())
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(metrics.render_metrics())
+
+
+def create_webhook_app(bot: Bot, update_queue: UpdateQueue, webhook_path: str = "/webhook", status_path: str = "/status",
+        metrics_path: str = "/metrics") -> tornado.web.Application:
+    """Creates the tornado application serving the webhook, the status and the metrics endpoints.
+
+    Args:
+        bot (Bot)
+        update_queue (UpdateQueue)
+        webhook_path (str, optional): Defaults to "/webhook".
+        status_path (str, optional): Defaults to "/status".
+        metrics_path (str, optional): Defaults to "/metrics".
+
+    Returns:
+        tornado.web.Application
+    """
+    return tornado.web.Application([
+        (webhook_path, WebhookHandler, {"bot": bot, "update_queue": update_queue}),
+        (status_path, StatusHandler, {"update_queue": update_queue}),
+        (metrics_path, MetricsHandler, {"update_queue": update_queue}),
+    ])
+
+
+def run_webhook_server(bot: Bot, process_update: Callable[[Update], None], port: int, listen: str = "0.0.0.0",
+        webhook_path: str = "/webhook", webhook_url: Optional[str] = None, num_of_workers: int = 4, max_queue_size: int = 1000):
+    """Starts the update workers and serves the webhook until the process is stopped.
+
+    Args:
+        bot (Bot)
+        process_update (Callable[[Update], None]): the function processing each update
+        port (int)
+        listen (str, optional): Defaults to "0.0.0.0".
+        webhook_path (str, optional): Defaults to "/webhook".
+        webhook_url (Optional[str], optional): if specified, the webhook is registered on Telegram. Defaults to None.
+        num_of_workers (int, optional): Defaults to 4.
+        max_queue_size (int, optional): Defaults to 1000.
+    """
+    update_queue = UpdateQueue(process_update, num_of_workers=num_of_workers, max_size=max_queue_size)
+    update_queue.start()
+    app = create_webhook_app(bot, update_queue, webhook_path=webhook_path)
+    app.listen(port, address=listen)
+    if webhook_url:
+        bot.set_webhook(webhook_url)
+    lgr.logger.info(f"Webhook server listening on {listen}:{port}{webhook_path} with {num_of_workers} workers")
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    finally:
+        update_queue.stop()
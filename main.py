@@ -1,9 +1,17 @@
+import sys
+import threading
+from typing import List
+
 from telegram import Update
 
 from lot_bot import bot
 from lot_bot import config as cfg
 from lot_bot import database as db
 from lot_bot import logger as lgr
+from lot_bot import sharded_sender
+from lot_bot import startup_profiler
+from lot_bot import update_deduplicator
+from lot_bot import webhook_server
 
 
 def run_bot_locally():
@@ -20,6 +28,103 @@ def run_bot_locally():
     bot.updater.idle()
 
 
+def run_webhook_server():
+    """Runs the bot as a long-lived webhook server, whose updates are
+    acknowledged immediately and processed by a pool of workers."""
+    cfg.create_config()
+    lgr.create_logger()
+    lgr.logger.info("Starting webhook server")
+    if not cfg.config.TOKEN:
+        lgr.logger.error("ERROR: TOKEN not valid")
+        raise Exception("No config TOKEN")
+    db.create_db()
+    bot.create_bot()
+    # * unlike start_polling, the webhook server does not start the job queue
+    bot.updater.job_queue.start()
+    # * nor the dispatcher, whose async workers send the broadcasts
+    threading.Thread(target=bot.dispatcher.start, name="dispatcher", daemon=True).start()
+    webhook_server.run_webhook_server(
+        bot.bot,
+        bot.dispatcher.process_update,
+        cfg.config.WEBHOOK_PORT,
+        listen=cfg.config.WEBHOOK_LISTEN,
+        webhook_path=cfg.config.WEBHOOK_PATH,
+        webhook_url=cfg.config.WEBHOOK_URL,
+        num_of_workers=cfg.config.UPDATE_WORKERS,
+        max_queue_size=cfg.config.UPDATE_QUEUE_SIZE,
+    )
+
+
+def run_sender_workers(shards_args: List[str]):
+    """Runs the sharded sender workers of the specified shards,
+    or of all the shards if none is specified.
+
+    Args:
+        shards_args (List[str]): the shards' indexes
+    """
+    cfg.create_config()
+    lgr.create_logger()
+    if not cfg.config.SENDER_SHARDS:
+        lgr.logger.error("ERROR: SENDER_SHARDS not set")
+        raise Exception("No config SENDER_SHARDS")
+    shards = [int(shard_arg) for shard_arg in shards_args] or list(range(cfg.config.SENDER_SHARDS))
+    if any(shard < 0 or shard >= cfg.config.SENDER_SHARDS for shard in shards):
+        raise Exception(f"The shards must be between 0 and {cfg.config.SENDER_SHARDS - 1}")
+    lgr.logger.info(f"Starting sender workers of shards {shards}")
+    sharded_sender.run_sender_workers(shards)
+
+
+def profile_startup():
+    """Prints the import time of each module and the time
+    spent creating the config, the logger, the db and the bot."""
+    import_times = startup_profiler.profile_imports("main")
+    step_times = startup_profiler.profile_startup_steps([
+        ("create_config", cfg.create_config),
+        ("create_logger", lgr.create_logger),
+        ("create_db", db.create_db),
+        ("create_bot", bot.create_bot),
+    ])
+    print(startup_profiler.create_startup_report(import_times, step_times))
+
+
+def flush_persistence():
+    """Writes the changed conversation states and user_data at the end of a request.
+    Since the update has already been processed, a db error does not fail the request
+    (Telegram would resend an update which is then dropped as a duplicate):
+    the changes are kept pending and written by the next flush.
+    """
+    try:
+        bot.dispatcher.persistence.flush()
+    except Exception as e:
+        lgr.logger.error(f"Could not write the persistence changes, they will be written by the next flush - {str(e)}")
+
+
+def process_webhook_update(update: Update) -> str:
+    """Processes the update received by the webhook, unless it is a duplicate.
+
+    Args:
+        update (Update)
+
+    Raises:
+        e (Exception): if the update could not be processed, after which it is forgotten,
+            so that it is accepted when Telegram sends it again
+
+    Returns:
+        str
+    """
+    if update_deduplicator.is_duplicate_update(update.update_id):
+        lgr.logger.warning(f"Dropped duplicate update {update.update_id}")
+        return "Ok"
+    try:
+        bot.dispatcher.process_update(update)
+    except Exception as e:
+        update_deduplicator.forget_update(update.update_id)
+        raise e
+    # * the instance may be stopped once the request is answered
+    flush_persistence()
+    return "Ok"
+
+
 def check_components():
     """Checks if config, logger, db and bot are up and running,
     creating them again if needed"""
@@ -50,8 +155,7 @@ def staging_webhook(request):
         lgr.logger.error(f"Staging bot received {request.method} request")
         return
     update = Update.de_json(request.get_json(force=True), bot.bot)
-    bot.dispatcher.process_update(update)
-    return "Ok"
+    return process_webhook_update(update)
 
 
 def webhook(request):
@@ -68,11 +172,17 @@ def webhook(request):
         lgr.logger.error(f"Bot received {request.method} request")
         return
     update = Update.de_json(request.get_json(force=True), bot.bot)
-    bot.dispatcher.process_update(update)
-    return "Ok"
+    return process_webhook_update(update)
 
 
 # this represents the default behaviour in case
 #   main.py is run
 if __name__ == "__main__":
-    run_bot_locally()
+    if len(sys.argv) > 1 and sys.argv[1] == "webhook":
+        run_webhook_server()
+    elif len(sys.argv) > 1 and sys.argv[1] == "sender":
+        run_sender_workers(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "--profile-startup":
+        profile_startup()
+    else:
+        run_bot_locally()
@@ -0,0 +1,100 @@
+"""Benchmark of the fan-out throughput of a giocata, with the logging enabled
+at DEBUG level (written on a file through the log queue) and disabled.
+The users are retrieved from memory instead of the db and the messages
+are not actually sent, so that the cost of the fan-out loop is measured.
+
+Run it from the project root with:
+    python -m tests.benchmarks.logging_benchmark
+"""
+import datetime
+import logging
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Dict
+
+from telegram.error import Unauthorized
+
+from lot_bot import config as cfg
+from lot_bot import logger as lgr
+from lot_bot import sender
+from lot_bot.dao import budget_manager, sport_subscriptions_manager, user_manager
+from lot_bot.handlers import message_handlers
+from lot_bot.models import sports as spr
+from lot_bot.models import strategies as strat
+from tests.conftest import create_giocata
+
+NUM_OF_USERS = 20000
+# * every BLOCKED_USERS_RATE users, one is blocked and one blocked the bot
+BLOCKED_USERS_RATE = 10
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent_messages = 0
+
+    def send_message(self, user_id: int, text: str, **kwargs):
+        if user_id % BLOCKED_USERS_RATE == 1:
+            raise Unauthorized("Forbidden: bot was blocked by the user")
+        self.sent_messages += 1
+
+
+def create_users_data(num_of_users: int) -> Dict[int, Dict]:
+    access_expiration = (datetime.datetime.now() + datetime.timedelta(days=30)).timestamp()
+    users_data = {}
+    for user_id in range(num_of_users):
+        users_data[user_id] = {
+            "_id": user_id,
+            "blocked": user_id % BLOCKED_USERS_RATE == 0,
+            "sport_access": {"calcio": access_expiration},
+            "personal_stakes": [],
+            "compiled_personal_stakes": {},
+            "budgets": [{"budget_name": "DEMO", "balance": 100000, "interest_type": "composto", "default": True}],
+        }
+    return users_data
+
+
+def use_in_memory_users(users_data: Dict[int, Dict]):
+    """Replaces the DAO functions used by the fan-out with lookups on users_data."""
+    sport_subscriptions_manager.retrieve_all_user_ids_sub_to_sport_and_strategy = lambda sport, strategy, active_timestamp=None: list(users_data)
+    user_manager.retrieve_user_fields_by_user_id = lambda user_id, fields: {field: users_data[user_id][field] for field in fields if field in users_data[user_id]}
+    budget_manager.retrieve_default_budget_from_user_id = lambda user_id: users_data[user_id]["budgets"][0]
+
+
+def measure_fan_out_time(giocata_text: str) -> float:
+    """Returns the messages per second of the fan-out of the giocata."""
+    update = SimpleNamespace(effective_message=SimpleNamespace(date=datetime.datetime.now()))
+    context = SimpleNamespace(bot=FakeBot())
+    start_time = time.perf_counter()
+    message_handlers.send_message_to_all_subscribers(update, context, giocata_text, "calcio", "produzione", is_giocata=True)
+    return context.bot.sent_messages / (time.perf_counter() - start_time)
+
+
+def run_benchmark(num_of_users: int = NUM_OF_USERS) -> Dict[str, float]:
+    use_in_memory_users(create_users_data(num_of_users))
+    # * the fan-out is not limited to Telegram's rate, since the messages are not sent
+    sender.rate_limiter = sender.RateLimiter(10 ** 9)
+    giocata_text, _ = create_giocata(spr.sports_container.CALCIO, strat.strategies_container.PRODUZIONE)
+    throughputs = {}
+    logging.disable(logging.NOTSET)
+    throughputs["logging on (DEBUG)"] = measure_fan_out_time(giocata_text)
+    logging.disable(logging.DEBUG)
+    throughputs["logging on (INFO)"] = measure_fan_out_time(giocata_text)
+    logging.disable(logging.CRITICAL)
+    throughputs["logging off"] = measure_fan_out_time(giocata_text)
+    logging.disable(logging.NOTSET)
+    return throughputs
+
+
+if __name__ == "__main__":
+    cfg.create_config()
+    cfg.config.LOG_ON_FILE = True
+    cfg.config.LOG_PATH = os.path.join(tempfile.mkdtemp(), "logging_benchmark.log")
+    lgr.create_logger()
+    logging.getLogger().setLevel(logging.DEBUG)
+    throughputs = run_benchmark()
+    lgr.stop_logger()
+    for mode, throughput in throughputs.items():
+        print(f"{mode:>20}: {throughput:.0f} messages/s")
+    print(f"{'log size':>20}: {os.path.getsize(cfg.config.LOG_PATH) / 1024:.0f} KiB")
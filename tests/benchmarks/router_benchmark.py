@@ -0,0 +1,141 @@
+"""Benchmark of the cost of finding the handler of each update, with the handlers
+added directly to the dispatcher (checked one after the other) and with the router.
+
+Run it from the project root with:
+    python -m tests.benchmarks.router_benchmark
+"""
+import logging
+import queue
+import time
+from typing import Dict, List, Optional
+
+from telegram import Bot, Update, User
+from telegram.ext import Dispatcher, Handler
+
+from lot_bot import bot as lot_bot
+from lot_bot import config as cfg
+from lot_bot import logger as lgr
+
+BOT_USERNAME = "lot_test_bot"
+SPORTS_CHANNELS_ID = {"calcio": -1001, "tennis": -1002, "exchange": -1003}
+TEACHERBET_CHANNEL_ID = -1004
+USER_ID = 12345
+GIOCATA_ID = "61d5c4c3e8f4b3a2f1e0d9c8"
+
+PRIVATE_TEXTS = ["/start", "/visualizza_budget", "/trend_giorni 7", "Homepage", "Il tuo BoT", "Gestione Esperienza", "ciao", "100"]
+CHANNEL_TEXTS = [
+    "🏆 CALCIO 🏆\n⚜️ Juventus - Inter ⚜️\nVincente 1 @2.10\nStake 5%\n#12 01/22",
+    "🟢 Calcio#12 01/22 Vincente +5,50% 🟢",
+    "#12 01/22 +3,5",
+    "/messaggio_abbonati calcio - produzione\nMessaggio",
+]
+CALLBACK_DATA = [
+    "to_homepage", "to_bot_config_menu", "sport_calcio", "calcio_produzione_activate", "to_sports_menu",
+    f"register_giocata_yes_{GIOCATA_ID}_5", f"register_giocata_no_{GIOCATA_ID}", "resoconto_7_days",
+    "to_budgets_menu", "edit_budget_DEMO", "set_default_budget_DEMO", "do_nothing", "to_add_referral:1m",
+]
+
+
+def create_benchmark_bot() -> Bot:
+    """Creates a bot which does not need to contact Telegram to know its username."""
+    benchmark_bot = Bot("123456:ABCDEF")
+    benchmark_bot._bot = User(123456, "LoT", True, username=BOT_USERNAME)
+    return benchmark_bot
+
+
+def create_message_update(benchmark_bot: Bot, update_id: int, text: str, chat_id: int, is_channel_post: bool) -> Update:
+    message_data = {
+        "message_id": update_id,
+        "date": 0,
+        "chat": {"id": chat_id, "type": "channel" if is_channel_post else "private"},
+        "text": text,
+    }
+    if not is_channel_post:
+        message_data["from"] = {"id": chat_id, "first_name": "Mario", "is_bot": False}
+    if text.startswith("/"):
+        message_data["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return Update.de_json({"update_id": update_id, "channel_post" if is_channel_post else "message": message_data}, benchmark_bot)
+
+
+def create_callback_query_update(benchmark_bot: Bot, update_id: int, callback_data: str) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": USER_ID, "first_name": "Mario", "is_bot": False},
+            "chat_instance": "1",
+            "data": callback_data,
+            "message": {"message_id": update_id, "date": 0, "chat": {"id": USER_ID, "type": "private"}, "text": "menu"},
+        },
+    }, benchmark_bot)
+
+
+def create_benchmark_updates(benchmark_bot: Bot) -> List[Update]:
+    """Creates a mix of private messages, commands, callback queries and channel posts.
+
+    Args:
+        benchmark_bot (Bot)
+
+    Returns:
+        List[Update]
+    """
+    updates = []
+    for text in PRIVATE_TEXTS:
+        updates.append(create_message_update(benchmark_bot, len(updates), text, USER_ID, False))
+    for callback_data in CALLBACK_DATA:
+        updates.append(create_callback_query_update(benchmark_bot, len(updates), callback_data))
+    for text in CHANNEL_TEXTS:
+        updates.append(create_message_update(benchmark_bot, len(updates), text, SPORTS_CHANNELS_ID["calcio"], True))
+    updates.append(create_message_update(benchmark_bot, len(updates), "#12 01/22 +3,5", SPORTS_CHANNELS_ID["exchange"], True))
+    updates.append(create_message_update(benchmark_bot, len(updates), "UPDATE: giocata", TEACHERBET_CHANNEL_ID, True))
+    return updates
+
+
+def create_dispatcher(benchmark_bot: Bot, use_router: bool) -> Dispatcher:
+    dispatcher = Dispatcher(benchmark_bot, queue.Queue(), use_context=True)
+    lot_bot.add_handlers(dispatcher, use_router=use_router)
+    return dispatcher
+
+
+def find_handler(dispatcher: Dispatcher, update: Update) -> Optional[Handler]:
+    """Finds the handler the dispatcher would run for the update, as in Dispatcher.process_update.
+    In case of the router, the handler it routes the update to is returned.
+    """
+    for handler in dispatcher.handlers[0]:
+        check_result = handler.check_update(update)
+        if check_result is not None and check_result is not False:
+            if isinstance(check_result, tuple) and len(check_result) == 2 and isinstance(check_result[0], Handler):
+                return check_result[0]
+            return handler
+    return None
+
+
+def measure_dispatch_time(dispatcher: Dispatcher, updates: List[Update], repetitions: int) -> float:
+    """Returns the average time in microseconds to find the handler of an update."""
+    start_time = time.perf_counter()
+    for _ in range(repetitions):
+        for update in updates:
+            find_handler(dispatcher, update)
+    return (time.perf_counter() - start_time) / (repetitions * len(updates)) * 10**6
+
+
+def run_benchmark(repetitions: int = 200) -> Dict[str, float]:
+    benchmark_bot = create_benchmark_bot()
+    updates = create_benchmark_updates(benchmark_bot)
+    return {
+        "sequential": measure_dispatch_time(create_dispatcher(benchmark_bot, False), updates, repetitions),
+        "router": measure_dispatch_time(create_dispatcher(benchmark_bot, True), updates, repetitions),
+    }
+
+
+if __name__ == "__main__":
+    cfg.create_config()
+    lgr.create_logger()
+    cfg.config.SPORTS_CHANNELS_ID = SPORTS_CHANNELS_ID
+    cfg.config.TEACHERBET_CHANNEL_ID = TEACHERBET_CHANNEL_ID
+    # * the handlers' debug logs would dominate the measures
+    logging.disable(logging.DEBUG)
+    dispatch_times = run_benchmark()
+    for mode, dispatch_time in dispatch_times.items():
+        print(f"{mode:>12}: {dispatch_time:.1f} us per update")
+    print(f"{'speedup':>12}: {dispatch_times['sequential'] / dispatch_times['router']:.1f}x")
@@ -0,0 +1,42 @@
+import pytest
+from lot_bot.dao import user_manager
+from lot_bot.models import users as user_model
+
+USER_ID = 4001
+
+
+def create_payment(telegram_payment_charge_id: str) -> dict:
+    return {
+        "payment_id": telegram_payment_charge_id,
+        "datetime_timestamp": 0.0,
+        "invoice_payload": "payload_test",
+        "telegram_payment_charge_id": telegram_payment_charge_id,
+        "provider_payment_charge_id": telegram_payment_charge_id,
+        "total_amount": 5000,
+        "currency": "EUR",
+    }
+
+
+@pytest.mark.slow
+def test_register_successful_payment_renewal():
+    # * the renewal uses the array filters, which are not implemented by mongomock
+    user_data = user_model.create_base_user_data()
+    user_data["_id"] = USER_ID
+    user_manager.delete_user_by_id(USER_ID)
+    user_manager.create_user(user_data)
+    try:
+        first_subscription = {"name": "lotcomplete", "expiration_date": 1000.0}
+        assert user_manager.register_successful_payment(USER_ID, create_payment("first"), first_subscription, None, {"email": "mario@lot.it"})
+        renewed_subscription = {"name": "lotcomplete", "expiration_date": 2000.0}
+        # * the same payment is not registered twice
+        assert not user_manager.register_successful_payment(USER_ID, create_payment("first"), renewed_subscription, 1000.0, {})
+        # * the subscription was changed after the expiration date was read
+        assert not user_manager.register_successful_payment(USER_ID, create_payment("second"), renewed_subscription, 500.0, {})
+        assert user_manager.register_successful_payment(USER_ID, create_payment("second"), renewed_subscription, 1000.0, {})
+        updated_user = user_manager.retrieve_user(USER_ID)
+        assert updated_user["subscriptions"] == [renewed_subscription]
+        assert updated_user["lot_expiration_date"] == 2000.0
+        assert updated_user["sport_access"]["all"] == 2000.0
+        assert len(updated_user["payments"]) == 2
+    finally:
+        user_manager.delete_user_by_id(USER_ID)
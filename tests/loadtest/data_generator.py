@@ -0,0 +1,129 @@
+"""Generator of synthetic users, with subscriptions, sport subscriptions, budgets
+and personal stakes, to be inserted (together with their analytics) in a local db
+dedicated to the load tests.
+"""
+import datetime
+import random
+from typing import Dict, List, Set
+
+from lot_bot import database as db
+from lot_bot.models import analytics
+from lot_bot.models import personal_stakes as personal_stakes_model
+from lot_bot.models import sports as spr
+from lot_bot.models import subscriptions as subs
+from lot_bot.models import users as user_model
+
+# * far from the real users IDs, the first one is an admin
+FIRST_USER_ID = 10**9
+# * fractions of the users
+EXPIRED_USERS_RATE = 0.1
+BLOCKED_USERS_RATE = 0.02
+BOT_BLOCKERS_RATE = 0.03
+MAX_PERSONAL_STAKES = 3
+
+
+def _create_personal_stakes(rng: random.Random) -> List[Dict]:
+    personal_stakes = []
+    for _ in range(rng.randint(0, MAX_PERSONAL_STAKES)):
+        personal_stake = personal_stakes_model.create_base_personal_stake()
+        personal_stake["min_quota"] = rng.randint(100, 250)
+        personal_stake["max_quota"] = personal_stake["min_quota"] + rng.randint(1, 200)
+        personal_stake["stake"] = rng.randint(100, 1000)
+        personal_stake["sport"] = rng.choice(["all", spr.sports_container.CALCIO.name, spr.sports_container.TENNIS.name])
+        personal_stake["strategies"] = ["all"]
+        personal_stakes.append(personal_stake)
+    return personal_stakes
+
+
+def generate_user(user_id: int, rng: random.Random, now: datetime.datetime) -> Dict:
+    """Generates a user subscribed to calcio (and maybe to tennis), with a default budget
+    and some personal stakes. Some of the users' subscriptions are expired.
+
+    Args:
+        user_id (int)
+        rng (random.Random)
+        now (datetime.datetime)
+
+    Returns:
+        Dict: the user data
+    """
+    user_data = user_model.create_base_user_data()
+    user_data["_id"] = user_id
+    user_data["name"] = f"Load{user_id}"
+    user_data["username"] = f"load_test_{user_id}"
+    # * the codes are unique without checking the db
+    user_data["referral_code"] = f"{user_id:08d}"[-8:] + "-lot"
+    user_data["role"] = "admin" if user_id == FIRST_USER_ID else "user"
+    user_data["blocked"] = rng.random() < BLOCKED_USERS_RATE
+    if rng.random() < EXPIRED_USERS_RATE:
+        expiration_date = now - datetime.timedelta(days=rng.randint(1, 30))
+    else:
+        expiration_date = now + datetime.timedelta(days=rng.randint(1, 30))
+    sub_name = rng.choice([subs.sub_container.LOTCOMPLETE.name, subs.sub_container.LOTFREE.name])
+    user_data["subscriptions"] = [{"name": sub_name, "expiration_date": expiration_date.timestamp()}]
+    user_data["sport_access"] = subs.create_sport_access_from_subscriptions(user_data["subscriptions"])
+    user_data["sport_subscriptions"] = [
+        {"sport": sport.name, "strategies": [strategy.name for strategy in sport.strategies]}
+        for sport in (spr.sports_container.CALCIO, spr.sports_container.TENNIS)
+        if sport is spr.sports_container.CALCIO or rng.random() < 0.5
+    ]
+    balance = rng.randint(100, 2000) * 100
+    user_data["budgets"] = [{
+        "budget_name": "Budget",
+        "balance": balance,
+        "default": True,
+        "interest_type": rng.choice(["semplice", "composto"]),
+        "simply_interest_base": balance,
+    }]
+    user_data["personal_stakes"] = _create_personal_stakes(rng)
+    user_data["compiled_personal_stakes"] = personal_stakes_model.compile_personal_stakes(user_data["personal_stakes"])
+    return user_data
+
+
+def generate_users(num_of_users: int, seed: int = 0) -> List[Dict]:
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    return [generate_user(FIRST_USER_ID + index, rng, now) for index in range(num_of_users)]
+
+
+def get_bot_blockers_ids(users_data: List[Dict], seed: int = 0) -> Set[int]:
+    """Chooses the users who blocked the bot, to whom the fake Bot API answers with 403.
+
+    Args:
+        users_data (List[Dict])
+        seed (int, optional): Defaults to 0.
+
+    Returns:
+        Set[int]
+    """
+    rng = random.Random(seed)
+    return {user_data["_id"] for user_data in users_data[1:] if rng.random() < BOT_BLOCKERS_RATE}
+
+
+def clear_db():
+    """Deletes all the users, giocate and analytics.
+    It must only be used on the db dedicated to the load tests.
+    """
+    db.mongo.utenti.delete_many({})
+    db.mongo.giocate.delete_many({})
+    db.mongo.analytics.delete_many({})
+
+
+def create_user_analytics(user_id: int) -> Dict:
+    # * created on /start for the real users, the giocate acceptances are recorded in them
+    analytics_data = analytics.create_base_analytics()
+    analytics_data["_id"] = user_id
+    return analytics_data
+
+
+def insert_users(users_data: List[Dict], batch_size: int = 1000):
+    """Inserts the users and their base analytics.
+
+    Args:
+        users_data (List[Dict])
+        batch_size (int, optional): Defaults to 1000.
+    """
+    for start_index in range(0, len(users_data), batch_size):
+        users_batch = users_data[start_index:start_index + batch_size]
+        db.mongo.utenti.insert_many(users_batch, ordered=False)
+        db.mongo.analytics.insert_many([create_user_analytics(user_data["_id"]) for user_data in users_batch], ordered=False)
@@ -0,0 +1,189 @@
+"""Local stand-in for the Telegram Bot API, implementing the methods used by the bot.
+Each request is answered after a configurable latency; the requests exceeding the
+configured rate limit are answered with 429 and the ones sent to the chats which
+"blocked the bot" with 403, as Telegram would do.
+The server runs on its own thread, so that the bot can use it through its base_url.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import random
+import threading
+import time
+from typing import Dict, Optional, Set
+from urllib.parse import parse_qsl
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "LoT", "username": "lot_load_test_bot"}
+MESSAGE_METHODS = {
+    "sendMessage", "editMessageText", "editMessageReplyMarkup", "sendVideo", "sendPhoto", "sendDocument",
+    "sendAnimation", "sendAudio", "sendVoice", "sendInvoice",
+}
+TRUE_METHODS = {
+    "answerCallbackQuery", "answerPreCheckoutQuery", "deleteMessage", "setWebhook", "deleteWebhook",
+    "sendChatAction", "setMyCommands",
+}
+
+
+class FakeBotApiState:
+    """Configuration and statistics of the fake Bot API."""
+
+    def __init__(self, latency: float = 0.0, latency_jitter: float = 0.0, rate_limit: Optional[int] = None,
+            retry_after: int = 1, too_many_requests_rate: float = 0.0, blocked_chat_ids: Set[int] = None):
+        """
+        Args:
+            latency (float, optional): seconds waited before answering each request. Defaults to 0.0.
+            latency_jitter (float, optional): max random seconds added to the latency. Defaults to 0.0.
+            rate_limit (Optional[int], optional): max requests per second, the following ones get 429. Defaults to None.
+            retry_after (int, optional): the retry_after of the 429 responses. Defaults to 1.
+            too_many_requests_rate (float, optional): the fraction of requests randomly answered with 429. Defaults to 0.0.
+            blocked_chat_ids (Set[int], optional): the chats which blocked the bot, answered with 403. Defaults to None.
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.too_many_requests_rate = too_many_requests_rate
+        self.blocked_chat_ids = blocked_chat_ids or set()
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+        self._recent_requests_times = collections.deque()
+        self.requests_by_method : Dict[str, int] = collections.Counter()
+        self.responses_by_code : Dict[int, int] = collections.Counter()
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests_by_method.clear()
+            self.responses_by_code.clear()
+
+    def _is_rate_limited(self) -> bool:
+        if self.too_many_requests_rate and random.random() < self.too_many_requests_rate:
+            return True
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        while self._recent_requests_times and now - self._recent_requests_times[0] >= 1:
+            self._recent_requests_times.popleft()
+        if len(self._recent_requests_times) >= self.rate_limit:
+            return True
+        self._recent_requests_times.append(now)
+        return False
+
+    def answer(self, method: str, parameters: Dict) -> Dict:
+        """Creates the response of the Bot API to the request.
+
+        Args:
+            method (str)
+            parameters (Dict)
+
+        Returns:
+            Dict: the response, in the Bot API format
+        """
+        with self._lock:
+            self.requests_by_method[method] += 1
+            chat_id = parameters.get("chat_id")
+            if chat_id is not None and int(chat_id) in self.blocked_chat_ids:
+                response = {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+            elif self._is_rate_limited():
+                response = {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+            else:
+                response = {"ok": True, "result": self._create_result(method, parameters)}
+            self.responses_by_code[response.get("error_code", 200)] += 1
+        return response
+
+    def _create_result(self, method: str, parameters: Dict) -> object:
+        if method == "getMe":
+            return BOT_USER
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method in TRUE_METHODS:
+            return True
+        if method in MESSAGE_METHODS:
+            chat_id = int(parameters.get("chat_id") or 0)
+            message = {
+                "message_id": int(parameters.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+                "from": BOT_USER,
+            }
+            if "text" in parameters:
+                message["text"] = parameters["text"]
+            if "caption" in parameters:
+                message["caption"] = parameters["caption"]
+            return message
+        return True
+
+
+class BotApiHandler(tornado.web.RequestHandler):
+    def initialize(self, state: FakeBotApiState):
+        self.state = state
+
+    def _get_parameters(self) -> Dict:
+        content_type = self.request.headers.get("Content-Type", "")
+        if content_type.startswith("application/json") and self.request.body:
+            return json.loads(self.request.body)
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return dict(parse_qsl(self.request.body.decode("utf-8")))
+        # * multipart requests (file uploads) only need the chat ID
+        return {name: values[0].decode("utf-8") for name, values in self.request.body_arguments.items()}
+
+    async def post(self, token: str, method: str):
+        parameters = self._get_parameters()
+        delay = self.state.latency + random.uniform(0, self.state.latency_jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        response = self.state.answer(method, parameters)
+        self.set_status(response.get("error_code", 200))
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(response))
+
+    get = post
+
+
+class FakeBotApiServer:
+    """Serves the fake Bot API on a random local port, on its own thread."""
+
+    def __init__(self, state: FakeBotApiState = None):
+        self.state = state or FakeBotApiState()
+        self.port = None
+        self._io_loop = None
+        self._thread = None
+        self._started = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        """The base_url to pass to the Bot."""
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def _serve(self):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        self._io_loop = tornado.ioloop.IOLoop.current()
+        # * the access log would be written for each request
+        app = tornado.web.Application([(r"/bot([^/]+)/(\w+)", BotApiHandler, {"state": self.state})], log_function=lambda handler: None)
+        sockets = tornado.netutil.bind_sockets(0, address="127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        server = tornado.httpserver.HTTPServer(app)
+        server.add_sockets(sockets)
+        self._started.set()
+        self._io_loop.start()
+        server.stop()
+        self._io_loop.close(all_fds=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, name="fake_bot_api", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        self._io_loop.add_callback(self._io_loop.stop)
+        self._thread.join()
@@ -0,0 +1,98 @@
+"""Offline load test of the bot: the handlers use a local db filled with synthetic users
+and the bot talks to a fake Bot API, so that no token nor Telegram account is needed.
+
+Run it from the project root with:
+    ENV=testing python -m tests.loadtest.run_load_test --users 5000 --mongo-url mongodb://localhost:27017
+Without --mongo-url an in-memory db (mongomock) is used, which is much slower than mongod.
+The db named by --db-name is emptied at the beginning of the test.
+"""
+import argparse
+import logging
+from typing import List
+
+import mongomock
+from pymongo import monitoring
+
+from lot_bot import config as cfg
+from lot_bot import database as db
+from lot_bot import logger as lgr
+from tests.loadtest import data_generator, scenarios
+from tests.loadtest.fake_bot_api import FakeBotApiServer, FakeBotApiState
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline load test of the bot")
+    parser.add_argument("--users", type=int, default=2000, help="number of synthetic users")
+    parser.add_argument("--mongo-url", default=None, help="URL of the local mongod, mongomock is used if missing")
+    parser.add_argument("--db-name", default="lot_load_test", help="name of the db, which is emptied")
+    parser.add_argument("--latency", type=float, default=0.02, help="latency of the fake Bot API, in seconds")
+    parser.add_argument("--latency-jitter", type=float, default=0.01, help="max random latency added, in seconds")
+    parser.add_argument("--rate-limit", type=int, default=None, help="max Bot API requests per second, then 429")
+    parser.add_argument("--too-many-requests-rate", type=float, default=0.0, help="fraction of requests randomly answered with 429")
+    parser.add_argument("--workers", type=int, default=8, help="number of threads processing the updates")
+    parser.add_argument("--callbacks", type=int, default=500, help="number of callbacks of the callback burst")
+    parser.add_argument("--scenarios", nargs="+", choices=list(scenarios.SCENARIOS), default=list(scenarios.SCENARIOS))
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def create_load_test_db(mongo_url: str, db_name: str, db_calls_counter: scenarios.DbCallsCounter):
+    if mongo_url:
+        # * the listener is registered before the client is created, so that it is used by it
+        monitoring.register(db_calls_counter)
+        cfg.config.MONGO_DB_URL = mongo_url
+        cfg.config.MONGO_DB_NAME = db_name
+        db.create_db()
+        return
+    mock_db = mongomock.MongoClient()[db_name]
+    mock_db.utenti.create_index([("referral_code", 1)], unique=True)
+    mock_db.giocate.create_index([("giocata_num", 1), ("sport", 1)], unique=True)
+    db.mongo = scenarios.CountingDatabase(mock_db, db_calls_counter)
+
+
+def print_results(results: List[scenarios.ScenarioResult]):
+    rows = [result.to_row() for result in results]
+    columns = list(rows[0])
+    widths = {column: max(len(column), *(len(row[column]) for row in rows)) for column in columns}
+    print("  ".join(column.rjust(widths[column]) for column in columns))
+    for row in rows:
+        print("  ".join(row[column].rjust(widths[column]) for column in columns))
+
+
+def main():
+    args = parse_args()
+    cfg.create_config()
+    lgr.create_logger()
+    # * the handlers' debug logs would dominate the measures
+    logging.disable(logging.INFO)
+    scenarios.configure_bot()
+    db_calls_counter = scenarios.DbCallsCounter()
+    create_load_test_db(args.mongo_url, args.db_name, db_calls_counter)
+    users_data = data_generator.generate_users(args.users, seed=args.seed)
+    data_generator.clear_db()
+    data_generator.insert_users(users_data)
+    server = FakeBotApiServer(FakeBotApiState(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        rate_limit=args.rate_limit,
+        too_many_requests_rate=args.too_many_requests_rate,
+        blocked_chat_ids=data_generator.get_bot_blockers_ids(users_data, seed=args.seed),
+    ))
+    server.start()
+    try:
+        load_test = scenarios.LoadTest(server, db_calls_counter, users_data, num_of_workers=args.workers)
+        results = []
+        for scenario_name in args.scenarios:
+            if scenario_name == "callback_burst":
+                results.append(scenarios.run_callback_burst(load_test, num_of_callbacks=args.callbacks))
+            else:
+                results.append(scenarios.SCENARIOS[scenario_name](load_test))
+    finally:
+        server.stop()
+        lgr.stop_logger()
+    print(f"{args.users} users, Bot API latency {args.latency * 1000:.0f}+{args.latency_jitter * 1000:.0f} ms, {args.workers} workers")
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""Load test scenarios, which send the updates to the bot's dispatcher as Telegram would,
+with the bot talking to the fake Bot API and the handlers using the load test db.
+Each scenario reports the messages sent per second, the latency of the updates and
+of the Bot API requests and the db calls made per update.
+"""
+import concurrent.futures
+import dataclasses
+import datetime
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from pymongo import monitoring
+from telegram import Update
+from telegram.ext import CallbackContext, Dispatcher
+from telegram.utils.request import Request
+
+from lot_bot import bot as lot_bot
+from lot_bot import config as cfg
+from lot_bot import database as db
+from lot_bot import metrics
+from lot_bot.models import sports as spr
+from lot_bot.models import strategies as strat
+from tests.conftest import create_giocata
+from tests.loadtest import data_generator
+from tests.loadtest.fake_bot_api import BOT_USER, MESSAGE_METHODS, FakeBotApiServer
+
+TOKEN = f"{BOT_USER['id']}:LOADTEST"
+SPORTS_CHANNELS_ID = {sport.name: -1001000000000 - index for index, sport in enumerate(spr.sports_container.astuple())}
+TEACHERBET_CHANNEL_ID = -1002000000000
+
+
+def get_percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    sorted_values = sorted(values)
+    return sorted_values[min(int(len(sorted_values) * percentile / 100), len(sorted_values) - 1)]
+
+
+@dataclasses.dataclass
+class ScenarioResult:
+    name : str
+    num_of_updates : int
+    duration : float
+    update_latencies : List[float]
+    request_latencies : List[float]
+    requests_by_method : Dict[str, int]
+    responses_by_code : Dict[int, int]
+    db_calls : int
+    handler_errors : int
+
+    @property
+    def messages_sent(self) -> int:
+        """The messages sent or edited, excluding the failed requests."""
+        messages_requests = sum(count for method, count in self.requests_by_method.items() if method in MESSAGE_METHODS or method == "copyMessage")
+        failed_requests = sum(count for code, count in self.responses_by_code.items() if code != 200)
+        return max(messages_requests - failed_requests, 0)
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.messages_sent / self.duration if self.duration else 0.0
+
+    @property
+    def db_calls_per_update(self) -> float:
+        return self.db_calls / self.num_of_updates if self.num_of_updates else 0.0
+
+    def to_row(self) -> Dict[str, str]:
+        return {
+            "scenario": self.name,
+            "updates": str(self.num_of_updates),
+            "messages": str(self.messages_sent),
+            "msg/s": f"{self.messages_per_second:.0f}",
+            "update p50/p99 ms": f"{get_percentile(self.update_latencies, 50) * 1000:.0f}/{get_percentile(self.update_latencies, 99) * 1000:.0f}",
+            "request p50/p99 ms": f"{get_percentile(self.request_latencies, 50) * 1000:.1f}/{get_percentile(self.request_latencies, 99) * 1000:.1f}",
+            "db calls/update": f"{self.db_calls_per_update:.1f}",
+            "429": str(self.responses_by_code.get(429, 0)),
+            "403": str(self.responses_by_code.get(403, 0)),
+            "errors": str(self.handler_errors),
+        }
+
+
+class DbCallsCounter(monitoring.CommandListener):
+    """Counts the commands sent to mongod."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def increment(self):
+        with self._lock:
+            self.count += 1
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        self.increment()
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        pass
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        pass
+
+
+class _CountingCollection:
+    def __init__(self, collection, db_calls_counter: DbCallsCounter):
+        self._collection = collection
+        self._db_calls_counter = db_calls_counter
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+        def counted_method(*args, **kwargs):
+            self._db_calls_counter.increment()
+            return attribute(*args, **kwargs)
+        return counted_method
+
+
+class CountingDatabase:
+    """Wraps a mongomock database, which sends no command events, counting the calls
+    to the methods of its collections instead.
+    """
+
+    def __init__(self, database, db_calls_counter: DbCallsCounter):
+        self._database = database
+        self._db_calls_counter = db_calls_counter
+
+    def __getattr__(self, name: str) -> _CountingCollection:
+        return _CountingCollection(self._database[name], self._db_calls_counter)
+
+    __getitem__ = __getattr__
+
+
+class LoadTestBot(metrics.InstrumentedBot):
+    """Bot which keeps the latency of each Bot API request."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.request_latencies : List[float] = []
+
+    def _post(self, endpoint: str, data: dict = None, timeout: float = None, api_kwargs: dict = None) -> object:
+        start_time = time.perf_counter()
+        try:
+            return super()._post(endpoint, data=data, timeout=timeout, api_kwargs=api_kwargs)
+        finally:
+            # * list.append is atomic
+            self.request_latencies.append(time.perf_counter() - start_time)
+
+
+class LoadTest:
+    """The bot, its dispatcher and the fake Bot API used by the scenarios."""
+
+    def __init__(self, server: FakeBotApiServer, db_calls_counter: DbCallsCounter, users_data: List[Dict], num_of_workers: int = 8):
+        self.server = server
+        self.db_calls_counter = db_calls_counter
+        self.users_data = users_data
+        self.num_of_workers = num_of_workers
+        self.bot = LoadTestBot(TOKEN, base_url=server.base_url, request=Request(con_pool_size=num_of_workers + 4))
+        self.dispatcher = Dispatcher(self.bot, queue.Queue(), use_context=True)
+        lot_bot.add_handlers(self.dispatcher)
+        self.dispatcher.add_error_handler(self._count_error)
+        self.handler_errors = 0
+        self._update_ids = iter(range(1, 10**9))
+        self._errors_lock = threading.Lock()
+        # * the giocata sent by the fan-out scenario, used by the following ones
+        self.giocata_text : Optional[str] = None
+        self.giocata_data : Optional[Dict] = None
+
+    def _count_error(self, update: Update, context: CallbackContext):
+        with self._errors_lock:
+            self.handler_errors += 1
+
+    def _process_update(self, update: Update) -> float:
+        start_time = time.perf_counter()
+        self.dispatcher.process_update(update)
+        return time.perf_counter() - start_time
+
+    def run_scenario(self, name: str, updates: List[Update]) -> ScenarioResult:
+        """Sends the updates to the dispatcher, using the workers, and measures them.
+
+        Args:
+            name (str)
+            updates (List[Update])
+
+        Returns:
+            ScenarioResult
+        """
+        self.server.state.reset_stats()
+        self.bot.request_latencies = []
+        self.handler_errors = 0
+        db_calls_before = self.db_calls_counter.count
+        start_time = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.num_of_workers, len(updates))) as executor:
+            update_latencies = list(executor.map(self._process_update, updates))
+        duration = time.perf_counter() - start_time
+        return ScenarioResult(
+            name=name,
+            num_of_updates=len(updates),
+            duration=duration,
+            update_latencies=update_latencies,
+            request_latencies=list(self.bot.request_latencies),
+            requests_by_method=dict(self.server.state.requests_by_method),
+            responses_by_code=dict(self.server.state.responses_by_code),
+            db_calls=self.db_calls_counter.count - db_calls_before,
+            handler_errors=self.handler_errors,
+        )
+
+    def create_update(self, update_type: str, update_data: Dict) -> Update:
+        return Update.de_json({"update_id": next(self._update_ids), update_type: update_data}, self.bot)
+
+    def create_channel_post(self, sport_name: str, text: str) -> Update:
+        return self.create_update("channel_post", {
+            "message_id": next(self._update_ids),
+            "date": int(time.time()),
+            "chat": {"id": SPORTS_CHANNELS_ID[sport_name], "type": "channel"},
+            "text": text,
+        })
+
+    def get_active_users_ids(self, sport_name: str) -> List[int]:
+        """Returns the IDs of the users who receive the messages of the sport."""
+        now = datetime.datetime.now().timestamp()
+        return [
+            user_data["_id"] for user_data in self.users_data
+            if not user_data["blocked"] and user_data["_id"] not in self.server.state.blocked_chat_ids and (
+                user_data["sport_access"].get(sport_name, 0) > now or user_data["sport_access"].get("all", 0) > now
+            )
+        ]
+
+
+def run_giocata_fan_out(load_test: LoadTest) -> ScenarioResult:
+    """A giocata is posted in the calcio channel and sent to all its subscribers."""
+    load_test.giocata_text, load_test.giocata_data = create_giocata(spr.sports_container.CALCIO, strat.strategies_container.PRODUZIONE)
+    update = load_test.create_channel_post(spr.sports_container.CALCIO.name, load_test.giocata_text)
+    return load_test.run_scenario("giocata fan-out", [update])
+
+
+def _ensure_giocata(load_test: LoadTest):
+    if load_test.giocata_data is None:
+        run_giocata_fan_out(load_test)
+
+
+def run_callback_burst(load_test: LoadTest, num_of_callbacks: int = 500) -> ScenarioResult:
+    """The users who received the giocata register it at the same time."""
+    _ensure_giocata(load_test)
+    giocata = db.mongo.giocate.find_one({"sport": load_test.giocata_data["sport"], "giocata_num": load_test.giocata_data["giocata_num"]})
+    message_text = load_test.giocata_text + "\n\nSeguirai questo evento?"
+    updates = []
+    for user_id in load_test.get_active_users_ids(spr.sports_container.CALCIO.name)[:num_of_callbacks]:
+        updates.append(load_test.create_update("callback_query", {
+            "id": str(user_id),
+            "from": {"id": user_id, "first_name": f"Load{user_id}", "is_bot": False},
+            "chat_instance": str(user_id),
+            "data": f"register_giocata_yes_{giocata['_id']}_",
+            "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": user_id, "type": "private"}, "text": message_text},
+        }))
+    return load_test.run_scenario("callback burst", updates)
+
+
+def run_outcome_settlement(load_test: LoadTest) -> ScenarioResult:
+    """The outcome of the giocata is posted: it is sent to the users who registered it
+    and their budgets are updated.
+    """
+    _ensure_giocata(load_test)
+    outcome_text = f"🟢 {spr.sports_container.CALCIO.display_name}#{load_test.giocata_data['giocata_num']} Vincente +5,50% 🟢"
+    update = load_test.create_channel_post(spr.sports_container.CALCIO.name, outcome_text)
+    return load_test.run_scenario("outcome settlement", [update])
+
+
+def run_broadcast(load_test: LoadTest) -> ScenarioResult:
+    """An admin broadcasts a message to all the users who did not block the bot."""
+    text = "/broadcast\nMessaggio di prova del load test"
+    update = load_test.create_update("message", {
+        "message_id": next(load_test._update_ids),
+        "date": int(time.time()),
+        "chat": {"id": data_generator.FIRST_USER_ID, "type": "private"},
+        "from": {"id": data_generator.FIRST_USER_ID, "first_name": "Admin", "is_bot": False},
+        "text": text,
+        "entities": [{"type": "bot_command", "offset": 0, "length": len("/broadcast")}],
+    })
+    return load_test.run_scenario("broadcast", [update])
+
+
+SCENARIOS = {
+    "fan_out": run_giocata_fan_out,
+    "callback_burst": run_callback_burst,
+    "outcome_settlement": run_outcome_settlement,
+    "broadcast": run_broadcast,
+}
+
+
+def configure_bot():
+    """Sets the channels used by the handlers' filters and disables the developers' notifications."""
+    cfg.config.SPORTS_CHANNELS_ID = SPORTS_CHANNELS_ID
+    cfg.config.TEACHERBET_CHANNEL_ID = TEACHERBET_CHANNEL_ID
+    cfg.config.DEVELOPER_CHAT_IDS = []
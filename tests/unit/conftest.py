@@ -34,3 +34,34 @@ def new_user() -> Dict:
     user_manager.create_user(user_data)
     yield user_data
     user_manager.delete_user_by_id(user_data["_id"])
+
+
+@pytest.fixture()
+def mock_array_filters(monkeypatch):
+    """Fixture which makes update_one support the array filters, which
+        are not implemented by mongomock, applying each filtered update
+        to the first element of the array matching the filter
+    """
+    update_one = mongomock.collection.Collection.update_one
+    def update_one_with_array_filters(collection, query, update, array_filters=None, **kwargs):
+        if not array_filters:
+            return update_one(collection, query, update, **kwargs)
+        document = collection.find_one(query)
+        if document is None:
+            return update_one(collection, query, update, **kwargs)
+        for array_filter in array_filters:
+            identifier = next(iter(array_filter)).split(".")[0]
+            element_filter = {key.split(".", 1)[1]: value for key, value in array_filter.items()}
+            filtered_update = {}
+            for operator, fields in update.items():
+                filtered_update[operator] = {}
+                for field, value in fields.items():
+                    if f".$[{identifier}]" in field:
+                        array_field = field.split(f".$[{identifier}]")[0]
+                        index = next(index for index, element in enumerate(document[array_field])
+                            if all(element.get(key) == filter_value for key, filter_value in element_filter.items()))
+                        field = field.replace(f"$[{identifier}]", str(index))
+                    filtered_update[operator][field] = value
+            update = filtered_update
+        return update_one(collection, {"_id": document["_id"]}, update, **kwargs)
+    monkeypatch.setattr(mongomock.collection.Collection, "update_one", update_one_with_array_filters)
@@ -43,6 +43,24 @@ def test_retrieve_giocata_by_num_and_sport(monkeypatch):
         giocate_manager.retrieve_giocata_by_num_and_sport(new_giocata)
 
 
+def test_retrieve_giocata_by_id(monkeypatch):
+    empty_giocata = giocata_model.create_base_giocata()
+    empty_giocata["sport"] = "test_retrieve_by_id"
+    empty_giocata["giocata_num"] = "12345"
+    giocata_id = giocate_manager.create_giocata(empty_giocata)
+    assert giocata_id
+    # * both the ObjectId and its string (as in callback data) are accepted
+    assert giocate_manager.retrieve_giocata_by_id(giocata_id)["giocata_num"] == empty_giocata["giocata_num"]
+    assert giocate_manager.retrieve_giocata_by_id(str(giocata_id))["giocata_num"] == empty_giocata["giocata_num"]
+    # * invalid or non-existing ids
+    assert giocate_manager.retrieve_giocata_by_id("impossible_id") is None
+    assert giocate_manager.retrieve_giocata_by_id("0" * 24) is None
+    # * db error
+    monkeypatch.setattr(db, "mongo", None)
+    with pytest.raises(Exception):
+        giocate_manager.retrieve_giocata_by_id(giocata_id)
+
+
 def test_retrieve_giocate_from_ids():
     # TODO finish
     return
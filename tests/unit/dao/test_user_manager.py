@@ -8,6 +8,7 @@ from lot_bot import database as db
 from lot_bot import logger as lgr
 from lot_bot.dao import giocate_manager, user_manager
 from lot_bot.models import giocate as giocata_model
+from lot_bot.models import subscriptions as subs
 from lot_bot.models import users as user_model
 
 
@@ -74,6 +75,19 @@ def test_update_user(new_user: Dict, monkeypatch):
         user_manager.update_user(user_id, {"name": new_name})
 
 
+def test_update_user_subscriptions_sport_access(new_user: Dict):
+    user_id = new_user["_id"]
+    expiration_date = (datetime.datetime.utcnow() + datetime.timedelta(days=2)).timestamp()
+    user_subscriptions = [
+        {"name": subs.sub_container.LOTFREE.name, "expiration_date": expiration_date},
+        {"name": subs.sub_container.LOTCOMPLETE.name, "expiration_date": expiration_date - 10},
+    ]
+    assert user_manager.update_user(user_id, {"subscriptions": user_subscriptions})
+    updated_user = user_manager.retrieve_user(user_id)
+    assert updated_user["sport_access"] == subs.create_sport_access_from_subscriptions(user_subscriptions)
+    assert updated_user["sport_access"][subs.ALL_SPORTS_ACCESS_KEY] == expiration_date - 10
+
+
 def test_delete_user(new_user: Dict, monkeypatch):
     user_id = new_user["_id"]
     assert user_manager.delete_user_by_id(user_id)
@@ -84,6 +98,27 @@ def test_delete_user(new_user: Dict, monkeypatch):
     assert not user_manager.delete_user(user_id)
     
 
+def test_store_subscriptions_derived_fields(new_user: Dict):
+    user_id = new_user["_id"]
+    expiration_date = (datetime.datetime.utcnow() + datetime.timedelta(days=2)).timestamp()
+    user_subscriptions = [
+        {"name": subs.sub_container.LOTFREE.name, "expiration_date": expiration_date},
+        {"name": subs.sub_container.LOTCOMPLETE.name, "expiration_date": expiration_date},
+    ]
+    # * a legacy user, whose LoT subscription was just extended by a payment
+    db.mongo.utenti.update_one({"_id": user_id}, {
+        "$set": {"subscriptions": [user_subscriptions[0], {**user_subscriptions[1], "expiration_date": expiration_date + 100}]},
+        "$unset": {"sport_access": "", "lot_expiration_date": ""},
+    })
+    db.mongo.utenti.update_one({"_id": user_id}, {"$set": {f"sport_access.{subs.ALL_SPORTS_ACCESS_KEY}": expiration_date + 100}})
+    assert user_manager.store_subscriptions_derived_fields(user_id, user_subscriptions)
+    updated_user = user_manager.retrieve_user(user_id)
+    assert updated_user["subscriptions"][1]["expiration_date"] == expiration_date + 100
+    assert updated_user["sport_access"][subs.ALL_SPORTS_ACCESS_KEY] == expiration_date + 100
+    assert updated_user["sport_access"]["calcio"] == expiration_date
+    assert updated_user["lot_expiration_date"] == expiration_date
+
+
 def test_check_user_active_validity():
     user_expiration_date = str((datetime.datetime.now() + datetime.timedelta(days=1)).timestamp())
     user_data = {"lot_subscription_expiration": user_expiration_date}
@@ -98,6 +133,18 @@ def test_check_user_expired_validity():
     assert validity == False
 
 
+def test_check_user_sport_subscription_all_sports():
+    now = datetime.datetime.now()
+    expiration_date = (now + datetime.timedelta(days=1)).timestamp()
+    # * lotcomplete gives access to every sport
+    user_subscriptions = [{"name": subs.sub_container.LOTCOMPLETE.name, "expiration_date": expiration_date}]
+    assert user_manager.check_user_sport_subscription(now, user_subscriptions, "calcio")
+    assert user_manager.check_user_sport_subscription(now, user_subscriptions, "tennis")
+    user_subscriptions = [{"name": subs.sub_container.LOTFREE.name, "expiration_date": expiration_date}]
+    assert user_manager.check_user_sport_subscription(now, user_subscriptions, "calcio")
+    assert not user_manager.check_user_sport_subscription(now, user_subscriptions, "tennis")
+
+
 def test_retrieve_user_id_by_referral(new_user: Dict, monkeypatch):
     user_ref_code = new_user["referral_code"]
     user_from_db = user_manager.retrieve_user_id_by_referral(user_ref_code)
@@ -126,6 +173,29 @@ def test_register_payment_for_user_id(new_user: Dict, monkeypatch):
         user_manager.register_payment_for_user_id(payment, user_id)
 
 
+def test_register_successful_payment(new_user: Dict, mock_array_filters):
+    user_id = new_user["_id"]
+    payment = get_random_payment()
+    subscription_entry = {"name": "lotcomplete", "expiration_date": 1000.0}
+    assert user_manager.register_successful_payment(user_id, payment, subscription_entry, None, {"email": "mario@lot.it"})
+    updated_user = user_manager.retrieve_user(user_id)
+    assert updated_user["subscriptions"] == [subscription_entry]
+    assert updated_user["sport_access"]["all"] == 1000.0
+    assert updated_user["email"] == "mario@lot.it"
+    assert user_manager.check_payment_registered(user_id, payment["telegram_payment_charge_id"])
+    # * the same payment is not registered twice
+    assert not user_manager.register_successful_payment(user_id, payment, {"name": "lotcomplete", "expiration_date": 2000.0}, 1000.0, {})
+    # * the subscription was changed after the expiration date was read
+    second_payment = get_random_payment()
+    assert not user_manager.register_successful_payment(user_id, second_payment, {"name": "lotcomplete", "expiration_date": 2000.0}, 500.0, {})
+    assert user_manager.register_successful_payment(user_id, second_payment, {"name": "lotcomplete", "expiration_date": 2000.0}, 1000.0, {})
+    updated_user = user_manager.retrieve_user(user_id)
+    assert updated_user["subscriptions"] == [{"name": "lotcomplete", "expiration_date": 2000.0}]
+    assert updated_user["sport_access"]["all"] == 2000.0
+    assert len(updated_user["payments"]) == 2
+    assert not user_manager.check_payment_registered(user_id, "wrong charge id")
+
+
 def test_update_user_succ_referrals(new_user: Dict):
     user_id = new_user["_id"]
     payment_ids = []
@@ -301,3 +371,32 @@ def test_update_user_giocata_with_previous_budget(new_user: Dict, correct_giocat
     # * inexistent giocata
     assert not user_manager.update_user_giocata_with_previous_budget(user_id, -1, previous_budget)
 
+
+
+def test_update_user_subscriptions_lot_expiration_date(new_user: Dict):
+    user_id = new_user["_id"]
+    user_subscriptions = [
+        {"name": subs.sub_container.LOTFREE.name, "expiration_date": 3000.0},
+        {"name": subs.sub_container.LOTCOMPLETE.name, "expiration_date": 2000.0},
+    ]
+    assert user_manager.update_user(user_id, {"subscriptions": user_subscriptions})
+    assert user_manager.retrieve_user(user_id)["lot_expiration_date"] == 2000.0
+    assert user_manager.update_user(user_id, {"subscriptions": user_subscriptions[:1]})
+    assert user_manager.retrieve_user(user_id)["lot_expiration_date"] == 0
+
+
+def test_retrieve_users_to_remind_of_expiration(new_user: Dict):
+    user_id = new_user["_id"]
+    user_manager.update_user(user_id, {"subscriptions": [{"name": subs.sub_container.LOTCOMPLETE.name, "expiration_date": 2000.0}]})
+    assert user_manager.retrieve_users_to_remind_of_expiration(1000.0, 3000.0) == [{"_id": user_id, "lot_expiration_date": 2000.0}]
+    assert user_manager.retrieve_users_to_remind_of_expiration(1000.0, 1500.0) == []
+    assert user_manager.claim_expiry_reminder(user_id, 2000.0, 1000.0)
+    assert user_manager.retrieve_users_to_remind_of_expiration(1000.0, 3000.0) == []
+    # * the reminder is claimed only once
+    assert not user_manager.claim_expiry_reminder(user_id, 2000.0, 1000.0)
+    assert user_manager.release_expiry_reminders({user_id: 2000.0}) == 1
+    assert user_manager.retrieve_users_to_remind_of_expiration(1000.0, 3000.0) == [{"_id": user_id, "lot_expiration_date": 2000.0}]
+    assert user_manager.claim_expiry_reminder(user_id, 2000.0, 1000.0)
+    # * the reminded expiration date is in the past after a renewal
+    user_manager.update_user(user_id, {"subscriptions": [{"name": subs.sub_container.LOTCOMPLETE.name, "expiration_date": 5000.0}]})
+    assert user_manager.retrieve_users_to_remind_of_expiration(4000.0, 6000.0) == [{"_id": user_id, "lot_expiration_date": 5000.0}]
@@ -0,0 +1,102 @@
+import random
+from typing import Dict, List
+
+import numpy as np
+import pytest
+from lot_bot.models import backtest
+from lot_bot.models import giocate as giocata_model
+from lot_bot.models import personal_stakes as personal_stakes_model
+from lot_bot.models import users
+
+SPORTS_AND_STRATEGIES = [("calcio", "produzione"), ("calcio", "live"), ("tennis", "produzione"), ("exchange", "produzione")]
+
+
+def get_random_giocate(num_of_giocate: int) -> List[Dict]:
+    random_giocate = []
+    for index in range(num_of_giocate):
+        sport, strategy = random.choice(SPORTS_AND_STRATEGIES)
+        giocata = {
+            "sport": sport,
+            "strategy": strategy,
+            "base_stake": random.randint(100, 1000),
+            "base_quota": random.randint(110, 400),
+            "outcome": random.choice(["win", "loss", "void", "?"]),
+            "sent_timestamp": float(random.randint(0, 10**6) + index),
+        }
+        if sport == "exchange":
+            giocata["cashout"] = random.randint(-500, 500)
+        random_giocate.append(giocata)
+    return random_giocate
+
+
+def get_random_personal_stakes() -> List[Dict]:
+    personal_stakes = []
+    for _ in range(random.randint(0, 4)):
+        personal_stake = personal_stakes_model.create_base_personal_stake()
+        personal_stake["min_quota"] = random.randint(100, 250)
+        personal_stake["max_quota"] = personal_stake["min_quota"] + random.randint(1, 200)
+        personal_stake["stake"] = random.randint(100, 1000)
+        personal_stake["sport"] = random.choice(["all", "calcio", "tennis"])
+        personal_stake["strategies"] = random.choice([["all"], ["produzione"], ["live", "produzione"]])
+        personal_stakes.append(personal_stake)
+    return personal_stakes
+
+
+def test_run_backtest_matches_scalar_replay():
+    giocate = get_random_giocate(300)
+    configurations = [
+        backtest.BacktestConfiguration(f"conf{index}", get_random_personal_stakes(), random.choice(backtest.INTEREST_TYPES), random.randint(1000, 100000))
+        for index in range(20)
+    ]
+    result = backtest.run_backtest(backtest.create_giocate_columns(giocate), configurations)
+    replayed_giocate = sorted([giocata for giocata in giocate if giocata["outcome"] != "?"], key=lambda giocata: giocata["sent_timestamp"])
+    assert result.equity_curves.shape == (len(configurations), len(replayed_giocate) + 1)
+    for configuration, equity_curve in zip(configurations, result.equity_curves):
+        compiled_personal_stakes = personal_stakes_model.compile_personal_stakes(list(configuration.personal_stakes))
+        budget = configuration.initial_budget
+        expected_equity_curve = [budget]
+        for giocata in replayed_giocate:
+            personal_stake = personal_stakes_model.find_personal_stake(compiled_personal_stakes, giocata["sport"], giocata["strategy"], giocata["base_quota"])
+            if configuration.interest_type == "composto":
+                budget = users.calculate_new_budget_after_giocata2(budget, giocata, personal_stake)
+            else:
+                budget += users.calculate_new_budget_after_giocata2(configuration.initial_budget, giocata, personal_stake) - configuration.initial_budget
+            expected_equity_curve.append(budget)
+        # * the semplice budgets can reach zero, where a relative tolerance is not enough
+        assert equity_curve == pytest.approx(expected_equity_curve, abs=1e-6)
+
+
+def test_calculate_outcome_percentages():
+    giocate = get_random_giocate(200)
+    columns = backtest.create_giocate_columns(giocate)
+    outcome_percentages = backtest.calculate_outcome_percentages(columns, columns.base_stakes[np.newaxis, :])[0]
+    for index, outcome_percentage in enumerate(outcome_percentages.tolist()):
+        if not np.isnan(columns.cashouts[index]):
+            expected_percentage = columns.cashouts[index] / 100 * int(columns.outcomes[index] != "void")
+        else:
+            expected_percentage = giocata_model.get_outcome_percentage(columns.outcomes[index], int(columns.base_stakes[index]), int(columns.quotas[index]))
+        assert outcome_percentage == expected_percentage
+
+
+def test_calculate_outcome_percentages_mb():
+    giocate = [
+        {"sport": "exchange", "strategy": giocata_model.MB_STRATEGY_NAME, "base_stake": 500, "base_quota": 200, "outcome": outcome, "sent_timestamp": index}
+        for index, outcome in enumerate(["win", "loss"])
+    ]
+    columns = backtest.create_giocate_columns(giocate)
+    outcome_percentages = backtest.calculate_outcome_percentages(columns, columns.base_stakes[np.newaxis, :])[0]
+    assert outcome_percentages.tolist() == [giocata_model.MB_OUTCOME_PERCENTAGES["win"], giocata_model.MB_OUTCOME_PERCENTAGES["loss"]]
+
+
+def test_calculate_drawdowns():
+    equity_curves = np.array([[100.0, 120.0, 90.0, 130.0, 65.0]])
+    drawdowns = backtest.calculate_drawdowns(equity_curves)
+    assert drawdowns[0].tolist() == pytest.approx([0, 0, 0.25, 0, 0.5])
+    result = backtest.BacktestResult((), np.array([]), equity_curves, drawdowns)
+    assert result.max_drawdowns.tolist() == [0.5]
+    assert result.final_budgets.tolist() == [65.0]
+
+
+def test_backtest_configuration_interest_type():
+    with pytest.raises(ValueError):
+        backtest.BacktestConfiguration("wrong", interest_type="wrong")
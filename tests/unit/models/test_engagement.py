@@ -0,0 +1,46 @@
+from bson import ObjectId
+
+from lot_bot import database as db
+from lot_bot.models import engagement
+
+
+def test_compute_engagement_rankings():
+    giocate = [
+        {"_id": 1, "sport": "calcio", "strategy": "produzione", "sent_timestamp": 100.0},
+        {"_id": 2, "sport": "calcio", "strategy": "produzione", "sent_timestamp": 200.0},
+        {"_id": 3, "sport": "calcio", "strategy": "multipla", "sent_timestamp": 300.0},
+    ]
+    users_accepted_giocate = [
+        {"_id": 10, "accepted_giocate": [1]},
+        {"_id": 11, "accepted_giocate": [1, 2]},
+        {"_id": 12, "accepted_giocate": [2, 3, 99]},
+        {"_id": 13, "accepted_giocate": [3]},
+    ]
+    rankings = engagement.compute_engagement_rankings(giocate, users_accepted_giocate)
+    # * 11 and 12 accepted two giocate, 12 more recently
+    assert rankings["calcio/produzione"] == [11, 12, 10]
+    assert rankings["calcio/multipla"] == [12, 13]
+    assert rankings["calcio/all"] == [12, 11, 13, 10]
+
+
+def test_refresh_engagement_rankings_and_order_user_ids():
+    old_giocata_id, recent_giocata_id = ObjectId(), ObjectId()
+    db.mongo.giocate.insert_many([
+        {"_id": old_giocata_id, "giocata_num": "9001", "sport": "basket", "strategy": "produzione", "sent_timestamp": 1000.0},
+        {"_id": recent_giocata_id, "giocata_num": "9002", "sport": "basket", "strategy": "produzione", "sent_timestamp": 90000.0},
+    ])
+    db.mongo.analytics.insert_many([
+        {"_id": 4001, "accepted_giocate": [old_giocata_id]},
+        {"_id": 4002, "accepted_giocate": [recent_giocata_id]},
+    ])
+    db.mongo.engagement_rankings.insert_one({"_id": "tennis/produzione", "user_ids": b"", "size": 0, "refreshed_at": 0})
+    try:
+        assert engagement.refresh_engagement_rankings(now_timestamp=100000.0, window_days=1) == 2
+        # * the rankings of the strategies without recently accepted giocate are deleted
+        assert db.mongo.engagement_rankings.find_one({"_id": "tennis/produzione"}) is None
+        assert engagement.order_user_ids_by_engagement([4001, 4003, 4002], "basket", "produzione") == [4002, 4001, 4003]
+        assert engagement.order_user_ids_by_engagement([4001, 4003, 4002], "tennis", "produzione") == [4001, 4003, 4002]
+    finally:
+        db.mongo.giocate.delete_many({"_id": {"$in": [old_giocata_id, recent_giocata_id]}})
+        db.mongo.analytics.delete_many({"_id": {"$in": [4001, 4002]}})
+        db.mongo.engagement_rankings.delete_many({})
@@ -1,6 +1,7 @@
 import random
 from typing import Dict, Tuple
 
+import numpy as np
 import pytest
 from lot_bot.models import giocate as giocata_model
 
@@ -24,6 +25,20 @@ def test_get_outcome_percentage():
     assert outcome_perc == 0.0
 
 
+def test_get_outcome_percentages():
+    outcomes = ["win", "loss", "?", "test"] * 5
+    stakes = [random.randint(100, 10000) for _ in outcomes]
+    quotas = [random.randint(100, 10000) for _ in outcomes]
+    outcome_percs = giocata_model.get_outcome_percentages(np.array(outcomes), np.array(stakes), np.array(quotas))
+    assert outcome_percs.tolist() == [
+        giocata_model.get_outcome_percentage(outcome, stake, quota)
+        for outcome, stake, quota in zip(outcomes, stakes, quotas)
+    ]
+    # * a single outcome and quota for many stakes
+    outcome_percs = giocata_model.get_outcome_percentages("win", np.array(stakes), quotas[0])
+    assert outcome_percs.tolist() == [giocata_model.get_outcome_percentage("win", stake, quotas[0]) for stake in stakes]
+
+
 @pytest.mark.parametrize(
     "giocata_text,sport,num,outcome",
     [
@@ -235,3 +235,51 @@ def test_check_stakes_overlapping():
     fake_command_args = get_fake_stake_command_args(random_stake_data)
     parsed_stake = personal_stakes.parse_personal_stake(fake_command_args)
     assert personal_stakes.check_stakes_overlapping(parsed_stake, [parsed_stake_with_sports_and_strat])
+
+
+def _find_personal_stake_linearly(user_stakes: List[Dict], sport_name: str, strategy_name: str, quota: int):
+    for user_stake in user_stakes:
+        if ((user_stake["sport"] != "all" and user_stake["sport"] != sport_name) or 
+            ("all" not in user_stake["strategies"] and strategy_name not in user_stake["strategies"])):
+            continue
+        if user_stake["min_quota"] > quota or user_stake["max_quota"] < quota:
+            continue
+        return user_stake["stake"]
+    return None
+
+
+@pytest.mark.parametrize("num_of_stakes", [0, 1, 5, 20])
+def test_find_personal_stake(num_of_stakes: int):
+    # * stakes may overlap here, the first one in the list must win as in a linear scan
+    user_stakes = []
+    for _ in range(num_of_stakes):
+        user_stake = personal_stakes.create_base_personal_stake()
+        user_stake["min_quota"] = random.randint(100, 500)
+        user_stake["max_quota"] = user_stake["min_quota"] + random.randint(1, 300)
+        user_stake["stake"] = random.randint(1, 10000)
+        random_sport = random.choice(spr.sports_container.astuple())
+        user_stake["sport"] = random.choice([random_sport.name, "all"])
+        user_stake["strategies"] = random.choice([[random.choice(random_sport.strategies).name], ["all"]])
+        user_stakes.append(user_stake)
+    compiled_personal_stakes = personal_stakes.compile_personal_stakes(user_stakes)
+    for _ in range(200):
+        random_sport = random.choice(spr.sports_container.astuple())
+        random_strategy = random.choice(random_sport.strategies)
+        quota = random.randint(50, 900)
+        expected_stake = _find_personal_stake_linearly(user_stakes, random_sport.name, random_strategy.name, quota)
+        assert personal_stakes.find_personal_stake(compiled_personal_stakes, random_sport.name, random_strategy.name, quota) == expected_stake
+
+
+def test_find_personal_stake_inclusive_range():
+    user_stake = personal_stakes.create_base_personal_stake()
+    user_stake.update({"min_quota": 150, "max_quota": 200, "stake": 300, "sport": "calcio", "strategies": ["all"]})
+    compiled_personal_stakes = personal_stakes.compile_personal_stakes([user_stake])
+    assert personal_stakes.find_personal_stake(compiled_personal_stakes, "calcio", "live", 150) == 300
+    assert personal_stakes.find_personal_stake(compiled_personal_stakes, "calcio", "live", 200) == 300
+    assert personal_stakes.find_personal_stake(compiled_personal_stakes, "calcio", "live", 149) is None
+    assert personal_stakes.find_personal_stake(compiled_personal_stakes, "calcio", "live", 201) is None
+    assert personal_stakes.find_personal_stake(compiled_personal_stakes, "tennis", "live", 175) is None
+    # * a new stake containing an existing one is overlapping too
+    new_stake = dict(user_stake, min_quota=100, max_quota=300)
+    assert personal_stakes.check_stakes_overlapping(new_stake, [user_stake])
+    assert not personal_stakes.check_stakes_overlapping(dict(new_stake, min_quota=201), [user_stake])
@@ -0,0 +1,84 @@
+import pytest
+from lot_bot import constants as cst
+from lot_bot import custom_exceptions
+from lot_bot import database as db
+from lot_bot.dao import segments_manager, user_manager
+from lot_bot.models import segments
+from lot_bot.models import users as user_model
+
+USER_IDS = range(3001, 3007)
+
+
+@pytest.fixture()
+def segment_users():
+    # * (lot_expiration_date, first_access_timestamp, blocked, role)
+    users_fields = [(2000.0, 300.0, False, "user"), (500.0, 100.0, False, "user"), (0, 200.0, False, "admin"),
+        (2000.0, 400.0, True, "user"), (3000.0, None, False, "user"), (500.0, 500.0, False, "analyst")]
+    for user_id, (lot_expiration_date, first_access_timestamp, blocked, role) in zip(USER_IDS, users_fields):
+        user_data = user_model.create_base_user_data()
+        user_data.update({"_id": user_id, "lot_expiration_date": lot_expiration_date, "blocked": blocked, "role": role})
+        if first_access_timestamp is not None:
+            user_data["first_access_timestamp"] = first_access_timestamp
+        user_manager.create_user(user_data)
+    yield
+    for user_id in USER_IDS:
+        user_manager.delete_user_by_id(user_id)
+    db.mongo.segments.delete_many({})
+
+
+def get_segment_ids(segment_data, activated_since_timestamp: float = None):
+    return [user_id for user_id in segments.get_segment_user_ids(segment_data, activated_since_timestamp) if user_id in USER_IDS]
+
+
+def test_refresh_builtin_segments(segment_users):
+    refreshed_segments = {segment_data["_id"]: segment_data for segment_data in segments.refresh_all_segments(now_timestamp=1000.0)}
+    assert sorted(get_segment_ids(refreshed_segments["active"])) == [3001, 3005]
+    assert sorted(get_segment_ids(refreshed_segments["expired"])) == [3002, 3006]
+    # * sorted by first access
+    not_blocked_segment = segments.get_segment("not_blocked")
+    assert get_segment_ids(not_blocked_segment) == [3005, 3002, 3003, 3001, 3006]
+    assert get_segment_ids(not_blocked_segment, activated_since_timestamp=200.0) == [3001, 3006]
+    with pytest.raises(ValueError):
+        segments.get_segment_user_ids(refreshed_segments["active"], activated_since_timestamp=200.0)
+
+
+def test_custom_segment(segment_users):
+    query = segments.parse_custom_segment_definition("staff", '{"role": {"$in": ["admin", "analyst"]}}')
+    segments.refresh_segment("staff", query)
+    segments.refresh_all_segments()
+    assert get_segment_ids(segments.get_segment("staff")) == [3003, 3006]
+    assert "staff" in [segment_summary["_id"] for segment_summary in segments_manager.retrieve_segments_summaries()]
+    assert segments_manager.delete_segment("staff")
+    assert segments.get_segment("staff") is None
+
+
+def test_get_segment_refreshes_old_segments(segment_users):
+    query = segments.parse_custom_segment_definition("staff", '{"role": {"$in": ["admin", "analyst"]}}')
+    segments.refresh_segment("staff", query, now_timestamp=1000.0)
+    segments.refresh_segment("active", now_timestamp=1000.0)
+    user_manager.update_user(3001, {"role": "admin", "lot_expiration_date": 500.0})
+    # * the segments are used as they are until they are old
+    assert get_segment_ids(segments.get_segment("staff", now_timestamp=1010.0)) == [3003, 3006]
+    assert sorted(get_segment_ids(segments.get_segment("active", now_timestamp=1010.0))) == [3001, 3005]
+    refresh_timestamp = 1000.0 + cst.SEGMENTS_REFRESH_INTERVAL
+    assert get_segment_ids(segments.get_segment("staff", now_timestamp=refresh_timestamp)) == [3001, 3003, 3006]
+    assert get_segment_ids(segments.get_segment("active", now_timestamp=refresh_timestamp)) == [3005]
+    assert segments_manager.retrieve_segment("active")["refreshed_at"] == refresh_timestamp
+
+
+@pytest.mark.parametrize("name,query_text", [
+    ("Staff", '{"role": "admin"}'),
+    ("active", '{"role": "admin"}'),
+    ("staff", '{"role": '),
+    ("staff", '["role"]'),
+    ("staff", '{"$or": [{"role": "admin"}, {"$where": "true"}]}'),
+])
+def test_parse_custom_segment_definition_errors(name: str, query_text: str):
+    with pytest.raises(custom_exceptions.SegmentDefinitionError):
+        segments.parse_custom_segment_definition(name, query_text)
+
+
+def test_pack_ids():
+    user_ids = [1, 2**40, -100123]
+    assert list(segments.unpack_ids(segments.pack_ids(user_ids))) == user_ids
+    assert segments.estimate_send_time(500) == 500 / segments.cst.MAX_MESSAGES_PER_SECOND
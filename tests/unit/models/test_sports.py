@@ -0,0 +1,68 @@
+import pytest
+from lot_bot.models import sports as spr
+from lot_bot.models import strategies as strat
+from lot_bot.models import subscriptions as subs
+
+
+@pytest.mark.parametrize("sport", spr.sports_container.astuple())
+def test_get_sport(sport: spr.Sport):
+    assert spr.sports_container.get_sport(sport.name) is sport
+    assert spr.sports_container.get_sport(f" {sport.name.upper()} ") is sport
+    assert spr.sports_container.get_sport_by_display_name(sport.display_name) is sport
+    assert sport in spr.sports_container
+    for strategy in sport.strategies:
+        assert sport.has_strategy(strategy)
+        assert strategy.name in sport.strategy_names
+
+
+def test_get_sport_not_found():
+    assert spr.sports_container.get_sport("impossible sport") is None
+    assert spr.sports_container.get_sport(None) is None
+    assert spr.sports_container.get_sport_by_display_name("impossible sport") is None
+    assert not spr.sports_container.EXCHANGE.has_strategy(None)
+    assert not spr.sports_container.EXCHANGE.has_strategy(strat.strategies_container.LIVE)
+
+
+def test_sports_identity_equality():
+    wrong_sport = spr.Sport(spr.sports_container.CALCIO.name, [])
+    assert wrong_sport != spr.sports_container.CALCIO
+    assert wrong_sport not in spr.sports_container
+    assert spr.sports_container.get_sports_in_menu() == tuple(sport for sport in spr.sports_container if sport.show_in_menu)
+
+
+@pytest.mark.parametrize("strategy", strat.strategies_container.astuple())
+def test_get_strategy(strategy: strat.Strategy):
+    assert strat.strategies_container.get_strategy(strategy.name) is strategy
+    assert strat.strategies_container.get_strategy_by_display_name(strategy.display_name) is strategy
+    assert strategy in strat.strategies_container
+    assert strat.Strategy(strategy.name) not in strat.strategies_container
+
+
+@pytest.mark.parametrize("sub", subs.sub_container.astuple())
+def test_get_subscription(sub: subs.Subscription):
+    assert subs.sub_container.get_subscription(sub.name) is sub
+    for alias in sub.aliases:
+        assert subs.sub_container.get_subscription(alias) is sub
+    assert subs.sub_container.get_subscription("impossible sub") is None
+
+
+def test_create_sport_access_from_subscriptions():
+    calcio = spr.sports_container.CALCIO.name
+    tennis = spr.sports_container.TENNIS.name
+    user_subscriptions = [
+        {"name": subs.sub_container.LOTFREE.name, "expiration_date": 200},
+        {"name": subs.sub_container.LOTCOMPLETE.name, "expiration_date": 100},
+        {"name": "impossible sub", "expiration_date": 300},
+    ]
+    sport_access = subs.create_sport_access_from_subscriptions(user_subscriptions)
+    assert sport_access == {
+        calcio: 200,
+        spr.sports_container.TUTTOILRESTO.name: 200,
+        subs.ALL_SPORTS_ACCESS_KEY: 100,
+    }
+    assert subs.get_sport_access_expiration(sport_access, calcio) == 200
+    assert subs.get_sport_access_expiration(sport_access, tennis) == 100
+    assert subs.get_sport_access_expiration({}, tennis) == 0
+    # * every sport is available
+    assert subs.get_available_sports_names_from_sport_access(sport_access, 50) == []
+    assert sorted(subs.get_available_sports_names_from_sport_access(sport_access, 150)) == sorted([calcio, spr.sports_container.TUTTOILRESTO.name])
@@ -3,6 +3,7 @@ import random
 import re
 from typing import Dict, Tuple
 
+import numpy as np
 import pytest
 from lot_bot import constants as cst
 from lot_bot import logger as lgr
@@ -137,6 +138,67 @@ def test_calculate_new_budget_after_giocata_cashout(outcome: str):
     assert new_budget == correct_budget
 
 
+@pytest.mark.parametrize(
+    "outcome, has_cashout",
+    [("win", False), ("loss", False), ("void", False), ("neutral", False), ("win", True), ("loss", True), ("void", True)]
+)
+def test_calculate_new_budgets_after_giocata_matches_scalar(outcome: str, has_cashout: bool):
+    for _ in range(20):
+        base_giocata = giocate.create_base_giocata()
+        base_giocata["base_stake"] = random.randint(1, 10000)
+        base_giocata["base_quota"] = random.randint(101, 5000)
+        base_giocata["outcome"] = outcome
+        if has_cashout:
+            base_giocata["cashout"] = random.randint(-10000, 10000)
+        num_of_users = random.randint(1, 200)
+        budget_balances = [random.randint(0, 10**8) for _ in range(num_of_users)]
+        # * 0 means that the user has no personalized stake
+        personalized_stakes = [random.choice([0, random.randint(1, 10000)]) for _ in range(num_of_users)]
+        new_budgets = users.calculate_new_budgets_after_giocata(np.array(budget_balances), base_giocata, np.array(personalized_stakes))
+        for budget_balance, personalized_stake, new_budget in zip(budget_balances, personalized_stakes, new_budgets.tolist()):
+            assert new_budget == users.calculate_new_budget_after_giocata2(budget_balance, base_giocata, personalized_stake)
+
+
+def test_calculate_new_budgets_after_giocata_rounding_ties():
+    # * 0.125 (stake 1250, quota 2.00) is an exact tie, 2.675 and 1.115 are close to one
+    for base_stake, base_quota in [(1250, 200), (2675, 200), (1115, 200), (5, 300), (105, 200)]:
+        base_giocata = giocate.create_base_giocata()
+        base_giocata["base_stake"] = base_stake
+        base_giocata["base_quota"] = base_quota
+        base_giocata["outcome"] = "win"
+        new_budgets = users.calculate_new_budgets_after_giocata(np.array([10000, 12345]), base_giocata)
+        assert new_budgets.tolist() == [users.calculate_new_budget_after_giocata2(balance, base_giocata) for balance in [10000, 12345]]
+
+
 def test_update_single_user_budget_with_giocata():
     pass
 
+
+
+def test_register_payment_and_extend_subscription(new_user: Dict, mock_array_filters):
+    user_id = new_user["_id"]
+    payment = {"payment_id": "1", "telegram_payment_charge_id": "charge_1", "total_amount": 2490}
+    user_manager.update_user(user_id, {"linked_referral_user": {"linked_user_id": 1234, "linked_user_code": ""}})
+    new_expiration_date, linked_referral_id = users.register_payment_and_extend_subscription(user_id, payment, "lotcomplete", 30, "mario@lot.it")
+    assert linked_referral_id == 1234
+    expected_expiration_date = (datetime.datetime.utcnow() + datetime.timedelta(days=30)).timestamp()
+    assert new_expiration_date == pytest.approx(expected_expiration_date, abs=60)
+    # * the duplicate delivery of the same payment does not extend the subscription
+    assert users.register_payment_and_extend_subscription(user_id, payment, "lotcomplete", 30, "mario@lot.it") is None
+    second_payment = {"payment_id": "2", "telegram_payment_charge_id": "charge_2", "total_amount": 2490}
+    second_expiration_date, _ = users.register_payment_and_extend_subscription(user_id, second_payment, "lotcomplete", 30, "mario@lot.it")
+    assert second_expiration_date == pytest.approx(new_expiration_date + 30 * 24 * 60 * 60)
+    updated_user = user_manager.retrieve_user(user_id)
+    assert updated_user["subscriptions"] == [{"name": "lotcomplete", "expiration_date": second_expiration_date}]
+    assert [payment["referred_by"] for payment in updated_user["payments"]] == [1234, 1234]
+    with pytest.raises(Exception):
+        users.register_payment_and_extend_subscription(-1, payment, "lotcomplete", 30, "mario@lot.it")
+
+
+def test_get_user_available_sports_names_from_subscriptions():
+    expiration_date = (datetime.datetime.utcnow() + datetime.timedelta(days=1)).timestamp()
+    lotfree_entry = {"name": "lotfree", "expiration_date": expiration_date}
+    assert sorted(users.get_user_available_sports_names_from_subscriptions([lotfree_entry])) == ["calcio", "tuttoilresto"]
+    # * an all-sports subscription gives access to every sport, even together with a limited one
+    lotcomplete_entry = {"name": "lotcomplete", "expiration_date": expiration_date}
+    assert users.get_user_available_sports_names_from_subscriptions([lotfree_entry, lotcomplete_entry]) == []
@@ -0,0 +1,79 @@
+import threading
+from unittest import mock
+
+from lot_bot import error_reporter
+from lot_bot.handlers import message_handlers
+
+
+def raise_error(error: Exception):
+    raise error
+
+
+def get_raised_error(error: Exception) -> Exception:
+    try:
+        raise_error(error)
+    except Exception as e:
+        return e
+
+
+def test_get_error_fingerprint():
+    first_error = get_raised_error(ValueError("user 1"))
+    second_error = get_raised_error(ValueError("user 2"))
+    fingerprint = error_reporter.get_error_fingerprint(first_error)
+    # * the message is not part of the fingerprint
+    assert fingerprint == error_reporter.get_error_fingerprint(second_error)
+    assert fingerprint.startswith("ValueError @ test_error_reporter.py:raise_error:")
+    assert error_reporter.get_error_fingerprint(get_raised_error(KeyError("user 1"))) != fingerprint
+    assert error_reporter.get_error_fingerprint(ValueError("not raised")) == "ValueError"
+
+
+def test_error_aggregator_coalesces_errors():
+    sent_messages = []
+    aggregator = error_reporter.ErrorAggregator(sent_messages.extend, window=60)
+    assert aggregator.report("error", lambda: ["full report"], now=0)
+    for _ in range(99):
+        assert not aggregator.report("error", lambda: ["full report"], now=10)
+    assert aggregator.report("other error", lambda: ["other full report"], now=10)
+    assert aggregator.get_due_summaries(now=30) == []
+    summaries = aggregator.get_due_summaries(now=60)
+    assert summaries == ["99 more like this in the last 1 minutes:\nerror"]
+    # * a new window is started
+    assert not aggregator.report("error", lambda: ["full report"], now=70)
+    assert aggregator.get_due_summaries(now=120) == ["1 more like this in the last 1 minutes:\nerror"]
+    # * the fingerprints without errors in the last window are forgotten
+    assert aggregator.get_due_summaries(now=180) == []
+    assert aggregator.report("error", lambda: ["full report"], now=200)
+    aggregator.start()
+    aggregator.stop(timeout=10)
+    assert sent_messages == ["full report", "other full report", "full report"]
+
+
+def test_error_aggregator_does_not_block():
+    sending = threading.Event()
+    can_send = threading.Event()
+    def send_messages(messages):
+        sending.set()
+        can_send.wait(10)
+    aggregator = error_reporter.ErrorAggregator(send_messages, window=60, max_pending_reports=1)
+    aggregator.start()
+    assert aggregator.report("first", lambda: ["first"])
+    assert sending.wait(10)
+    assert aggregator.report("second", lambda: ["second"])
+    # * the pending reports are full and the sender is busy, hence the report is dropped
+    assert not aggregator.report("third", lambda: ["third"])
+    can_send.set()
+    aggregator.stop(timeout=10)
+
+
+def test_developer_alerts_are_queued(monkeypatch):
+    sent_messages = []
+    aggregator = error_reporter.ErrorAggregator(sent_messages.extend, window=60)
+    monkeypatch.setattr(error_reporter, "error_aggregator", aggregator)
+    context = mock.Mock()
+    message_handlers.send_messages_to_developers(context, ["0 messages have been sent out of 2 for <calcio>"])
+    # * nothing is sent by the handler itself
+    context.bot.send_message.assert_not_called()
+    assert sent_messages == []
+    aggregator.start()
+    aggregator.stop(timeout=10)
+    assert sent_messages == ["0 messages have been sent out of 2 for &lt;calcio&gt;"]
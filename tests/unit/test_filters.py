@@ -124,3 +124,17 @@ def test_get_outcome_giocata_filter(message_text, expected, monkeypatch):
     update = get_update_from_sports_channel(sports_channel_id=-1)
     update.message.text = message_text
     assert bool(outcome_giocata_filter(update)) == False
+
+
+@pytest.mark.parametrize("caption,is_broadcast", [
+    ("/broadcast", True),
+    ("/broadcast\nNuovo video!", True),
+    ("/broadcast_attivi", True),
+    ("/broadcast_nuovi 3\nBenvenuti", True),
+    ("/broadcast_segmento staff", True),
+    ("/broadcasting", False),
+    ("Nuovo video! /broadcast", False),
+])
+def test_broadcast_media_filter(caption: str, is_broadcast: bool):
+    update = Update(0, Message(0, datetime.datetime.utcnow(), Chat(0, "private"), from_user=User(0, "Testuser", False), caption=caption))
+    assert bool(filters.get_broadcast_media_filter()(update)) == is_broadcast
@@ -0,0 +1,81 @@
+import datetime
+from unittest.mock import MagicMock
+
+from telegram.error import Unauthorized
+
+from lot_bot import database as db
+from lot_bot import jobs
+from lot_bot.dao import user_manager
+from lot_bot.models import subscriptions as subs
+from lot_bot.models import users as user_model
+
+
+def create_user_with_lot_subscription(user_id: int, expiration_date: float, **user_fields):
+    user_data = user_model.create_base_user_data()
+    user_data.update({"_id": user_id, "subscriptions": [{"name": subs.sub_container.LOTCOMPLETE.name, "expiration_date": expiration_date}], **user_fields})
+    user_data["lot_expiration_date"] = expiration_date
+    user_manager.create_user(user_data)
+
+
+def test_remind_expiring_subscriptions():
+    now = datetime.datetime.utcnow().timestamp()
+    day = 24 * 60 * 60
+    create_user_with_lot_subscription(2001, now + day)
+    create_user_with_lot_subscription(2002, now + 2 * day)
+    create_user_with_lot_subscription(2003, now + 2 * day, blocked=True)
+    create_user_with_lot_subscription(2004, now + 10 * day)
+    create_user_with_lot_subscription(2005, now - day)
+    # * the user who blocked the bot
+    create_user_with_lot_subscription(2006, now + day)
+    # * a user created before lot_expiration_date was introduced
+    create_user_with_lot_subscription(2007, now + day)
+    db.mongo.utenti.update_one({"_id": 2007}, {"$unset": {"lot_expiration_date": ""}})
+    bot = MagicMock()
+    def send_message(user_id, *args, **kwargs):
+        if user_id == 2006:
+            raise Unauthorized("Forbidden: bot was blocked by the user")
+    bot.send_message.side_effect = send_message
+    try:
+        assert jobs.remind_expiring_subscriptions(bot, days=3, batch_size=2, now_timestamp=now) == 3
+        assert sorted(call.args[0] for call in bot.send_message.call_args_list) == [2001, 2002, 2006, 2007]
+        # * the users are reminded once per expiration date
+        assert jobs.remind_expiring_subscriptions(bot, days=3, now_timestamp=now + 60) == 0
+        # * after a renewal, the new expiration date is reminded
+        user_manager.update_user(2001, {"subscriptions": [{"name": subs.sub_container.LOTCOMPLETE.name, "expiration_date": now + 31 * day}]})
+        bot.send_message.reset_mock()
+        assert jobs.remind_expiring_subscriptions(bot, days=3, now_timestamp=now + 29 * day) == 1
+        assert bot.send_message.call_args.args[0] == 2001
+    finally:
+        for user_id in range(2001, 2008):
+            user_manager.delete_user_by_id(user_id)
+
+
+def test_remind_expiring_subscriptions_claims_users(monkeypatch):
+    now = datetime.datetime.utcnow().timestamp()
+    day = 24 * 60 * 60
+    for user_id in (2011, 2012, 2013):
+        create_user_with_lot_subscription(user_id, now + day)
+    # * another instance retrieved the same users and is reminding them
+    retrieve_users_to_remind_of_expiration = user_manager.retrieve_users_to_remind_of_expiration
+    def retrieve_and_claim_users(*args):
+        users_to_remind = retrieve_users_to_remind_of_expiration(*args)
+        assert user_manager.claim_expiry_reminder(2011, now + day, now)
+        return users_to_remind
+    monkeypatch.setattr(user_manager, "retrieve_users_to_remind_of_expiration", retrieve_and_claim_users)
+    bot = MagicMock()
+    def send_message(user_id, *args, **kwargs):
+        if user_id == 2013:
+            raise Exception("Timed out")
+    bot.send_message.side_effect = send_message
+    try:
+        assert jobs.remind_expiring_subscriptions(bot, days=3, now_timestamp=now) == 1
+        assert sorted(call.args[0] for call in bot.send_message.call_args_list) == [2012, 2013]
+        # * the failed user is reminded on the next run
+        monkeypatch.undo()
+        bot.send_message.reset_mock()
+        bot.send_message.side_effect = None
+        assert jobs.remind_expiring_subscriptions(bot, days=3, now_timestamp=now + 60) == 1
+        assert bot.send_message.call_args.args[0] == 2013
+    finally:
+        for user_id in (2011, 2012, 2013):
+            user_manager.delete_user_by_id(user_id)
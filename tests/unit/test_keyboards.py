@@ -1,5 +1,38 @@
 import pytest
 
 from lot_bot import keyboards as kyb
+from lot_bot.models import sports as spr
 
 
+def test_build_sports_inline_keyboard_cache():
+    kyb.clear_keyboards_cache()
+    calcio = spr.sports_container.CALCIO.name
+    keyboard = kyb.build_sports_inline_keyboard(frozenset([calcio]), frozenset([calcio]))
+    assert kyb.build_sports_inline_keyboard(frozenset([calcio]), frozenset([calcio])) is keyboard
+    assert kyb.build_sports_inline_keyboard(frozenset(), frozenset([calcio])) is not keyboard
+    buttons = [button for row in keyboard.inline_keyboard for button in row]
+    calcio_button = [button for button in buttons if button.callback_data == f"sport_{calcio}"][0]
+    assert calcio_button.text.startswith("🟢")
+    assert all(button.text.startswith("🔒") for button in buttons if button.callback_data == "new")
+    cache_stats = kyb.get_keyboards_cache_stats()["build_sports_inline_keyboard"]
+    assert cache_stats["hits"] == 1
+    assert cache_stats["misses"] == 2
+    assert cache_stats["hit_rate"] == 1 / 3
+    assert cache_stats["max_size"] == kyb.KEYBOARDS_CACHE_SIZE
+
+
+def test_build_strategies_and_budgets_inline_keyboard_cache():
+    kyb.clear_keyboards_cache()
+    sport = spr.sports_container.CALCIO
+    strategy_name = sport.strategies[0].name
+    keyboard = kyb.build_strategies_inline_keyboard(sport, frozenset([strategy_name]))
+    assert keyboard.inline_keyboard[0][0].text.startswith("🟢")
+    assert kyb.build_strategies_inline_keyboard(sport, frozenset([strategy_name])) is keyboard
+    budgets_keyboard = kyb.build_budgets_inline_keyboard(("budget",))
+    assert budgets_keyboard.inline_keyboard[0][0].callback_data == "edit_budget_budget"
+    assert len(kyb.build_budgets_inline_keyboard(()).inline_keyboard) == 2
+    cache_stats = kyb.get_keyboards_cache_stats()
+    assert cache_stats["build_strategies_inline_keyboard"]["hits"] == 1
+    assert cache_stats["build_budgets_inline_keyboard"]["size"] == 2
+    kyb.clear_keyboards_cache()
+    assert kyb.get_keyboards_cache_stats()["build_budgets_inline_keyboard"]["size"] == 0
@@ -0,0 +1,67 @@
+import logging
+import logging.handlers
+
+from lot_bot import logger as lgr
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record: logging.LogRecord):
+        self.messages.append(record.getMessage())
+
+
+def test_sampling_filter():
+    sampled_logger = lgr.create_sampled_logger("test_sampling", 10)
+    list_handler = ListHandler()
+    sampled_logger.addHandler(list_handler)
+    try:
+        for user_id in range(25):
+            sampled_logger.info("User %s is blocked", user_id)
+        sampled_logger.info("Different message")
+    finally:
+        sampled_logger.removeHandler(list_handler)
+    assert list_handler.messages == [
+        "User 0 is blocked",
+        "User 10 is blocked [1 out of 10, 11 so far]",
+        "User 20 is blocked [1 out of 10, 21 so far]",
+        "Different message",
+    ]
+
+
+def test_sampling_filter_keeps_warnings_and_errors():
+    sampled_logger = lgr.create_sampled_logger("test_sampling_errors", 10)
+    list_handler = ListHandler()
+    sampled_logger.addHandler(list_handler)
+    try:
+        for user_id in range(25):
+            sampled_logger.warning("No user found with id %s", user_id)
+            sampled_logger.error("Could not send message to user %s", user_id)
+    finally:
+        sampled_logger.removeHandler(list_handler)
+    assert len(list_handler.messages) == 50
+    assert list_handler.messages[-1] == "Could not send message to user 24"
+
+
+def test_create_sampled_logger_replaces_filter():
+    lgr.create_sampled_logger("test_replace", 10)
+    sampled_logger = lgr.create_sampled_logger("test_replace", 5)
+    sampling_filters = [log_filter for log_filter in sampled_logger.filters if isinstance(log_filter, lgr.SamplingFilter)]
+    assert [sampling_filter.sample_rate for sampling_filter in sampling_filters] == [5]
+
+
+def test_create_logger_uses_queue():
+    lgr.create_logger()
+    queue_handlers = [handler for handler in logging.getLogger().handlers if isinstance(handler, logging.handlers.QueueHandler)]
+    assert len(queue_handlers) == 1
+    assert lgr.log_listener is not None
+    assert lgr.fan_out_logger.name == "lot_bot.logger.fan_out"
+    list_handler = ListHandler()
+    lgr.log_listener.handlers = lgr.log_listener.handlers + (list_handler,)
+    lgr.logger.info("Queued %s", "message")
+    # * stopping the listener writes the enqueued records
+    lgr.stop_logger()
+    assert list_handler.messages == ["Queued message"]
+    lgr.create_logger()
@@ -0,0 +1,55 @@
+from unittest import mock
+
+import main
+import pytest
+from lot_bot import bot
+from lot_bot import database as db
+from lot_bot import persistence, update_deduplicator
+from lot_bot.dao import persistence_manager
+
+
+def test_webhook_flush_error(monkeypatch):
+    mongo_persistence = persistence.MongoPersistence()
+    def process_update(update):
+        mongo_persistence.refresh_user_data(1, {})
+        mongo_persistence.update_user_data(1, {"budget_name": "DEMO"})
+    monkeypatch.setattr(bot, "bot", mock.Mock())
+    monkeypatch.setattr(bot, "updater", mock.Mock())
+    monkeypatch.setattr(bot, "dispatcher", mock.Mock(persistence=mongo_persistence, process_update=process_update))
+    def failing_update_persistence_data(fields_by_persistence_id):
+        raise Exception("db error")
+    monkeypatch.setattr(persistence_manager, "update_persistence_data", failing_update_persistence_data)
+    request = mock.Mock(method="POST")
+    request.get_json.return_value = {"update_id": 901}
+    # * the update was processed, hence the request does not fail
+    assert main.webhook(request) == "Ok"
+    assert mongo_persistence._pending_fields == {1: {"user_data": {"budget_name": "DEMO"}}}
+    monkeypatch.undo()
+    mongo_persistence.flush()
+    assert db.mongo.persistence.find_one({"_id": 1}) == {"_id": 1, "user_data": {"budget_name": "DEMO"}}
+    db.mongo.persistence.delete_many({})
+    db.mongo.updates.delete_many({})
+    update_deduplicator.clear_seen_updates()
+
+
+def test_webhook_failed_update_is_accepted_again(monkeypatch):
+    processed_update_ids = []
+    def process_update(update):
+        processed_update_ids.append(update.update_id)
+        if len(processed_update_ids) == 1:
+            raise Exception("db error")
+    monkeypatch.setattr(bot, "bot", mock.Mock())
+    monkeypatch.setattr(bot, "updater", mock.Mock())
+    monkeypatch.setattr(bot, "dispatcher", mock.Mock(process_update=process_update))
+    request = mock.Mock(method="POST")
+    request.get_json.return_value = {"update_id": 902}
+    try:
+        with pytest.raises(Exception):
+            main.webhook(request)
+        # * Telegram sends the failed update again
+        assert main.webhook(request) == "Ok"
+        assert main.webhook(request) == "Ok"
+        assert processed_update_ids == [902, 902]
+    finally:
+        db.mongo.updates.delete_many({})
+        update_deduplicator.clear_seen_updates()
@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from lot_bot import metrics
+from telegram import Bot
+from telegram.error import RetryAfter
+from telegram.ext import DispatcherHandlerStop
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset_metrics()
+    yield
+    metrics.reset_metrics()
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram("test_latency_seconds", "Test latency", ["handler"], buckets=(0.1, 1.0))
+    histogram.observe("start", value=0.05)
+    histogram.observe("start", value=0.5)
+    histogram.observe("start", value=2)
+    assert histogram.get_count("start") == 3
+    assert histogram.get_count("other") == 0
+    lines = histogram.render()
+    assert lines[1] == "# TYPE test_latency_seconds histogram"
+    assert 'test_latency_seconds_bucket{handler="start",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{handler="start",le="1.0"} 2' in lines
+    assert 'test_latency_seconds_bucket{handler="start",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_sum{handler="start"} 2.55' in lines
+    assert 'test_latency_seconds_count{handler="start"} 3' in lines
+
+
+def test_counter_and_gauge_render():
+    counter = metrics.Counter("test_errors_total", "Test errors", ["method", "error"])
+    counter.inc("sendMessage", 'Bad"Request')
+    counter.inc("sendMessage", 'Bad"Request', amount=2)
+    assert counter.get("sendMessage", 'Bad"Request') == 3
+    assert 'test_errors_total{method="sendMessage",error="Bad\\"Request"} 3' in counter.render()
+    gauge = metrics.Gauge("test_depth", "Test depth")
+    gauge.set(value=5)
+    gauge.set(value=2)
+    assert gauge.render() == ["# HELP test_depth Test depth", "# TYPE test_depth gauge", "test_depth 2"]
+
+
+def test_measure_handler():
+    assert metrics.measure_handler("handler", lambda: 1) == 1
+    def failing_handler():
+        raise ValueError("error")
+    with pytest.raises(ValueError):
+        metrics.measure_handler("failing_handler", failing_handler)
+    def stopping_handler():
+        raise DispatcherHandlerStop()
+    with pytest.raises(DispatcherHandlerStop):
+        metrics.measure_handler("stopping_handler", stopping_handler)
+    assert metrics.HANDLER_LATENCY.get_count("handler") == 1
+    assert metrics.HANDLER_LATENCY.get_count("failing_handler") == 1
+    assert metrics.HANDLER_ERRORS.get("handler") == 0
+    assert metrics.HANDLER_ERRORS.get("failing_handler") == 1
+    # * stopping the dispatching is not an error
+    assert metrics.HANDLER_ERRORS.get("stopping_handler") == 0
+    assert 'lot_handler_latency_seconds_count{handler="handler"} 1' in metrics.render_metrics()
+
+
+def test_db_commands_listener():
+    listener = metrics.DbCommandsListener()
+    listener.started(SimpleNamespace(command_name="find", command={"find": "users"}, request_id=1, operation_id=1))
+    listener.started(SimpleNamespace(command_name="update", command={"update": "giocate"}, request_id=2, operation_id=2))
+    listener.succeeded(SimpleNamespace(command_name="find", request_id=1, operation_id=1, duration_micros=1500))
+    listener.failed(SimpleNamespace(command_name="update", request_id=2, operation_id=2, duration_micros=3000))
+    assert metrics.DB_COMMAND_LATENCY.get_count("find", "users") == 1
+    assert metrics.DB_COMMAND_LATENCY.get_count("update", "giocate") == 1
+    assert metrics.DB_COMMAND_ERRORS.get("update", "giocate") == 1
+    assert metrics.DB_COMMAND_ERRORS.get("find", "users") == 0
+
+
+def test_instrumented_bot():
+    bot = metrics.InstrumentedBot("123:token")
+    with patch.object(Bot, "_post", return_value=True):
+        assert bot._post("sendMessage", data={"chat_id": 1})
+    with patch.object(Bot, "_post", side_effect=RetryAfter(1)):
+        with pytest.raises(RetryAfter):
+            bot._post("sendMessage", data={"chat_id": 1})
+    assert metrics.TELEGRAM_REQUEST_LATENCY.get_count("sendMessage") == 2
+    assert metrics.TELEGRAM_REQUEST_ERRORS.get("sendMessage", "RetryAfter") == 1
@@ -0,0 +1,129 @@
+import queue
+
+import pytest
+from lot_bot import database as db
+from lot_bot import persistence, router
+from lot_bot.dao import persistence_manager
+from telegram.ext import (CallbackQueryHandler, ConversationHandler,
+                          Dispatcher, Filters, MessageHandler)
+from tests.benchmarks import router_benchmark
+
+NAME_STATE = 1
+
+
+@pytest.fixture()
+def clean_persistence_collection():
+    yield
+    db.mongo.persistence.delete_many({})
+
+
+def create_dispatcher(benchmark_bot, received_names: list) -> Dispatcher:
+    """Creates the dispatcher of an instance of the bot, whose conversation
+    asks for a name and stores it in the user_data."""
+    def ask_name(update, context):
+        context.user_data["asked"] = True
+        return NAME_STATE
+
+    def received_name(update, context):
+        received_names.append((update.effective_message.text, context.user_data.get("asked")))
+        context.user_data.clear()
+        return ConversationHandler.END
+
+    dispatcher = Dispatcher(benchmark_bot, queue.Queue(), use_context=True, persistence=persistence.MongoPersistence())
+    update_router = router.UpdateRouter(dispatcher.persistence)
+    update_router.add_handler(ConversationHandler(
+        entry_points=[CallbackQueryHandler(ask_name, pattern=r"^ask_name$")],
+        states={NAME_STATE: [MessageHandler(Filters.text, received_name)]},
+        fallbacks=[],
+        name="ask_name",
+        persistent=True,
+    ))
+    dispatcher.add_handler(update_router)
+    return dispatcher
+
+
+def test_conversation_goes_on_in_another_instance(clean_persistence_collection):
+    benchmark_bot = router_benchmark.create_benchmark_bot()
+    user_id = router_benchmark.USER_ID
+    received_names = []
+    first_dispatcher = create_dispatcher(benchmark_bot, received_names)
+    first_dispatcher.process_update(router_benchmark.create_callback_query_update(benchmark_bot, 1, "ask_name"))
+    # * nothing is written until the flush
+    assert db.mongo.persistence.find_one({"_id": user_id}) is None
+    first_dispatcher.persistence.flush()
+    assert db.mongo.persistence.find_one({"_id": user_id}) == {
+        "_id": user_id,
+        "conversations": {"ask_name": {f"{user_id}_{user_id}": NAME_STATE}},
+        "user_data": {"asked": True},
+    }
+    second_dispatcher = create_dispatcher(benchmark_bot, received_names)
+    second_dispatcher.process_update(router_benchmark.create_message_update(benchmark_bot, 2, "Mario", user_id, False))
+    assert received_names == [("Mario", True)]
+    second_dispatcher.persistence.flush()
+    assert db.mongo.persistence.find_one({"_id": user_id}) == {"_id": user_id, "conversations": {"ask_name": {}}}
+
+
+def test_persistence_caches_reads_and_batches_writes(monkeypatch, clean_persistence_collection):
+    read_ids = []
+    retrieve_persistence_data = persistence_manager.retrieve_persistence_data
+    def counting_retrieve_persistence_data(persistence_id):
+        read_ids.append(persistence_id)
+        return retrieve_persistence_data(persistence_id)
+    monkeypatch.setattr(persistence_manager, "retrieve_persistence_data", counting_retrieve_persistence_data)
+    mongo_persistence = persistence.MongoPersistence(cache_ttl=60, max_pending_users=2)
+    conversations = mongo_persistence.get_conversations("test")
+    assert conversations.get((1, 1)) is None
+    conversations[(1, 1)] = NAME_STATE
+    assert conversations.get((1, 1)) == NAME_STATE
+    user_data = {}
+    mongo_persistence.refresh_user_data(1, user_data)
+    # * the unchanged user_data is not written
+    mongo_persistence.update_user_data(1, {})
+    assert read_ids == [1]
+    assert mongo_persistence._pending_fields == {1: {"conversations.test.1_1": NAME_STATE}}
+    # * the changes are flushed as soon as two users have them
+    mongo_persistence.refresh_user_data(2, {})
+    mongo_persistence.update_user_data(2, {"budget_name": "DEMO"})
+    assert mongo_persistence._pending_fields == {}
+    assert db.mongo.persistence.find_one({"_id": 2}) == {"_id": 2, "user_data": {"budget_name": "DEMO"}}
+    # * once the cache expires, the data is read again
+    mongo_persistence.cache_ttl = 0
+    db.mongo.persistence.update_one({"_id": 1}, {"$set": {"conversations.test.1_1": 2}})
+    assert conversations.get((1, 1)) == 2
+    assert read_ids == [1, 2, 1]
+
+
+def test_failed_flush_keeps_the_changes(monkeypatch, clean_persistence_collection):
+    mongo_persistence = persistence.MongoPersistence()
+    mongo_persistence.refresh_user_data(1, {})
+    mongo_persistence.update_user_data(1, {"budget_name": "DEMO"})
+    def failing_update_persistence_data(fields_by_persistence_id):
+        raise Exception("db error")
+    monkeypatch.setattr(persistence_manager, "update_persistence_data", failing_update_persistence_data)
+    with pytest.raises(Exception):
+        mongo_persistence.flush()
+    assert mongo_persistence._pending_fields == {1: {"user_data": {"budget_name": "DEMO"}}}
+    monkeypatch.undo()
+    mongo_persistence.flush()
+    assert db.mongo.persistence.find_one({"_id": 1}) == {"_id": 1, "user_data": {"budget_name": "DEMO"}}
+
+
+def test_dispatcher_persistence_update_without_update(monkeypatch, clean_persistence_collection):
+    benchmark_bot = router_benchmark.create_benchmark_bot()
+    user_id = router_benchmark.USER_ID
+    dispatcher = create_dispatcher(benchmark_bot, [])
+    dispatcher.process_update(router_benchmark.create_callback_query_update(benchmark_bot, 1, "ask_name"))
+    dispatcher.persistence.flush()
+    # * the users seen by the dispatcher, e.g. one whose payment was completed by another instance
+    for seen_user_id in range(1000):
+        dispatcher.user_data[seen_user_id] = {"payment_payload": "payload"}
+    db.mongo.persistence.update_one({"_id": user_id}, {"$unset": {"user_data": ""}})
+    read_ids = []
+    monkeypatch.setattr(persistence_manager, "retrieve_persistence_data", lambda persistence_id: read_ids.append(persistence_id))
+    dispatcher.persistence.cache_ttl = 0
+    # * called by the job queue after each job
+    dispatcher.update_persistence()
+    dispatcher.persistence.flush()
+    assert read_ids == []
+    assert db.mongo.persistence.count_documents({}) == 1
+    assert "user_data" not in db.mongo.persistence.find_one({"_id": user_id})
@@ -0,0 +1,70 @@
+import datetime
+
+import pytest
+from lot_bot import results_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_results_cache():
+    results_cache.clear_results_cache()
+    yield
+    results_cache.clear_results_cache()
+
+
+def test_cache_result():
+    results_cache.cache_result(results_cache.TREND_DAYS, 7, "trend")
+    assert results_cache.get_cached_result(results_cache.TREND_DAYS, 7) == "trend"
+    assert results_cache.get_cached_result(results_cache.TREND_DAYS, 30) is None
+    assert results_cache.get_cached_result(results_cache.TREND_DAYS, 7, user_id=1) is None
+
+
+def test_cached_result_expiration():
+    now_timestamp = datetime.datetime.now().timestamp()
+    results_cache.cache_result(results_cache.RESOCONTO, 3600, ("line",), user_id=1, expiration_timestamp=now_timestamp - 1)
+    results_cache.cache_result(results_cache.TREND_DAYS, 7, "trend", expiration_timestamp=results_cache.get_next_midnight_timestamp())
+    assert results_cache.get_cached_result(results_cache.RESOCONTO, 3600, user_id=1) is None
+    assert results_cache.get_cached_result(results_cache.TREND_DAYS, 7) == "trend"
+    assert results_cache.get_next_midnight_timestamp() > now_timestamp
+
+
+def test_cached_result_ttl():
+    results_cache.cache_result(results_cache.TREND_EVENTS, 50, "trend", ttl=0)
+    results_cache.cache_result(results_cache.RESOCONTO, 3600, (), user_id=1, ttl=0,
+        expiration_timestamp=results_cache.get_next_midnight_timestamp())
+    results_cache.cache_result(results_cache.TREND_EVENTS, 30, "trend")
+    # * the results are computed again after the TTL, even without an expiration
+    assert results_cache.get_cached_result(results_cache.TREND_EVENTS, 50) is None
+    assert results_cache.get_cached_result(results_cache.RESOCONTO, 3600, user_id=1) is None
+    assert results_cache.get_cached_result(results_cache.TREND_EVENTS, 30) == "trend"
+
+
+def test_invalidate_giocata_results():
+    results_cache.cache_result(results_cache.RESOCONTO, 3600, ("line",), user_id=1, giocata_ids=["a", "b"])
+    results_cache.cache_result(results_cache.RESOCONTO, 3600, ("line",), user_id=2, giocata_ids=["c"])
+    results_cache.cache_result(results_cache.TREND_EVENTS, 50, "trend")
+    results_cache.invalidate_giocata_results("b")
+    assert results_cache.get_cached_result(results_cache.RESOCONTO, 3600, user_id=1) is None
+    assert results_cache.get_cached_result(results_cache.RESOCONTO, 3600, user_id=2) == ("line",)
+    assert results_cache.get_cached_result(results_cache.TREND_EVENTS, 50) is None
+
+
+def test_invalidate_user_results():
+    results_cache.cache_result(results_cache.RESOCONTO, 3600, (), user_id=1)
+    results_cache.cache_result(results_cache.RESOCONTO, 86400, (), user_id=1)
+    results_cache.cache_result(results_cache.RESOCONTO, 3600, (), user_id=2)
+    results_cache.invalidate_user_results(1)
+    assert results_cache.get_cached_result(results_cache.RESOCONTO, 3600, user_id=1) is None
+    assert results_cache.get_cached_result(results_cache.RESOCONTO, 86400, user_id=1) is None
+    assert results_cache.get_cached_result(results_cache.RESOCONTO, 3600, user_id=2) == ()
+
+
+def test_results_cache_eviction(monkeypatch):
+    monkeypatch.setattr(results_cache, "MAX_RESULTS_CACHE_SIZE", 2)
+    results_cache.cache_result(results_cache.TREND_EVENTS, 1, "first", giocata_ids=["a"])
+    results_cache.cache_result(results_cache.TREND_EVENTS, 2, "second")
+    # * the first result becomes the most recently used
+    assert results_cache.get_cached_result(results_cache.TREND_EVENTS, 1) == "first"
+    results_cache.cache_result(results_cache.TREND_EVENTS, 3, "third")
+    assert results_cache.get_cached_result(results_cache.TREND_EVENTS, 2) is None
+    assert results_cache.get_cached_result(results_cache.TREND_EVENTS, 1) == "first"
+    assert results_cache.get_cached_result(results_cache.TREND_EVENTS, 3) == "third"
@@ -0,0 +1,78 @@
+import pytest
+from lot_bot import config as cfg
+from lot_bot import router
+from telegram.ext import CallbackQueryHandler, ConversationHandler, MessageHandler
+from telegram.ext.filters import Filters
+from tests.benchmarks import router_benchmark
+
+
+@pytest.fixture()
+def benchmark_channels(monkeypatch):
+    monkeypatch.setattr(cfg.config, "SPORTS_CHANNELS_ID", router_benchmark.SPORTS_CHANNELS_ID)
+    monkeypatch.setattr(cfg.config, "TEACHERBET_CHANNEL_ID", router_benchmark.TEACHERBET_CHANNEL_ID)
+
+
+@pytest.mark.parametrize("pattern,literal_prefix", [
+    (r"^to_homepage$", "to_homepage"),
+    (r"^sport_\w+$", "sport_"),
+    (r"^register_giocata_yes(_[0-9a-f]{24}_\d*)?$", "register_giocata_yes"),
+    (r"^to_add_referral:\d[am]$", "to_add_referral:"),
+    (r"^edit_budget_(?!name|balance|interest)[a-zA-Z0-9_ ]+$", "edit_budget_"),
+    (r"^\w+_\w+_(activate|disable)$", ""),
+    (r"^a|b$", None),
+    (r"^a[|]b$", "a"),
+    (r"ab?c", "a"),
+    (None, None),
+])
+def test_get_pattern_literal_prefix(pattern, literal_prefix):
+    assert router.get_pattern_literal_prefix(pattern) == literal_prefix
+
+
+def test_get_filter_chat_ids():
+    channel_filter = Filters.chat([1, 2])
+    assert router.get_filter_chat_ids(channel_filter & Filters.regex("x")) == {1, 2}
+    assert router.get_filter_chat_ids(Filters.regex("x") & Filters.chat(1)) == {1}
+    assert router.get_filter_chat_ids(channel_filter | Filters.chat(3)) == {1, 2, 3}
+    assert router.get_filter_chat_ids(channel_filter | Filters.text) is None
+    assert router.get_filter_chat_ids(Filters.text) is None
+    assert router.get_filter_chat_ids(Filters.chat(username="channel")) is None
+
+
+def test_router_matches_sequential_dispatch(benchmark_channels):
+    benchmark_bot = router_benchmark.create_benchmark_bot()
+    routed_dispatcher = router_benchmark.create_dispatcher(benchmark_bot, use_router=True)
+    assert [type(handler) for handler in routed_dispatcher.handlers[0]] == [router.UpdateRouter]
+    sequential_dispatcher = router_benchmark.create_dispatcher(benchmark_bot, use_router=False)
+    # * the same handlers, so that they can be compared
+    update_router = router.UpdateRouter()
+    for handler in sequential_dispatcher.handlers[0]:
+        update_router.add_handler(handler)
+    for update in router_benchmark.create_benchmark_updates(benchmark_bot):
+        sequential_handler = router_benchmark.find_handler(sequential_dispatcher, update)
+        assert sequential_handler is not None
+        assert update_router.check_update(update)[0] is sequential_handler
+
+
+def test_router_preserves_order():
+    update_router = router.UpdateRouter()
+    generic_handler = CallbackQueryHandler(lambda update, context: None, pattern=r"^\w+$")
+    specific_handler = CallbackQueryHandler(lambda update, context: None, pattern=r"^to_homepage$")
+    update_router.add_handler(generic_handler)
+    update_router.add_handler(specific_handler)
+    update_router.add_handler(MessageHandler(Filters.all, lambda update, context: None))
+    benchmark_bot = router_benchmark.create_benchmark_bot()
+    update = router_benchmark.create_callback_query_update(benchmark_bot, 1, "to_homepage")
+    assert update_router.get_candidates(update) == [generic_handler, specific_handler]
+    assert update_router.check_update(update)[0] is generic_handler
+
+
+def test_router_requires_persistence_for_persistent_conversations():
+    conversation_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(lambda update, context: None, pattern=r"^to_homepage$")],
+        states={},
+        fallbacks=[],
+        name="test",
+        persistent=True,
+    )
+    with pytest.raises(ValueError):
+        router.UpdateRouter().add_handler(conversation_handler)
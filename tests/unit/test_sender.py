@@ -0,0 +1,82 @@
+import threading
+import time
+
+from telegram.error import BadRequest, RetryAfter, TimedOut, Unauthorized
+
+from lot_bot import sender
+
+
+def test_rate_limiter():
+    limiter = sender.RateLimiter(rate=100)
+    start_time = time.monotonic()
+    for _ in range(21):
+        limiter.acquire()
+    # * the first token is available immediately
+    assert time.monotonic() - start_time >= 0.19
+    limiter.pause(0.2)
+    start_time = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start_time >= 0.19
+
+
+def acquire_in_threads(limiter: sender.RateLimiter, priorities, arrival_interval: float):
+    acquired_priorities = []
+    def acquire(priority: sender.MessagePriority):
+        limiter.acquire(priority)
+        acquired_priorities.append(priority)
+    threads = []
+    for priority in priorities:
+        threads.append(threading.Thread(target=acquire, args=(priority,)))
+        threads[-1].start()
+        time.sleep(arrival_interval)
+    for thread in threads:
+        thread.join()
+    return acquired_priorities
+
+
+def test_rate_limiter_priorities():
+    limiter = sender.RateLimiter(rate=20)
+    limiter.pause(0.2)
+    priorities = [sender.MessagePriority.DEV_ALERT, sender.MessagePriority.BROADCAST, sender.MessagePriority.GIOCATA, sender.MessagePriority.INTERACTIVE]
+    assert acquire_in_threads(limiter, priorities, 0.02) == sorted(priorities)
+
+
+def test_rate_limiter_priorities_aging():
+    limiter = sender.RateLimiter(rate=20, aging_interval=0.05)
+    limiter.pause(0.3)
+    # * the broadcast waited for longer than three aging intervals when the giocata arrives
+    priorities = [sender.MessagePriority.BROADCAST, sender.MessagePriority.GIOCATA]
+    assert acquire_in_threads(limiter, priorities, 0.2) == priorities
+
+
+def test_send_to_users():
+    attempts = {}
+    def send_message(user_id: int):
+        attempts[user_id] = attempts.get(user_id, 0) + 1
+        if user_id == 1:
+            raise Unauthorized("Forbidden: bot was blocked by the user")
+        if user_id == 2:
+            raise BadRequest("Chat not found")
+        if user_id == 3 and attempts[user_id] == 1:
+            raise RetryAfter(0.1)
+        if user_id == 4:
+            raise TimedOut()
+    result = sender.send_to_users(range(10), send_message, limiter=sender.RateLimiter(rate=1000), max_attempts=3)
+    assert sorted(result.sent_ids) == [0, 3, 5, 6, 7, 8, 9]
+    assert result.blocked_ids == [1]
+    assert sorted(result.failed_ids) == [2, 4]
+    # * only the flood limit and the network errors are retried
+    assert attempts == {0: 1, 1: 1, 2: 1, 3: 2, 4: 3, 5: 1, 6: 1, 7: 1, 8: 1, 9: 1}
+
+
+def test_send_to_users_reports_progress():
+    reported_results = []
+    def send_message(user_id: int):
+        time.sleep(0.01)
+    result = sender.send_to_users(range(20), send_message, limiter=sender.RateLimiter(rate=1000), num_of_workers=1,
+        report_progress=reported_results.append, progress_interval=0.05)
+    assert len(result.sent_ids) == 20
+    assert reported_results
+    completed_counts = [partial_result.get_completed_count() for partial_result in reported_results]
+    assert completed_counts == sorted(completed_counts)
+    assert 0 < completed_counts[0] < 20
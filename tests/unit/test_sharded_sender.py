@@ -0,0 +1,133 @@
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from telegram.error import Unauthorized
+
+from lot_bot import database as db
+from lot_bot import sender
+from lot_bot import sharded_sender
+from lot_bot.dao import send_jobs_manager
+from lot_bot.models import segments
+
+
+@pytest.fixture(autouse=True)
+def clean_send_jobs():
+    yield
+    db.mongo.send_jobs.delete_many({})
+    db.mongo.rate_budget.delete_many({})
+
+
+def test_get_user_shard():
+    shards = [sharded_sender.get_user_shard(user_id, 4) for user_id in range(1000)]
+    assert set(shards) == {0, 1, 2, 3}
+    assert shards == [sharded_sender.get_user_shard(user_id, 4) for user_id in range(1000)]
+
+
+def test_create_send_jobs_data():
+    send_jobs_data = sharded_sender.create_send_jobs_data("broadcast", range(100), 4, "send_message", {"text": "ciao"}, 0)
+    assert sorted(user_id for send_job in send_jobs_data for user_id in segments.unpack_ids(send_job["user_ids"])) == list(range(100))
+    for send_job in send_jobs_data:
+        assert all(sharded_sender.get_user_shard(user_id, 4) == send_job["shard"] for user_id in segments.unpack_ids(send_job["user_ids"]))
+    assert [send_job["reports_completion"] for send_job in send_jobs_data].count(True) == 1
+    with pytest.raises(ValueError):
+        sharded_sender.create_send_jobs_data("broadcast", range(100), 4, "delete_message", {}, 0)
+
+
+def test_claim_send_job():
+    sharded_sender.enqueue_broadcast([1], "send_message", {"text": "ciao"}, 1)
+    now = time.time()
+    send_job = send_jobs_manager.claim_send_job(0, "worker_a", now, now + 60)
+    assert send_job["claimed_by"] == "worker_a"
+    # * the job cannot be claimed while the lease is live, nor from another shard
+    assert send_jobs_manager.claim_send_job(0, "worker_b", now, now + 60) is None
+    assert send_jobs_manager.claim_send_job(1, "worker_b", now + 61, now + 120) is None
+    # * once the lease expires, another worker resumes the job
+    assert send_jobs_manager.claim_send_job(0, "worker_b", now + 61, now + 120)["claimed_by"] == "worker_b"
+    assert not send_jobs_manager.update_send_job_progress(send_job["_id"], "worker_a", 1, {"sent_count": 1}, now + 120)
+
+
+def test_sender_workers_send_broadcast():
+    bot = MagicMock()
+    def send_message(user_id, *args, **kwargs):
+        if user_id == 7:
+            raise Unauthorized("Forbidden: bot was blocked by the user")
+    bot.send_message.side_effect = send_message
+    broadcast_id = sharded_sender.enqueue_broadcast(range(10, 60), "send_message", {"text": "ciao"}, 2,
+        status_chat_id=1, status_message_id=2, status_text="Invio")
+    sharded_sender.enqueue_broadcast([7], "send_message", {"text": "ciao"}, 2)
+    workers = [sharded_sender.SenderWorker(bot, shard, worker_id=f"worker_{shard}", limiter=sender.RateLimiter(1000), chunk_size=10,
+        progress_interval=0) for shard in range(2)]
+    while any([worker.claim_and_process_job() for worker in workers]):
+        pass
+    sent_user_ids = [call.args[0] for call in bot.send_message.call_args_list if call.kwargs == {"text": "ciao"}]
+    assert sorted(sent_user_ids) == [7] + list(range(10, 60))
+    send_jobs = send_jobs_manager.retrieve_broadcast_send_jobs(broadcast_id)
+    assert all(send_job["status"] == send_jobs_manager.DONE_STATUS for send_job in send_jobs)
+    assert sum(send_job["sent_count"] for send_job in send_jobs) == 50
+    # * the progress is reported on the status message, and the completion only once
+    assert bot.edit_message_text.call_args.kwargs == {"chat_id": 1, "message_id": 2}
+    completion_calls = [call for call in bot.send_message.call_args_list if call.args[0] == 1]
+    assert len(completion_calls) == 1
+    assert completion_calls[0].args[1].startswith("Broadcast completato: 50 messaggi inviati")
+
+
+def test_sender_worker_extends_job_lease():
+    sharded_sender.enqueue_broadcast(range(4), "send_message", {"text": "ciao"}, 1)
+    worker = sharded_sender.SenderWorker(MagicMock(), 0, worker_id="worker_a", limiter=sender.RateLimiter(1000), chunk_size=4, lease_duration=0.3)
+    claims_during_send = []
+    def send_message(user_id, *args, **kwargs):
+        time.sleep(0.5)
+        # * the single chunk takes longer than the lease, which is extended while it is sent
+        claims_during_send.append(send_jobs_manager.claim_send_job(0, "worker_b", time.time(), time.time() + 60))
+    worker.bot.send_message.side_effect = send_message
+    assert worker.claim_and_process_job()
+    assert claims_during_send == [None] * 4
+
+
+def test_shared_rate_limiter():
+    limiter_a = sharded_sender.SharedRateLimiter("worker_a", global_rate=20)
+    limiter_b = sharded_sender.SharedRateLimiter("worker_b", global_rate=20)
+    assert limiter_a.refresh_lease() == 20
+    assert limiter_b.refresh_lease() == 10
+    assert limiter_a.refresh_lease() == 10
+    # * the pauses are shared by the workers
+    limiter_b.pause(0.2)
+    limiter_a.refresh_lease()
+    start_time = time.monotonic()
+    limiter_a.acquire()
+    assert time.monotonic() - start_time >= 0.1
+    limiter_b.release_lease()
+    assert limiter_a.refresh_lease() == 20
+
+
+def test_bot_process_shares_rate_budget(monkeypatch):
+    monkeypatch.setattr(sender, "rate_limiter", sender.rate_limiter)
+    worker_limiter = sharded_sender.SharedRateLimiter("worker_a", global_rate=20)
+    assert worker_limiter.refresh_lease() == 20
+    sharded_sender.share_rate_budget_with_workers()
+    assert isinstance(sender.rate_limiter, sharded_sender.SharedRateLimiter)
+    sender.rate_limiter.acquire()
+    # * the bot's process holds a lease as well, so the worker only sends at half the global rate
+    assert worker_limiter.refresh_lease() == 10
+    sender.rate_limiter.release_lease()
+
+
+def test_sender_workers_yield_to_giocate():
+    bot_limiter = sharded_sender.SharedRateLimiter("bot", global_rate=20, refresh_interval=0.1, priority_duration=0.5)
+    worker_limiter = sharded_sender.SharedRateLimiter("worker_a", global_rate=20, yields_to_priority=True)
+    assert worker_limiter.refresh_lease() == 20
+    assert bot_limiter.refresh_lease() == 10
+    # * a giocata starts the priority period, the bot keeps its share until the workers have seen it
+    bot_limiter.acquire(sender.MessagePriority.GIOCATA)
+    assert bot_limiter.rate == 10
+    worker_limiter.refresh_lease()
+    start_time = time.monotonic()
+    worker_limiter.acquire(sender.MessagePriority.BROADCAST)
+    assert time.monotonic() - start_time >= 0.3
+    # * the priority period has ended, so the rate is split again
+    assert bot_limiter.refresh_lease() == 10
+    bot_limiter = sharded_sender.SharedRateLimiter("bot", global_rate=20, refresh_interval=0.1, priority_duration=5)
+    bot_limiter.refresh_lease(priority_until=time.time() + 5)
+    time.sleep(0.1)
+    assert bot_limiter.refresh_lease() == 20
@@ -0,0 +1,41 @@
+from lot_bot import startup_profiler
+
+IMPORTTIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       100 |        100 |   lot_bot.constants
+import time:       300 |        300 |     lot_bot.handlers.conversation_states
+import time:       200 |        500 |   lot_bot.bot
+import time:        50 |        650 | main
+"""
+
+
+def test_parse_import_times():
+    import_times = startup_profiler.parse_import_times(IMPORTTIME_OUTPUT)
+    assert [import_time.module_name for import_time in import_times] == ["lot_bot.constants", "lot_bot.handlers.conversation_states", "lot_bot.bot", "main"]
+    assert import_times[1].self_time == 300
+    assert import_times[2].cumulative_time == 500
+    assert [import_time.depth for import_time in import_times] == [1, 2, 1, 0]
+
+
+def test_profile_startup_steps():
+    def failing_step():
+        raise Exception("no db")
+    executed_steps = []
+    step_times = startup_profiler.profile_startup_steps([
+        ("first", lambda: executed_steps.append("first")),
+        ("failing", failing_step),
+        ("skipped", lambda: executed_steps.append("skipped")),
+    ])
+    assert executed_steps == ["first"]
+    assert [step_time.name for step_time in step_times] == ["first", "failing"]
+    assert step_times[1].error == "no db"
+    report = startup_profiler.create_startup_report(startup_profiler.parse_import_times(IMPORTTIME_OUTPUT), step_times)
+    assert "Total import time: 0.7 ms (4 modules)" in report
+    assert "FAILED: no db" in report
+
+
+def test_lazy_handlers_modules():
+    from lot_bot import bot
+    from lot_bot.handlers import conversation_states
+    lazy_callback = bot.budget_handlers.to_budgets_menu
+    assert lazy_callback.__name__ == "to_budgets_menu"
+    assert bot.get_new_budget_conversation_handler().states.keys() == {conversation_states.CREATE_BUDGET_NAME, conversation_states.SET_BUDGET_BALANCE}
@@ -0,0 +1,49 @@
+import pytest
+from lot_bot import database as db
+from lot_bot import update_deduplicator
+from lot_bot.dao import updates_manager
+
+
+@pytest.fixture(autouse=True)
+def empty_seen_updates():
+    update_deduplicator.clear_seen_updates()
+    db.mongo.updates.delete_many({})
+    yield
+    update_deduplicator.clear_seen_updates()
+    db.mongo.updates.delete_many({})
+
+
+def test_is_duplicate_update():
+    assert not update_deduplicator.is_duplicate_update(1)
+    assert update_deduplicator.is_duplicate_update(1)
+    assert not update_deduplicator.is_duplicate_update(2)
+    assert db.mongo.updates.count_documents({}) == 2
+
+
+def test_is_duplicate_update_from_other_instance():
+    # * the update was received by another instance
+    assert updates_manager.register_update_id(1)
+    assert update_deduplicator.is_duplicate_update(1)
+
+
+def test_is_duplicate_update_bounded_local_set(monkeypatch):
+    monkeypatch.setattr(update_deduplicator, "MAX_SEEN_UPDATE_IDS", 2)
+    for update_id in range(3):
+        assert not update_deduplicator.is_duplicate_update(update_id)
+    assert len(update_deduplicator._seen_update_ids) == 2
+    # * the db still remembers the evicted update_id
+    assert update_deduplicator.is_duplicate_update(0)
+
+
+def test_is_duplicate_update_db_error(monkeypatch):
+    def raise_error(update_id):
+        raise Exception("db error")
+    monkeypatch.setattr(updates_manager, "register_update_id", raise_error)
+    assert not update_deduplicator.is_duplicate_update(1)
+    assert update_deduplicator.is_duplicate_update(1)
+
+
+def test_forget_update():
+    assert not update_deduplicator.is_duplicate_update(1)
+    update_deduplicator.forget_update(1)
+    assert not update_deduplicator.is_duplicate_update(1)
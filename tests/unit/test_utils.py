@@ -1,4 +1,5 @@
 import pytest
+from lot_bot import constants as cst
 from lot_bot import utils
 
 
@@ -9,3 +10,49 @@ from lot_bot import utils
 def test_get_emoji_for_cashout_percentage(percentage_text: str, expected: str):
     emoji = utils.get_emoji_for_cashout_percentage(percentage_text)
     assert emoji == expected
+
+
+@pytest.mark.parametrize("max_length", [20, 64, 4096])
+def test_split_lines_in_messages(max_length: int):
+    lines = [f"{index}) " + "x" * (index % 15) + "\n" for index in range(300)]
+    messages = list(utils.split_lines_in_messages(lines, header="Resoconto", max_length=max_length))
+    assert all(len(message) <= max_length for message in messages)
+    assert "".join(messages) == "Resoconto\n" + "".join(lines)
+    # * messages are split only on line boundaries
+    assert all(message.endswith("\n") for message in messages)
+
+
+def test_split_lines_in_messages_long_line():
+    messages = list(utils.split_lines_in_messages(["a" * 25 + "\n", "b\n"], max_length=10))
+    assert all(len(message) <= 10 for message in messages)
+    assert "".join(messages) == "a" * 25 + "\nb\n"
+
+
+def test_split_lines_in_messages_utf16_length():
+    # * each emoji counts as 2 UTF-16 code units
+    lines = ["🟢" * 3 + "\n"] * 3
+    messages = list(utils.split_lines_in_messages(lines, max_length=14))
+    assert messages == ["🟢🟢🟢\n🟢🟢🟢\n", "🟢🟢🟢\n"]
+    messages = list(utils.split_lines_in_messages(["🟢" * 5 + "a\n"], max_length=4))
+    assert messages == ["🟢🟢", "🟢🟢", "🟢a\n"]
+    assert all(utils.get_telegram_length(message) <= 4 for message in messages)
+
+
+def test_create_resoconto_messages():
+    giocate = [
+        {"_id": index, "sport": "calcio", "giocata_num": index, "base_stake": 500, "base_quota": 200, "outcome": "win"}
+        for index in range(500)
+    ]
+    user_giocate_data_dict = {index: {"personal_stake": 0} for index in range(500)}
+    resoconto_message = utils.create_resoconto_message(giocate, user_giocate_data_dict)
+    assert resoconto_message.startswith("1) Calcio #0: @2.00 Stake 5.00% = 5.00% 🟢\n")
+    messages = list(utils.create_resoconto_messages(giocate, user_giocate_data_dict, header="Resoconto"))
+    assert len(messages) > 1
+    assert all(len(message) <= cst.MAX_MESSAGE_LENGTH for message in messages)
+    assert "".join(messages) == "Resoconto\n" + resoconto_message
+
+
+def test_create_duration_text():
+    assert utils.create_duration_text(0.2) == "1 secondi"
+    assert utils.create_duration_text(59) == "59 secondi"
+    assert utils.create_duration_text(61) == "2 minuti"
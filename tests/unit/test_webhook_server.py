@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+
+import pytest
+import tornado.testing
+from lot_bot import database as db
+from lot_bot import update_deduplicator, webhook_server
+from telegram import Update
+
+
+@pytest.fixture(autouse=True)
+def clean_seen_updates():
+    update_deduplicator.clear_seen_updates()
+    db.mongo.updates.delete_many({})
+    yield
+    update_deduplicator.clear_seen_updates()
+    db.mongo.updates.delete_many({})
+
+
+def create_update(update_id: int, chat_id: int) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "text": f"{update_id}",
+        },
+    }, None)
+
+
+def test_update_queue_preserves_chat_order():
+    processed_updates = {}
+    lock = threading.Lock()
+    def process_update(update: Update):
+        time.sleep(0.001)
+        with lock:
+            processed_updates.setdefault(update.effective_chat.id, []).append(update.update_id)
+    update_queue = webhook_server.UpdateQueue(process_update, num_of_workers=4, max_size=1000)
+    update_queue.start()
+    for update_id in range(200):
+        assert update_queue.put(create_update(update_id, update_id % 7))
+    update_queue.stop(timeout=10)
+    assert sum(len(update_ids) for update_ids in processed_updates.values()) == 200
+    for update_ids in processed_updates.values():
+        assert update_ids == sorted(update_ids)
+    stats = update_queue.get_stats()
+    assert stats["processed_updates"] == 200
+    assert stats["queue_depth"] == 0
+    assert stats["latency_max"] >= stats["latency_p50"] > 0
+
+
+def test_update_queue_bounded():
+    update_queue = webhook_server.UpdateQueue(lambda update: None, num_of_workers=1, max_size=2)
+    # * the workers are not started, hence the updates are not consumed
+    assert update_queue.put(create_update(1, 1))
+    assert update_queue.put(create_update(2, 1))
+    assert not update_queue.put(create_update(3, 1))
+    stats = update_queue.get_stats()
+    assert stats["queue_depth"] == 2
+    assert stats["rejected_updates"] == 1
+
+
+def test_update_queue_failed_update():
+    def process_update(update: Update):
+        raise Exception("error")
+    update_queue = webhook_server.UpdateQueue(process_update, num_of_workers=1)
+    update_queue.start()
+    update_queue.put(create_update(1, 1))
+    update_queue.stop(timeout=10)
+    assert update_queue.get_stats()["failed_updates"] == 1
+
+
+def test_update_queue_drops_duplicate_updates():
+    processed_update_ids = []
+    update_queue = webhook_server.UpdateQueue(lambda update: processed_update_ids.append(update.update_id), num_of_workers=2)
+    update_queue.start()
+    for update_id in (1, 2, 1, 3, 2):
+        assert update_queue.put(create_update(update_id, update_id))
+    update_queue.stop(timeout=10)
+    assert sorted(processed_update_ids) == [1, 2, 3]
+    stats = update_queue.get_stats()
+    assert stats["processed_updates"] == 3
+    assert stats["duplicate_updates"] == 2
+
+
+class TestWebhookApp(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        self.update_queue = webhook_server.UpdateQueue(lambda update: None, num_of_workers=1, max_size=1)
+        return webhook_server.create_webhook_app(None, self.update_queue)
+
+    def test_webhook(self):
+        response = self.fetch("/webhook", method="POST", body=json.dumps(create_update(1, 1).to_dict()))
+        assert response.code == 200
+        # * the queue is full, since the workers are not started
+        rejected_update_data = json.dumps(create_update(2, 1).to_dict())
+        response = self.fetch("/webhook", method="POST", body=rejected_update_data)
+        assert response.code == 503
+        # * the rejected update is not considered a duplicate when it is sent again
+        assert not update_deduplicator.is_duplicate_update(2)
+        response = self.fetch("/webhook", method="POST", body="not json")
+        assert response.code == 400
+        status = json.loads(self.fetch("/status").body)
+        assert status["queue_depth"] == 1
+        assert status["rejected_updates"] == 1
+
+    def test_metrics(self):
+        self.fetch("/webhook", method="POST", body=json.dumps(create_update(1, 1).to_dict()))
+        response = self.fetch("/metrics")
+        assert response.code == 200
+        assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert "lot_update_queue_depth 1" in response.body.decode("utf-8")